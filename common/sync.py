@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Copy the modules shared by the Python services from common/ into each service.
+
+common/ holds the only source of these modules. The Docker images copy them from
+here directly (the `common` build context in docker-compose.yaml); the copies in
+the services' source trees exist so a service and its tests also run from its own
+directory. Run this after editing a shared module:
+
+  python3 common/sync.py           # rewrite the copies
+  python3 common/sync.py --check   # exit 1 when a copy differs from common/
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import List
+
+COMMON = Path(__file__).resolve().parent
+ROOT = COMMON.parent
+MODULES = ["instrumentation.py", "profiling.py"]
+SERVICES = ["crawler/src/fastapi", "manager/src/python", "data-analysis/src"]
+
+
+def copies() -> List[Path]:
+    return [ROOT / service / module for service in SERVICES for module in MODULES]
+
+
+def stale_copies() -> List[Path]:
+    """Copies that are missing or differ from their source in common/."""
+    return [path for path in copies()
+            if not path.exists() or path.read_bytes() != (COMMON / path.name).read_bytes()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync the shared modules into the services")
+    parser.add_argument("--check", action="store_true", help="only report copies that differ")
+    args = parser.parse_args()
+
+    stale = stale_copies()
+    if args.check:
+        for path in stale:
+            print(f"{path.relative_to(ROOT)} differs from common/{path.name}")
+        sys.exit(1 if stale else 0)
+    for path in stale:
+        path.write_bytes((COMMON / path.name).read_bytes())
+        print(f"updated {path.relative_to(ROOT)}")
+
+
+if __name__ == "__main__":
+    main()
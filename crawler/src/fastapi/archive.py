@@ -0,0 +1,246 @@
+"""
+Content-addressed archive of raw crawled pages.
+
+Every page is stored once, keyed by the SHA-256 of its body, as an individual
+zstd frame appended to a segment file (segment-000001.zst, ...). A compact
+fixed-size record per page in index.bin maps the digest to its segment, offset,
+compressed length and raw size; it is loaded into memory on startup.
+
+Reads map the segment files with mmap and decompress straight from the mapped
+pages, so a page can be streamed (re-analysis, snippets) without copying the
+compressed data or reading anything but its own frame.
+
+Environment variables:
+- ARCHIVE_DIR           : Optional. Directory of segments and index. Defaults to 'archive'.
+- ARCHIVE_SEGMENT_BYTES : Optional. Size after which a new segment is started. Defaults to 256 MiB.
+- ARCHIVE_LEVEL         : Optional. zstd compression level. Defaults to 3.
+- ARCHIVE_ENABLED       : Optional. 'false' disables archiving of crawled pages. Defaults to 'true'.
+"""
+
+import codecs
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+from collections import namedtuple
+from html.parser import HTMLParser
+from typing import Dict, Iterator, Optional
+
+import zstandard
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_SEGMENT_BYTES = int(os.getenv("ARCHIVE_SEGMENT_BYTES", str(256 * 1024 * 1024)))
+ARCHIVE_LEVEL = int(os.getenv("ARCHIVE_LEVEL", "3"))
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "true").lower() not in ("0", "false", "no")
+
+CHUNK_SIZE = 64 * 1024
+
+# digest, segment number, offset, compressed length, raw size
+_RECORD = struct.Struct("<32sIQII")
+
+Entry = namedtuple("Entry", "segment offset length size")
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_digest(value: str) -> bool:
+    return bool(_DIGEST_RE.match(value))
+
+
+class _TextExtractor(HTMLParser):
+    """Collects visible text fed to it incrementally, skipping scripts and styles."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+class PageArchive:
+    def __init__(self, directory: str = ARCHIVE_DIR, segment_bytes: int = ARCHIVE_SEGMENT_BYTES,
+                 level: int = ARCHIVE_LEVEL):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._lock = threading.Lock()
+        self._index: Dict[bytes, Entry] = {}
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._raw_bytes = 0
+        self._stored_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.bin")
+        self._load_index()
+        self._segment = max((e.segment for e in self._index.values()), default=1)
+        self._segment_file = open(self._segment_path(self._segment), "ab")
+        self._index_file = open(self._index_path, "ab")
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:06d}.zst")
+
+    def _load_index(self) -> None:
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % _RECORD.size
+        if usable != len(data):
+            # A torn trailing record from a crash; drop it so appends stay aligned
+            with open(self._index_path, "r+b") as f:
+                f.truncate(usable)
+        sizes: Dict[int, int] = {}
+        for digest, segment, offset, length, size in _RECORD.iter_unpack(data[:usable]):
+            if segment not in sizes:
+                path = self._segment_path(segment)
+                sizes[segment] = os.path.getsize(path) if os.path.exists(path) else 0
+            if offset + length <= sizes[segment]:
+                self._add(digest, Entry(segment, offset, length, size))
+
+    def _add(self, digest: bytes, entry: Entry) -> None:
+        self._index[digest] = entry
+        self._raw_bytes += entry.size
+        self._stored_bytes += entry.length
+
+    def put(self, data: bytes) -> str:
+        """Store a page unless it is already archived; returns its hex digest."""
+        digest = hashlib.sha256(data).digest()
+        if digest in self._index:
+            return digest.hex()
+        frame = self._compressor.compress(data)
+        with self._lock:
+            if digest in self._index:
+                return digest.hex()
+            offset = self._segment_file.tell()
+            if offset and offset + len(frame) > self.segment_bytes:
+                self._segment_file.close()
+                self._segment += 1
+                self._segment_file = open(self._segment_path(self._segment), "ab")
+                offset = 0
+            self._segment_file.write(frame)
+            self._segment_file.flush()
+            entry = Entry(self._segment, offset, len(frame), len(data))
+            # Index after the data: a crash in between only leaves unreferenced bytes behind
+            self._index_file.write(_RECORD.pack(digest, *entry))
+            self._index_file.flush()
+            self._add(digest, entry)
+        return digest.hex()
+
+    def info(self, digest: str) -> Optional[Entry]:
+        return self._index.get(bytes.fromhex(digest)) if is_digest(digest) else None
+
+    def __contains__(self, digest: str) -> bool:
+        return self.info(digest) is not None
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _frame(self, entry: Entry) -> memoryview:
+        mapped = self._maps.get(entry.segment)
+        end = entry.offset + entry.length
+        if mapped is None or len(mapped) < end:
+            with open(self._segment_path(entry.segment), "rb") as f:
+                # Readers may still hold views of an older, shorter map; it is freed with them
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[entry.segment] = mapped
+        return memoryview(mapped)[entry.offset:end]
+
+    def iter_chunks(self, digest: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Decompressed page body in chunks, read from the mapped segment; KeyError if unknown."""
+        entry = self.info(digest)
+        if entry is None:
+            raise KeyError(digest)
+        with zstandard.ZstdDecompressor().stream_reader(self._frame(entry)) as reader:
+            while True:
+                chunk = reader.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def get(self, digest: str) -> bytes:
+        entry = self.info(digest)
+        if entry is None:
+            raise KeyError(digest)
+        return zstandard.ZstdDecompressor().decompress(self._frame(entry), max_output_size=entry.size)
+
+    def iter_text(self, digest: str) -> Iterator[str]:
+        """Visible text of an archived HTML page, extracted while it is streamed."""
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        parser = _TextExtractor()
+        for chunk in self.iter_chunks(digest):
+            parser.feed(decoder.decode(chunk))
+            if parser.parts:
+                yield " ".join(parser.parts)
+                parser.parts.clear()
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+        if parser.parts:
+            yield " ".join(parser.parts)
+
+    def snippet(self, digest: str, query: str, width: int = 160) -> Optional[str]:
+        """Text around the first case-insensitive match of `query`, or None if it does not occur.
+
+        Stops decompressing as soon as enough context after the match was read.
+        """
+        needle = " ".join(query.lower().split())
+        if not needle:
+            return None
+        window = ""
+        match = -1
+        for text in self.iter_text(digest):
+            window = " ".join((window + " " + text).split())
+            if match < 0:
+                match = window.lower().find(needle)
+                if match < 0:
+                    # Keep just enough to catch a match spanning chunks plus the leading context
+                    keep = len(needle) + width
+                    window = window[-keep:]
+                    continue
+                start = max(0, match - width // 2)
+                window, match = window[start:], match - start
+            if len(window) >= match + len(needle) + width // 2:
+                break
+        if match < 0:
+            return None
+        return window[:match + len(needle) + width // 2].strip()
+
+    def stats(self) -> Dict:
+        return {
+            "pages": len(self._index),
+            "segments": self._segment,
+            "raw_bytes": self._raw_bytes,
+            "stored_bytes": self._stored_bytes,
+            "compression_ratio": round(self._raw_bytes / self._stored_bytes, 2) if self._stored_bytes else None,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._segment_file.close()
+            self._index_file.close()
+            self._maps.clear()
+
+
+_archive: Optional[PageArchive] = None
+_archive_lock = threading.Lock()
+
+
+def get_archive() -> PageArchive:
+    """Process-wide archive, opened on first use."""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = PageArchive()
+        return _archive
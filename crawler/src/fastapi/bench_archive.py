@@ -0,0 +1,98 @@
+"""
+Write/read throughput benchmark for the page archive.
+
+Generates synthetic onion-like HTML pages (with a share of exact duplicates),
+archives them and measures
+
+- write:        pages/s and raw MiB/s of PageArchive.put (hash, compress, append),
+- random read:  full decompression of random pages through the mapped segments,
+- stream read:  iter_chunks of random pages, as used by re-analysis uploads,
+- snippet:      streamed text extraction until the first match,
+
+plus the compression ratio and the index size per page.
+
+Usage:
+  python3 bench_archive.py [--pages 20000] [--reads 5000] [--dir /tmp/archive-bench]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import archive
+
+WORDS = ("market forum vendor escrow bitcoin monero wiki links mirror hosting email chat news blog "
+         "login register search about contact rules guide support").split()
+
+
+def make_page(rng: random.Random, i: int) -> bytes:
+    paragraphs = "".join(
+        "<p>" + " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 80))) + "</p>\n"
+        for _ in range(rng.randint(10, 120))
+    )
+    nav = "".join(f'<a href="/{w}">{w}</a>' for w in rng.sample(WORDS, 8))
+    return (f"<html><head><title>Site {i}</title><style>body{{font:14px sans-serif}}</style></head>"
+            f"<body><nav>{nav}</nav>{paragraphs}<footer>page {i}</footer></body></html>").encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=20_000)
+    parser.add_argument("--reads", type=int, default=5000)
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix="archive-bench-")
+    shutil.rmtree(directory, ignore_errors=True)
+    rng = random.Random(4)
+    pages = []
+    for i in range(args.pages):
+        # ~10% re-crawls of an unchanged page
+        pages.append(rng.choice(pages) if pages and rng.random() < 0.1 else make_page(rng, i))
+    raw = sum(len(p) for p in pages)
+
+    store = archive.PageArchive(directory, segment_bytes=64 * 1024 * 1024)
+    start = time.perf_counter()
+    digests = [store.put(p) for p in pages]
+    elapsed = time.perf_counter() - start
+    print(f"write        {len(pages) / elapsed:10.0f} pages/s  {raw / elapsed / 2**20:8.1f} MiB/s raw")
+
+    stats = store.stats()
+    index_bytes = os.path.getsize(os.path.join(directory, "index.bin"))
+    print(f"stored       {stats['pages']} unique pages in {stats['segments']} segments, "
+          f"ratio {stats['compression_ratio']}x, index {index_bytes / stats['pages']:.0f} B/page")
+    store.close()
+
+    store = archive.PageArchive(directory)  # cold index load + fresh maps
+    sample = [rng.choice(digests) for _ in range(args.reads)]
+    read_bytes = sum(store.info(d).size for d in sample)
+
+    start = time.perf_counter()
+    for digest in sample:
+        store.get(digest)
+    elapsed = time.perf_counter() - start
+    print(f"random read  {len(sample) / elapsed:10.0f} pages/s  {read_bytes / elapsed / 2**20:8.1f} MiB/s")
+
+    start = time.perf_counter()
+    for digest in sample:
+        for _ in store.iter_chunks(digest):
+            pass
+    elapsed = time.perf_counter() - start
+    print(f"stream read  {len(sample) / elapsed:10.0f} pages/s  {read_bytes / elapsed / 2**20:8.1f} MiB/s")
+
+    start = time.perf_counter()
+    for digest in sample[:1000]:
+        store.snippet(digest, "escrow bitcoin")
+    elapsed = time.perf_counter() - start
+    print(f"snippet      {min(1000, len(sample)) / elapsed:10.0f} pages/s")
+
+    store.close()
+    if not args.dir:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,37 +3,174 @@ import socket
 import uuid
 import threading
 from typing import Dict, List, Optional
+from collections import Counter
+from urllib.parse import urlsplit
 import time
 from stem import Signal
 from stem.control import Controller
 import json
+import os
+
+import archive
+import decoding
+import instrumentation
+import profiling
 
 JOB_STORE: Dict[str, Dict] = {}
 
+FETCH_SECONDS = instrumentation.histogram(
+    "crawler_fetch_duration_seconds", "Latency of page fetches through Tor per host", ["host"],
+)
+FETCH_BYTES = instrumentation.counter("crawler_fetch_bytes_total", "Page bytes downloaded per host", ["host"])
+FETCHES = instrumentation.counter(
+    "crawler_fetches_total", "Page fetches per host and HTTP status ('error' if the request failed)",
+    ["host", "status"],
+)
+DELIVERIES = instrumentation.counter(
+    "crawler_deliveries_total", "Pages and reports handed to the analyzer / manager by outcome",
+    ["target", "outcome"],
+)
+instrumentation.gauge(
+    "crawler_jobs", "Crawl jobs in the job store per status", ["status"],
+    collect=lambda: Counter(job.get('status') for job in list(JOB_STORE.values())),
+)
+instrumentation.counter(
+    "crawler_decoded_pages_total", "Relayed page bodies by the step that decided their encoding", ["step"],
+    collect=decoding.stats,
+)
+
+MANAGER_URL = os.getenv("MANAGER_URL", "http://manager:8000/crawl-results")
+# The manager's API key; results for jobs it no longer tracks are only accepted with it
+MANAGER_API_KEY = os.getenv("MANAGER_API_KEY", "changeme")
+# Tor daemon; defaults to the docker compose service (overridden by tests/bench_e2e.py)
+TOR_HOST = os.getenv("TOR_HOST", "tor")
+TOR_CONTROL_PORT = int(os.getenv("TOR_CONTROL_PORT", "9051"))
+TOR_PROXY = os.getenv("TOR_PROXY", f"socks5h://{TOR_HOST}:{os.getenv('TOR_SOCKS_PORT', '9050')}")
+# Bearer key for the analyzer when pages are submitted to it directly (see start_crawl)
+ANALYZER_API_KEY = os.getenv("ANALYZER_API_KEY", "changeme")
+# Analyzer /analyze URLs pages may be submitted to (comma separated). Submissions carry
+# ANALYZER_API_KEY, so an analyze_url from a request is only used if it is listed here.
+ANALYZER_URLS = [url.strip() for url in os.getenv("ANALYZER_URLS", "http://analyzer:8000/analyze").split(",")
+                 if url.strip()]
+
+
+def analyzer_allowed(analyze_url: Optional[str]) -> bool:
+    return analyze_url is None or analyze_url in ANALYZER_URLS
+
+
+def submit_analysis(analyze_url: str, url: str, body, content_type: Optional[str] = None,
+                    trace_id: Optional[str] = None) -> Optional[str]:
+    """POST a raw page body (bytes or an iterator of chunks) to the analyzer; returns its jobId or None."""
+    if not analyzer_allowed(analyze_url):
+        print(f"Refusing to submit {url} to unlisted analyzer {analyze_url}")
+        DELIVERIES.labels('analyzer', 'rejected').inc()
+        return None
+    content_type = content_type or 'text/html'
+    if not content_type.startswith('text/'):
+        # Anything else (e.g. application/json) must not be mistaken for an AnalyzeRequest
+        content_type = 'application/octet-stream'
+    try:
+        params = {'sourceUrl': url, 'traceId': trace_id} if trace_id else {'sourceUrl': url}
+        resp = requests.post(analyze_url, data=body, params=params, headers={
+            'Authorization': f"Bearer {ANALYZER_API_KEY}",
+            'Content-Type': content_type,
+        }, timeout=30)
+        if resp.status_code == 202:
+            DELIVERIES.labels('analyzer', 'accepted').inc()
+            return resp.json().get('jobId')
+        print(f"Analyzer rejected {url} (status {resp.status_code}): {resp.text}")
+        DELIVERIES.labels('analyzer', 'rejected').inc()
+    except (requests.RequestException, ValueError) as exc:
+        print(f"Analyzer submission for {url} failed: {exc}")
+        DELIVERIES.labels('analyzer', 'error').inc()
+    return None
+
+
 class Crawler:
     def __init__(self):
-        tor_ip = socket.gethostbyname('tor') # Because stem doesn't resolve docker service names and checks for valid IP format
-        self.controller = Controller.from_port(address=tor_ip, port=9051)
+        tor_ip = socket.gethostbyname(TOR_HOST) # Because stem doesn't resolve docker service names and checks for valid IP format
+        self.controller = Controller.from_port(address=tor_ip, port=TOR_CONTROL_PORT)
         self.controller.authenticate()
         self.controller.signal(Signal.NEWNYM)
 
         self.session = requests.Session()
         self.session.proxies = {
-            'http': 'socks5h://tor:9050',
-            'https': 'socks5h://tor:9050'
+            'http': TOR_PROXY,
+            'https': TOR_PROXY
         }
 
-    def _perform_crawl(self, job_id: str, urls: List[str]):
+    @staticmethod
+    def _conditional_headers(validators: Dict) -> Dict[str, str]:
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    @profiling.profiled("_perform_crawl")
+    def _perform_crawl(self, job_id: str, urls: List[str], analyze_url: Optional[str] = None,
+                       validators: Optional[Dict[str, Dict]] = None, trace_ids: Optional[Dict[str, str]] = None):
         print("Crawling url: ", urls)
         JOB_STORE[job_id]['status'] = 'running'
         results: Dict[str, str] = {}
+        # What the manager gets per URL: the page itself, or only metadata when the
+        # page went to the analyzer directly or did not change since the last crawl
+        reports: Dict[str, Dict] = {}
+        validators = validators or {}
+        trace_ids = trace_ids or {}
+        # Wall-clock stage timestamps per URL for the manager's pipeline tracing
+        timings: Dict[str, Dict[str, float]] = {}
 
         for url in urls:
+            previous = validators.get(url) or {}
+            host = urlsplit(url).hostname or 'unknown'
+            timings[url] = {'crawl_started': time.time()}
+            started = time.perf_counter()
             try:
-                response = self.session.get(url, timeout=30)
-                results[url] = response.text
+                response = self.session.get(url, timeout=30, headers=self._conditional_headers(previous))
             except requests.RequestException as e:
+                FETCHES.labels(host, 'error').inc()
                 results[url] = {"error": str(e)}
+                reports[url] = {'error': str(e)}
+                continue
+            timings[url]['fetched'] = time.time()
+            FETCH_SECONDS.labels(host).observe(time.perf_counter() - started)
+            FETCHES.labels(host, response.status_code).inc()
+            FETCH_BYTES.labels(host).inc(len(response.content))
+
+            headers = response.headers
+            http_validators = {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+
+            if response.status_code == 304:
+                # Nothing downloaded; the archived copy tells how much that saved
+                entry = archive.get_archive().info(previous.get('content_hash') or '')
+                results[url] = {"not_modified": True}
+                reports[url] = {'not_modified': True, 'bytes_saved': entry.size if entry else None, **http_validators}
+                continue
+
+            # Keep the raw page so it can be re-analyzed later without crawling it again
+            content_hash = archive.get_archive().put(response.content) if archive.ARCHIVE_ENABLED else None
+            if content_hash and content_hash == previous.get('content_hash'):
+                # Same body as last time (server without validators): no need to analyze it again
+                results[url] = {"unchanged": True}
+                reports[url] = {'unchanged': True, 'content_hash': content_hash, **http_validators}
+                continue
+
+            analysis_job_id = None
+            if analyze_url:
+                timings[url]['analysis_submitted'] = time.time()
+                analysis_job_id = submit_analysis(analyze_url, url, response.content,
+                                                  headers.get('Content-Type'), trace_ids.get(url))
+            if analysis_job_id:
+                results[url] = {"analysis_job_id": analysis_job_id}
+                reports[url] = {'analysis_job_id': analysis_job_id, 'content_length': len(response.content)}
+            else:
+                # Relay mode, or the analyzer was unavailable: hand the page to the manager
+                text, _ = decoding.decode_body(response.content, headers.get('Content-Type'), url)
+                results[url] = text
+                reports[url] = {'content': text}
+            reports[url].update(content_hash=content_hash, **http_validators)
 
         JOB_STORE[job_id]['status'] = 'finished'
         JOB_STORE[job_id]['finished_at'] = time.time()
@@ -44,24 +181,26 @@ class Crawler:
         try:
             print("Send results to Manager")
 
-            headers = { "Authorization": f"Bearer changeme" }
-            # `results` is a dict mapping url -> response (or error). The manager expects
-            # `content` to be a string, so send the crawled HTML/text for the URL we posted
-            # in `url` (urls[0]). If the crawl produced an error dict, stringify it.
-            for key, value in results.items():
-                resp = requests.post("http://manager:8000/crawl-results", json={
+            headers = {"Authorization": f"Bearer {MANAGER_API_KEY}"}
+            for key, report in reports.items():
+                resp = requests.post(MANAGER_URL, json={
                     'url': key,
                     'job_id': job_id,
-                    'content': value,
+                    'trace_id': trace_ids.get(key),
+                    'timings': timings.get(key),
+                    **report,
                 }, headers=headers, timeout=10)
+                DELIVERIES.labels('manager', 'accepted' if resp.ok else 'rejected').inc()
             
             JOB_STORE[job_id]["analysis_status"] = 'sent off'
         except Exception as exc:
+            DELIVERIES.labels('manager', 'error').inc()
             print(exc)
             pass
 
 
-    def start_crawl(self, urls: List[str]) -> str:
+    def start_crawl(self, urls: List[str], analyze_url: Optional[str] = None,
+                    validators: Optional[Dict[str, Dict]] = None, trace_ids: Optional[Dict[str, str]] = None) -> str:
         job_id = str(uuid.uuid4())
 
         JOB_STORE[job_id] = {
@@ -72,7 +211,8 @@ class Crawler:
         }
 
         # Start background thread to perform the crawl (requests is blocking)
-        thread = threading.Thread(target=self._perform_crawl, args=(job_id, urls), daemon=True)
+        thread = threading.Thread(target=self._perform_crawl,
+                                  args=(job_id, urls, analyze_url, validators, trace_ids), daemon=True)
         thread.start()
 
         return job_id
@@ -84,3 +224,21 @@ class Crawler:
     @staticmethod
     def get_jobs() -> Dict:
         return JOB_STORE
+
+
+_crawler: Optional[Crawler] = None
+_crawler_lock = threading.Lock()
+
+
+def get_crawler() -> Crawler:
+    """Process-wide crawler, connected to Tor on first use.
+
+    Jobs share its session and Tor circuits: the manager sends all links of a host
+    to the same crawler, so keeping the circuit and connections to that host warm
+    is what makes the affinity pay off (a NEWNYM per job would drop them).
+    """
+    global _crawler
+    with _crawler_lock:
+        if _crawler is None:
+            _crawler = Crawler()
+        return _crawler
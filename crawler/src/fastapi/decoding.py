@@ -0,0 +1,143 @@
+"""
+Charset decoding of crawled page bodies.
+
+`response.text` falls back to charset detection over the whole body whenever
+no charset is declared, which is expensive on large pages and runs in the
+crawl threads. decode_body tries the cheap and reliable signals first:
+
+1. a byte order mark,
+2. the charset parameter of the Content-Type header,
+3. a <meta charset> / http-equiv declaration in the first META_SCAN_BYTES,
+4. a strict UTF-8 decode (plain ASCII included),
+5. the encoding previously detected for the same host,
+
+and only then runs charset_normalizer on the first DETECT_SAMPLE_BYTES. The
+detected encoding is remembered per host, as hidden services rarely mix
+encodings across their pages.
+
+Environment variables:
+- META_SCAN_BYTES     : Optional. Leading bytes searched for a <meta> charset. Defaults to 4096.
+- DETECT_SAMPLE_BYTES : Optional. Bytes handed to charset detection. Defaults to 32768.
+- HOST_CACHE_SIZE     : Optional. Hosts whose detected encoding is remembered. Defaults to 4096.
+"""
+
+import codecs
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from charset_normalizer import from_bytes
+
+META_SCAN_BYTES = int(os.getenv("META_SCAN_BYTES", "4096"))
+DETECT_SAMPLE_BYTES = int(os.getenv("DETECT_SAMPLE_BYTES", str(32 * 1024)))
+HOST_CACHE_SIZE = int(os.getenv("HOST_CACHE_SIZE", "4096"))
+
+# Longest BOMs first: the UTF-32 LE BOM starts with the UTF-16 LE one
+_BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+_HEADER_CHARSET_RE = re.compile(r"""charset\s*=\s*["']?([\w.:-]+)""", re.IGNORECASE)
+# Covers <meta charset="x"> as well as <meta http-equiv="Content-Type" content="text/html; charset=x">
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]*?charset\s*=\s*["']?\s*([\w.:-]+)""", re.IGNORECASE)
+
+_host_encodings: "OrderedDict[str, str]" = OrderedDict()
+_host_lock = threading.Lock()
+_stats: Counter = Counter()
+
+
+def _codec(label) -> Optional[str]:
+    """Python codec name for a declared charset label, or None if it is unknown."""
+    if isinstance(label, bytes):
+        label = label.decode("ascii", "ignore")
+    try:
+        name = codecs.lookup(label.strip()).name
+    except (LookupError, ValueError):
+        return None
+    # A UTF-16/32 declaration in an 8-bit compatible document is always wrong (HTML spec)
+    return "utf-8" if name.startswith(("utf-16", "utf-32")) else name
+
+
+def _strict(body: bytes, encoding: Optional[str]) -> Optional[str]:
+    if encoding is None:
+        return None
+    try:
+        return body.decode(encoding)
+    except UnicodeDecodeError:
+        return None
+
+
+def _cached(host: Optional[str]) -> Optional[str]:
+    if not host:
+        return None
+    with _host_lock:
+        encoding = _host_encodings.get(host)
+        if encoding is not None:
+            _host_encodings.move_to_end(host)
+        return encoding
+
+
+def _remember(host: Optional[str], encoding: str) -> None:
+    if not host:
+        return
+    with _host_lock:
+        _host_encodings[host] = encoding
+        _host_encodings.move_to_end(host)
+        while len(_host_encodings) > HOST_CACHE_SIZE:
+            _host_encodings.popitem(last=False)
+
+
+def detect(sample: bytes) -> Optional[str]:
+    """Best guess for the encoding of `sample`, or None."""
+    best = from_bytes(sample).best()
+    return _codec(best.encoding) if best is not None else None
+
+
+def decode_body(body: bytes, content_type: Optional[str] = None, url: Optional[str] = None) -> Tuple[str, str]:
+    """Decode a page body; returns (text, encoding) and never raises on undecodable bytes."""
+    for bom, encoding in _BOMS:
+        if body.startswith(bom):
+            _stats["bom"] += 1
+            return body.decode(encoding, errors="replace"), encoding
+
+    # Declarations win, as in browsers; bytes invalid in the declared charset are replaced
+    header = _HEADER_CHARSET_RE.search(content_type or "")
+    encoding = _codec(header.group(1)) if header else None
+    if encoding:
+        _stats["header"] += 1
+        return body.decode(encoding, errors="replace"), encoding
+
+    meta = _META_CHARSET_RE.search(body, 0, META_SCAN_BYTES)
+    encoding = _codec(meta.group(1)) if meta else None
+    if encoding:
+        _stats["meta"] += 1
+        return body.decode(encoding, errors="replace"), encoding
+
+    text = _strict(body, "utf-8")
+    if text is not None:
+        _stats["utf-8"] += 1
+        return text, "utf-8"
+
+    host = urlsplit(url).hostname if url else None
+    encoding = _cached(host)
+    text = _strict(body, encoding)
+    if text is not None:
+        _stats["host_cache"] += 1
+        return text, encoding
+
+    _stats["detected"] += 1
+    encoding = detect(body[:DETECT_SAMPLE_BYTES]) or "cp1252"
+    _remember(host, encoding)
+    return body.decode(encoding, errors="replace"), encoding
+
+
+def stats() -> Dict[str, int]:
+    """How often each step decided the encoding since startup."""
+    return dict(_stats)
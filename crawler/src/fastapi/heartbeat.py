@@ -0,0 +1,65 @@
+"""
+Heartbeats announcing this crawler to the manager.
+
+With CRAWLER_PUBLIC_URL set (the base URL the manager reaches this crawler at),
+a thread POSTs the crawler's id, URL, capacity and job counts to the manager's
+/crawlers/heartbeat every HEARTBEAT_INTERVAL seconds. The manager shards links
+over the registered crawlers by host and stops sending work to a crawler whose
+heartbeats stop, so crawlers can be added by just starting them.
+"""
+
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+import requests
+
+from crawler import JOB_STORE, MANAGER_API_KEY, MANAGER_URL
+
+CRAWLER_PUBLIC_URL = os.getenv("CRAWLER_PUBLIC_URL", "")
+CRAWLER_ID = os.getenv("CRAWLER_ID") or socket.gethostname()
+# Crawl jobs the manager may have in flight here at once
+CRAWLER_CAPACITY = int(os.getenv("CRAWLER_CAPACITY", "8"))
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "10"))
+HEARTBEAT_URL = os.getenv("HEARTBEAT_URL", MANAGER_URL.rsplit("/", 1)[0] + "/crawlers/heartbeat")
+
+
+def payload() -> Dict:
+    states = Counter(job.get('status') for job in list(JOB_STORE.values()))
+    return {
+        'id': CRAWLER_ID,
+        'url': CRAWLER_PUBLIC_URL,
+        'capacity': CRAWLER_CAPACITY,
+        'running': states['running'],
+        'queued': states['queued'],
+    }
+
+
+def send() -> bool:
+    try:
+        resp = requests.post(HEARTBEAT_URL, json=payload(), timeout=5,
+                             headers={'Authorization': f"Bearer {MANAGER_API_KEY}"})
+        if resp.ok:
+            return True
+        print(f"Manager rejected heartbeat (status {resp.status_code}): {resp.text}")
+    except requests.RequestException as exc:
+        print(f"Heartbeat to manager failed: {exc}")
+    return False
+
+
+def _run():
+    while True:
+        send()
+        time.sleep(HEARTBEAT_INTERVAL)
+
+
+def start() -> Optional[threading.Thread]:
+    """Start sending heartbeats in a daemon thread; does nothing without CRAWLER_PUBLIC_URL."""
+    if not CRAWLER_PUBLIC_URL or HEARTBEAT_INTERVAL <= 0:
+        return None
+    thread = threading.Thread(target=_run, name="heartbeat", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,347 @@
+"""
+Prometheus-style metrics for the crawler, manager and analyzer services.
+
+Shared by all three services: edit common/instrumentation.py and run common/sync.py, which
+writes the copies in the services' source trees (see that script).
+
+Metrics are plain in-process counters, gauges and histograms rendered in the
+Prometheus text exposition format by GET /metrics. Updating a metric costs a
+dict lookup and an uncontended lock, so they are safe to use in request
+handlers, crawl threads and SQLAlchemy hooks:
+
+    FETCHES = counter("crawler_fetches_total", "Pages fetched", ["host", "status"])
+    FETCHES.labels(host, 200).inc()
+
+    with LATENCY.labels(host).time():
+        ...
+
+Counters and gauges can also be computed at scrape time from a callback
+(`collect`), which keeps queue depths and existing statistics out of the hot
+path entirely.
+
+The number of label sets per metric is capped at MAX_LABEL_SETS; further ones
+are folded into a single series labelled "other" so per-host metrics cannot
+grow without bound.
+
+Environment variables:
+- METRICS_MAX_LABEL_SETS : Optional. Label sets per metric before folding into "other". Defaults to 1000.
+"""
+
+import bisect
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+MAX_LABEL_SETS = int(os.getenv("METRICS_MAX_LABEL_SETS", "1000"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Timer:
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._start)
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    if len(self._children) >= MAX_LABEL_SETS:
+                        key = ("other",) * len(key)
+                        child = self._children.get(key)
+                    if child is None:
+                        child = self._children[key] = self._new_child()
+        return child
+
+    def _samples(self) -> List[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        """(name suffix, label names, label values, value) of every sample."""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return lines
+
+    # Label-less metrics are updated directly on the metric
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+
+class _ValueMetric(Metric):
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 collect: Optional[Callable[[], Dict]] = None):
+        """`collect` returns {label value tuple (or plain value without labels): value} at scrape time."""
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def _samples(self):
+        if self.collect is None:
+            return [("", self.labelnames, key, child.value) for key, child in list(self._children.items())]
+        samples = []
+        for key, value in self.collect().items():
+            key = key if isinstance(key, tuple) else (key,) if self.labelnames else ()
+            samples.append(("", self.labelnames, tuple(str(k) for k in key), float(value)))
+        return samples
+
+
+class Counter(_ValueMetric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_ValueMetric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _samples(self):
+        samples = []
+        names = self.labelnames + ("le",)
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append(("_bucket", names, key + (_format_value(float(bound)),), cumulative))
+            samples.append(("_sum", self.labelnames, key, total))
+            samples.append(("_count", self.labelnames, key, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """Add a metric, or return the one already registered under its name (module reloads, tests)."""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception as exc:  # a failing collect callback must not break the scrape
+                lines.append(f"# {metric.name} unavailable: {_escape(str(exc))}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Iterable[str] = (),
+            collect: Optional[Callable[[], Dict]] = None) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames, collect))
+
+
+def gauge(name: str, documentation: str, labelnames: Iterable[str] = (),
+          collect: Optional[Callable[[], Dict]] = None) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames, collect))
+
+
+def histogram(name: str, documentation: str, labelnames: Iterable[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# ---------------- HTTP ---------------- #
+
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds", "Latency of handled HTTP requests by route template",
+    ["method", "route", "status"],
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every request under its route template (e.g. /links/{link_id})."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(scope["method"], path, status[0]).observe(time.perf_counter() - start)
+
+
+def setup_metrics(app) -> None:
+    """Time all requests of a FastAPI app and serve the registry at GET /metrics."""
+    from fastapi import Response
+
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+# ---------------- SQLAlchemy ---------------- #
+
+DB_QUERY_SECONDS = histogram(
+    "db_query_duration_seconds", "Latency of SQL statements by engine and statement type",
+    ["engine", "operation"],
+)
+DB_QUERY_ERRORS = counter(
+    "db_query_errors_total", "SQL statements that raised, by engine and statement type",
+    ["engine", "operation"],
+)
+
+
+def _operation(statement: str) -> str:
+    parts = statement.lstrip().split(None, 1)
+    return parts[0].upper() if parts else "UNKNOWN"
+
+
+def instrument_engine(engine, name: str) -> None:
+    """Time every statement of a SQLAlchemy engine (pass async_engine.sync_engine for async engines)."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        DB_QUERY_SECONDS.labels(name, _operation(statement)).observe(time.perf_counter() - start)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        stack = context.connection.info.get("query_start") if context.connection is not None else None
+        if stack:
+            stack.pop()
+        DB_QUERY_ERRORS.labels(name, _operation(context.statement or "")).inc()
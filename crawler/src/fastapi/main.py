@@ -1,5 +1,9 @@
 from fastapi import FastAPI
-from routers import crawler
+import heartbeat
+from routers import crawler, archive
+from instrumentation import setup_metrics
+from profiling import setup_profiling
+from security.authentication import require_api_key
 
 app = FastAPI(
     title="Darkwebsearch - Crawler API",
@@ -8,4 +12,12 @@ app = FastAPI(
 )
 
 app.include_router(crawler.router, tags=["Crawl"])
+app.include_router(archive.router, tags=["Archive"])
+setup_metrics(app)
+setup_profiling(app, "crawler", require_api_key)
 
+
+@app.on_event("startup")
+async def on_startup():
+    # Announces this crawler to the manager when CRAWLER_PUBLIC_URL is set
+    heartbeat.start()
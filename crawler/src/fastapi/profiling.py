@@ -0,0 +1,302 @@
+"""
+Opt-in statistical profiler for HTTP requests and background jobs.
+
+Shared by all three services: edit common/profiling.py and run common/sync.py, which
+writes the copies in the services' source trees (see that script).
+
+While profiling is enabled, a random PROFILE_SAMPLE_RATE fraction of requests
+and of wrapped background units (jobs, loop iterations) is profiled:
+
+    with profiling.maybe_profile("process_job"):
+        ...
+
+Functions can be wrapped as a whole with the @profiled() decorator.
+
+A profiled unit starts a sampler thread that records the Python stacks every
+PROFILE_INTERVAL seconds via sys._current_frames(); nothing is traced or
+hooked, so the profiled code runs at full speed and unsampled units pay a
+single random() call. When the unit ends, its stacks are written to
+PROFILE_DIR as collapsed stacks (flamegraph.pl, speedscope, ...) or as a
+speedscope JSON file; only the newest PROFILE_MAX_FILES files are kept.
+
+Background jobs sample the thread running them. HTTP requests and loop
+iterations sample all threads, as their work may be handed to thread pools;
+stacks of concurrently running units then show up as well, under their thread
+name as root frame. Idle pool threads and event loops are skipped.
+
+Profiling can be switched at runtime with POST /profiling (authenticated with
+the service's API key), see setup_profiling.
+
+Environment variables:
+- PROFILE_ENABLED        : Optional. 'true' enables profiling on startup. Defaults to 'false'.
+- PROFILE_SAMPLE_RATE    : Optional. Fraction of requests / jobs profiled. Defaults to 0.01.
+- PROFILE_INTERVAL       : Optional. Seconds between stack samples. Defaults to 0.005.
+- PROFILE_DIR            : Optional. Output directory. Defaults to 'profiles'.
+- PROFILE_FORMAT         : Optional. 'collapsed' or 'speedscope'. Defaults to 'collapsed'.
+- PROFILE_MAX_FILES      : Optional. Profiles kept on disk. Defaults to 200.
+- PROFILE_MAX_CONCURRENT : Optional. Units profiled at the same time. Defaults to 4.
+"""
+
+import functools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MAX_DEPTH = 128
+
+# (file name, function) of frames that mean a thread is waiting for work
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+class _Settings:
+    def __init__(self):
+        self.enabled = os.getenv("PROFILE_ENABLED", "false").lower() in ("1", "true", "yes")
+        self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+        self.interval = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+        self.directory = os.getenv("PROFILE_DIR", "profiles")
+        self.format = os.getenv("PROFILE_FORMAT", "collapsed")
+        self.max_files = int(os.getenv("PROFILE_MAX_FILES", "200"))
+        self.max_concurrent = int(os.getenv("PROFILE_MAX_CONCURRENT", "4"))
+        self.service = "service"
+
+
+settings = _Settings()
+_state = threading.local()
+_lock = threading.Lock()
+_running = 0
+_written: List[str] = []
+
+
+def _frame_name(frame) -> Tuple[str, str, int]:
+    code = frame.f_code
+    return code.co_name, code.co_filename, code.co_firstlineno
+
+
+def _stack(frame) -> Optional[Tuple[Tuple[str, str, int], ...]]:
+    """Root-first stack of a frame, or None if the thread is idle."""
+    if (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in _IDLE_FRAMES:
+        return None
+    frames = []
+    while frame is not None and len(frames) < MAX_DEPTH:
+        frames.append(_frame_name(frame))
+        frame = frame.f_back
+    frames.reverse()
+    return tuple(frames)
+
+
+class Sampler(threading.Thread):
+    """Counts the stacks of `thread_ids` (all threads if None) every `interval` seconds."""
+
+    def __init__(self, interval: float, thread_ids: Optional[set] = None):
+        super().__init__(name="profiler", daemon=True)
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident or (self.thread_ids is not None and ident not in self.thread_ids):
+                    continue
+                stack = _stack(frame)
+                if stack is not None:
+                    self.counts[(names.get(ident, str(ident)),) + stack] += 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+def _label(frame: Tuple[str, str, int]) -> str:
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def write_collapsed(f, counts: Counter) -> None:
+    for (thread, *frames), count in counts.most_common():
+        f.write(";".join([thread] + [_label(frame) for frame in frames]) + f" {count}\n")
+
+
+def write_speedscope(f, counts: Counter, name: str, interval: float) -> None:
+    index: Dict = {}
+    frames, samples, weights = [], [], []
+    for (thread, *stack), count in counts.most_common():
+        sample = []
+        for frame in [(thread, "", 0)] + stack:
+            if frame not in index:
+                index[frame] = len(frames)
+                frames.append({"name": frame[0], "file": frame[1], "line": frame[2]} if frame[1]
+                              else {"name": frame[0]})
+            sample.append(index[frame])
+        samples.append(sample)
+        weights.append(count * interval)
+    json.dump({
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "profiling.py",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled", "name": name, "unit": "seconds",
+            "startValue": 0, "endValue": sum(weights), "samples": samples, "weights": weights,
+        }],
+    }, f)
+
+
+def _write(name: str, sampler: Sampler, duration: float) -> Optional[str]:
+    if not sampler.counts:
+        return None
+    os.makedirs(settings.directory, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_") or "unit"
+    extension = ".speedscope.json" if settings.format == "speedscope" else ".collapsed"
+    stamp = time.strftime("%Y%m%dT%H%M%S")
+    filename = f"{settings.service}-{slug}-{stamp}-{int(duration * 1000)}ms-{uuid.uuid4().hex[:8]}{extension}"
+    path = os.path.join(settings.directory, filename)
+    with open(path, "w", encoding="utf-8") as f:
+        if settings.format == "speedscope":
+            write_speedscope(f, sampler.counts, name, sampler.interval)
+        else:
+            write_collapsed(f, sampler.counts)
+    with _lock:
+        _written.append(path)
+        stale, _written[:] = _written[:-settings.max_files], _written[-settings.max_files:]
+    for old in stale:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+    return path
+
+
+@contextmanager
+def profile(name: str, all_threads: bool = False) -> Iterator[None]:
+    """Profile the enclosed block unconditionally (unless a profile is already running in this thread)."""
+    global _running
+    if getattr(_state, "active", False):
+        yield
+        return
+    with _lock:
+        if _running >= settings.max_concurrent:
+            busy = True
+        else:
+            busy = False
+            _running += 1
+    if busy:
+        yield
+        return
+
+    _state.active = True
+    sampler = Sampler(settings.interval, None if all_threads else {threading.get_ident()})
+    started = time.perf_counter()
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        _state.active = False
+        with _lock:
+            _running -= 1
+        try:
+            _write(name, sampler, time.perf_counter() - started)
+        except OSError as exc:
+            print(f"[profiling] Could not write profile of {name}: {exc}")
+
+
+def sampled() -> bool:
+    return settings.enabled and random.random() < settings.sample_rate
+
+
+@contextmanager
+def maybe_profile(name: str, all_threads: bool = False) -> Iterator[None]:
+    """Profile the enclosed block if profiling is enabled and this unit is sampled."""
+    if not sampled():
+        yield
+        return
+    with profile(name, all_threads):
+        yield
+
+
+def profiled(name: Optional[str] = None, all_threads: bool = False):
+    """Decorator applying maybe_profile to every call of a (synchronous) function."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with maybe_profile(name or func.__qualname__, all_threads):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def status() -> Dict:
+    with _lock:
+        recent = [os.path.basename(p) for p in _written[-20:]]
+    return {
+        "enabled": settings.enabled,
+        "sample_rate": settings.sample_rate,
+        "interval": settings.interval,
+        "format": settings.format,
+        "directory": os.path.abspath(settings.directory),
+        "running": _running,
+        "recent": recent,
+    }
+
+
+# ---------------- HTTP ---------------- #
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling the sampled fraction of HTTP requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not sampled():
+            await self.app(scope, receive, send)
+            return
+        with profile(f"{scope['method']} {scope['path']}", all_threads=True):
+            await self.app(scope, receive, send)
+
+
+def setup_profiling(app, service: str, auth_dependency) -> None:
+    """Add the middleware plus GET/POST /profiling (guarded by `auth_dependency`) to a FastAPI app."""
+    from typing import Literal
+
+    from fastapi import Depends
+    from pydantic import BaseModel, Field
+
+    class ProfilingUpdate(BaseModel):
+        enabled: Optional[bool] = None
+        sample_rate: Optional[float] = Field(None, ge=0, le=1)
+        interval: Optional[float] = Field(None, gt=0, le=1)
+        format: Optional[Literal["collapsed", "speedscope"]] = None
+
+    settings.service = service
+    app.add_middleware(ProfilingMiddleware)
+
+    @app.get("/profiling", tags=["profiling"], dependencies=[Depends(auth_dependency)])
+    def get_profiling():
+        """Profiler settings and the most recently written profiles."""
+        return status()
+
+    @app.post("/profiling", tags=["profiling"], dependencies=[Depends(auth_dependency)])
+    def update_profiling(update: ProfilingUpdate):
+        """Switch profiling on or off and change sample rate, interval or output format at runtime."""
+        for field, value in update.model_dump(exclude_none=True).items():
+            setattr(settings, field, value)
+        return status()
@@ -0,0 +1,74 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+
+import archive
+from crawler import ANALYZER_URLS, analyzer_allowed, submit_analysis
+from security.authentication import require_api_key
+
+# Archived pages and resubmissions (which carry the analyzer key) are for the manager only
+router = APIRouter(dependencies=[Depends(require_api_key)])
+
+
+class ReanalyzeItem(BaseModel):
+    content_hash: str
+    source_url: str
+
+
+class ReanalyzeRequest(BaseModel):
+    # One of ANALYZER_URLS; the first of them if not given
+    analyze_url: Optional[str] = None
+    items: List[ReanalyzeItem]
+
+
+def _entry_or_404(content_hash: str) -> archive.Entry:
+    entry = archive.get_archive().info(content_hash)
+    if entry is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Page not archived")
+    return entry
+
+
+@router.get("/archive")
+async def archive_stats():
+    return archive.get_archive().stats()
+
+
+@router.get("/archive/{content_hash}")
+async def get_archived_page(content_hash: str):
+    entry = _entry_or_404(content_hash)
+    return StreamingResponse(
+        archive.get_archive().iter_chunks(content_hash),
+        media_type="text/html",
+        headers={"Content-Length": str(entry.size), "ETag": f'"{content_hash}"'},
+    )
+
+
+@router.get("/archive/{content_hash}/snippet")
+async def get_snippet(content_hash: str, q: str = Query(..., min_length=1), width: int = Query(160, ge=20, le=2000)):
+    _entry_or_404(content_hash)
+    text = await run_in_threadpool(archive.get_archive().snippet, content_hash, q, width)
+    return {"content_hash": content_hash, "snippet": text}
+
+
+def _reanalyze(request: ReanalyzeRequest) -> List[dict]:
+    store = archive.get_archive()
+    analyze_url = request.analyze_url or ANALYZER_URLS[0]
+    results = []
+    for item in request.items:
+        job_id: Optional[str] = None
+        if item.content_hash in store:
+            # Streamed from the mapped segment straight into the upload
+            job_id = submit_analysis(analyze_url, item.source_url, store.iter_chunks(item.content_hash))
+        results.append({"content_hash": item.content_hash, "source_url": item.source_url, "analysis_job_id": job_id})
+    return results
+
+
+@router.post("/archive/reanalyze")
+async def reanalyze(request: ReanalyzeRequest):
+    """Submit archived pages to the analyzer again without crawling them; returns the analyzer jobIds."""
+    if not analyzer_allowed(request.analyze_url):
+        raise HTTPException(status_code=400, detail="analyze_url is not a configured analyzer (ANALYZER_URLS)")
+    return await run_in_threadpool(_reanalyze, request)
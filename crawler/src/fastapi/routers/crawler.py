@@ -1,18 +1,23 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status
 from schemas import CrawlRequest
-from  crawler import Crawler, JOB_STORE
+from  crawler import Crawler, JOB_STORE, analyzer_allowed, get_crawler
+from security.authentication import require_api_key
 
 router = APIRouter()
 
-@router.post("/crawl")
+@router.post("/crawl", dependencies=[Depends(require_api_key)])
 async def start_crawl(request: CrawlRequest):
     addresses = request.addresses
 
     if not addresses or len(addresses) == 0:
         raise HTTPException(status_code=400, detail="No addresses provided")
+    if not analyzer_allowed(request.analyze_url):
+        raise HTTPException(status_code=400, detail="analyze_url is not a configured analyzer (ANALYZER_URLS)")
 
-    crawler = Crawler()
-    job_id = crawler.start_crawl(addresses)
+    crawler = get_crawler()
+    job_id = crawler.start_crawl(addresses, request.analyze_url,
+                                 {url: v.model_dump() for url, v in request.validators.items()},
+                                 request.trace_ids)
 
     return {"job_id": job_id}
 
@@ -1,9 +1,24 @@
 from pydantic import BaseModel, field_validator
-from typing import List, Union
+from typing import Dict, List, Optional, Union
+
+
+class Validators(BaseModel):
+    """What the manager knows about the last crawl of a URL."""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+
 
 # To convert a single string address into a list of addresses (e.g {"addresses": "address1"} -> {"addresses": ["address1"]})
 class CrawlRequest(BaseModel):
     addresses: Union[str, List[str]]
+    # When set, pages are POSTed to this analyzer /analyze URL directly and the
+    # manager only receives the analyzer jobId instead of the page body
+    analyze_url: Optional[str] = None
+    # Per-URL validators of the previous crawl for conditional requests
+    validators: Dict[str, Validators] = {}
+    # Per-URL pipeline trace ids, echoed to the manager and analyzer with stage timestamps
+    trace_ids: Dict[str, str] = {}
 
     @field_validator("addresses")
     @classmethod
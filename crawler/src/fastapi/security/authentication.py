@@ -0,0 +1,17 @@
+import os
+
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+
+# Same key the manager sends as CRAWLER_APIKEY
+API_KEY = os.getenv("API_KEY", "changeme")
+security = HTTPBearer()
+
+
+def require_api_key(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    if not credentials or credentials.scheme.lower() != "bearer":
+        raise HTTPException(status_code=401, detail="Invalid authentication scheme")
+    token = credentials.credentials
+    if token != API_KEY:
+        raise HTTPException(status_code=403, detail="Invalid or missing API key")
+    return token
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import archive
+
+
+class TestPageArchive(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def test_put_is_deduplicated_and_round_trips(self):
+        store = archive.PageArchive(self.directory)
+        page = b"<html><body>" + b"hello onion " * 5000 + b"</body></html>"
+        digest = store.put(page)
+        self.assertEqual(store.put(page), digest)
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.get(digest), page)
+        self.assertEqual(b"".join(store.iter_chunks(digest, chunk_size=1000)), page)
+        self.assertLess(store.stats()["stored_bytes"], len(page) // 10)
+
+    def test_segments_roll_over_and_survive_reopen(self):
+        store = archive.PageArchive(self.directory, segment_bytes=200)
+        pages = [os.urandom(150) for _ in range(5)]
+        digests = [store.put(p) for p in pages]
+        self.assertGreater(store.stats()["segments"], 1)
+        store.close()
+
+        # A torn trailing index record is dropped on open
+        with open(os.path.join(self.directory, "index.bin"), "ab") as f:
+            f.write(b"\x00" * 7)
+        reopened = archive.PageArchive(self.directory, segment_bytes=200)
+        self.assertEqual(len(reopened), 5)
+        self.assertEqual([reopened.get(d) for d in digests], pages)
+        digest = reopened.put(b"after reopen")
+        self.assertEqual(reopened.get(digest), b"after reopen")
+
+    def test_snippet_streams_visible_text(self):
+        store = archive.PageArchive(self.directory)
+        filler = "<p>" + "lorem ipsum " * 20000 + "</p>"
+        page = f"<html><script>var hidden = 'Needle';</script>{filler}<p>find the Needle here</p>{filler}</html>"
+        digest = store.put(page.encode("utf-8"))
+
+        snippet = store.snippet(digest, "needle", width=40)
+        self.assertIn("find the Needle here", snippet)
+        self.assertLessEqual(len(snippet), 60)
+        self.assertIsNone(store.snippet(digest, "absent"))
+
+    def test_unknown_digest(self):
+        store = archive.PageArchive(self.directory)
+        self.assertNotIn("0" * 64, store)
+        self.assertNotIn("not-a-digest", store)
+        with self.assertRaises(KeyError):
+            store.get("0" * 64)
+
+
+    def test_endpoints_require_api_key_and_listed_analyzer(self):
+        from fastapi.testclient import TestClient
+        from main import app
+        from security.authentication import API_KEY
+
+        store = archive.PageArchive(self.directory)
+        digest = store.put(b"<html>archived</html>")
+        auth = {"Authorization": f"Bearer {API_KEY}"}
+        client = TestClient(app)
+        analyzer = MagicMock(status_code=202)
+        analyzer.json.return_value = {"jobId": "analysis-1"}
+        with patch("archive._archive", store), patch("crawler.requests.post", return_value=analyzer) as mock_post:
+            self.assertIn(client.get(f"/archive/{digest}").status_code, (401, 403))
+            self.assertEqual(client.get(f"/archive/{digest}", headers=auth).content, b"<html>archived</html>")
+            items = [{"content_hash": digest, "source_url": "http://a.onion"}]
+            self.assertIn(client.post("/archive/reanalyze", json={"items": items}).status_code, (401, 403))
+            rejected = client.post("/archive/reanalyze", headers=auth,
+                                   json={"analyze_url": "http://attacker.example/", "items": items})
+            self.assertEqual(rejected.status_code, 400)
+            mock_post.assert_not_called()
+            response = client.post("/archive/reanalyze", headers=auth, json={"items": items})
+            self.assertEqual(response.json()[0]["analysis_job_id"], "analysis-1")
+            self.assertEqual(mock_post.call_args.args[0], "http://analyzer:8000/analyze")
+
+
+if __name__ == '__main__':
+    unittest.main()
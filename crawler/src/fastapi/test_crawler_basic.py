@@ -1,15 +1,20 @@
 import os
+import tempfile
 import time
 import unittest
 from unittest.mock import patch, MagicMock
 
+import archive
 import crawler
+import heartbeat
 
 
 class FakeResponse:
-    def __init__(self, status_code=200, text='ok'):
+    def __init__(self, status_code=200, text='ok', headers=None):
         self.status_code = status_code
         self.text = text
+        self.content = text.encode('utf-8')
+        self.headers = headers or {}
 
 
 class TestCrawler(unittest.TestCase):
@@ -29,6 +34,11 @@ class TestCrawler(unittest.TestCase):
         self.addCleanup(patcher_dns.stop)
         self.mock_gethost = patcher_dns.start()
 
+        # Archive crawled pages into a throwaway directory
+        patcher_archive = patch('archive._archive', archive.PageArchive(tempfile.mkdtemp()))
+        self.addCleanup(patcher_archive.stop)
+        patcher_archive.start()
+
     def wait_for_job_finished(self, crawler_instance, job_id, timeout=3.0):
         start = time.time()
         while time.time() - start < timeout:
@@ -87,7 +97,121 @@ class TestCrawler(unittest.TestCase):
 
                 # Verify POST was attempted to manager endpoint
                 mock_post.assert_called()
-   
+
+    def test_direct_analysis_handoff(self):
+        # with analyze_url the page goes to the analyzer and the manager only gets the jobId
+        analyzer_response = MagicMock(status_code=202)
+        analyzer_response.json.return_value = {'jobId': 'analysis-1'}
+        page = FakeResponse(200, '<html>page</html>', {'Content-Type': 'text/html; charset=utf-8'})
+        with patch.object(crawler.requests.Session, 'get', return_value=page):
+            with patch('crawler.requests.post', return_value=analyzer_response) as mock_post:
+                c = crawler.Crawler()
+                job_id = c.start_crawl(['http://example.net'], analyze_url='http://analyzer:8000/analyze',
+                                       trace_ids={'http://example.net': 'trace-1'})
+
+                job = self.wait_for_job_finished(c, job_id, timeout=5.0)
+                self.assertIsNotNone(job)
+                self.assertEqual(job['results']['http://example.net'], {'analysis_job_id': 'analysis-1'})
+                # the report to the manager is sent right after the job is marked finished
+                self.wait_for_report(job)
+
+                analyzer_call, manager_call = mock_post.call_args_list
+                self.assertEqual(analyzer_call.args[0], 'http://analyzer:8000/analyze')
+                self.assertEqual(analyzer_call.kwargs['data'], b'<html>page</html>')
+                self.assertEqual(analyzer_call.kwargs['params'],
+                                 {'sourceUrl': 'http://example.net', 'traceId': 'trace-1'})
+                self.assertEqual(analyzer_call.kwargs['headers']['Content-Type'], 'text/html; charset=utf-8')
+                report = manager_call.kwargs['json']
+                self.assertEqual(report['analysis_job_id'], 'analysis-1')
+                self.assertNotIn('content', report)
+                # the trace id comes back with the crawler's stage timestamps
+                self.assertEqual(report['trace_id'], 'trace-1')
+                self.assertEqual(set(report['timings']), {'crawl_started', 'fetched', 'analysis_submitted'})
+                # the page was archived under the reported hash
+                self.assertEqual(archive.get_archive().get(report['content_hash']), b'<html>page</html>')
+
+
+    def test_unlisted_analyzer_gets_no_page(self):
+        # The analyzer key travels with every submission, so only configured analyzers get pages
+        page = FakeResponse(200, '<html>page</html>', {'Content-Type': 'text/html'})
+        with patch.object(crawler.requests.Session, 'get', return_value=page):
+            with patch('crawler.requests.post') as mock_post:
+                c = crawler.Crawler()
+                job_id = c.start_crawl(['http://example.net'], analyze_url='http://attacker.example/collect')
+                self.wait_for_report(self.wait_for_job_finished(c, job_id))
+                manager_call, = mock_post.call_args_list
+                self.assertEqual(manager_call.args[0], crawler.MANAGER_URL)
+                self.assertEqual(manager_call.kwargs['headers']['Authorization'], f"Bearer {crawler.MANAGER_API_KEY}")
+                self.assertEqual(manager_call.kwargs['json']['content'], '<html>page</html>')
+
+    def test_crawl_endpoint_requires_api_key_and_listed_analyzer(self):
+        from fastapi.testclient import TestClient
+        from main import app
+        from security.authentication import API_KEY
+
+        client = TestClient(app)
+        body = {'addresses': 'http://example.onion/'}
+        self.assertIn(client.post('/crawl', json=body).status_code, (401, 403))
+        self.assertEqual(client.post('/crawl', json=body, headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        response = client.post('/crawl', json={**body, 'analyze_url': 'http://attacker.example/collect'},
+                               headers={'Authorization': f'Bearer {API_KEY}'})
+        self.assertEqual(response.status_code, 400)
+        self.mock_from_port.assert_not_called()
+
+    def wait_for_report(self, job):
+        deadline = time.time() + 3.0
+        while job.get('analysis_status') != 'sent off' and time.time() < deadline:
+            time.sleep(0.05)
+
+    def test_conditional_recrawl(self):
+        previous = archive.get_archive().put(b'<html>old</html>')
+        validators = {'http://example.net': {'etag': '"v1"', 'last_modified': None, 'content_hash': previous}}
+
+        # 304: nothing downloaded, the archived size is reported as saved
+        with patch.object(crawler.requests.Session, 'get', return_value=FakeResponse(304, '')) as mock_get:
+            with patch('crawler.requests.post') as mock_post:
+                c = crawler.Crawler()
+                job = self.wait_for_job_finished(c, c.start_crawl(['http://example.net'], validators=validators))
+                self.wait_for_report(job)
+                self.assertEqual(mock_get.call_args.kwargs['headers'], {'If-None-Match': '"v1"'})
+                report = mock_post.call_args.kwargs['json']
+                self.assertTrue(report['not_modified'])
+                self.assertEqual(report['bytes_saved'], len(b'<html>old</html>'))
+                self.assertNotIn('content', report)
+
+        # 200 with the same body: reported as unchanged, not analyzed again
+        page = FakeResponse(200, '<html>old</html>', {'ETag': '"v2"'})
+        with patch.object(crawler.requests.Session, 'get', return_value=page):
+            with patch('crawler.requests.post') as mock_post:
+                c = crawler.Crawler()
+                job_id = c.start_crawl(['http://example.net'], analyze_url='http://analyzer:8000/analyze',
+                                       validators=validators)
+                self.wait_for_report(self.wait_for_job_finished(c, job_id))
+                mock_post.assert_called_once()  # only the manager report, no analyzer submission
+                report = mock_post.call_args.kwargs['json']
+                self.assertTrue(report['unchanged'])
+                self.assertEqual(report['etag'], '"v2"')
+
+    def test_crawler_is_shared_between_jobs(self):
+        # One Tor connection and session for all jobs, no NEWNYM per job
+        with patch('crawler._crawler', None):
+            first = crawler.get_crawler()
+            self.assertIs(crawler.get_crawler(), first)
+        self.mock_from_port.assert_called_once()
+        self.mock_from_port.return_value.signal.assert_called_once()
+
+    def test_heartbeat_reports_jobs(self):
+        jobs = {'a': {'status': 'queued'}, 'b': {'status': 'running'}, 'c': {'status': 'queued'},
+                'd': {'status': 'finished'}}
+        with patch.dict(crawler.JOB_STORE, jobs, clear=True), \
+                patch('heartbeat.CRAWLER_PUBLIC_URL', 'http://crawler-2:8080'), \
+                patch('heartbeat.requests.post', return_value=MagicMock(ok=True)) as mock_post:
+            self.assertTrue(heartbeat.send())
+        self.assertTrue(mock_post.call_args.args[0].endswith('/crawlers/heartbeat'))
+        self.assertEqual(mock_post.call_args.kwargs['headers']['Authorization'], f"Bearer {heartbeat.MANAGER_API_KEY}")
+        beat = mock_post.call_args.kwargs['json']
+        self.assertEqual(beat['url'], 'http://crawler-2:8080')
+        self.assertEqual((beat['queued'], beat['running']), (2, 1))
 
 
 if __name__ == '__main__':
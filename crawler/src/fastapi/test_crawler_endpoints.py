@@ -1,11 +1,12 @@
 from fastapi.testclient import TestClient
 from main import app
+from security.authentication import API_KEY
 
 client = TestClient(app)
 
 def test_crawl_and_single_status_endpoint():
     crawl_data = {"addresses": "https://duckduckgogg42xjoc72x3sjasowoarfbgcmvfimaftt6twagswzczad.onion/"}
-    response = client.post("/crawl", json=crawl_data)
+    response = client.post("/crawl", json=crawl_data, headers={"Authorization": f"Bearer {API_KEY}"})
     assert "job_id" in response.json()
     job_id = response.json()["job_id"]
 
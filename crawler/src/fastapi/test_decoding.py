@@ -0,0 +1,57 @@
+import codecs
+import unittest
+from unittest.mock import patch
+
+import decoding
+
+
+class TestDecodeBody(unittest.TestCase):
+    def setUp(self):
+        decoding._host_encodings.clear()
+
+    def test_bom_wins_over_declarations(self):
+        body = codecs.BOM_UTF8 + '<meta charset="iso-8859-1">Grüße'.encode('utf-8')
+        text, encoding = decoding.decode_body(body, 'text/html; charset=windows-1251')
+        self.assertEqual(encoding, 'utf-8-sig')
+        self.assertTrue(text.endswith('Grüße'))
+
+        text, encoding = decoding.decode_body(codecs.BOM_UTF16_LE + 'hi'.encode('utf-16-le'))
+        self.assertEqual((text, encoding), ('hi', 'utf-16'))
+
+    def test_header_and_meta_declarations(self):
+        body = 'Привет'.encode('cp1251')
+        self.assertEqual(decoding.decode_body(body, 'text/html; charset="windows-1251"'), ('Привет', 'cp1251'))
+
+        page = '<html><head><meta http-equiv="Content-Type" content="text/html; charset=koi8-r"></head>Привет'
+        text, encoding = decoding.decode_body(page.encode('koi8-r'), 'text/html')
+        self.assertEqual(encoding, 'koi8-r')
+        self.assertTrue(text.endswith('Привет'))
+
+        # An unknown label is ignored rather than failing the page
+        self.assertEqual(decoding.decode_body(b'plain', 'text/html; charset=bogus'), ('plain', 'utf-8'))
+
+    def test_meta_is_only_searched_near_the_start(self):
+        body = b'x' * (decoding.META_SCAN_BYTES + 10) + b'<meta charset="koi8-r">'
+        self.assertEqual(decoding.decode_body(body)[1], 'utf-8')
+
+    def test_undeclared_utf8_skips_detection(self):
+        with patch('decoding.detect') as detect:
+            text, encoding = decoding.decode_body('日本語 page'.encode('utf-8'), 'text/html')
+        self.assertEqual((text, encoding), ('日本語 page', 'utf-8'))
+        detect.assert_not_called()
+
+    def test_detection_uses_a_bounded_sample_and_is_cached_per_host(self):
+        body = ('Съешь же ещё этих мягких французских булок, да выпей чаю. ' * 2000).encode('cp1251')
+        with patch('decoding.detect', wraps=decoding.detect) as detect:
+            text, encoding = decoding.decode_body(body, 'text/html', 'http://abc.onion/a')
+            self.assertEqual(detect.call_args.args[0], body[:decoding.DETECT_SAMPLE_BYTES])
+            self.assertEqual(encoding, 'cp1251')
+            self.assertTrue(text.startswith('Съешь же ещё'))
+
+            text, encoding = decoding.decode_body('другая страница'.encode('cp1251'), None, 'http://abc.onion/b')
+        self.assertEqual((text, encoding), ('другая страница', 'cp1251'))
+        self.assertEqual(detect.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,13 +10,28 @@ Environment variables:
 import os
 import json
 import re
-from typing import Dict, Any
+import time
+from typing import Dict, Any, List
 import openai  # noqa: F401
 
+import heuristics
+import instrumentation
+import local_classifier
+
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MODEL_NAME = os.getenv("MODEL_NAME", "gpt-3.5-turbo")
 
+LLM_SECONDS = instrumentation.histogram(
+    "analyzer_llm_duration_seconds", "Latency of LLM completion calls by model and outcome", ["model", "outcome"],
+)
+LLM_TOKENS = instrumentation.counter(
+    "analyzer_llm_tokens_total", "Tokens used by LLM completions by model and kind", ["model", "kind"],
+)
+ANALYSES = instrumentation.counter(
+    "analyzer_analyses_total", "Analyses by the path that produced the result", ["path"],
+)
+
 # ---------------- JSON Parsing Helpers ---------------- #
 
 def safe_parse_json(text: str) -> Dict[str, Any]:
@@ -49,37 +64,18 @@ def safe_parse_json(text: str) -> Dict[str, Any]:
 
 def analyze_fallback(content: str) -> Dict[str, Any]:
     """
-    Simple deterministic heuristic: picks frequent words as tags, infers legality
-    based on presence of high-risk keywords, extracts first line as title, etc.
+    Heuristic: picks the highest TF-IDF words as tags (deterministic only with a frozen
+    document-frequency table, see heuristics.py), infers legality based on presence of
+    high-risk keywords, extracts first line as title, etc.
     """
-    stopwords = {
-        "the","and","a","an","of","to","in","for","on","with","by","is","this","that","it","be","are","was","were"
-    }
-    words = re.findall(r"[A-Za-z]{3,}", content.lower())
-    freq = {}
-    for w in words:
-        if w in stopwords:
-            continue
-        freq[w] = freq.get(w, 0) + 1
-    tags = sorted(freq.keys(), key=lambda k: (-freq[k], k))[:6]
-
-    first_line = next((ln.strip() for ln in content.splitlines() if ln.strip()), "") or "Untitled"
-    illegal_keywords = {"exploit", "bomb", "weapon", "carding", "fraud", "malware", "ddos", "phish", "ransomware"}
-    legality = not any(k in content.lower() for k in illegal_keywords)
-
-    description = re.sub(r"\s+", " ", content).strip()[:300]  # crude summary
-    url = None
-    m = re.search(r"https?://[^\s'\"]+", content)
-    if m:
-        url = m.group(0)
+    return heuristics.engine.analyze(content)
 
-    return {
-        "tags": tags,
-        "title": first_line,
-        "legality": legality,
-        "description": description,
-        "url": url,
-    }
+
+def analyze_fallback_batch(contents: List[str]) -> List[Dict[str, Any]]:
+    """
+    Heuristic analysis of several documents in one call (see heuristics.HeuristicAnalyzer).
+    """
+    return heuristics.engine.analyze_batch(contents)
 
 
 # ---------------- OpenAI Integrations ---------------- #
@@ -105,16 +101,26 @@ def _new_client_completion(content: str) -> Dict[str, Any]:
     user_prompt = f"Content:\n{content}\n\nReturn JSON."
 
     # Use structured JSON response if model supports it (gpt-4.1 / newer); for gpt-3.5 it may ignore.
-    response = client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        temperature=0.0,
-        max_tokens=512,
-        response_format={"type": "json_object"},
-    )
+    started = time.perf_counter()
+    try:
+        response = client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            temperature=0.0,
+            max_tokens=512,
+            response_format={"type": "json_object"},
+        )
+    except Exception:
+        LLM_SECONDS.labels(MODEL_NAME, "error").observe(time.perf_counter() - started)
+        raise
+    LLM_SECONDS.labels(MODEL_NAME, "ok").observe(time.perf_counter() - started)
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        LLM_TOKENS.labels(MODEL_NAME, "prompt").inc(usage.prompt_tokens or 0)
+        LLM_TOKENS.labels(MODEL_NAME, "completion").inc(usage.completion_tokens or 0)
 
     text = response.choices[0].message.content
     parsed = safe_parse_json(text)
@@ -143,16 +149,23 @@ def analyze_with_openai(content: str) -> Dict[str, Any]:
 
 def analyze_content_sync(content: str) -> Dict[str, Any]:
     """
-    Main entry used by API endpoint. Attempts OpenAI analysis, falls back if anything fails.
+    Main entry used by API endpoint. Answers confident pages with the local classifier,
+    otherwise attempts OpenAI analysis, falls back if anything fails.
     """
+    local = local_classifier.classify(content)
+    if local is not None:
+        ANALYSES.labels("local").inc()
+        return local
+
     if OPENAI_API_KEY:
         try:
-            return analyze_with_openai(content)
+            result = analyze_with_openai(content)
+            ANALYSES.labels("openai").inc()
+            return result
         except Exception as exc:
             # Log or print if desired; fallback ensures endpoint still succeeds.
             print(f"[ai_client] OpenAI analysis failed, using fallback: {exc}")
-            return analyze_fallback(content)
-    else:
-        return analyze_fallback(content)
+    ANALYSES.labels("fallback").inc()
+    return analyze_fallback(content)
 
 
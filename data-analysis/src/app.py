@@ -1,9 +1,24 @@
 from fastapi import FastAPI
-from routers.analyze_router import analyze_router
+from routers.analyze_router import analyze_router, dispatcher, require_api_key
+from instrumentation import setup_metrics
+from profiling import setup_profiling
 
 app = FastAPI()
 
 app.include_router(analyze_router,  tags=["analyze"])
+setup_metrics(app)
+setup_profiling(app, "analyzer", require_api_key)
+
+
+@app.on_event("startup")
+async def on_startup():
+    # Replays results left in the outbox by a previous run
+    await dispatcher.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await dispatcher.stop()
 
 
 
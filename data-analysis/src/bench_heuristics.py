@@ -0,0 +1,99 @@
+"""
+Throughput benchmark for the heuristic fallback analyzer.
+
+Compares the previous dict-loop implementation with heuristics.HeuristicAnalyzer
+on synthetic pages, both per document and in batches.
+
+Usage:
+  python3 bench_heuristics.py [--pages 500] [--size 50000] [--batch 50]
+"""
+
+import argparse
+import random
+import re
+import time
+
+from heuristics import HeuristicAnalyzer
+
+VOCABULARY = (
+    "market forum vendor escrow bitcoin monero shipping listing account login register password "
+    "hosting mirror onion service wiki links directory news blog privacy email chat support "
+    "carding exploit malware fraud weapon guide tutorial download software release update"
+).split()
+
+
+def legacy_analyze_fallback(content: str):
+    """The analyzer as it was before the heuristics engine, kept for comparison."""
+    stopwords = {
+        "the","and","a","an","of","to","in","for","on","with","by","is","this","that","it","be","are","was","were"
+    }
+    words = re.findall(r"[A-Za-z]{3,}", content.lower())
+    freq = {}
+    for w in words:
+        if w in stopwords:
+            continue
+        freq[w] = freq.get(w, 0) + 1
+    tags = sorted(freq.keys(), key=lambda k: (-freq[k], k))[:6]
+
+    first_line = next((ln.strip() for ln in content.splitlines() if ln.strip()), "") or "Untitled"
+    illegal_keywords = {"exploit", "bomb", "weapon", "carding", "fraud", "malware", "ddos", "phish", "ransomware"}
+    legality = not any(k in content.lower() for k in illegal_keywords)
+
+    description = re.sub(r"\s+", " ", content).strip()[:300]
+    url = None
+    m = re.search(r"https?://[^\s'\"]+", content)
+    if m:
+        url = m.group(0)
+
+    return {"tags": tags, "title": first_line, "legality": legality, "description": description, "url": url}
+
+
+def make_pages(count: int, size: int, seed: int = 42):
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(count):
+        words = []
+        length = 0
+        while length < size:
+            word = rng.choice(VOCABULARY)
+            words.append(word)
+            length += len(word) + 1
+            if rng.random() < 0.05:
+                words.append("\n")
+        pages.append("Title line\n" + " ".join(words))
+    return pages
+
+
+def run(label: str, func, pages) -> None:
+    start = time.perf_counter()
+    func(pages)
+    elapsed = time.perf_counter() - start
+    total_mb = sum(len(p) for p in pages) / 1_000_000
+    print(f"{label:<28} {len(pages) / elapsed:10.1f} pages/s {total_mb / elapsed:8.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--size", type=int, default=50_000, help="approximate characters per page")
+    parser.add_argument("--batch", type=int, default=50)
+    args = parser.parse_args()
+
+    pages = make_pages(args.pages, args.size)
+
+    run("legacy", lambda ps: [legacy_analyze_fallback(p) for p in ps], pages)
+
+    engine = HeuristicAnalyzer()
+    run("engine (single)", lambda ps: [engine.analyze(p) for p in ps], pages)
+
+    engine = HeuristicAnalyzer()
+
+    def batched(ps):
+        for i in range(0, len(ps), args.batch):
+            engine.analyze_batch(ps[i:i + args.batch])
+
+    run(f"engine (batch={args.batch})", batched, pages)
+
+
+if __name__ == "__main__":
+    main()
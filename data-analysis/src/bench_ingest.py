@@ -0,0 +1,79 @@
+"""
+Memory benchmark for /analyze body ingestion.
+
+Simulates many concurrent multi-MB submissions in-process and compares the
+peak Python heap of the JSON path (whole page parsed into a str and kept until
+the job runs) with the streaming path (gzip body spooled to a temp file and
+streamed through pre-processing). Peak heap is measured with tracemalloc.
+
+Usage:
+  python3 bench_ingest.py [--jobs 32] [--size-mb 8]
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import tracemalloc
+
+from ingest import spool_body, extract_text
+
+
+def make_page(size: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    words = "market forum vendor escrow onion mirror login listing bitcoin news".split()
+    paragraph = " ".join(rng.choice(words) for _ in range(200))
+    block = f"<p>{paragraph}</p>\n"
+    repeat = size // len(block) + 1
+    return ("<html><body>" + block * repeat + "</body></html>").encode("utf-8")
+
+
+async def _chunks(data: bytes, size: int = 64 * 1024):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+        await asyncio.sleep(0)
+
+
+async def json_path(bodies):
+    # Every request is parsed into a str and held until its job runs
+    held = [json.loads(body)["content"] for body in bodies]
+    return sum(len(content) for content in held)
+
+
+async def streaming_path(bodies):
+    spools = await asyncio.gather(*(spool_body(_chunks(body), "gzip") for body in bodies))
+    texts = await asyncio.gather(*(asyncio.to_thread(extract_text, spool, "text/html") for spool in spools))
+    for spool in spools:
+        spool.close()
+    return sum(len(text) for text in texts)
+
+
+def measure(label: str, coro_factory) -> None:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    asyncio.run(coro_factory())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<12} peak heap {peak / (1 << 20):8.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=32)
+    parser.add_argument("--size-mb", type=float, default=8)
+    args = parser.parse_args()
+
+    page = make_page(int(args.size_mb * (1 << 20)), seed=1)
+    print(f"{args.jobs} concurrent submissions of {len(page) / (1 << 20):.1f} MiB each")
+
+    json_bodies = [json.dumps({"content": page.decode("utf-8")}).encode("utf-8") for _ in range(args.jobs)]
+    measure("json", lambda: json_path(json_bodies))
+    del json_bodies
+
+    gzip_bodies = [gzip.compress(page, compresslevel=1) for _ in range(args.jobs)]
+    measure("streaming", lambda: streaming_path(gzip_bodies))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Escalation-rate and latency benchmark for the local first-pass classifier.
+
+Trains a model on one NDJSON file and evaluates it on another (or on a
+synthetic corpus of repeating onion page categories when no files are given),
+then reports how many pages would still escalate to the LLM, how often the
+local answer agrees with the reference tags, and the CPU latency per page.
+
+Usage:
+  python3 bench_local_classifier.py [--train contents.ndjson --eval holdout.ndjson] [--threshold 0.85]
+"""
+
+import argparse
+import random
+import time
+
+import local_classifier
+
+CATEGORIES = {
+    "market": "vendor escrow listing shipping price bitcoin monero cart order product stealth",
+    "forum": "thread reply post member topic board moderator register login signature",
+    "links": "directory links onion list mirror verified index category uptime",
+    "placeholder": "site hosted under construction default page nginx apache works",
+    "blog": "article author published comments privacy opinion archive news",
+}
+
+
+def synthetic_rows(count: int, seed: int):
+    rng = random.Random(seed)
+    filler = "the and page site welcome home about contact information more".split()
+    rows = []
+    for _ in range(count):
+        category = rng.choice(list(CATEGORIES))
+        words = CATEGORIES[category].split()
+        text = " ".join(rng.choice(words) if rng.random() < 0.6 else rng.choice(filler) for _ in range(300))
+        rows.append({"content": f"{category.title()} page\n{text}", "tags": [category]})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--train")
+    parser.add_argument("--eval")
+    parser.add_argument("--threshold", type=float, default=local_classifier.LOCAL_CLASSIFIER_THRESHOLD)
+    parser.add_argument("--categories", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.train and args.eval:
+        train_rows = list(local_classifier.read_ndjson(args.train))
+        eval_rows = list(local_classifier.read_ndjson(args.eval))
+    else:
+        train_rows = synthetic_rows(2000, seed=1)
+        eval_rows = synthetic_rows(1000, seed=2)
+
+    start = time.perf_counter()
+    model = local_classifier.train_from_rows(train_rows, categories=args.categories)
+    print(f"trained {len(model.classes)} classes on {len(train_rows)} rows in {time.perf_counter() - start:.1f}s")
+
+    latencies = []
+    answered = agreed = 0
+    for row in eval_rows:
+        text = local_classifier._row_text(row, model.source)
+        t0 = time.perf_counter()
+        label, confidence = model.predict(text)
+        latencies.append(time.perf_counter() - t0)
+        if label != local_classifier.OTHER_CLASS and confidence >= args.threshold:
+            answered += 1
+            if label in (row.get("tags") or []):
+                agreed += 1
+
+    latencies.sort()
+    total = len(eval_rows)
+    print(f"pages evaluated      {total}")
+    print(f"escalation rate      {(total - answered) / total:.1%}")
+    print(f"local agreement      {(agreed / answered) if answered else 0:.1%} of {answered} local answers")
+    print(f"latency p50 / p95    {latencies[total // 2] * 1000:.3f} ms / {latencies[int(total * 0.95)] * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Heuristic analysis engine used whenever the OpenAI path is unavailable.
+
+The engine lowercases each document once, tokenizes it with a compiled regex,
+counts terms with collections.Counter and checks all high-risk keywords in a
+single scan. Tags are ranked by TF-IDF against a process-wide
+document-frequency table, so words that appear on nearly every page (boilerplate
+such as "login" or "home") sink below the terms that characterise a page.
+
+By default the table learns from every analysed page, so the tags of a page
+depend on what the worker analysed before it. A table seeded from
+HEURISTIC_DF_PATH is frozen instead, which makes the results deterministic.
+
+Environment variables:
+- HEURISTIC_MAX_TAGS    : Optional. Number of tags to return. Defaults to 6.
+- HEURISTIC_DF_MAX_TERMS: Optional. Vocabulary cap of the document-frequency
+                          table before rare terms are pruned. Defaults to 200000.
+- HEURISTIC_DF_PATH     : Optional. JSON file {"documents": N, "frequencies": {term: count}}
+                          seeding a frozen document-frequency table.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+HEURISTIC_MAX_TAGS = int(os.getenv("HEURISTIC_MAX_TAGS", "6"))
+HEURISTIC_DF_MAX_TERMS = int(os.getenv("HEURISTIC_DF_MAX_TERMS", "200000"))
+HEURISTIC_DF_PATH = os.getenv("HEURISTIC_DF_PATH")
+
+STOPWORDS = frozenset({
+    "the", "and", "a", "an", "of", "to", "in", "for", "on", "with", "by", "is", "this", "that", "it", "be", "are",
+    "was", "were",
+})
+ILLEGAL_KEYWORDS = ("exploit", "bomb", "weapon", "carding", "fraud", "malware", "ddos", "phish", "ransomware")
+
+DESCRIPTION_LENGTH = 300
+
+_TOKEN_RE = re.compile(r"[a-z]{3,}")
+_WHITESPACE_RE = re.compile(r"\s+")
+_URL_RE = re.compile(r"https?://[^\s'\"]+")
+# First non-blank line; the character class mirrors the boundaries str.splitlines() uses.
+_FIRST_LINE_RE = re.compile(r"\S[^\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]*")
+
+
+def compile_keywords(keywords: Iterable[str]) -> "re.Pattern[str]":
+    """
+    Build one alternation pattern for a keyword list so the whole list is
+    matched in a single pass over the text. Longer keywords come first so that
+    overlapping keywords report the most specific hit.
+    """
+    ordered = sorted({k.lower() for k in keywords}, key=lambda k: (-len(k), k))
+    return re.compile("|".join(re.escape(k) for k in ordered))
+
+
+_ILLEGAL_RE = compile_keywords(ILLEGAL_KEYWORDS)
+
+
+# ---------------- Document Frequency ---------------- #
+
+class DocumentFrequencyTable:
+    """
+    Thread-safe corpus-wide document-frequency counts used for IDF weighting.
+
+    When the vocabulary grows past `max_terms` the table keeps only the most
+    frequent half, which bounds memory on long-running workers. A frozen table
+    ignores observe(), so the weights it gives never change.
+    """
+
+    def __init__(self, max_terms: int = HEURISTIC_DF_MAX_TERMS, frozen: bool = False):
+        self.max_terms = max_terms
+        self.frozen = frozen
+        self.documents = 0
+        self.frequencies: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str) -> "DocumentFrequencyTable":
+        """Frozen table from a JSON file {"documents": N, "frequencies": {term: count}}."""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        table = cls(frozen=True)
+        table.documents = int(data["documents"])
+        table.frequencies = Counter(data["frequencies"])
+        return table
+
+    def observe(self, terms: Iterable[str]) -> None:
+        if self.frozen:
+            return
+        with self._lock:
+            self.documents += 1
+            self.frequencies.update(terms)
+            if len(self.frequencies) > self.max_terms:
+                self.frequencies = Counter(dict(self.frequencies.most_common(self.max_terms // 2)))
+
+    def idf(self, term: str) -> float:
+        # Smoothed IDF; an unseen term gets the highest weight.
+        return math.log((1 + self.documents) / (1 + self.frequencies.get(term, 0))) + 1.0
+
+
+# ---------------- Engine ---------------- #
+
+def tokenize(lowered: str) -> Counter:
+    """Term frequencies of an already lowercased text, stopwords removed."""
+    counts = Counter(_TOKEN_RE.findall(lowered))
+    for word in STOPWORDS.intersection(counts):
+        del counts[word]
+    return counts
+
+
+def first_line(content: str) -> str:
+    match = _FIRST_LINE_RE.search(content)
+    return match.group(0).strip() if match else ""
+
+
+def find_url(content: str) -> Optional[str]:
+    match = _URL_RE.search(content)
+    return match.group(0) if match else None
+
+
+def is_legal(lowered: str) -> bool:
+    """False if the lowercased text contains any high-risk keyword."""
+    return _ILLEGAL_RE.search(lowered) is None
+
+
+def summarize(content: str, limit: int = DESCRIPTION_LENGTH) -> str:
+    """
+    Whitespace-collapsed prefix of the content. Only as much of the text as is
+    needed to fill `limit` characters is processed.
+    """
+    window = 4 * limit
+    while True:
+        summary = _WHITESPACE_RE.sub(" ", content[:window]).strip()
+        if len(summary) > limit or window >= len(content):
+            return summary[:limit]
+        window *= 4
+
+
+class HeuristicAnalyzer:
+    """
+    Analyzer producing the same result shape as the OpenAI path. Its results
+    only repeat for the same content while the document-frequency table is frozen.
+    """
+
+    def __init__(self, df_table: Optional[DocumentFrequencyTable] = None, max_tags: int = HEURISTIC_MAX_TAGS):
+        self.df_table = df_table if df_table is not None else DocumentFrequencyTable()
+        self.max_tags = max_tags
+
+    def rank_tags(self, counts: Counter) -> List[str]:
+        idf = self.df_table.idf
+        scores = {term: tf * idf(term) for term, tf in counts.items()}
+        return sorted(scores, key=lambda k: (-scores[k], k))[:self.max_tags]
+
+    def _build_result(self, content: str, lowered: str, counts: Counter) -> Dict[str, Any]:
+        return {
+            "tags": self.rank_tags(counts),
+            "title": first_line(content) or "Untitled",
+            "legality": is_legal(lowered),
+            "description": summarize(content),
+            "url": find_url(content),
+        }
+
+    def analyze(self, content: str) -> Dict[str, Any]:
+        lowered = content.lower()
+        counts = tokenize(lowered)
+        self.df_table.observe(counts.keys())
+        return self._build_result(content, lowered, counts)
+
+    def analyze_batch(self, contents: Iterable[str]) -> List[Dict[str, Any]]:
+        """
+        Analyze several documents at once. All documents are added to the
+        document-frequency table before any of them is scored, so pages in the
+        same batch weight each other's terms.
+        """
+        prepared = []
+        for content in contents:
+            lowered = content.lower()
+            counts = tokenize(lowered)
+            self.df_table.observe(counts.keys())
+            prepared.append((content, lowered, counts))
+        return [self._build_result(*item) for item in prepared]
+
+
+def _default_df_table() -> DocumentFrequencyTable:
+    if HEURISTIC_DF_PATH:
+        try:
+            return DocumentFrequencyTable.load(HEURISTIC_DF_PATH)
+        except Exception as exc:
+            print(f"[heuristics] Could not load document frequencies {HEURISTIC_DF_PATH}: {exc}")
+    return DocumentFrequencyTable()
+
+
+# Process-wide engine shared by all requests of the worker.
+engine = HeuristicAnalyzer(_default_df_table())
@@ -0,0 +1,249 @@
+"""
+Streaming ingestion of raw /analyze bodies.
+
+Request bodies that are not plain JSON (raw HTML/text, optionally gzip or zstd
+compressed, possibly sent with chunked transfer encoding) are decompressed
+chunk by chunk into a spooled temporary file, which stays in memory only up to
+INGEST_SPOOL_MEMORY bytes and rolls over to disk beyond that. The analysis job
+later streams the spool through an incremental decoder and HTML text extractor
+that stops after ANALYZE_MAX_CHARS characters, so the memory held per job is
+bounded no matter how large the submitted page is. The `content` of JSON
+requests goes through the same extractor and limit.
+
+Environment variables:
+- INGEST_SPOOL_MEMORY : Optional. Bytes kept in memory before spooling to disk. Defaults to 1 MiB.
+- INGEST_MAX_BYTES    : Optional. Maximum decompressed body size. Defaults to 256 MiB.
+- ANALYZE_MAX_CHARS   : Optional. Characters of extracted text passed to the analysis. Defaults to 200000.
+"""
+
+import codecs
+import io
+import os
+import tempfile
+import zlib
+from html.parser import HTMLParser
+from typing import AsyncIterable, BinaryIO, Iterator, Optional
+
+try:
+    import zstandard  # type: ignore
+except ImportError:  # zstd bodies are rejected when the package is missing
+    zstandard = None
+
+INGEST_SPOOL_MEMORY = int(os.getenv("INGEST_SPOOL_MEMORY", str(1 << 20)))
+INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", str(256 << 20)))
+ANALYZE_MAX_CHARS = int(os.getenv("ANALYZE_MAX_CHARS", "200000"))
+
+READ_CHUNK = 64 * 1024
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+# ---------------- Decompression ---------------- #
+#
+# Decompressors yield their output in pieces of at most READ_CHUNK bytes, so a
+# small compression bomb is stopped by the INGEST_MAX_BYTES check after the
+# first oversized piece instead of being expanded in memory first.
+
+class _Identity:
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        yield data
+
+    def flush(self) -> Iterator[bytes]:
+        return iter(())
+
+    def close(self) -> None:
+        pass
+
+
+class _Gzip:
+    def __init__(self):
+        # 32 + MAX_WBITS accepts both gzip and zlib framing
+        self._d = zlib.decompressobj(32 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        while data and not self._d.eof:
+            yield self._d.decompress(data, READ_CHUNK)
+            data = self._d.unconsumed_tail
+
+    def flush(self) -> Iterator[bytes]:
+        yield self._d.flush()
+
+    def close(self) -> None:
+        pass
+
+
+class _Zstd:
+    """zstd frames are spooled as they arrive and decompressed through a stream reader at the end.
+
+    The decompressobj API has no output limit, so bounded reads need the whole input
+    (which counts against INGEST_MAX_BYTES as well) to be available.
+    """
+
+    def __init__(self):
+        self._compressed = tempfile.SpooledTemporaryFile(max_size=INGEST_SPOOL_MEMORY)
+        self._size = 0
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        self._size += len(data)
+        if self._size > INGEST_MAX_BYTES:
+            raise BodyTooLarge(f"Body exceeds {INGEST_MAX_BYTES} bytes")
+        self._compressed.write(data)
+        return iter(())
+
+    def flush(self) -> Iterator[bytes]:
+        self._compressed.seek(0)
+        reader = zstandard.ZstdDecompressor().stream_reader(self._compressed, read_across_frames=True)
+        while True:
+            piece = reader.read(READ_CHUNK)
+            if not piece:
+                return
+            yield piece
+
+    def close(self) -> None:
+        self._compressed.close()
+
+
+# Errors of a corrupt compressed body, reported as UnsupportedEncoding
+_CORRUPT = (zlib.error, zstandard.ZstdError) if zstandard is not None else (zlib.error,)
+
+
+def make_decompressor(content_encoding: Optional[str]):
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding in ("", "identity"):
+        return _Identity()
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        return _Gzip()
+    if encoding == "zstd":
+        if zstandard is None:
+            raise UnsupportedEncoding("zstd bodies require the 'zstandard' package")
+        return _Zstd()
+    raise UnsupportedEncoding(f"Unsupported Content-Encoding: {content_encoding}")
+
+
+async def spool_body(chunks: AsyncIterable[bytes], content_encoding: Optional[str] = None) -> BinaryIO:
+    """
+    Decompress an async stream of body chunks into a spooled temporary file
+    positioned at its start. Raises UnsupportedEncoding or BodyTooLarge.
+    """
+    decompressor = make_decompressor(content_encoding)
+    spool = tempfile.SpooledTemporaryFile(max_size=INGEST_SPOOL_MEMORY)
+    written = 0
+
+    def write(pieces: Iterator[bytes]) -> None:
+        nonlocal written
+        for piece in pieces:
+            written += len(piece)
+            if written > INGEST_MAX_BYTES:
+                raise BodyTooLarge(f"Body exceeds {INGEST_MAX_BYTES} bytes")
+            spool.write(piece)
+
+    try:
+        async for chunk in chunks:
+            write(decompressor.decompress(chunk))
+        write(decompressor.flush())
+    except _CORRUPT as exc:
+        spool.close()
+        raise UnsupportedEncoding(f"Corrupt compressed body: {exc}")
+    except Exception:
+        spool.close()
+        raise
+    finally:
+        decompressor.close()
+    spool.seek(0)
+    return spool
+
+
+# ---------------- Pre-processing ---------------- #
+
+class _TextExtractor(HTMLParser):
+    """Collects visible text, skipping script/style, until `limit` characters are gathered."""
+
+    SKIP = {"script", "style", "noscript", "template"}
+
+    def __init__(self, limit: int):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.size = 0
+        self.parts = []
+        self._skip_depth = 0
+
+    @property
+    def full(self) -> bool:
+        return self.size >= self.limit
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip_depth += 1
+        elif tag in ("br", "p", "div", "li", "tr", "h1", "h2", "h3", "h4", "title"):
+            self._append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip_depth and data.strip():
+            self._append(data)
+
+    def _append(self, text: str):
+        if self.full:
+            return
+        text = text[:self.limit - self.size]
+        self.parts.append(text)
+        self.size += len(text)
+
+
+def _charset_from_content_type(content_type: Optional[str]) -> str:
+    for param in (content_type or "").split(";")[1:]:
+        key, _, value = param.strip().partition("=")
+        if key.lower() == "charset" and value:
+            try:
+                return codecs.lookup(value.strip('"\'')).name
+            except LookupError:
+                break
+    return "utf-8"
+
+
+def extract_text(spool: BinaryIO, content_type: Optional[str] = None, max_chars: int = ANALYZE_MAX_CHARS) -> str:
+    """
+    Stream a spooled body through an incremental decoder and, for HTML, a text
+    extractor. Reading stops as soon as `max_chars` characters are collected.
+    """
+    decoder = codecs.getincrementaldecoder(_charset_from_content_type(content_type))(errors="replace")
+    is_html = "html" in (content_type or "").lower()
+
+    if is_html:
+        extractor = _TextExtractor(max_chars)
+        while not extractor.full:
+            chunk = spool.read(READ_CHUNK)
+            extractor.feed(decoder.decode(chunk, final=not chunk))
+            if not chunk:
+                extractor.close()
+                break
+        return "".join(extractor.parts).strip()
+
+    parts, size = [], 0
+    while size < max_chars:
+        chunk = spool.read(READ_CHUNK)
+        text = decoder.decode(chunk, final=not chunk)[:max_chars - size]
+        parts.append(text)
+        size += len(text)
+        if not chunk:
+            break
+    return "".join(parts)
+
+
+def extract_content_text(content: str, max_chars: int = ANALYZE_MAX_CHARS) -> str:
+    """
+    Bound the `content` of a JSON request like a raw body: content that starts with
+    markup goes through the HTML text extractor, anything else is cut at `max_chars`.
+    """
+    is_html = content.lstrip("\ufeff \t\r\n").startswith("<")
+    content_type = "text/html; charset=utf-8" if is_html else "text/plain; charset=utf-8"
+    return extract_text(io.BytesIO(content.encode("utf-8", errors="replace")), content_type, max_chars)
@@ -0,0 +1,361 @@
+"""
+Job bookkeeping for the analyzer.
+
+Every job is in exactly one state:
+
+    queued -> running -> done         (result produced; delivered or awaiting delivery)
+                      -> failed       (analysis raised)
+                done  -> undelivered  (delivery retries exhausted, outbox keeps trying)
+         undelivered  -> done         (late delivery succeeded)
+
+Stores keep a secondary index per state so listings are paginated with a
+cursor in O(page size), and they evict finished jobs JOB_TTL_SECONDS after
+they were delivered (or failed), so long-running workers do not accumulate
+results forever. Eviction runs on creates and reads (at most every
+JOB_EVICT_INTERVAL seconds), so it also happens while no new jobs arrive; the
+metrics scrape of counts() keeps it going on an idle worker.
+
+Environment variables:
+- JOB_STORE_BACKEND : Optional. 'memory' (default) or 'sqlite'.
+- JOB_STORE_PATH    : Optional. SQLite file for the sqlite backend. Defaults to 'jobs.sqlite3'.
+- JOB_TTL_SECONDS   : Optional. Lifetime of delivered/failed jobs. Defaults to 3600.
+"""
+
+import abc
+import bisect
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "memory")
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs.sqlite3")
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", "3600"))
+# Seconds between eviction passes run by creates and reads
+JOB_EVICT_INTERVAL = 1.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+UNDELIVERED = "undelivered"
+STATES = (QUEUED, RUNNING, DONE, FAILED, UNDELIVERED)
+FINISHED_STATES = (DONE, FAILED, UNDELIVERED)
+
+Page = Tuple[List[Dict[str, Any]], Optional[str]]
+
+
+def _summary(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "jobId": job["jobId"],
+        "state": job["state"],
+        "delivered": job["delivered"],
+        "error": job.get("error"),
+        "createdAt": job["createdAt"],
+        "updatedAt": job["updatedAt"],
+    }
+
+
+def _parse_cursor(cursor: Optional[str]) -> int:
+    """Sequence number encoded in a listing cursor; ValueError if it is not one we handed out."""
+    if not cursor:
+        return 0
+    try:
+        seq = int(cursor)
+    except ValueError:
+        seq = -1
+    if seq < 0:
+        raise ValueError(f"Invalid cursor {cursor!r}: pass the nextCursor of the previous page")
+    return seq
+
+
+class JobStore(abc.ABC):
+    """Interface of the analyzer job stores."""
+
+    _last_eviction = 0.0
+
+    @abc.abstractmethod
+    def create(self, callback_url: str) -> str:
+        ...
+
+    @abc.abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    def transition(self, job_id: str, state: str, **fields) -> None:
+        ...
+
+    @abc.abstractmethod
+    def list(self, state: str, cursor: Optional[str] = None, limit: int = 50) -> Page:
+        ...
+
+    @abc.abstractmethod
+    def counts(self) -> Dict[str, int]:
+        ...
+
+    @abc.abstractmethod
+    def evict_expired(self, now: Optional[float] = None) -> int:
+        ...
+
+    def _evict_if_due(self, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        if now - self._last_eviction >= JOB_EVICT_INTERVAL:
+            self._last_eviction = now
+            self.evict_expired(now)
+
+    # Convenience transitions used by the router
+    def start(self, job_id: str) -> None:
+        self.transition(job_id, RUNNING)
+
+    def finish(self, job_id: str, result: Dict[str, Any]) -> None:
+        self.transition(job_id, DONE, result=result)
+
+    def fail(self, job_id: str, error: str) -> None:
+        self.transition(job_id, FAILED, error=error)
+
+    def mark_delivered(self, job_id: str) -> None:
+        self.transition(job_id, DONE, delivered=True)
+
+    def mark_undelivered(self, job_id: str) -> None:
+        self.transition(job_id, UNDELIVERED)
+
+
+# ---------------- In-memory backend ---------------- #
+
+class _StateIndex:
+    """
+    Jobs of one state ordered by the sequence number they entered it with.
+    New entries always carry the highest sequence number, so appends are O(1);
+    removals are lazy and the list is compacted once half of it is stale.
+    """
+
+    def __init__(self):
+        self.seqs: List[int] = []
+        self.members: Dict[int, str] = {}
+
+    def add(self, seq: int, job_id: str) -> None:
+        self.seqs.append(seq)
+        self.members[seq] = job_id
+
+    def remove(self, seq: int) -> None:
+        self.members.pop(seq, None)
+        if len(self.seqs) > 64 and len(self.members) < len(self.seqs) // 2:
+            self.seqs = [s for s in self.seqs if s in self.members]
+
+    def page(self, after: int, limit: int) -> Tuple[List[str], Optional[int]]:
+        i = bisect.bisect_right(self.seqs, after)
+        job_ids, last = [], None
+        while i < len(self.seqs) and len(job_ids) < limit:
+            seq = self.seqs[i]
+            job_id = self.members.get(seq)
+            if job_id is not None:
+                job_ids.append(job_id)
+                last = seq
+            i += 1
+        # A full page may be followed by an empty one; that keeps the cost at O(page size)
+        return job_ids, (last if len(job_ids) == limit else None)
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+
+class InMemoryJobStore(JobStore):
+    def __init__(self, ttl: float = JOB_TTL_SECONDS):
+        self.ttl = ttl
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._index = {state: _StateIndex() for state in STATES}
+        self._expiry: deque = deque()
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def _next_seq(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    def create(self, callback_url: str) -> str:
+        now = time.time()
+        self._evict_if_due(now)
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            seq = self._next_seq()
+            self._jobs[job_id] = {
+                "jobId": job_id, "state": QUEUED, "seq": seq, "callbackUrl": callback_url,
+                "result": None, "error": None, "delivered": False, "createdAt": now, "updatedAt": now,
+            }
+            self._index[QUEUED].add(seq, job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        self._evict_if_due()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def transition(self, job_id: str, state: str, **fields) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            now = time.time()
+            if job["state"] != state:
+                self._index[job["state"]].remove(job["seq"])
+                job["seq"] = self._next_seq()
+                job["state"] = state
+                self._index[state].add(job["seq"], job_id)
+            job.update(fields, updatedAt=now)
+            if state == FAILED or (state == DONE and job["delivered"]):
+                self._expiry.append((now + self.ttl, job_id))
+
+    def list(self, state: str, cursor: Optional[str] = None, limit: int = 50) -> Page:
+        seq = _parse_cursor(cursor)
+        self._evict_if_due()
+        with self._lock:
+            job_ids, last = self._index[state].page(seq, limit)
+            items = [_summary(self._jobs[j]) for j in job_ids]
+        return items, (str(last) if last is not None else None)
+
+    def counts(self) -> Dict[str, int]:
+        self._evict_if_due()
+        with self._lock:
+            return {state: len(index) for state, index in self._index.items()}
+
+    def evict_expired(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        evicted = 0
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, job_id = self._expiry.popleft()
+                job = self._jobs.get(job_id)
+                # Skip stale expiry entries of jobs that changed state afterwards
+                if job is None or job["updatedAt"] + self.ttl > now:
+                    continue
+                if job["state"] == FAILED or (job["state"] == DONE and job["delivered"]):
+                    self._index[job["state"]].remove(job["seq"])
+                    del self._jobs[job_id]
+                    evicted += 1
+        return evicted
+
+
+# ---------------- SQLite backend ---------------- #
+
+class SQLiteJobStore(JobStore):
+    def __init__(self, path: str = JOB_STORE_PATH, ttl: float = JOB_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " callback_url TEXT NOT NULL,"
+            " result TEXT,"
+            " error TEXT,"
+            " delivered INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " expires_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state_seq ON jobs (state, seq)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_expires ON jobs (expires_at) WHERE expires_at IS NOT NULL")
+        self._seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM jobs").fetchone()[0]
+        self._counts = {state: 0 for state in STATES}
+        for state, count in self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"):
+            self._counts[state] = count
+
+    @staticmethod
+    def _row_to_job(row) -> Dict[str, Any]:
+        job_id, state, seq, callback_url, result, error, delivered, created_at, updated_at = row
+        return {
+            "jobId": job_id, "state": state, "seq": seq, "callbackUrl": callback_url,
+            "result": json.loads(result) if result else None, "error": error, "delivered": bool(delivered),
+            "createdAt": created_at, "updatedAt": updated_at,
+        }
+
+    def create(self, callback_url: str) -> str:
+        now = time.time()
+        self._evict_if_due(now)
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._seq += 1
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, state, seq, callback_url, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, self._seq, callback_url, now, now),
+            )
+            self._counts[QUEUED] += 1
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        self._evict_if_due()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, state, seq, callback_url, result, error, delivered, created_at, updated_at"
+                " FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def transition(self, job_id: str, state: str, **fields) -> None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT state, delivered FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            previous, delivered = row[0], bool(fields.get("delivered", row[1]))
+            expires_at = now + self.ttl if state == FAILED or (state == DONE and delivered) else None
+            if previous != state:
+                self._seq += 1
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, seq = CASE WHEN state = ? THEN seq ELSE ? END,"
+                " result = COALESCE(?, result), error = COALESCE(?, error), delivered = ?,"
+                " updated_at = ?, expires_at = ? WHERE job_id = ?",
+                (state, state, self._seq, json.dumps(fields["result"]) if "result" in fields else None,
+                 fields.get("error"), int(delivered), now, expires_at, job_id),
+            )
+            if previous != state:
+                self._counts[previous] -= 1
+                self._counts[state] += 1
+
+    def list(self, state: str, cursor: Optional[str] = None, limit: int = 50) -> Page:
+        seq = _parse_cursor(cursor)
+        self._evict_if_due()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, state, seq, callback_url, NULL, error, delivered, created_at, updated_at"
+                " FROM jobs WHERE state = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (state, seq, limit + 1),
+            ).fetchall()
+        items = [self._row_to_job(row) for row in rows[:limit]]
+        next_cursor = str(items[-1]["seq"]) if len(rows) > limit else None
+        return [_summary(job) for job in items], next_cursor
+
+    def counts(self) -> Dict[str, int]:
+        self._evict_if_due()
+        with self._lock:
+            return dict(self._counts)
+
+    def evict_expired(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = self._conn.execute(
+                "SELECT state, COUNT(*) FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ? GROUP BY state",
+                (now,),
+            ).fetchall()
+            if not expired:
+                return 0
+            self._conn.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            for state, count in expired:
+                self._counts[state] -= count
+        return sum(count for _, count in expired)
+
+
+def create_job_store() -> JobStore:
+    if JOB_STORE_BACKEND == "sqlite":
+        return SQLiteJobStore(JOB_STORE_PATH)
+    return InMemoryJobStore()
@@ -0,0 +1,331 @@
+"""
+CPU-only first-pass page classifier that runs before the OpenAI analysis.
+
+Pages are turned into hashed bag-of-words features and scored with a softmax
+linear model trained from the manager's analysed Content/Tag data. When the top
+class probability reaches the confidence threshold the page is answered locally
+with that class's tag profile; everything else escalates to the LLM.
+
+Environment variables:
+- LOCAL_CLASSIFIER_PATH      : Optional. JSON model file; the stage is disabled when unset or missing.
+- LOCAL_CLASSIFIER_THRESHOLD : Optional. Minimum class probability for a local answer. Defaults to 0.85.
+
+Tags are only ever the labels, never part of the text a page is scored on. A model
+trained on rows that all carry the page `content` scores the page text; otherwise pages
+are scored on their first line and summary. Such a model trains on the first line and
+summary of the rows that have content, the same text it is served, and only falls back
+to the title and description for rows without content, the nearest substitute.
+
+Training (input is NDJSON with url/title/description/tags and optionally content/legality per line,
+as produced by the manager's contents export):
+  python3 local_classifier.py train contents.ndjson model.json [--categories 20] [--epochs 5]
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import heuristics
+
+LOCAL_CLASSIFIER_PATH = os.getenv("LOCAL_CLASSIFIER_PATH")
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.85"))
+
+DEFAULT_FEATURES = 1 << 18
+MAX_TERMS_PER_PAGE = 512
+OTHER_CLASS = "other"
+PROFILE_TAGS = 5
+# Text a model is trained and scored on: the page content, or its title and description
+SOURCE_CONTENT = "content"
+SOURCE_SUMMARY = "summary"
+
+Features = List[Tuple[int, float]]
+
+
+# ---------------- Features ---------------- #
+
+def _source_text(content: str, source: str) -> str:
+    if source == SOURCE_SUMMARY:
+        return f"{heuristics.first_line(content)} {heuristics.summarize(content)}"
+    return content
+
+
+def extract_features(text: str, n_features: int = DEFAULT_FEATURES) -> Features:
+    """
+    Hashed, log-scaled and L2-normalised term features. Only the most frequent
+    terms of a page are kept so the cost per page stays bounded.
+    """
+    counts = heuristics.tokenize(text.lower())
+    buckets: Dict[int, float] = {}
+    mask = n_features - 1
+    for term, tf in counts.most_common(MAX_TERMS_PER_PAGE):
+        bucket = zlib.crc32(term.encode("utf-8")) & mask
+        buckets[bucket] = buckets.get(bucket, 0.0) + 1.0 + math.log(tf)
+    norm = math.sqrt(sum(v * v for v in buckets.values())) or 1.0
+    return [(b, v / norm) for b, v in buckets.items()]
+
+
+def _softmax(scores: List[float]) -> List[float]:
+    top = max(scores)
+    exps = [math.exp(s - top) for s in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+
+# ---------------- Model ---------------- #
+
+class LocalClassifier:
+    """
+    Softmax regression over hashed features. `profiles` maps each class to the
+    tags and legality returned for confident predictions.
+    """
+
+    def __init__(self, classes: List[str], n_features: int = DEFAULT_FEATURES, source: str = SOURCE_CONTENT):
+        self.classes = list(classes)
+        self.n_features = n_features
+        self.source = source
+        self.bias = [0.0] * len(self.classes)
+        self.weights: Dict[int, List[float]] = {}
+        self.profiles: Dict[str, Dict[str, Any]] = {}
+
+    def scores(self, features: Features) -> List[float]:
+        scores = list(self.bias)
+        n_classes = len(scores)
+        for bucket, value in features:
+            row = self.weights.get(bucket)
+            if row is not None:
+                for c in range(n_classes):
+                    scores[c] += row[c] * value
+        return scores
+
+    def page_text(self, content: str) -> str:
+        """The text of a page that this model scores (see SOURCE_CONTENT / SOURCE_SUMMARY)."""
+        return _source_text(content, self.source)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        probabilities = _softmax(self.scores(extract_features(text, self.n_features)))
+        best = max(range(len(probabilities)), key=probabilities.__getitem__)
+        return self.classes[best], probabilities[best]
+
+    def fit(self, samples: List[Tuple[Features, int]], epochs: int = 5, learning_rate: float = 0.5,
+            l2: float = 1e-6, seed: int = 0) -> None:
+        rng = random.Random(seed)
+        n_classes = len(self.classes)
+        order = list(range(len(samples)))
+        for epoch in range(epochs):
+            rng.shuffle(order)
+            rate = learning_rate / (1 + epoch)
+            for i in order:
+                features, label = samples[i]
+                probabilities = _softmax(self.scores(features))
+                gradient = [p - (1.0 if c == label else 0.0) for c, p in enumerate(probabilities)]
+                for c in range(n_classes):
+                    self.bias[c] -= rate * gradient[c]
+                for bucket, value in features:
+                    row = self.weights.get(bucket)
+                    if row is None:
+                        row = self.weights[bucket] = [0.0] * n_classes
+                    for c in range(n_classes):
+                        row[c] -= rate * (gradient[c] * value + l2 * row[c])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": 1,
+            "n_features": self.n_features,
+            "source": self.source,
+            "classes": self.classes,
+            "bias": self.bias,
+            "weights": {str(b): [round(w, 6) for w in row] for b, row in self.weights.items()},
+            "profiles": self.profiles,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LocalClassifier":
+        model = cls(data["classes"], data["n_features"], data.get("source", SOURCE_CONTENT))
+        model.bias = list(data["bias"])
+        model.weights = {int(b): row for b, row in data["weights"].items()}
+        model.profiles = data.get("profiles", {})
+        return model
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str) -> "LocalClassifier":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+# ---------------- Training ---------------- #
+
+def _row_text(row: Dict[str, Any], source: str = SOURCE_CONTENT) -> str:
+    # Train on what LocalClassifier.page_text serves; title and description only without content
+    if row.get("content"):
+        return _source_text(row["content"], source)
+    return f"{row.get('title') or ''} {row.get('description') or ''}"
+
+
+def train_from_rows(rows: List[Dict[str, Any]], categories: int = 20, epochs: int = 5,
+                    n_features: int = DEFAULT_FEATURES) -> LocalClassifier:
+    """
+    Train a classifier from analysed contents. The `categories` most common tags
+    become the classes; each row is assigned the most common of its own tags,
+    rows without any of them fall into OTHER_CLASS (which always escalates).
+    Unless every row has its page content, rows train on the first line and summary of
+    their content, or on title and description when they have none.
+    """
+    source = SOURCE_CONTENT if rows and all(row.get("content") for row in rows) else SOURCE_SUMMARY
+    tag_counts = Counter(tag for row in rows for tag in set(row.get("tags") or []))
+    top_tags = [tag for tag, _ in tag_counts.most_common(categories)]
+    top_set = set(top_tags)
+    classes = top_tags + [OTHER_CLASS]
+    index = {name: i for i, name in enumerate(classes)}
+
+    samples = []
+    cooccurring: Dict[str, Counter] = {name: Counter() for name in classes}
+    legality: Dict[str, Counter] = {name: Counter() for name in classes}
+    for row in rows:
+        tags = row.get("tags") or []
+        candidates = [t for t in tags if t in top_set]
+        label = max(candidates, key=lambda t: (tag_counts[t], t)) if candidates else OTHER_CLASS
+        samples.append((extract_features(_row_text(row, source), n_features), index[label]))
+        cooccurring[label].update(tags)
+        if row.get("legality") is not None:
+            legality[label][bool(row["legality"])] += 1
+
+    model = LocalClassifier(classes, n_features, source)
+    model.fit(samples, epochs=epochs)
+    for name in classes:
+        profile_tags = [] if name == OTHER_CLASS else [name]
+        profile_tags += [t for t, _ in cooccurring[name].most_common(PROFILE_TAGS + 1) if t != name]
+        votes = legality[name]
+        model.profiles[name] = {
+            "tags": profile_tags[:PROFILE_TAGS],
+            "legality": votes.most_common(1)[0][0] if votes else None,
+        }
+    return model
+
+
+def read_ndjson(path: str) -> Iterable[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+# ---------------- Runtime Stage ---------------- #
+
+class ClassifierStats:
+    """Escalation and latency counters of the local stage."""
+
+    def __init__(self, window: int = 1000):
+        self.pages = 0
+        self.answered = 0
+        self.escalated = 0
+        self.latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, answered: bool, seconds: float) -> None:
+        with self._lock:
+            self.pages += 1
+            if answered:
+                self.answered += 1
+            else:
+                self.escalated += 1
+            self.latencies.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self.latencies)
+        def percentile(q: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 3)
+        return {
+            "enabled": get_model() is not None,
+            "pages": self.pages,
+            "answeredLocally": self.answered,
+            "escalated": self.escalated,
+            "escalationRate": (self.escalated / self.pages) if self.pages else None,
+            "latencyMsP50": percentile(0.50),
+            "latencyMsP95": percentile(0.95),
+        }
+
+
+STATS = ClassifierStats()
+_MODEL: Optional[LocalClassifier] = None
+_MODEL_LOADED = False
+_MODEL_LOCK = threading.Lock()
+
+
+def get_model() -> Optional[LocalClassifier]:
+    """Load the model from LOCAL_CLASSIFIER_PATH once; None when the stage is disabled."""
+    global _MODEL, _MODEL_LOADED
+    if not _MODEL_LOADED:
+        with _MODEL_LOCK:
+            if not _MODEL_LOADED:
+                if LOCAL_CLASSIFIER_PATH and os.path.exists(LOCAL_CLASSIFIER_PATH):
+                    try:
+                        _MODEL = LocalClassifier.load(LOCAL_CLASSIFIER_PATH)
+                    except Exception as exc:
+                        print(f"[local_classifier] Could not load model {LOCAL_CLASSIFIER_PATH}: {exc}")
+                _MODEL_LOADED = True
+    return _MODEL
+
+
+def classify(content: str, threshold: float = LOCAL_CLASSIFIER_THRESHOLD) -> Optional[Dict[str, Any]]:
+    """
+    Return an analysis dict when the local model is confident, None when the page
+    should escalate to the LLM (or the stage is disabled).
+    """
+    model = get_model()
+    if model is None:
+        return None
+
+    start = time.perf_counter()
+    label, confidence = model.predict(model.page_text(content))
+    profile = model.profiles.get(label, {})
+    answered = label != OTHER_CLASS and confidence >= threshold
+    result = None
+    if answered:
+        legality = profile.get("legality")
+        if legality is None:
+            legality = heuristics.is_legal(content.lower())
+        result = {
+            "tags": list(profile.get("tags") or [label]),
+            "title": heuristics.first_line(content) or "Untitled",
+            "legality": bool(legality),
+            "description": heuristics.summarize(content),
+            "url": heuristics.find_url(content),
+        }
+    STATS.record(answered, time.perf_counter() - start)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the local first-pass classifier")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train = sub.add_parser("train")
+    train.add_argument("input", help="NDJSON file of analysed contents")
+    train.add_argument("output", help="model JSON path")
+    train.add_argument("--categories", type=int, default=20)
+    train.add_argument("--epochs", type=int, default=5)
+    train.add_argument("--features", type=int, default=DEFAULT_FEATURES, help="hash buckets, a power of two")
+    args = parser.parse_args()
+
+    rows = list(read_ndjson(args.input))
+    model = train_from_rows(rows, categories=args.categories, epochs=args.epochs, n_features=args.features)
+    model.save(args.output)
+    print(f"Trained {len(model.classes)} classes on {len(rows)} rows -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
+from enum import Enum
 from pydantic import BaseModel, Field, HttpUrl
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 class AnalyzeRequest(BaseModel):
     content: str = Field(..., description="Content to be analyzed")
@@ -7,6 +8,14 @@ class AnalyzeRequest(BaseModel):
         None,
         description="Optional override URL to POST analysis result to"
     )
+    sourceUrl: Optional[str] = Field(
+        None,
+        description="Optional URL the content was crawled from, echoed back in the result"
+    )
+    traceId: Optional[str] = Field(
+        None,
+        description="Optional pipeline trace id, echoed back in the result with stage timestamps"
+    )
 
 class JobAccepted(BaseModel):
     jobId: str
@@ -17,4 +26,29 @@ class AnalysisResult(BaseModel):
     legality: bool
     description: Optional[str] = None
     url: Optional[str] = None
+    sourceUrl: Optional[str] = None
     jobId: str
+    traceId: Optional[str] = None
+    # Wall-clock timestamps (analysis_started, analysis_done) for the manager's pipeline tracing
+    timings: Optional[Dict[str, float]] = None
+
+
+class JobState(str, Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+    undelivered = "undelivered"
+
+class JobSummary(BaseModel):
+    jobId: str
+    state: JobState
+    delivered: bool
+    error: Optional[str] = None
+    createdAt: float
+    updatedAt: float
+
+class JobPage(BaseModel):
+    items: List[JobSummary]
+    nextCursor: Optional[str] = None
+    counts: Dict[str, int]
@@ -0,0 +1,266 @@
+"""
+Durable outbox for analysis results.
+
+Finished results are written to a local SQLite file before any delivery is
+attempted and removed only after the callback endpoint acknowledged them. An
+async dispatcher delivers due entries in batches over a pooled httpx client,
+retrying failures with jittered exponential backoff. Entries left over from a
+previous run are replayed when the dispatcher starts, so a delivery failure
+never costs a second (paid) analysis.
+
+Environment variables:
+- OUTBOX_PATH             : Optional. SQLite file of the outbox. Defaults to 'outbox.sqlite3'.
+- OUTBOX_BATCH_SIZE       : Optional. Entries delivered per dispatcher round. Defaults to 50.
+- OUTBOX_MAX_CONNECTIONS  : Optional. Size of the HTTP connection pool. Defaults to 10.
+- DELIVERY_MAX_RETRIES    : Optional. Attempts after which a job is reported as deliveryFailed
+                            (delivery continues in the background). Defaults to 3.
+- DELIVERY_INITIAL_DELAY  : Optional. Base backoff delay in seconds. Defaults to 1.0.
+- DELIVERY_BACKOFF_FACTOR : Optional. Backoff multiplier per attempt. Defaults to 2.0.
+- DELIVERY_MAX_DELAY      : Optional. Upper bound of the backoff in seconds. Defaults to 300.
+- SHARED_SECRET           : Optional. HMAC-SHA256 signing secret for the X-Signature header.
+- HTTP_TIMEOUT            : Optional. Per-request timeout in seconds. Defaults to 10.0.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+import instrumentation
+
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.sqlite3")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_MAX_CONNECTIONS = int(os.getenv("OUTBOX_MAX_CONNECTIONS", "10"))
+DELIVERY_MAX_RETRIES = int(os.getenv("DELIVERY_MAX_RETRIES", "3"))
+DELIVERY_INITIAL_DELAY = float(os.getenv("DELIVERY_INITIAL_DELAY", "1.0"))
+DELIVERY_BACKOFF_FACTOR = float(os.getenv("DELIVERY_BACKOFF_FACTOR", "2.0"))
+DELIVERY_MAX_DELAY = float(os.getenv("DELIVERY_MAX_DELAY", "300"))
+SHARED_SECRET = os.getenv("SHARED_SECRET")
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10.0"))
+
+IDLE_POLL_SECONDS = 30.0
+
+DELIVERY_ATTEMPTS = instrumentation.counter(
+    "analyzer_delivery_attempts_total", "Result delivery attempts by outcome (failed ones are retried)", ["outcome"],
+)
+DELIVERY_SECONDS = instrumentation.histogram(
+    "analyzer_delivery_duration_seconds", "Latency of result delivery attempts",
+)
+
+
+def sign_body(body: bytes) -> Dict[str, str]:
+    """Request headers for a JSON body, including the HMAC signature if SHARED_SECRET is set."""
+    headers = {"Content-Type": "application/json"}
+    if SHARED_SECRET:
+        headers["X-Signature"] = hmac.new(SHARED_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return headers
+
+
+def backoff_delay(attempts: int) -> float:
+    """Full-jitter exponential backoff for the given number of failed attempts."""
+    ceiling = min(DELIVERY_MAX_DELAY, DELIVERY_INITIAL_DELAY * (DELIVERY_BACKOFF_FACTOR ** max(attempts - 1, 0)))
+    return random.uniform(0, ceiling)
+
+
+# ---------------- Storage ---------------- #
+
+class OutboxStore:
+    """
+    SQLite table of undelivered results. Safe to use from worker threads and the
+    event loop; every call runs in its own short transaction.
+    """
+
+    def __init__(self, path: str = OUTBOX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " job_id TEXT PRIMARY KEY,"
+            " callback_url TEXT NOT NULL,"
+            " body BLOB NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt_at)")
+
+    def add(self, job_id: str, callback_url: str, body: bytes) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO outbox (job_id, callback_url, body, attempts, next_attempt_at, created_at)"
+                " VALUES (?, ?, ?, 0, ?, ?)",
+                # str(): callback URLs validated as pydantic HttpUrl are not sqlite types
+                (job_id, str(callback_url), body, now, now),
+            )
+
+    def due(self, limit: int, now: Optional[float] = None) -> List[tuple]:
+        now = time.time() if now is None else now
+        with self._lock:
+            cur = self._conn.execute(
+                "SELECT job_id, callback_url, body, attempts FROM outbox"
+                " WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (now, limit),
+            )
+            return cur.fetchall()
+
+    def next_due_at(self) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(next_attempt_at) FROM outbox").fetchone()
+        return row[0] if row else None
+
+    def delivered(self, job_ids: List[str]) -> None:
+        if not job_ids:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM outbox WHERE job_id = ?", [(j,) for j in job_ids])
+
+    def failed(self, job_id: str, attempts: int, error: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE job_id = ?",
+                (attempts, time.time() + backoff_delay(attempts), error[:500], job_id),
+            )
+
+    def replay_all(self) -> int:
+        """Make every stored entry due now; used once on startup."""
+        with self._lock:
+            return self._conn.execute("UPDATE outbox SET next_attempt_at = ?", (time.time(),)).rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+
+_store: Optional[OutboxStore] = None
+_store_lock = threading.Lock()
+
+
+def get_outbox_store() -> OutboxStore:
+    """Process-wide outbox at OUTBOX_PATH, opened on first use (not at import)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = OutboxStore()
+        return _store
+
+
+# ---------------- Dispatcher ---------------- #
+
+class OutboxDispatcher:
+    """
+    Async delivery loop over an OutboxStore. `on_delivered` / `on_failed` are
+    called with the job id after a successful delivery and once an entry has
+    used up DELIVERY_MAX_RETRIES attempts.
+    """
+
+    def __init__(self, store: Optional[OutboxStore] = None, on_delivered: Optional[Callable[[str], None]] = None,
+                 on_failed: Optional[Callable[[str], None]] = None):
+        self._store = store
+        self.on_delivered = on_delivered
+        self.on_failed = on_failed
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def store(self) -> OutboxStore:
+        """The given store, or the process-wide one (see get_outbox_store)."""
+        return self._store if self._store is not None else get_outbox_store()
+
+    def enqueue(self, job_id: str, callback_url: str, body: bytes) -> None:
+        """Persist a result and wake the dispatcher. Callable from any thread."""
+        self.store.add(job_id, callback_url, body)
+        self.notify()
+
+    def notify(self) -> None:
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=OUTBOX_MAX_CONNECTIONS,
+                                max_keepalive_connections=OUTBOX_MAX_CONNECTIONS),
+        )
+        replayed = await asyncio.to_thread(self.store.replay_all)
+        if replayed:
+            print(f"[outbox] Replaying {replayed} undelivered result(s)")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _deliver(self, job_id: str, callback_url: str, body: bytes, attempts: int) -> bool:
+        started = time.perf_counter()
+        try:
+            resp = await self._client.post(callback_url, content=body, headers=sign_body(body))
+            if 200 <= resp.status_code < 300:
+                DELIVERY_SECONDS.observe(time.perf_counter() - started)
+                DELIVERY_ATTEMPTS.labels("delivered").inc()
+                return True
+            error = f"Non-success {resp.status_code} - {resp.text[:200]}"
+        except Exception as e:
+            error = f"Exception - {e}"
+
+        DELIVERY_SECONDS.observe(time.perf_counter() - started)
+        DELIVERY_ATTEMPTS.labels("failed").inc()
+        attempts += 1
+        print(f"[outbox] Job {job_id} attempt {attempts}: {error}")
+        await asyncio.to_thread(self.store.failed, job_id, attempts, error)
+        if attempts == DELIVERY_MAX_RETRIES and self.on_failed:
+            self.on_failed(job_id)
+        return False
+
+    async def dispatch_once(self) -> int:
+        """Deliver one batch of due entries concurrently; returns the number delivered (failed ones are rescheduled)."""
+        rows = await asyncio.to_thread(self.store.due, OUTBOX_BATCH_SIZE)
+        if not rows:
+            return 0
+        outcomes = await asyncio.gather(*(self._deliver(*row) for row in rows))
+        delivered = [row[0] for row, ok in zip(rows, outcomes) if ok]
+        await asyncio.to_thread(self.store.delivered, delivered)
+        if self.on_delivered:
+            for job_id in delivered:
+                self.on_delivered(job_id)
+        return len(delivered)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.dispatch_once() >= OUTBOX_BATCH_SIZE:
+                    continue
+                next_due = await asyncio.to_thread(self.store.next_due_at)
+            except Exception as exc:
+                print(f"[outbox] Dispatcher error: {exc}")
+                next_due = None
+
+            timeout = IDLE_POLL_SECONDS if next_due is None else max(0.0, next_due - time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=min(timeout, IDLE_POLL_SECONDS))
+            except asyncio.TimeoutError:
+                pass
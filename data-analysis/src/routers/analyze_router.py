@@ -1,32 +1,30 @@
 import os
-import uuid
-import time
-import hmac
-import hashlib
-import json
 import asyncio
-from typing import Dict, Any
+import time
+from typing import BinaryIO, Optional
 
-import requests
-from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks, status
+from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks, Request, status
+from fastapi.exceptions import RequestValidationError
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from pydantic import HttpUrl, ValidationError
 
-from models import AnalyzeRequest, JobAccepted, AnalysisResult
+from models import AnalyzeRequest, JobAccepted, AnalysisResult, JobPage, JobState
 from ai_client import analyze_content_sync
+from outbox import OutboxDispatcher
+from job_store import create_job_store, FINISHED_STATES
+from ingest import spool_body, extract_content_text, extract_text, UnsupportedEncoding, BodyTooLarge
+import instrumentation
+import profiling
+import local_classifier
 
 analyze_router = APIRouter()
 security = HTTPBearer()
 
 API_KEY = os.getenv("API_KEY", "changeme")
 DEFAULT_CALLBACK_URL = os.getenv("CALLBACK_URL")  # e.g. https://external.example.com/result
-SHARED_SECRET = os.getenv("SHARED_SECRET")  # optional HMAC signing secret
-DELIVERY_MAX_RETRIES = int(os.getenv("DELIVERY_MAX_RETRIES", "3"))
-DELIVERY_INITIAL_DELAY = float(os.getenv("DELIVERY_INITIAL_DELAY", "1.0"))
-DELIVERY_BACKOFF_FACTOR = float(os.getenv("DELIVERY_BACKOFF_FACTOR", "2.0"))
-HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10.0"))
 
-# In-memory job store: jobId -> state dict
-JOB_STORE: Dict[str, Dict[str, Any]] = {}
+# Job bookkeeping with per-state index and TTL eviction (see job_store.py)
+job_store = create_job_store()
 
 
 def require_api_key(credentials: HTTPAuthorizationCredentials = Depends(security)):
@@ -38,89 +36,173 @@ def require_api_key(credentials: HTTPAuthorizationCredentials = Depends(security
     return token
 
 
-def deliver_result(result: AnalysisResult, callback_url: str) -> bool:
-    """
-    Synchronously deliver the analysis result using requests with retries.
-    Adds optional HMAC signature header if SHARED_SECRET set.
-    """
-    payload = result.model_dump()
-    body = json.dumps(payload)
-    headers = {"Content-Type": "application/json"}
-
-    if SHARED_SECRET:
-        signature = hmac.new(
-            SHARED_SECRET.encode("utf-8"),
-            body.encode("utf-8"),
-            hashlib.sha256
-        ).hexdigest()
-        headers["X-Signature"] = signature
+# Results are persisted in the outbox and delivered asynchronously (see outbox.py).
+# Started and stopped by the app's startup/shutdown hooks.
+dispatcher = OutboxDispatcher(on_delivered=job_store.mark_delivered,
+                              on_failed=job_store.mark_undelivered)
 
-    delay = DELIVERY_INITIAL_DELAY
-    attempt = 0
-    while attempt < DELIVERY_MAX_RETRIES:
-        attempt += 1
-        try:
-            resp = requests.post(callback_url, data=body, headers=headers, timeout=HTTP_TIMEOUT)
-            if 200 <= resp.status_code < 300:
-                return True
-            else:
-                print(f"[deliver_result] Attempt {attempt}: Non-success {resp.status_code} - {resp.text}")
-        except Exception as e:
-            print(f"[deliver_result] Attempt {attempt}: Exception - {e}")
+instrumentation.gauge("analyzer_jobs", "Analysis jobs per state", ["state"], collect=job_store.counts)
+instrumentation.gauge("analyzer_outbox_entries", "Results waiting for (re)delivery in the outbox",
+                      collect=lambda: {(): len(dispatcher.store)})
 
-        if attempt < DELIVERY_MAX_RETRIES:
-            time.sleep(delay)
-            delay *= DELIVERY_BACKOFF_FACTOR
 
-    return False
-
-
-def process_job(job_id: str, content: str, callback_url: str):
+@profiling.profiled("process_job")
+def process_job(job_id: str, content: str, callback_url: str, source_url: Optional[str] = None,
+                trace_id: Optional[str] = None, started: Optional[float] = None):
     """
-    Perform analysis (potentially blocking) and deliver results.
+    Perform analysis (potentially blocking) and hand the result to the outbox for delivery.
     """
     try:
+        started = started or time.time()
+        job_store.start(job_id)
         # Use to_thread for potential heavy model call (optional)
         analysis_dict = asyncio.run(asyncio.to_thread(analyze_content_sync, content))
-        result = AnalysisResult(**{**analysis_dict, "jobId": job_id})
-        JOB_STORE[job_id]["result"] = result
-        JOB_STORE[job_id]["done"] = True
+        timings = {"analysis_started": started, "analysis_done": time.time()} if trace_id else None
+        result = AnalysisResult(**{**analysis_dict, "jobId": job_id, "sourceUrl": source_url,
+                                   "traceId": trace_id, "timings": timings})
+        job_store.finish(job_id, result.model_dump())
 
-        delivered = deliver_result(result, callback_url)
-        if delivered:
-            JOB_STORE[job_id]["delivered"] = True
-        else:
-            JOB_STORE[job_id]["deliveryFailed"] = True
+        dispatcher.enqueue(job_id, callback_url, result.model_dump_json().encode("utf-8"))
 
     except Exception as exc:
         print(f"[process_job] Job {job_id} failed: {exc}")
-        JOB_STORE[job_id]["error"] = str(exc)
-        JOB_STORE[job_id]["done"] = True
+        job_store.fail(job_id, str(exc))
+
+
+# Documented request bodies of /analyze; the handler reads the body itself so that
+# raw and compressed uploads can be streamed instead of parsed into memory.
+_ANALYZE_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": AnalyzeRequest.model_json_schema()},
+            "text/html": {"schema": {"type": "string", "format": "binary"}},
+            "text/plain": {"schema": {"type": "string", "format": "binary"}},
+            "application/octet-stream": {"schema": {"type": "string", "format": "binary"}},
+        },
+    }
+}
+
+
+def _resolve_callback_url(*candidates) -> str:
+    for candidate in (*candidates, DEFAULT_CALLBACK_URL):
+        if candidate:
+            return str(candidate)
+    raise HTTPException(status_code=400, detail="No callback URL provided (missing callbackUrl field or CALLBACK_URL env var)")
 
 
-@analyze_router.post("/analyze", response_model=JobAccepted, status_code=status.HTTP_202_ACCEPTED)
-def analyze_data(payload: AnalyzeRequest, background: BackgroundTasks, api_key: str = Depends(require_api_key)):
+@profiling.profiled("process_spooled_job")
+def process_spooled_job(job_id: str, spool: BinaryIO, content_type: str, callback_url: str,
+                        source_url: Optional[str] = None, trace_id: Optional[str] = None):
+    """
+    Extract bounded analysis text from a spooled raw body, then process it like a JSON job.
+    """
+    started = time.time()
+    try:
+        content = extract_text(spool, content_type)
+    except Exception as exc:
+        print(f"[process_spooled_job] Job {job_id} failed: {exc}")
+        job_store.fail(job_id, str(exc))
+        return
+    finally:
+        spool.close()
+
+    if not content.strip():
+        job_store.fail(job_id, "No data provided for analysis")
+        return
+    process_job(job_id, content, callback_url, source_url, trace_id, started)
+
+
+@profiling.profiled("process_json_job")
+def process_json_job(job_id: str, content: str, callback_url: str, source_url: Optional[str] = None,
+                     trace_id: Optional[str] = None):
+    """
+    Extract bounded analysis text from the content of a JSON request, then process the job.
+    """
+    started = time.time()
+    try:
+        content = extract_content_text(content)
+    except Exception as exc:
+        print(f"[process_json_job] Job {job_id} failed: {exc}")
+        job_store.fail(job_id, str(exc))
+        return
+
+    if not content.strip():
+        job_store.fail(job_id, "No data provided for analysis")
+        return
+    process_job(job_id, content, callback_url, source_url, trace_id, started)
+
+
+@analyze_router.post("/analyze", response_model=JobAccepted, status_code=status.HTTP_202_ACCEPTED,
+                     openapi_extra=_ANALYZE_REQUEST_BODY)
+async def analyze_data(
+    request: Request,
+    background: BackgroundTasks,
+    callbackUrl: Optional[HttpUrl] = Query(None, description="Callback URL for raw (non-JSON) bodies"),
+    sourceUrl: Optional[str] = Query(None, description="Crawled URL of a raw body, echoed back in the result"),
+    traceId: Optional[str] = Query(None, description="Pipeline trace id of a raw body, echoed back in the result"),
+    api_key: str = Depends(require_api_key),
+):
     """
     Queue an analysis job. Returns only jobId immediately.
     Result will be POSTed to callbackUrl.
+
+    Accepts the JSON AnalyzeRequest (also when no Content-Type is given), or the
+    raw page (text/html, text/plain, ...) as body, optionally compressed with Content-Encoding gzip/zstd and/or sent
+    chunked. Raw bodies are spooled to a temporary file and streamed through
+    pre-processing by the job, so they are never held in memory as a whole.
     """
+    content_type = request.headers.get("content-type", "")
+    content_encoding = request.headers.get("content-encoding")
+    media_type = content_type.split(";")[0].strip().lower()
+    # Like FastAPI's body parsing, a missing Content-Type means JSON
+    is_json = media_type in ("", "application/json") or media_type.endswith("+json")
+
+    if is_json and not content_encoding:
+        body = await request.body()
+    else:
+        try:
+            spool = await spool_body(request.stream(), content_encoding)
+        except UnsupportedEncoding as exc:
+            raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(exc))
+        except BodyTooLarge as exc:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(exc))
+
+        if not is_json:
+            spool.seek(0, os.SEEK_END)
+            empty = spool.tell() == 0
+            spool.seek(0)
+            if empty:
+                spool.close()
+                raise HTTPException(status_code=400, detail="No data provided for analysis")
+            try:
+                callback_url = _resolve_callback_url(callbackUrl)
+            except HTTPException:
+                spool.close()
+                raise
+
+            job_id = job_store.create(callback_url)
+            background.add_task(process_spooled_job, job_id, spool, content_type, callback_url, sourceUrl, traceId)
+            return JobAccepted(jobId=job_id)
+
+        with spool:
+            body = spool.read()
+
+    try:
+        payload = AnalyzeRequest.model_validate_json(body)
+    except ValidationError as exc:
+        raise RequestValidationError(exc.errors())
+    del body
+
     if not payload.content or not payload.content.strip():
         raise HTTPException(status_code=400, detail="No data provided for analysis")
 
-    callback_url = payload.callbackUrl or DEFAULT_CALLBACK_URL
-    if not callback_url:
-        raise HTTPException(status_code=400, detail="No callback URL provided (missing callbackUrl field or CALLBACK_URL env var)")
-
-    job_id = str(uuid.uuid4())
-    JOB_STORE[job_id] = {
-        "done": False,
-        "result": None,
-        "callbackUrl": callback_url,
-        "delivered": False
-    }
+    callback_url = _resolve_callback_url(payload.callbackUrl, callbackUrl)
+    job_id = job_store.create(callback_url)
 
     # Schedule synchronous processing (runs after response is returned)
-    background.add_task(process_job, job_id, payload.content, callback_url)
+    background.add_task(process_json_job, job_id, payload.content, callback_url, payload.sourceUrl or sourceUrl,
+                        payload.traceId or traceId)
 
     return JobAccepted(jobId=job_id)
 
@@ -130,7 +212,44 @@ def get_status(jobId: str = Query(..., alias="jobId"), api_key: str = Depends(re
     """
     Return True if analysis finished (regardless of delivery success), False otherwise.
     """
-    job = JOB_STORE.get(jobId)
+    job = job_store.get(jobId)
     if job is None:
         raise HTTPException(status_code=400, detail="Unknown jobId")
-    return job.get("done", False)
+    return job["state"] in FINISHED_STATES
+
+
+@analyze_router.get("/jobs", response_model=JobPage)
+def list_jobs(
+    state: JobState = Query(..., description="Only list jobs in this state"),
+    cursor: Optional[str] = Query(None, description="nextCursor of the previous page"),
+    limit: int = Query(50, ge=1, le=500),
+    api_key: str = Depends(require_api_key),
+):
+    """
+    Page through the jobs of one state, oldest first, plus the current count per state.
+    """
+    try:
+        items, next_cursor = job_store.list(state.value, cursor, limit)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return JobPage(items=items, nextCursor=next_cursor, counts=job_store.counts())
+
+
+@analyze_router.get("/jobs/{jobId}")
+def get_job(jobId: str, api_key: str = Depends(require_api_key)):
+    """
+    Full record of one job, including its result once available.
+    """
+    job = job_store.get(jobId)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown jobId")
+    job.pop("seq", None)
+    return job
+
+
+@analyze_router.get("/classifier/stats")
+def get_classifier_stats(api_key: str = Depends(require_api_key)):
+    """
+    Escalation rate and per-page CPU latency of the local first-pass classifier.
+    """
+    return local_classifier.STATS.snapshot()
@@ -1,5 +1,23 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import time
 import unittest
+from unittest.mock import patch
+
+# Keep the process-wide outbox out of the working directory
+os.environ.setdefault("OUTBOX_PATH", os.path.join(tempfile.mkdtemp(), "outbox.sqlite3"))
+
 from ai_client import safe_parse_json
+from heuristics import HeuristicAnalyzer, DocumentFrequencyTable, summarize, first_line
+import local_classifier
+from outbox import OutboxStore, OutboxDispatcher
+import ingest
+from ingest import spool_body, extract_content_text, extract_text, BodyTooLarge, UnsupportedEncoding
+import job_store
+from job_store import InMemoryJobStore, SQLiteJobStore
 
 class TestAIClient(unittest.TestCase):
     def test_safe_parse_json_valid(self):
@@ -27,5 +45,351 @@ class TestAIClient(unittest.TestCase):
         with self.assertRaises(ValueError):
             safe_parse_json('')
 
+class TestHeuristics(unittest.TestCase):
+    def test_legality_and_title(self):
+        engine = HeuristicAnalyzer()
+        result = engine.analyze("\n\n  Welcome to the shop  \nBuy phishing kits here")
+        self.assertEqual(result["title"], "Welcome to the shop")
+        self.assertFalse(result["legality"])
+        self.assertTrue(engine.analyze("A friendly cooking blog")["legality"])
+        self.assertEqual(engine.analyze("   ")["title"], "Untitled")
+
+    def test_tags_use_idf(self):
+        engine = HeuristicAnalyzer(DocumentFrequencyTable(), max_tags=2)
+        # "login" appears on every page, so it should lose against page-specific terms
+        results = engine.analyze_batch([
+            "login login login bitcoin bitcoin",
+            "login login login forum forum",
+            "login login login wiki wiki",
+        ])
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]["tags"][0], "bitcoin")
+        self.assertNotIn("the", engine.analyze("the the the onion")["tags"])
+
+    def test_frozen_table_keeps_results_stable(self):
+        path = os.path.join(tempfile.mkdtemp(), "df.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"documents": 10, "frequencies": {"login": 10, "bitcoin": 1}}, f)
+        engine = HeuristicAnalyzer(DocumentFrequencyTable.load(path), max_tags=2)
+        page = "login login login bitcoin bitcoin forum"
+        first = engine.analyze(page)
+        engine.analyze_batch(["forum forum bitcoin"] * 50)
+        self.assertEqual(engine.analyze(page), first)
+        self.assertEqual(first["tags"], ["bitcoin", "forum"])
+        self.assertEqual(engine.df_table.documents, 10)
+
+    def test_summarize_matches_full_collapse(self):
+        content = ("word \n\t " * 500) + "end"
+        self.assertEqual(summarize(content), " ".join(content.split())[:300])
+        self.assertEqual(summarize("  short   text "), "short text")
+        self.assertEqual(first_line("\r\n  \nline two\r\nline three"), "line two")
+
+
+class TestLocalClassifier(unittest.TestCase):
+    def test_train_and_predict(self):
+        rows = [{"content": "vendor escrow listing bitcoin shipping", "tags": ["market", "bitcoin"], "legality": False}] * 20
+        rows += [{"content": "thread reply member board topic", "tags": ["forum"], "legality": True}] * 20
+        model = local_classifier.train_from_rows(rows, categories=3)
+        label, confidence = model.predict("new vendor listing with escrow")
+        self.assertEqual(label, "market")
+        self.assertGreater(confidence, 0.5)
+        self.assertEqual(model.profiles["market"], {"tags": ["market", "bitcoin"], "legality": False})
+
+        restored = local_classifier.LocalClassifier.from_dict(model.to_dict())
+        self.assertEqual(restored.predict("board topic reply")[0], "forum")
+
+    def test_tags_are_not_trained_on(self):
+        # Same title and description, only the tags differ: nothing to learn the label from
+        rows = [{"title": "Welcome", "description": "an onion site", "tags": ["market"]}] * 20
+        rows += [{"title": "Welcome", "description": "an onion site", "tags": ["forum"]}] * 20
+        model = local_classifier.train_from_rows(rows, categories=3)
+        self.assertEqual(model.source, local_classifier.SOURCE_SUMMARY)
+        self.assertLess(model.predict("market forum")[1], 0.6)
+
+        rows = [{"title": "Vendor escrow", "description": "listing shipping", "tags": ["market"]}] * 20
+        rows += [{"title": "Board", "description": "thread reply member", "tags": ["forum"]}] * 20
+        model = local_classifier.LocalClassifier.from_dict(local_classifier.train_from_rows(rows, categories=3).to_dict())
+        self.assertEqual(model.page_text("Vendor escrow\n\n" + "word " * 500).split()[:3], ["Vendor", "escrow", "Vendor"])
+        self.assertEqual(model.predict(model.page_text("Board\nthread reply member list"))[0], "forum")
+
+    def test_summary_models_train_on_what_they_serve(self):
+        # One row without content makes a summary model; rows with content must train on the
+        # first line and summary of the content, not on the LLM's title and description
+        page = "Vendor escrow\nlisting shipping " + "filler " * 200
+        rows = [{"content": page, "title": "Board", "description": "thread reply", "tags": ["market"]}] * 20
+        rows += [{"title": "Board", "description": "thread reply member", "tags": ["forum"]}] * 20
+        model = local_classifier.train_from_rows(rows, categories=3)
+        self.assertEqual(model.source, local_classifier.SOURCE_SUMMARY)
+        self.assertEqual(local_classifier._row_text(rows[0], model.source), model.page_text(page))
+        self.assertEqual(model.predict(model.page_text(page))[0], "market")
+
+
+class _FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = ""
+
+
+class _FakeClient:
+    def __init__(self, status_codes):
+        self.status_codes = status_codes
+        self.calls = []
+
+    async def post(self, url, content=None, headers=None):
+        self.calls.append(url)
+        return _FakeResponse(self.status_codes.get(url, 200))
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.store = OutboxStore(os.path.join(tmp, "outbox.sqlite3"))
+
+    def test_store_survives_reopen_and_replays(self):
+        self.store.add("job-1", "http://manager/analyze-results", b"{}")
+        self.store.failed("job-1", 1, "connection refused")
+        reopened = OutboxStore(self.store.path)
+        self.assertEqual(len(reopened), 1)
+        self.assertEqual(reopened.replay_all(), 1)
+        self.assertEqual([row[0] for row in reopened.due(10)], ["job-1"])
+
+    def test_callback_url_may_be_a_validated_url(self):
+        from models import AnalyzeRequest
+
+        payload = AnalyzeRequest(content="page", callbackUrl="http://manager:8000/analyze-results")
+        self.store.add("job-1", payload.callbackUrl, b"{}")
+        self.assertEqual(self.store.due(10)[0][1], "http://manager:8000/analyze-results")
+
+    def test_dispatch_keeps_failed_entries(self):
+        delivered, failed = [], []
+        dispatcher = OutboxDispatcher(self.store, on_delivered=delivered.append, on_failed=failed.append)
+        dispatcher._client = _FakeClient({"http://down/": 503})
+        self.store.add("ok", "http://up/", b"{}")
+        self.store.add("bad", "http://down/", b"{}")
+
+        self.assertEqual(asyncio.run(dispatcher.dispatch_once()), 1)
+        self.assertEqual(delivered, ["ok"])
+        self.assertEqual(len(self.store), 1)
+        # the failed entry is scheduled for a later attempt, not dropped
+        self.assertEqual(self.store.due(10, now=0), [])
+        self.assertEqual([row[0] for row in self.store.due(10, now=float("inf"))], ["bad"])
+
+
+async def _chunks(data, size=1000):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+class TestIngest(unittest.TestCase):
+    def test_gzip_body_is_spooled_and_extracted(self):
+        html = "<html><head><script>var x = 1;</script><title>Shop</title></head><body><p>Hello &amp; welcome</p></body></html>"
+        spool = asyncio.run(spool_body(_chunks(gzip.compress(html.encode("utf-8"))), "gzip"))
+        text = extract_text(spool, "text/html; charset=utf-8")
+        self.assertIn("Shop", text)
+        self.assertIn("Hello & welcome", text)
+        self.assertNotIn("var x", text)
+
+    def test_extraction_is_bounded(self):
+        spool = asyncio.run(spool_body(_chunks(b"a" * 500_000)))
+        self.assertEqual(len(extract_text(spool, "text/plain", max_chars=1000)), 1000)
+
+    def test_json_content_is_extracted_and_bounded(self):
+        text = extract_content_text("\n <html><script>var x = 1;</script><p>Hello</p></html>")
+        self.assertEqual(text, "Hello")
+        self.assertEqual(len(extract_content_text("a" * 500_000, max_chars=1000)), 1000)
+
+    def test_unknown_encoding_rejected(self):
+        with self.assertRaises(UnsupportedEncoding):
+            asyncio.run(spool_body(_chunks(b"data"), "br"))
+
+    def test_compression_bombs_stop_at_the_limit(self):
+        import tracemalloc
+        import zstandard
+
+        bombs = {"gzip": gzip.compress(b"\0" * (64 << 20)),
+                 "zstd": zstandard.ZstdCompressor().compress(b"\0" * (64 << 20))}
+        for encoding, bomb in bombs.items():
+            self.assertLess(len(bomb), 128 << 10)
+            # Expanded piece by piece: the check fires after ~1 MiB, not after all 64 MiB
+            tracemalloc.start()
+            with patch.object(ingest, "INGEST_MAX_BYTES", 1 << 20), self.assertRaises(BodyTooLarge):
+                asyncio.run(spool_body(_chunks(bomb, 1 << 20), encoding))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.assertLess(peak, 8 << 20, encoding)
+
+    def test_corrupt_bodies_rejected(self):
+        for encoding, data in (("gzip", b"\x1f\x8b garbage"), ("zstd", b"\x28\xb5\x2f\xfd garbage")):
+            with self.assertRaises(UnsupportedEncoding):
+                asyncio.run(spool_body(_chunks(data), encoding))
+
+
+class TestJobStore(unittest.TestCase):
+    def stores(self):
+        yield InMemoryJobStore(ttl=60)
+        yield SQLiteJobStore(os.path.join(tempfile.mkdtemp(), "jobs.sqlite3"), ttl=60)
+
+    def test_state_index_pagination(self):
+        for store in self.stores():
+            ids = [store.create("http://manager/analyze-results") for _ in range(5)]
+            store.start(ids[1])
+            store.fail(ids[3], "boom")
+
+            items, cursor = store.list("queued", limit=2)
+            self.assertEqual([i["jobId"] for i in items], [ids[0], ids[2]])
+            items, cursor = store.list("queued", cursor=cursor, limit=2)
+            self.assertEqual([i["jobId"] for i in items], [ids[4]])
+            self.assertIsNone(cursor)
+            self.assertEqual(store.counts(), {"queued": 3, "running": 1, "done": 0, "failed": 1, "undelivered": 0})
+
+    def test_delivered_jobs_are_evicted_after_ttl(self):
+        for store in self.stores():
+            job_id = store.create("http://manager/analyze-results")
+            store.finish(job_id, {"tags": ["a"], "legality": True, "jobId": job_id})
+            self.assertEqual(store.evict_expired(time.time() + 3600), 0)  # not delivered yet
+            store.mark_undelivered(job_id)
+            store.mark_delivered(job_id)
+            self.assertEqual(store.get(job_id)["result"]["tags"], ["a"])
+            self.assertEqual(store.evict_expired(time.time() + 3600), 1)
+            self.assertIsNone(store.get(job_id))
+            self.assertEqual(store.counts()["done"], 0)
+
+    def test_reads_evict_without_new_jobs(self):
+        for store in (InMemoryJobStore(ttl=0), SQLiteJobStore(os.path.join(tempfile.mkdtemp(), "jobs.sqlite3"), ttl=0)):
+            job_id = store.create("http://manager/analyze-results")
+            store.fail(job_id, "boom")
+            with patch.object(job_store, "JOB_EVICT_INTERVAL", 0):
+                self.assertEqual(store.counts()["failed"], 0)
+            self.assertIsNone(store.get(job_id))
+
+    def test_interface_is_abstract(self):
+        with self.assertRaises(TypeError):
+            job_store.JobStore()
+
+    def test_malformed_cursor_rejected(self):
+        for store in self.stores():
+            store.create("http://manager/analyze-results")
+            for cursor in ("abc", "-1", "1.5"):
+                with self.assertRaises(ValueError):
+                    store.list("queued", cursor=cursor)
+
+
+class TestAnalyzeRouter(unittest.TestCase):
+    def test_raw_body_echoes_source_url(self):
+        from fastapi.testclient import TestClient
+        from app import app
+        from routers import analyze_router as router
+
+        analysis = {"tags": ["forum"], "title": "t", "legality": True, "description": "d", "url": None}
+        with patch.object(router, "analyze_content_sync", return_value=analysis), \
+                patch.object(router.dispatcher, "enqueue") as enqueue:
+            resp = TestClient(app).post(
+                "/analyze", content=b"<html><title>t</title></html>",
+                params={"callbackUrl": "http://manager/analyze-results", "sourceUrl": "http://abc.onion",
+                        "traceId": "trace-1"},
+                headers={"Content-Type": "text/html", "Authorization": f"Bearer {router.API_KEY}"},
+            )
+        self.assertEqual(resp.status_code, 202)
+        job = router.job_store.get(resp.json()["jobId"])
+        self.assertEqual(job["result"]["sourceUrl"], "http://abc.onion")
+        self.assertEqual(job["result"]["traceId"], "trace-1")
+        self.assertLessEqual(job["result"]["timings"]["analysis_started"], job["result"]["timings"]["analysis_done"])
+        enqueue.assert_called_once()
+
+    def test_json_body_without_content_type(self):
+        from fastapi.testclient import TestClient
+        from app import app
+        from routers import analyze_router as router
+
+        analysis = {"tags": ["forum"], "title": "t", "legality": True, "description": "d", "url": None}
+        with patch.object(router, "analyze_content_sync", return_value=analysis) as analyze, \
+                patch.object(router.dispatcher, "enqueue"):
+            resp = TestClient(app).post(
+                "/analyze", content=b'{"content": "<html>page</html>", "callbackUrl": "http://manager/analyze-results"}',
+                headers={"Authorization": f"Bearer {router.API_KEY}"},
+            )
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(router.job_store.get(resp.json()["jobId"])["result"]["tags"], ["forum"])
+        analyze.assert_called_once_with("page")
+
+    def test_malformed_cursor_is_a_bad_request(self):
+        from fastapi.testclient import TestClient
+        from app import app
+        from routers import analyze_router as router
+
+        resp = TestClient(app).get("/jobs", params={"state": "queued", "cursor": "abc"},
+                                   headers={"Authorization": f"Bearer {router.API_KEY}"})
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("cursor", resp.json()["detail"])
+
+    def test_metrics_endpoint(self):
+        from fastapi.testclient import TestClient
+        from app import app
+        from routers import analyze_router as router
+
+        client = TestClient(app)
+        client.get("/jobs/unknown", headers={"Authorization": f"Bearer {router.API_KEY}"})
+        resp = client.get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.headers["content-type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/jobs/{jobId}",status="404"}',
+                      resp.text)
+        self.assertIn('analyzer_jobs{state="queued"}', resp.text)
+        self.assertIn("analyzer_outbox_entries ", resp.text)
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        import profiling
+        self.profiling = profiling
+        self.directory = tempfile.mkdtemp()
+        patcher = patch.multiple(profiling.settings, directory=self.directory, enabled=False,
+                                 sample_rate=0.01, interval=0.005)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_runtime_toggle_and_collapsed_output(self):
+        from fastapi.testclient import TestClient
+        from app import app
+        from routers import analyze_router as router
+
+        client = TestClient(app)
+        self.assertIn(client.post("/profiling", json={"enabled": True}).status_code, (401, 403))
+        resp = client.post("/profiling", json={"enabled": True, "sample_rate": 1, "interval": 0.001},
+                           headers={"Authorization": f"Bearer {router.API_KEY}"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.json()["enabled"])
+
+        @self.profiling.profiled("busy_job")
+        def busy_job():
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                sum(range(1000))
+
+        busy_job()
+        files = os.listdir(self.directory)
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith("analyzer-busy_job-"))
+        with open(os.path.join(self.directory, files[0])) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(all(line.startswith("MainThread;") for line in lines))
+        self.assertTrue(any("busy_job (tests.py:" in line for line in lines))
+
+    def test_speedscope_output_and_nesting(self):
+        import json
+        self.profiling.settings.format = "speedscope"
+        self.addCleanup(setattr, self.profiling.settings, "format", "collapsed")
+        with self.profiling.profile("outer"):
+            with self.profiling.profile("inner"):  # already profiled thread: no second file
+                time.sleep(0.02)
+                sum(range(200000))
+        files = os.listdir(self.directory)
+        self.assertEqual(len(files), 1)
+        with open(os.path.join(self.directory, files[0])) as f:
+            data = json.load(f)
+        self.assertEqual(data["profiles"][0]["type"], "sampled")
+        self.assertEqual(len(data["profiles"][0]["samples"]), len(data["profiles"][0]["weights"]))
+
+
 if __name__ == '__main__':
     unittest.main()
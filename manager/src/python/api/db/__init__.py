@@ -1,8 +1,35 @@
+from sqlalchemy import inspect, text
+
 from api.db import models
 from api.db import database
+from api.db import bulk
 
 models.Base.metadata.create_all(bind=database.engine)
 
+
+def _add_missing_columns():
+	"""Best-effort ALTER TABLE ... ADD COLUMN for nullable model columns added after a table was created."""
+	inspector = inspect(database.engine)
+	for table in models.Base.metadata.sorted_tables:
+		existing = {column["name"] for column in inspector.get_columns(table.name)}
+		for column in table.columns:
+			if column.name in existing or not column.nullable:
+				continue
+			column_type = column.type.compile(dialect=database.engine.dialect)
+			try:
+				with database.engine.begin() as conn:
+					conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+			except Exception as e:
+				print(f"Error adding column {table.name}.{column.name}: {e}")
+
+
+_add_missing_columns()
+
+# create_all skips existing tables, so add indexes introduced later to them explicitly
+for _table in models.Base.metadata.sorted_tables:
+	for _index in _table.indexes:
+		_index.create(bind=database.engine, checkfirst=True)
+
 def _seed_links():
 	"""Insert two seed entries into the `links` table if they don't already exist."""
 	session = database.SessionLocal()
@@ -14,10 +41,7 @@ def _seed_links():
             "http://zwf5i7hiwmffq2bl7euedg6y5ydzze3ljiyrjmm7o42vhe7ni56fm7qd.onion",
             "http://z7s2w5vruxbp2wzts3snxs24yggbtdcdj5kp2f6z5gimouyh3wiaf7id.onion"
 		]
-		for url in seed_urls:
-			exists = session.query(models.Links).filter(models.Links.url == url).first()
-			if not exists:
-				session.add(models.Links(url=url))
+		bulk.insert_links(session, seed_urls)
 		session.commit()
 	except Exception as e:
 		session.rollback()
@@ -0,0 +1,143 @@
+"""Set-based helpers for bulk writes to the links table."""
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, exists, insert, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from api.db.facets import apply_facet_counts, count_removed_contents
+from api.db.models import Content, ContentTag, Links
+from api.db.urls import normalize_url
+from api.db.vector_index import vector_index
+
+INSERT_BATCH_SIZE = 1000
+DELETE_BATCH_SIZE = 500
+# Characters a bulk delete's URL pattern must keep besides wildcards and URL scaffolding,
+# so that patterns like '%' or 'http://%.onion%' cannot empty the table
+MIN_DELETE_PATTERN_CHARS = 3
+_URL_SCAFFOLDING = ("https", "http", ":", "www.", ".onion", "/", ".")
+
+
+def insert_ignore_links(dialect_name: str, urls: List[str]):
+	"""Multi-row INSERT of `urls` that silently skips URLs already in the table."""
+	rows = [{"url": url} for url in urls]
+	if dialect_name == "mysql":
+		return mysql.insert(Links).values(rows).prefix_with("IGNORE")
+	if dialect_name == "sqlite":
+		return sqlite.insert(Links).values(rows).on_conflict_do_nothing(index_elements=["url"])
+	if dialect_name == "postgresql":
+		return postgresql.insert(Links).values(rows).on_conflict_do_nothing(index_elements=["url"])
+	return insert(Links).values(rows)
+
+
+def _batches(urls: Iterable[str], size: int):
+	batch = []
+	for url in urls:
+		batch.append(url)
+		if len(batch) >= size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+def insert_links(session: Session, urls: Iterable[str], batch_size: int = INSERT_BATCH_SIZE) -> int:
+	"""Normalize URLs and insert them in batches with INSERT IGNORE semantics; unusable URLs are
+	skipped. Returns the number of new rows."""
+	inserted = 0
+	dialect = session.get_bind().dialect.name
+	normalized = (url for url in map(normalize_url, urls) if url is not None)
+	for batch in _batches(normalized, batch_size):
+		inserted += session.execute(insert_ignore_links(dialect, batch)).rowcount
+	return inserted
+
+
+async def insert_links_async(session: AsyncSession, urls: List[str]) -> int:
+	"""Async variant of insert_links for a single, already deduplicated batch."""
+	if not urls:
+		return 0
+	dialect = session.get_bind().dialect.name
+	result = await session.execute(insert_ignore_links(dialect, urls))
+	return result.rowcount
+
+
+def link_filter(ids: Optional[List[int]] = None, url_pattern: Optional[str] = None,
+		dead_for_days: Optional[int] = None):
+	"""WHERE clause selecting links by id list, SQL LIKE pattern and/or deadness (combined with AND).
+
+	A link is dead when it was crawled at least `dead_for_days` days ago and no Content row
+	was ever stored for it.
+	"""
+	clauses = []
+	if ids is not None:
+		clauses.append(Links.id.in_(ids))
+	if url_pattern is not None:
+		clauses.append(Links.url.like(url_pattern))
+	if dead_for_days is not None:
+		clauses.append(Links.analysed_on <= date.today() - timedelta(days=dead_for_days))
+		clauses.append(~exists().where(Content.url == Links.url))
+	if not clauses:
+		raise ValueError("at least one of ids, url_pattern or dead_for_days is required")
+	return clauses
+
+
+def check_delete_pattern(url_pattern: Optional[str]):
+	"""Raise ValueError for a LIKE pattern that would match (nearly) every link."""
+	if url_pattern is None:
+		return
+	literal = "".join(url_pattern.replace("%", "").replace("_", "").split()).lower()
+	for scaffolding in _URL_SCAFFOLDING:
+		literal = literal.replace(scaffolding, "")
+	if len(literal) < MIN_DELETE_PATTERN_CHARS:
+		raise ValueError(f"url_pattern {url_pattern!r} is too broad; it needs at least "
+			f"{MIN_DELETE_PATTERN_CHARS} characters besides wildcards and the scheme")
+
+
+def delete_links(session: Session, clauses, batch_size: int = DELETE_BATCH_SIZE,
+		dry_run: bool = False) -> Dict[str, int]:
+	"""Delete matching links with their contents and tag associations using set-based DELETEs.
+
+	Matching ids are resolved in keyset batches so each transaction stays short; every batch
+	issues one DELETE per table instead of one per row, and takes the removed contents out of
+	the facet counts in the same transaction and out of the vector index after it. Tags left
+	without contents are not touched here, see api.db.maintenance.
+	"""
+	counts = {"links": 0, "contents": 0, "content_tags": 0}
+	last_id = 0
+	while True:
+		batch = session.execute(
+			select(Links.id, Links.url).where(Links.id > last_id, *clauses).order_by(Links.id).limit(batch_size)
+		).all()
+		if not batch:
+			break
+		last_id = batch[-1].id
+		link_ids = [row.id for row in batch]
+		urls = [row.url for row in batch]
+		content_ids = select(Content.id).where(Content.url.in_(urls))
+
+		if dry_run:
+			counts["links"] += len(link_ids)
+			counts["contents"] += len(session.execute(content_ids).all())
+			counts["content_tags"] += len(session.execute(
+				select(ContentTag.content_id).where(ContentTag.content_id.in_(content_ids))
+			).all())
+		else:
+			options = {"synchronize_session": False}
+			removed_contents = session.scalars(content_ids).all()
+			apply_facet_counts(session, count_removed_contents(session, content_ids))
+			counts["content_tags"] += session.execute(
+				delete(ContentTag).where(ContentTag.content_id.in_(content_ids)), execution_options=options
+			).rowcount
+			counts["contents"] += session.execute(
+				delete(Content).where(Content.url.in_(urls)), execution_options=options
+			).rowcount
+			counts["links"] += session.execute(
+				delete(Links).where(Links.id.in_(link_ids)), execution_options=options
+			).rowcount
+			session.commit()
+			vector_index.remove_many(removed_contents)
+		if len(batch) < batch_size:
+			break
+	return counts
@@ -1,20 +1,60 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from dotenv import load_dotenv
 import os
 
+import instrumentation
+
 user = os.environ.get("MYSQL_USER")
 hostname = os.environ.get("MYSQL_HOST")
 port = os.environ.get("MYSQL_PORT")
 password = os.environ.get("MYSQL_ROOT_PASSWORD")
 db = os.environ.get("MYSQL_DATABASE")
 
-DATABASE_URL = f"mysql+pymysql://root:{password}@{hostname}:{port}/{db}" 
+# Pool sizes apply per engine and per process. The async engine serves the hot routes
+# and the loop, the sync engine only the threadpool-run CRUD routes.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+DB_SYNC_POOL_SIZE = int(os.environ.get("DB_SYNC_POOL_SIZE", "5"))
+DB_SYNC_MAX_OVERFLOW = int(os.environ.get("DB_SYNC_MAX_OVERFLOW", "10"))
+
+# DATABASE_URL overrides the MySQL settings, e.g. sqlite:///./manager.db for tests and benchmarks
+DATABASE_URL = os.environ.get("DATABASE_URL") or f"mysql+pymysql://root:{password}@{hostname}:{port}/{db}"
 print(DATABASE_URL)
 
-engine = create_engine(DATABASE_URL, pool_size=200, max_overflow=250)
+
+def _async_url(url: str) -> str:
+    """Map a sync driver URL to its async counterpart (aiomysql / aiosqlite)."""
+    if url.startswith("mysql+pymysql://"):
+        return "mysql+aiomysql://" + url[len("mysql+pymysql://"):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+
+def _engine_options(url: str, pool_size: int, max_overflow: int) -> dict:
+    if url.startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False}}
+    return {"pool_size": pool_size, "max_overflow": max_overflow, "pool_pre_ping": True, "pool_recycle": 3600}
+
+
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL, DB_SYNC_POOL_SIZE, DB_SYNC_MAX_OVERFLOW))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW)
+)
+# Statement timings for /metrics; the async engine runs its statements on a wrapped sync engine
+instrumentation.instrument_engine(engine, "sync")
+instrumentation.instrument_engine(async_engine.sync_engine, "async")
+
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
 def get_db():
     """
     Dependency to get a SQLAlchemy DB session.
@@ -24,3 +64,11 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """
+    Dependency to get an async SQLAlchemy DB session for `async def` routes.
+    """
+    async with AsyncSessionLocal() as session:
+        yield session
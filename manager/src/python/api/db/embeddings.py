@@ -0,0 +1,96 @@
+"""Compact text embeddings of contents for semantic search, from hashed features.
+
+No model is needed: words, word pairs and character trigrams of the title,
+description and tags are hashed into EMBEDDING_DIM signed buckets (the hashing
+trick) and the vector is L2 normalized. Trigrams make related spellings such
+as "cards" and "carding" land close to each other, which the fuzzy tag match
+of /search cannot do for words it has no tag for.
+
+Content embeddings are stored as EMBEDDING_DIM int8 values (see quantize);
+queries stay float32.
+"""
+import re
+import zlib
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+from api.db.tags import fold_tag, singular
+
+EMBEDDING_DIM = 256
+# Components are stored as round(value * EMBEDDING_SCALE) clipped to int8; content vectors
+# have dozens of features, so components above 0.5 are rare
+EMBEDDING_SCALE = 254
+
+_STOP_WORDS = {
+	"a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it", "its",
+	"of", "on", "or", "that", "the", "this", "to", "was", "we", "with", "you", "your", "our",
+}
+_DIGITS = re.compile(r"^\d+$")
+# Relative weight of the fields of a content
+TAG_WEIGHT = 2.0
+TITLE_WEIGHT = 1.5
+DESCRIPTION_WEIGHT = 1.0
+
+
+def _words(text: Optional[str]):
+	return [singular(word) for word in fold_tag(text or "").split() if word not in _STOP_WORDS]
+
+
+def _add(features: Dict[int, float], feature: str, weight: float) -> None:
+	h = zlib.crc32(feature.encode("utf-8"))
+	bucket = h % EMBEDDING_DIM
+	features[bucket] = features.get(bucket, 0.0) + (weight if h & 0x80000000 else -weight)
+
+
+def _add_text(features: Dict[int, float], words, weight: float) -> None:
+	for word in words:
+		_add(features, "w:" + word, weight)
+		if _DIGITS.match(word):
+			continue
+		padded = f"<{word}>"
+		# Full weight per trigram: shared stems ("card" in "carding") must outweigh hash collisions
+		for i in range(len(padded) - 2):
+			_add(features, "c:" + padded[i:i + 3], weight)
+	for first, second in zip(words, words[1:]):
+		_add(features, f"b:{first} {second}", weight * 0.5)
+
+
+def _vector(features: Dict[int, float]) -> np.ndarray:
+	vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+	if features:
+		vector[list(features)] = list(features.values())
+		norm = np.linalg.norm(vector)
+		if norm > 0:
+			vector /= norm
+	return vector
+
+
+def embed_text(text: str) -> np.ndarray:
+	"""Unit float32 embedding of a search query."""
+	features: Dict[int, float] = {}
+	_add_text(features, _words(text), 1.0)
+	return _vector(features)
+
+
+def embed_content(title: Optional[str], description: Optional[str], tags: Iterable[str]) -> np.ndarray:
+	"""Unit float32 embedding of an analysed content."""
+	features: Dict[int, float] = {}
+	for tag in tags:
+		_add_text(features, _words(tag), TAG_WEIGHT)
+	_add_text(features, _words(title), TITLE_WEIGHT)
+	_add_text(features, _words(description), DESCRIPTION_WEIGHT)
+	return _vector(features)
+
+
+def quantize(vector: np.ndarray) -> np.ndarray:
+	return np.clip(np.rint(vector * EMBEDDING_SCALE), -127, 127).astype(np.int8)
+
+
+def to_bytes(vector: np.ndarray) -> bytes:
+	"""Stored form of an embedding (Content.embedding)."""
+	return quantize(vector).tobytes()
+
+
+def from_bytes(data: bytes) -> np.ndarray:
+	return np.frombuffer(data, dtype=np.int8)
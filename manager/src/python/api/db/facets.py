@@ -0,0 +1,154 @@
+"""Facet counts (contents per tag and per legality verdict) for filtering search results.
+
+A GROUP BY over content_tags per request grows with the table, so the counts of all
+contents are kept in facet_counts instead. /analyze-results and link deletes add their
+changes in the same transaction as the rows they write, and api.db.maintenance
+periodically reconciles the table with contents and content_tags, which corrects
+drift from writes that bypass these paths (tag merges, manual SQL).
+
+Facets of a query's result set are counted over at most FACET_SCAN_LIMIT of its
+contents, so their cost does not grow with the table either.
+"""
+import heapq
+import os
+import random
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from api.db.models import Content, ContentTag, FacetCount, Tag
+
+FACET_TAG = "tag"
+FACET_TOTAL = "total"
+# Rows the total of all contents is spread over; every analysis updates one of them
+FACET_TOTAL_SHARDS = 16
+# Most contents of a result set counted per facet request
+FACET_SCAN_LIMIT = int(os.environ.get("FACET_SCAN_LIMIT", "5000"))
+FACET_BATCH_SIZE = 1000
+
+_COLUMNS = ("contents", "legal", "illegal")
+
+# (facet, value) -> [contents, legal, illegal]
+Counts = Dict[Tuple[str, int], List[int]]
+# (tag name, [contents, legal, illegal])
+TagCounts = List[Tuple[str, List[int]]]
+
+
+def total_key() -> Tuple[str, int]:
+	return FACET_TOTAL, random.randrange(FACET_TOTAL_SHARDS)
+
+
+def count(counts: Counts, key: Tuple[str, int], legality: Optional[bool], n: int = 1) -> None:
+	row = counts.setdefault(key, [0, 0, 0])
+	row[0] += n
+	if legality is not None:
+		row[1 if legality else 2] += n
+
+
+def count_content(counts: Counts, tag_ids: Iterable[int], legality: Optional[bool], n: int = 1,
+		total: Optional[Tuple[str, int]] = None) -> None:
+	"""Add a content with these tags `n` times (-1 to take it out) to `counts`.
+
+	Pass the same `total` key when replacing a content, so its unchanged total cancels out.
+	"""
+	count(counts, total or total_key(), legality, n)
+	for tag_id in tag_ids:
+		count(counts, (FACET_TAG, tag_id), legality, n)
+
+
+def count_removed_contents(session: Session, content_ids) -> Counts:
+	"""Negative counts of the contents selected by `content_ids` (a SELECT of ids), before they are deleted."""
+	counts: Counts = {}
+	for tag_id, legality, n in session.execute(
+		select(ContentTag.tag_id, Content.legality, func.count())
+		.join(Content, Content.id == ContentTag.content_id)
+		.where(ContentTag.content_id.in_(content_ids))
+		.group_by(ContentTag.tag_id, Content.legality)
+	):
+		count(counts, (FACET_TAG, tag_id), legality, -n)
+	total = total_key()
+	for legality, n in session.execute(
+		select(Content.legality, func.count()).where(Content.id.in_(content_ids)).group_by(Content.legality)
+	):
+		count(counts, total, legality, -n)
+	return counts
+
+
+def upsert_facet_counts(dialect_name: str, counts: Counts):
+	"""INSERT adding `counts` to the stored rows (creating missing ones), or None if nothing changes.
+
+	Rows are written in key order so concurrent transactions lock them in the same order.
+	"""
+	rows = [
+		{"facet": facet, "value": value, "contents": contents, "legal": legal, "illegal": illegal}
+		for (facet, value), (contents, legal, illegal) in sorted(counts.items()) if contents or legal or illegal
+	]
+	if not rows:
+		return None
+	if dialect_name == "mysql":
+		stmt = mysql.insert(FacetCount).values(rows)
+		return stmt.on_duplicate_key_update({name: getattr(FacetCount, name) + stmt.inserted[name] for name in _COLUMNS})
+	if dialect_name in ("sqlite", "postgresql"):
+		stmt = (sqlite if dialect_name == "sqlite" else postgresql).insert(FacetCount).values(rows)
+		return stmt.on_conflict_do_update(
+			index_elements=["facet", "value"],
+			set_={name: getattr(FacetCount, name) + stmt.excluded[name] for name in _COLUMNS},
+		)
+	raise NotImplementedError(f"facet counts need MySQL, PostgreSQL or SQLite, not {dialect_name}")
+
+
+def apply_facet_counts(session: Session, counts: Counts) -> None:
+	stmt = upsert_facet_counts(session.get_bind().dialect.name, counts)
+	if stmt is not None:
+		session.execute(stmt)
+
+
+async def apply_facet_counts_async(session: AsyncSession, counts: Counts) -> None:
+	stmt = upsert_facet_counts(session.get_bind().dialect.name, counts)
+	if stmt is not None:
+		await session.execute(stmt)
+
+
+async def top_facets(session: AsyncSession, limit: int) -> Tuple[List[int], TagCounts]:
+	"""Counts of all contents and of the `limit` tags with most contents, from facet_counts."""
+	total = (await session.execute(
+		select(*(func.coalesce(func.sum(getattr(FacetCount, name)), 0) for name in _COLUMNS))
+		.where(FacetCount.facet == FACET_TOTAL)
+	)).one()
+	rows = (await session.execute(
+		select(Tag.name, FacetCount.contents, FacetCount.legal, FacetCount.illegal)
+		.join(Tag, Tag.id == FacetCount.value)
+		.where(FacetCount.facet == FACET_TAG, FacetCount.contents > 0)
+		.order_by(FacetCount.contents.desc(), FacetCount.value.desc())
+		.limit(limit)
+	)).all()
+	return list(total), [(name, [contents, legal, illegal]) for name, contents, legal, illegal in rows]
+
+
+async def count_facets(session: AsyncSession, content_ids: List[int], limit: int) -> Tuple[List[int], TagCounts]:
+	"""Counts of the given contents and of their `limit` most frequent tags, in batches of ids."""
+	counts: Counts = {}
+	total = (FACET_TOTAL, 0)
+	for start in range(0, len(content_ids), FACET_BATCH_SIZE):
+		batch = content_ids[start:start + FACET_BATCH_SIZE]
+		for tag_id, legality, n in await session.execute(
+			select(ContentTag.tag_id, Content.legality, func.count())
+			.join(Content, Content.id == ContentTag.content_id)
+			.where(ContentTag.content_id.in_(batch))
+			.group_by(ContentTag.tag_id, Content.legality)
+		):
+			count(counts, (FACET_TAG, tag_id), legality, n)
+		# Ids of contents deleted meanwhile (semantic hits) are not counted
+		for legality, n in await session.execute(
+			select(Content.legality, func.count()).where(Content.id.in_(batch)).group_by(Content.legality)
+		):
+			count(counts, total, legality, n)
+	totals = counts.pop(total, [0, 0, 0])
+	top = heapq.nsmallest(limit, counts.items(), key=lambda item: (-item[1][0], -item[0][1]))
+	names = dict((await session.execute(
+		select(Tag.id, Tag.name).where(Tag.id.in_([tag_id for (_, tag_id), _ in top]))
+	)).all()) if top else {}
+	return totals, [(names[tag_id], row) for (_, tag_id), row in top if tag_id in names]
@@ -0,0 +1,178 @@
+"""Background housekeeping jobs for the manager database."""
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import delete, exists, func, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.db.database import AsyncSessionLocal
+from api.db.facets import FACET_TAG, FACET_TOTAL, Counts, count
+from api.db.models import Content, ContentTag, FacetCount, Tag, TagAlias
+from api.db.suggest import tag_suggester
+from api.db.tags import tag_resolver
+
+logger = logging.getLogger(__name__)
+
+# Seconds between orphan-tag sweeps; 0 disables the periodic job
+TAG_GC_INTERVAL = float(os.environ.get("TAG_GC_INTERVAL", "600"))
+TAG_GC_BATCH_SIZE = int(os.environ.get("TAG_GC_BATCH_SIZE", "500"))
+# Seconds between facet count reconciliations; 0 disables the periodic job
+FACET_RECONCILE_INTERVAL = float(os.environ.get("FACET_RECONCILE_INTERVAL", "3600"))
+FACET_RECONCILE_BATCH_SIZE = int(os.environ.get("FACET_RECONCILE_BATCH_SIZE", "500"))
+_ZERO = [0, 0, 0]
+
+
+def _orphaned():
+	return ~exists().where(ContentTag.tag_id == Tag.id)
+
+
+async def collect_orphan_tags(session: AsyncSession, batch_size: int = TAG_GC_BATCH_SIZE) -> int:
+	"""Delete tags without any content, one committed batch at a time; returns the number removed.
+
+	The DELETE re-checks the anti-join so a tag that got attached to new content between
+	the SELECT and the DELETE survives.
+	"""
+	removed = 0
+	last_id = 0
+	while True:
+		ids = (await session.execute(
+			select(Tag.id).where(Tag.id > last_id, _orphaned()).order_by(Tag.id).limit(batch_size)
+		)).scalars().all()
+		if not ids:
+			break
+		last_id = ids[-1]
+		result = await session.execute(
+			delete(Tag).where(Tag.id.in_(ids), _orphaned()), execution_options={"synchronize_session": False}
+		)
+		# Not every backend cascades the foreign key (SQLite without foreign_keys pragma)
+		await session.execute(
+			delete(TagAlias).where(TagAlias.tag_id.in_(ids), ~exists().where(Tag.id == TagAlias.tag_id)),
+			execution_options={"synchronize_session": False},
+		)
+		await session.commit()
+		removed += result.rowcount
+		if len(ids) < batch_size:
+			break
+	if removed:
+		# Cached aliases and suggestions may point to the removed tags
+		tag_resolver.clear()
+		tag_suggester.invalidate()
+	return removed
+
+
+async def run_tag_gc(interval: float = TAG_GC_INTERVAL) -> None:
+	"""Periodically sweep orphan tags until cancelled."""
+	while True:
+		await asyncio.sleep(interval)
+		started = time.perf_counter()
+		try:
+			async with AsyncSessionLocal() as session:
+				removed = await collect_orphan_tags(session)
+			if removed:
+				logger.info("Tag GC removed %d orphan tags in %.2fs", removed, time.perf_counter() - started)
+		except Exception as e:
+			logger.warning("Tag GC failed: %s", e)
+
+
+async def _replace_counts(session: AsyncSession, stored: Counts, actual: Counts) -> int:
+	"""Overwrite the facet_counts rows whose stored counts differ from `actual`; returns how many."""
+	# A row counting nothing is as good as a missing one; rows of collected tags go with them
+	changed = [key for key in stored.keys() | actual.keys() if stored.get(key, _ZERO) != actual.get(key, _ZERO)]
+	if not changed:
+		return 0
+	await session.execute(
+		delete(FacetCount).where(tuple_(FacetCount.facet, FacetCount.value).in_(changed)),
+		execution_options={"synchronize_session": False},
+	)
+	rows = [
+		{"facet": facet, "value": value, "contents": actual[facet, value][0],
+		 "legal": actual[facet, value][1], "illegal": actual[facet, value][2]}
+		for facet, value in sorted(changed) if (facet, value) in actual
+	]
+	if rows:
+		await session.execute(insert(FacetCount), rows)
+	return len(changed)
+
+
+async def reconcile_facet_counts(session: AsyncSession, batch_size: int = FACET_RECONCILE_BATCH_SIZE) -> int:
+	"""Recount facet_counts from contents and content_tags, one committed batch of tags at a time.
+
+	Returns the number of rows corrected. An analysis committing while its tags are being
+	recounted can be missed or counted twice; the next run corrects that.
+	"""
+	fixed = 0
+	last_id = 0
+	while True:
+		ids = (await session.execute(
+			select(Tag.id).where(Tag.id > last_id).order_by(Tag.id).limit(batch_size)
+		)).scalars().all()
+		if not ids:
+			break
+		last_id = ids[-1]
+		actual: Counts = {}
+		for tag_id, legality, n in await session.execute(
+			select(ContentTag.tag_id, Content.legality, func.count())
+			.join(Content, Content.id == ContentTag.content_id)
+			.where(ContentTag.tag_id.in_(ids))
+			.group_by(ContentTag.tag_id, Content.legality)
+		):
+			count(actual, (FACET_TAG, tag_id), legality, n)
+		stored = {
+			(FACET_TAG, value): [contents, legal, illegal]
+			for value, contents, legal, illegal in await session.execute(
+				select(FacetCount.value, FacetCount.contents, FacetCount.legal, FacetCount.illegal)
+				.where(FacetCount.facet == FACET_TAG, FacetCount.value.in_(ids))
+			)
+		}
+		fixed += await _replace_counts(session, stored, actual)
+		await session.commit()
+		if len(ids) < batch_size:
+			break
+
+	# Rows of deleted tags
+	result = await session.execute(
+		delete(FacetCount).where(FacetCount.facet == FACET_TAG, ~exists().where(Tag.id == FacetCount.value)),
+		execution_options={"synchronize_session": False},
+	)
+	fixed += result.rowcount
+
+	# The total goes back into a single shard
+	actual = {}
+	for legality, n in await session.execute(select(Content.legality, func.count()).group_by(Content.legality)):
+		count(actual, (FACET_TOTAL, 0), legality, n)
+	shards = (await session.execute(
+		select(FacetCount.value, FacetCount.contents, FacetCount.legal, FacetCount.illegal)
+		.where(FacetCount.facet == FACET_TOTAL)
+	)).all()
+	stored = {(FACET_TOTAL, value): [contents, legal, illegal] for value, contents, legal, illegal in shards}
+	sums = [sum(row[i] for row in stored.values()) for i in range(3)]
+	if sums != actual.get((FACET_TOTAL, 0), [0, 0, 0]):
+		fixed += await _replace_counts(session, stored, actual)
+	await session.commit()
+	return fixed
+
+
+async def reconcile_facets() -> int:
+	"""reconcile_facet_counts in its own session, logged; for background tasks."""
+	started = time.perf_counter()
+	try:
+		async with AsyncSessionLocal() as session:
+			fixed = await reconcile_facet_counts(session)
+		logger.info("Facet reconcile corrected %d rows in %.2fs", fixed, time.perf_counter() - started)
+		return fixed
+	except Exception as e:
+		logger.warning("Facet reconcile failed: %s", e)
+		return 0
+
+
+async def run_facet_reconcile(interval: float = FACET_RECONCILE_INTERVAL) -> None:
+	"""Reconcile the facet counts every `interval` seconds until cancelled; right away if none are stored yet."""
+	async with AsyncSessionLocal() as session:
+		pending = (await session.execute(select(FacetCount.facet).limit(1))).first() is None
+	while True:
+		if not pending:
+			await asyncio.sleep(interval)
+		pending = False
+		await reconcile_facets()
@@ -1,9 +1,11 @@
 from sqlalchemy import (
-    create_engine, Column, String, Integer, ForeignKey, Date
+    create_engine, Column, String, Integer, ForeignKey, Date, LargeBinary, Boolean, Index
 )
-from sqlalchemy.orm import sessionmaker, relationship, Session, declarative_base
+from sqlalchemy.orm import sessionmaker, relationship, Session, declarative_base, deferred, validates
 from sqlalchemy.ext.associationproxy import association_proxy
 
+from api.db.urls import normalize_url
+
 Base = declarative_base()
 
 
@@ -15,7 +17,8 @@ class ContentTag(Base):
     __tablename__ = "content_tags"
 
     content_id = Column(Integer, ForeignKey("contents.id", ondelete="CASCADE"), primary_key=True)
-    tag_id = Column(Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True)
+    # own index for tag -> contents lookups (search, orphan-tag GC); the PK only covers content_id first
+    tag_id = Column(Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True, index=True)
     priority = Column(Integer, nullable=False, default=0)
 
     # relationships to the parent objects
@@ -30,6 +33,11 @@ class Content(Base):
     url = Column(String(2083), unique=True, index=True, nullable=False)
     title = Column(String(255), nullable=True)
     description = Column(String(1024), nullable=True)
+    # Analyzer verdict: True legal, False illegal, None not reported
+    legality = Column(Boolean, nullable=True)
+    # int8 text embedding of title, description and tags (see api.db.embeddings); only
+    # needed to rebuild the vector index, so not loaded with the row
+    embedding = deferred(Column(LargeBinary, nullable=True))
 
     # association objects linking to Tag (ContentTag instances)
     tag_links = relationship(
@@ -57,10 +65,50 @@ class Tag(Base):
     contents = association_proxy("content_links", "content")
 
 
+class TagAlias(Base):
+    """Canonical key of a tag spelling (see api.db.tags.normalize_tag) -> the tag it stands for."""
+    __tablename__ = "tag_aliases"
+
+    alias = Column(String(50), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tags.id", ondelete="CASCADE"), nullable=False, index=True)
+
+
+class FacetCount(Base):
+    """Maintained number of contents per facet value, with their legal/illegal breakdown.
+
+    facet "tag": one row per tag id; facet "total": all contents, spread over a few
+    rows (value = shard) so concurrent analyses do not all update the same row. Kept
+    current by /analyze-results and link deletes, see api.db.facets.
+    """
+    __tablename__ = "facet_counts"
+
+    facet = Column(String(16), primary_key=True)
+    value = Column(Integer, primary_key=True)
+    contents = Column(Integer, nullable=False, default=0)
+    legal = Column(Integer, nullable=False, default=0)
+    illegal = Column(Integer, nullable=False, default=0)
+
+    # top-N tags by contents without sorting the table
+    __table_args__ = (Index("ix_facet_counts_facet_contents", "facet", "contents", "value"),)
+
+
 class Links(Base):
     __tablename__ = "links"
 
     id = Column(Integer, primary_key=True, index=True)
     url = Column(String(2083), unique=True, index=True, nullable=False)
     analysed_on = Column(Date, nullable=True)
+    # SHA-256 of the last crawled body in the crawler's page archive
+    content_hash = Column(String(64), nullable=True)
+    # HTTP validators of the last crawl, sent back as If-None-Match / If-Modified-Since
+    etag = Column(String(255), nullable=True)
+    last_modified = Column(String(64), nullable=True)
+
+    @validates("url")
+    def _normalize_url(self, key, url):
+        # Every spelling of a URL maps to one row (see api.db.urls); bulk inserts normalize themselves
+        normalized = normalize_url(url) if isinstance(url, str) else None
+        if normalized is None:
+            raise ValueError(f"Not a usable link URL: {url!r}")
+        return normalized
 
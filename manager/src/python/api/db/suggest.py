@@ -0,0 +1,188 @@
+"""Tag typeahead: tags starting with what the user typed, most used first.
+
+The index is a sorted array of (folded name, tag id) searched with bisect, so a
+prefix maps to a contiguous slice. Small slices are ranked by scanning them;
+for prefixes matching more tags the ranked top list is computed when loading
+and kept current as tags gain or lose contents.
+
+/analyze-results reports tag usage changes after each commit, so new tags are
+suggestible immediately. The index is reloaded from the database every
+TAG_SUGGEST_REFRESH seconds and after tag merges, which corrects usage drift
+from deleted contents.
+"""
+import bisect
+import heapq
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from api.db.database import AsyncSessionLocal
+from api.db.models import ContentTag, Tag
+from api.db.tags import fold_tag
+
+# Most suggestions per request, and the length of the cached top lists
+TAG_SUGGEST_LIMIT = 20
+# Prefixes matching up to this many tags are ranked by scanning, larger ones use a cached top list
+TAG_SUGGEST_SCAN_LIMIT = int(os.environ.get("TAG_SUGGEST_SCAN_LIMIT", "256"))
+TAG_SUGGEST_REFRESH = float(os.environ.get("TAG_SUGGEST_REFRESH", "600"))
+
+_LAST = "\U0010ffff"
+
+
+class TagSuggester:
+	"""In-memory prefix index over the names of tags in use, weighted by their number of contents."""
+
+	def __init__(self, scan_limit: int = TAG_SUGGEST_SCAN_LIMIT, refresh: float = TAG_SUGGEST_REFRESH):
+		self.scan_limit = scan_limit
+		self.refresh = refresh
+		self.loaded_at: Optional[float] = None
+		self._loading = False
+		self._lock = threading.Lock()
+		self._keys: List[Tuple[str, int]] = []
+		# tag id -> (folded name, name, uses)
+		self._tags: Dict[int, Tuple[str, str, int]] = {}
+		# prefix -> ids of its TAG_SUGGEST_LIMIT best ranked tags
+		self._top: Dict[str, List[int]] = {}
+		# name -> tag id, the choices of the fuzzy tag match of /search
+		self._names: Dict[str, int] = {}
+
+	def __len__(self) -> int:
+		return len(self._keys)
+
+	@property
+	def stale(self) -> bool:
+		return self.loaded_at is None or time.monotonic() - self.loaded_at > self.refresh
+
+	def invalidate(self) -> None:
+		"""Reload on the next request; needed when tags are merged, renamed or deleted."""
+		self.loaded_at = None
+
+	def load(self, rows: Iterable[Tuple[int, str, int]]) -> None:
+		"""Replace the index with (tag id, name, uses) rows; tags without uses are left out."""
+		tags = {}
+		for tag_id, name, uses in rows:
+			key = fold_tag(name)
+			if key and uses > 0:
+				tags[tag_id] = (key, name, uses)
+		keys = sorted((key, tag_id) for tag_id, (key, _, _) in tags.items())
+		# Top lists of all prefixes matching more than scan_limit tags, one prefix length at a time:
+		# only tags under a long list at length n can be under one at length n + 1
+		top = {}
+		ranked = sorted(tags, key=lambda tag_id: (-tags[tag_id][2], tags[tag_id][0]))
+		end = 1
+		while ranked:
+			groups = defaultdict(list)
+			for tag_id in ranked:
+				key = tags[tag_id][0]
+				if len(key) >= end:
+					groups[key[:end]].append(tag_id)
+			ranked = []
+			for prefix, ids in groups.items():
+				if len(ids) > self.scan_limit:
+					top[prefix] = ids[:TAG_SUGGEST_LIMIT]
+					ranked.extend(ids)
+			end += 1
+		names = {name: tag_id for tag_id, (_, name, _) in tags.items()}
+		with self._lock:
+			self._tags, self._keys, self._top, self._names = tags, keys, top, names
+			self.loaded_at = time.monotonic()
+
+	async def ensure_loaded(self) -> None:
+		"""Load the index if it is missing or older than `refresh`; other requests meanwhile use the old one."""
+		if not self.stale or self._loading:
+			return
+		self._loading = True
+		try:
+			async with AsyncSessionLocal() as session:
+				rows = (await session.execute(
+					select(Tag.id, Tag.name, func.count(ContentTag.content_id))
+					.join(ContentTag, ContentTag.tag_id == Tag.id)
+					.group_by(Tag.id, Tag.name)
+				)).all()
+			self.load(rows)
+		finally:
+			self._loading = False
+
+	def _rank(self, tag_id: int) -> Tuple[int, str]:
+		key, _, uses = self._tags[tag_id]
+		return -uses, key
+
+	def tag_names(self) -> Dict[str, int]:
+		"""Name -> id of the tags in use; callers must not modify it."""
+		return self._names
+
+	def suggest(self, prefix: str, limit: int = 10) -> List[Tuple[str, int]]:
+		"""(name, uses) of up to `limit` tags whose folded name starts with the folded `prefix`."""
+		key = fold_tag(prefix)
+		if not key:
+			return []
+		if prefix[-1:].isspace() or prefix.endswith(("-", "_")):
+			# "drug " only completes further words, not "drugstore"
+			key += " "
+		limit = min(limit, TAG_SUGGEST_LIMIT)
+		with self._lock:
+			lo = bisect.bisect_left(self._keys, (key,))
+			hi = bisect.bisect_left(self._keys, (key + _LAST,), lo)
+			if hi - lo <= self.scan_limit:
+				ids = heapq.nsmallest(limit, (tag_id for _, tag_id in self._keys[lo:hi]), key=self._rank)
+			else:
+				ids = self._top.get(key)
+				if ids is None:
+					ids = self._top[key] = heapq.nsmallest(
+						TAG_SUGGEST_LIMIT, (tag_id for _, tag_id in self._keys[lo:hi]), key=self._rank
+					)
+				ids = ids[:limit]
+			return [(self._tags[tag_id][1], self._tags[tag_id][2]) for tag_id in ids]
+
+	def record_uses(self, changes: Iterable[Tuple[int, str, int]]) -> None:
+		"""Apply (tag id, name, change in uses) of a committed analysis; the name only matters for new tags."""
+		with self._lock:
+			for tag_id, name, delta in changes:
+				entry = self._tags.get(tag_id)
+				if entry is None:
+					key = fold_tag(name)
+					if delta <= 0 or not key:
+						continue
+					bisect.insort(self._keys, (key, tag_id))
+					self._names[name] = tag_id
+					entry = (key, name, 0)
+				key, name, uses = entry
+				uses += delta
+				if uses <= 0:
+					del self._keys[bisect.bisect_left(self._keys, (key, tag_id))]
+					del self._tags[tag_id]
+					self._names.pop(name, None)
+					self._drop_top(key, tag_id)
+					continue
+				self._tags[tag_id] = (key, name, uses)
+				if delta > 0:
+					self._raise_top(key, tag_id)
+				else:
+					self._drop_top(key, tag_id)
+
+	def _raise_top(self, key: str, tag_id: int) -> None:
+		rank = self._rank(tag_id)
+		for end in range(1, len(key) + 1):
+			top = self._top.get(key[:end])
+			if top is None:
+				continue
+			if tag_id in top:
+				top.sort(key=self._rank)
+			elif len(top) < TAG_SUGGEST_LIMIT or rank < self._rank(top[-1]):
+				top.append(tag_id)
+				top.sort(key=self._rank)
+				del top[TAG_SUGGEST_LIMIT:]
+
+	def _drop_top(self, key: str, tag_id: int) -> None:
+		# A tag falling back may be overtaken by one outside the list; recompute those lazily
+		for end in range(1, len(key) + 1):
+			top = self._top.get(key[:end])
+			if top is not None and tag_id in top:
+				del self._top[key[:end]]
+
+
+tag_suggester = TagSuggester()
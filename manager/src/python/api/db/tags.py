@@ -0,0 +1,289 @@
+"""Tag canonicalization: one tag per concept instead of one per spelling.
+
+Analyzer tags come straight from LLM output or the heuristic's top words, so the
+same concept arrives as "Drugs", "drug", "drug-market" and "drugs market".
+normalize_tag maps every spelling to a canonical key (case folded, separators
+collapsed, plural words singularized) and the tag_aliases table maps keys to
+the tag standing for them. Aliases are cached in-process, so resolving the tags
+of an analysis usually needs no query at all. Keys only live in tag_aliases;
+a tag is named with a real spelling of it, the one users see.
+
+merge_duplicate_tags folds tags created before canonicalization (or with
+spellings normalizing to the same key) into one tag per key.
+"""
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import instrumentation
+from api.db.models import ContentTag, Tag, TagAlias
+
+MAX_TAG_LENGTH = 50
+TAG_ALIAS_CACHE_SIZE = int(os.environ.get("TAG_ALIAS_CACHE_SIZE", "100000"))
+TAG_MERGE_BATCH_SIZE = int(os.environ.get("TAG_MERGE_BATCH_SIZE", "200"))
+
+_SEPARATORS = re.compile(r"[\s_\-./,;:|+&]+")
+_NON_WORD = re.compile(r"[^\w ]+")
+# Words ending in s that are no plurals (or whose singular the rules below get wrong)
+_INVARIANT = {
+	"news", "series", "species", "physics", "politics", "economics", "ethics", "mathematics",
+	"gas", "bus", "lens", "atlas", "chaos", "canvas", "cosmos", "kudos", "windows", "movies", "cookies",
+	"https", "socks", "tails", "status", "alias", "always", "whereas", "perhaps", "analytics", "logistics",
+}
+# Words ending in os are left alone (ddos, macos, chaos) except these plurals
+_OS_PLURALS = {
+	"videos", "photos", "logos", "demos", "memos", "repos", "casinos", "radios", "studios", "scenarios", "promos",
+}
+
+TAG_RESOLUTIONS = instrumentation.counter(
+	"manager_tag_resolutions_total", "Analyzer tags by how their canonical tag was found", ["source"],
+)
+
+
+def singular(word: str) -> str:
+	"""Rule-based English singular of a lowercase word (a light lemmatizer for tag words).
+
+	Conservative: short words and words it has no safe rule for stay as they are.
+	"""
+	if len(word) <= 4 or not word.isalpha() or word in _INVARIANT:
+		return word
+	if word.endswith("os"):
+		return word[:-1] if word in _OS_PLURALS else word
+	if word.endswith("ies"):
+		return word[:-3] + "y"
+	if word.endswith(("sses", "shes", "ches", "xes", "zes")):
+		return word[:-2]
+	if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+		return word[:-1]
+	return word
+
+
+def fold_tag(raw: str) -> str:
+	"""Case folded words of a tag spelling, single space separated ("Drugs_Market" -> "drugs market")."""
+	text = _SEPARATORS.sub(" ", unicodedata.normalize("NFKC", raw).casefold())
+	return " ".join(_NON_WORD.sub("", text).split())
+
+
+def _is_acronym(word: str) -> bool:
+	# DDoS, SOCKS, macOS, VPNs: spellings whose trailing s is no English plural
+	return sum(c.isupper() for c in word) >= 2
+
+
+def normalize_tag(raw: str) -> Optional[str]:
+	"""Canonical key of a tag spelling, or None if nothing usable is left.
+
+	"Drugs", "drug" -> "drug"; "drug-market", "Drugs_Market", "drugs market" -> "drug market"
+	"""
+	words = []
+	for word in _SEPARATORS.sub(" ", unicodedata.normalize("NFKC", raw)).split():
+		folded = fold_tag(word)
+		if folded:
+			words.append(folded if _is_acronym(word) else singular(folded))
+	key = " ".join(words)[:MAX_TAG_LENGTH].strip()
+	return key or None
+
+
+def display_name(raw: str) -> str:
+	"""Name a tag gets from a spelling: the spelling itself, whitespace collapsed and length capped."""
+	return " ".join(unicodedata.normalize("NFKC", raw).split())[:MAX_TAG_LENGTH].strip()
+
+
+def _spellings(raw_tags: Iterable[str]) -> Dict[str, Counter]:
+	"""Display spellings per canonical key of `raw_tags`, counted; the first is the first seen."""
+	counts: Dict[str, Counter] = defaultdict(Counter)
+	for raw in raw_tags or ():
+		key = normalize_tag(raw)
+		if key:
+			counts[key][display_name(raw) or key] += 1
+	return counts
+
+
+def canonical_keys(raw_tags: Iterable[str]) -> List[str]:
+	"""Distinct canonical keys of `raw_tags` in order; TagResolver.resolve returns their ids."""
+	return list(dict.fromkeys(key for key in map(normalize_tag, raw_tags or ()) if key))
+
+
+class TagResolver:
+	"""Maps analyzer tags to tag ids through tag_aliases, with an in-process LRU cache of the aliases."""
+
+	def __init__(self, max_size: int = TAG_ALIAS_CACHE_SIZE):
+		self.max_size = max_size
+		self._cache: "OrderedDict[str, int]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	def _get(self, key: str) -> Optional[int]:
+		with self._lock:
+			tag_id = self._cache.get(key)
+			if tag_id is not None:
+				self._cache.move_to_end(key)
+			return tag_id
+
+	def _put(self, key: str, tag_id: int) -> None:
+		with self._lock:
+			self._cache[key] = tag_id
+			self._cache.move_to_end(key)
+			while len(self._cache) > self.max_size:
+				self._cache.popitem(last=False)
+
+	def clear(self) -> None:
+		"""Forget all cached aliases; needed whenever tags are merged or deleted."""
+		with self._lock:
+			self._cache.clear()
+
+	async def resolve(self, session: AsyncSession, raw_tags: Iterable[str]) -> List[int]:
+		"""Ids of the canonical tags of `raw_tags` (in the order of canonical_keys), creating missing ones.
+
+		New tags and aliases are flushed but not committed; they are only cached once a later
+		lookup finds them in the database, so a rolled back analysis cannot poison the cache.
+		"""
+		keys = canonical_keys(raw_tags)
+		ids: Dict[str, int] = {}
+		for key in keys:
+			tag_id = self._get(key)
+			if tag_id is not None:
+				ids[key] = tag_id
+				TAG_RESOLUTIONS.labels("cache").inc()
+
+		missing = [key for key in keys if key not in ids]
+		if missing:
+			for alias, tag_id in (await session.execute(
+				select(TagAlias.alias, TagAlias.tag_id).where(TagAlias.alias.in_(missing))
+			)).all():
+				ids[alias] = tag_id
+				self._put(alias, tag_id)
+				TAG_RESOLUTIONS.labels("alias").inc()
+
+		missing = [key for key in keys if key not in ids]
+		if missing:
+			# Tags without alias yet (created before canonicalization), named like the key or
+			# like one of the spellings; names compare case-insensitively as in MySQL
+			spellings = _spellings(raw_tags)
+			by_name = {spelling.casefold(): key for key in missing for spelling in spellings[key]}
+			by_name.update({key: key for key in missing})
+			for tag_id, name in (await session.execute(
+				select(Tag.id, Tag.name).where(Tag.name.in_(list(set(missing) | {
+					spelling for key in missing for spelling in spellings[key]
+				})))
+			)).all():
+				key = by_name.get(name.casefold())
+				if key is not None and key not in ids:
+					ids[key] = tag_id
+					self._put(key, tag_id)
+					TAG_RESOLUTIONS.labels("name").inc()
+
+		missing = [key for key in keys if key not in ids]
+		if missing:
+			# Named with the most common spelling, the first seen on ties
+			new_tags = {key: Tag(name=spellings[key].most_common(1)[0][0]) for key in missing}
+			session.add_all(new_tags.values())
+			await session.flush()
+			session.add_all([TagAlias(alias=key, tag_id=tag.id) for key, tag in new_tags.items()])
+			for key, tag in new_tags.items():
+				ids[key] = tag.id
+			TAG_RESOLUTIONS.labels("new").inc(len(new_tags))
+
+		return [ids[key] for key in keys]
+
+
+tag_resolver = TagResolver()
+
+
+def _merge_into(session: Session, survivor: int, loser: int) -> None:
+	"""Move the contents and aliases of tag `loser` to `survivor` and delete `loser`."""
+	options = {"synchronize_session": False}
+	# Derived table, as MySQL cannot select from the table an UPDATE modifies
+	tagged = select(ContentTag.content_id).where(ContentTag.tag_id == survivor).subquery()
+	session.execute(
+		update(ContentTag)
+		.where(ContentTag.tag_id == loser, ContentTag.content_id.not_in(select(tagged.c.content_id)))
+		.values(tag_id=survivor),
+		execution_options=options,
+	)
+	# Contents tagged with both keep their survivor row
+	session.execute(delete(ContentTag).where(ContentTag.tag_id == loser), execution_options=options)
+	session.execute(update(TagAlias).where(TagAlias.tag_id == loser).values(tag_id=survivor), execution_options=options)
+	session.execute(delete(Tag).where(Tag.id == loser), execution_options=options)
+
+
+def merge_duplicate_tags(session: Session, dry_run: bool = False,
+		batch_size: int = TAG_MERGE_BATCH_SIZE) -> Dict:
+	"""Merge all tags whose names normalize to the same key into one tag per key.
+
+	The surviving tag of a key is the one its alias already points to, else the most
+	used one; a survivor among the merged tags takes the name of the most used of them,
+	so tags keep a real spelling. Contents of the other tags move to the survivor, every
+	key gets an alias, and each batch of keys is committed on its own. Returns tag and
+	content_tags cardinality before and after.
+	"""
+	started = time.perf_counter()
+	names = dict(session.execute(select(Tag.id, Tag.name)).all())
+	aliases = dict(session.execute(select(TagAlias.alias, TagAlias.tag_id)).all())
+	usage = dict(session.execute(select(ContentTag.tag_id, func.count()).group_by(ContentTag.tag_id)).all())
+	merged: Dict[int, int] = {}
+
+	groups = defaultdict(list)
+	for tag_id, name in names.items():
+		key = normalize_tag(name)
+		if key is not None:
+			groups[key].append(tag_id)
+
+	counts = {
+		"tags_before": len(names), "tags_after": len(names),
+		"content_tags_before": sum(usage.values()), "content_tags_after": None,
+		"keys_merged": 0, "tags_merged": 0, "aliases_written": 0, "tags_renamed": 0,
+	}
+	pending = 0
+	for key, tag_ids in groups.items():
+		target = aliases.get(key)
+		while target in merged:
+			target = merged[target]
+		if target not in names:
+			target = None
+		most_used = max(tag_ids, key=lambda tag_id: (usage.get(tag_id, 0), -tag_id))
+		survivor = target or most_used
+		losers = [tag_id for tag_id in tag_ids if tag_id != survivor]
+		# A synonym's alias target (btc -> bitcoin) keeps its own name
+		rename = survivor in tag_ids and names[survivor] != names[most_used]
+		if not losers and not rename and aliases.get(key) == survivor:
+			continue
+
+		counts["keys_merged"] += bool(losers)
+		counts["tags_merged"] += len(losers)
+		counts["tags_after"] -= len(losers)
+		counts["tags_renamed"] += rename
+		counts["aliases_written"] += aliases.get(key) != survivor
+		for loser in losers:
+			merged[loser] = survivor
+		if dry_run:
+			continue
+
+		for loser in losers:
+			_merge_into(session, survivor, loser)
+		if rename:
+			# The most used tag is one of the losers, already deleted above
+			session.execute(update(Tag).where(Tag.id == survivor).values(name=names[most_used]))
+			names[survivor] = names[most_used]
+		if key in aliases:
+			session.execute(update(TagAlias).where(TagAlias.alias == key).values(tag_id=survivor))
+		else:
+			session.execute(insert(TagAlias).values(alias=key, tag_id=survivor))
+		aliases[key] = survivor
+		pending += 1
+		if pending >= batch_size:
+			session.commit()
+			pending = 0
+
+	if not dry_run:
+		session.commit()
+		tag_resolver.clear()
+		counts["content_tags_after"] = session.execute(select(func.count()).select_from(ContentTag)).scalar()
+	counts["seconds"] = round(time.perf_counter() - started, 3)
+	return counts
@@ -0,0 +1,31 @@
+"""Canonical form of the URLs stored in the links table."""
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+MAX_URL_LENGTH = 2083
+
+
+def normalize_url(raw: str) -> Optional[str]:
+	"""Canonical form of a link URL, or None if it is not usable.
+
+	Adds a missing http:// scheme, lowercases scheme and host, drops fragments
+	and a bare trailing slash so trivially different spellings dedup to one row.
+	"""
+	url = raw.strip()
+	if not url or any(c.isspace() for c in url):
+		return None
+	if "://" not in url:
+		url = "http://" + url
+	try:
+		parts = urlsplit(url)
+		port = parts.port
+	except ValueError:
+		return None
+	if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+		return None
+	netloc = parts.hostname.lower()
+	if port:
+		netloc = f"{netloc}:{port}"
+	path = "" if parts.path == "/" else parts.path
+	url = urlunsplit((parts.scheme.lower(), netloc, path, parts.query, ""))
+	return url if len(url) <= MAX_URL_LENGTH else None
@@ -0,0 +1,360 @@
+"""On-disk approximate nearest neighbour index over content embeddings (IVF).
+
+Layout of VECTOR_INDEX_DIR, all memory-mapped and appended to in place:
+
+- vectors.i8     one row of EMBEDDING_DIM int8 per indexed embedding
+- ids.i32        content id of each row, -1 once replaced or removed
+- lists.i32      inverted list (nearest centroid) of each row, -1 before training
+- centroids.f32  the k-means centroids of the inverted lists
+- meta.json      number of valid rows and lists; rows past `count` are ignored,
+                 so a crash while appending loses at most that row
+
+A search scores only the rows of the `nprobe` lists whose centroids are closest
+to the query (plus rows added before the first training), instead of all rows.
+Re-analysed contents append a new row and retire the old one; rebuild() writes
+a compacted index from the embeddings stored in the database. Adds and removals
+made while a rebuild reads the database are replayed onto the new index.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from array import array
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from api.db.embeddings import EMBEDDING_DIM, EMBEDDING_SCALE
+
+logger = logging.getLogger(__name__)
+
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", "vector_index")
+# Inverted lists at training time, capped at one per VECTOR_INDEX_LIST_SIZE vectors
+VECTOR_INDEX_LISTS = int(os.environ.get("VECTOR_INDEX_LISTS", "1024"))
+VECTOR_INDEX_LIST_SIZE = 64
+VECTOR_INDEX_PROBES = int(os.environ.get("VECTOR_INDEX_PROBES", "16"))
+# The lists are trained once the index holds this many vectors, and retrained whenever it doubled
+VECTOR_INDEX_TRAIN_AFTER = int(os.environ.get("VECTOR_INDEX_TRAIN_AFTER", "20000"))
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 40
+SCORE_CHUNK_ROWS = 65536
+
+_INITIAL_CAPACITY = 1024
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+	"""Spherical k-means (cosine) centroids of float32 unit `vectors`."""
+	rng = np.random.default_rng(seed)
+	centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+	for _ in range(iterations):
+		assignment = np.argmax(vectors @ centroids.T, axis=1)
+		sums = np.zeros_like(centroids)
+		np.add.at(sums, assignment, vectors)
+		norms = np.linalg.norm(sums, axis=1, keepdims=True)
+		empty = norms[:, 0] == 0
+		# Empty lists restart from a random vector
+		sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+		norms[empty] = 1.0
+		centroids = sums / norms
+	return centroids.astype(np.float32)
+
+
+class IvfIndex:
+	"""Memory-mapped IVF index of int8 vectors keyed by content id; thread safe."""
+
+	def __init__(self, path: str = VECTOR_INDEX_DIR, dim: int = EMBEDDING_DIM):
+		self.path = path
+		self.dim = dim
+		self._lock = threading.RLock()
+		self._opened = False
+		self._training = False
+		self._rebuild_lock = threading.Lock()
+		# (content id, vector or None for a removal) of updates made during a rebuild
+		self._journal: Optional[List[Tuple[int, Optional[np.ndarray]]]] = None
+
+	# -- storage
+
+	def _file(self, name: str) -> str:
+		return os.path.join(self.path, name)
+
+	def _map(self, capacity: int) -> None:
+		for name, dtype, width in (("vectors.i8", np.int8, self.dim), ("ids.i32", np.int32, 1), ("lists.i32", np.int32, 1)):
+			size = capacity * width * np.dtype(dtype).itemsize
+			with open(self._file(name), "ab") as f:
+				if f.tell() < size:
+					f.truncate(size)
+		self.capacity = capacity
+		self.vectors = np.memmap(self._file("vectors.i8"), dtype=np.int8, mode="r+", shape=(capacity, self.dim))
+		self.ids = np.memmap(self._file("ids.i32"), dtype=np.int32, mode="r+", shape=(capacity,))
+		self.lists = np.memmap(self._file("lists.i32"), dtype=np.int32, mode="r+", shape=(capacity,))
+
+	def _write_meta(self) -> None:
+		tmp = self._file("meta.json.tmp")
+		with open(tmp, "w") as f:
+			json.dump({"dim": self.dim, "count": self.count, "nlist": len(self.centroids),
+			           "trained_count": self.trained_count}, f)
+		os.replace(tmp, self._file("meta.json"))
+
+	def open(self) -> "IvfIndex":
+		with self._lock:
+			os.makedirs(self.path, exist_ok=True)
+			meta = {"dim": self.dim, "count": 0, "nlist": 0, "trained_count": 0}
+			if os.path.exists(self._file("meta.json")):
+				with open(self._file("meta.json")) as f:
+					meta = json.load(f)
+				if meta["dim"] != self.dim:
+					raise ValueError(f"{self.path} holds {meta['dim']}-dimensional vectors, expected {self.dim}")
+			self.count = meta["count"]
+			self.trained_count = meta.get("trained_count", 0)
+			capacity = _INITIAL_CAPACITY
+			while capacity < self.count:
+				capacity *= 2
+			self._map(capacity)
+			self.centroids = np.zeros((0, self.dim), dtype=np.float32)
+			if meta["nlist"]:
+				self.centroids = np.fromfile(self._file("centroids.f32"), dtype=np.float32).reshape(-1, self.dim)
+			self._load_lists()
+			self._opened = True
+		return self
+
+	def _load_lists(self) -> None:
+		"""Rebuild the in-memory row lists and content id -> row map from the mapped files."""
+		ids = np.asarray(self.ids[:self.count])
+		lists = np.asarray(self.lists[:self.count])
+		live = np.flatnonzero(ids >= 0)
+		self.row_of = dict(zip(ids[live].tolist(), live.tolist()))
+		self.members = [array("i") for _ in range(len(self.centroids))]
+		self.unassigned = array("i")
+		order = live[np.argsort(lists[live], kind="stable")]
+		bounds = np.searchsorted(lists[order], np.arange(-1, len(self.centroids) + 1))
+		self.unassigned.extend(order[bounds[0]:bounds[1]].tolist())
+		for n in range(len(self.centroids)):
+			self.members[n].extend(order[bounds[n + 1]:bounds[n + 2]].tolist())
+
+	def _ensure_open(self) -> None:
+		if not self._opened:
+			self.open()
+
+	def close(self) -> None:
+		with self._lock:
+			if self._opened:
+				self.vectors.flush()
+				self.ids.flush()
+				self.lists.flush()
+				del self.vectors, self.ids, self.lists
+				self._opened = False
+
+	def __len__(self) -> int:
+		self._ensure_open()
+		return len(self.row_of)
+
+	# -- updates
+
+	def add(self, content_id: int, vector: np.ndarray) -> None:
+		"""Index (or re-index) the int8 embedding of a content."""
+		self.add_many([(content_id, vector)])
+
+	def add_many(self, items: Iterable[Tuple[int, np.ndarray]]) -> None:
+		items = list(items)
+		if not items:
+			return
+		with self._lock:
+			if self._journal is not None:
+				self._journal.extend(items)
+			self._ensure_open()
+			while self.count + len(items) > self.capacity:
+				self._map(self.capacity * 2)
+			start, end = self.count, self.count + len(items)
+			ids = np.array([content_id for content_id, _ in items], dtype=np.int32)
+			vectors = np.stack([vector for _, vector in items]).astype(np.int8)
+			if len(self.centroids):
+				targets = np.argmax(vectors.astype(np.float32) @ self.centroids.T, axis=1)
+			else:
+				targets = np.full(len(items), -1)
+			self.vectors[start:end] = vectors
+			self.ids[start:end] = ids
+			self.lists[start:end] = targets
+			for content_id, row, target in zip(ids.tolist(), range(start, end), targets.tolist()):
+				# A re-analysed content keeps only its newest row
+				old = self.row_of.get(content_id)
+				if old is not None:
+					self.ids[old] = -1
+				self.row_of[content_id] = row
+				(self.members[target] if target >= 0 else self.unassigned).append(row)
+			self.count = end
+			self._write_meta()
+
+	def remove(self, content_id: int) -> None:
+		self.remove_many([content_id])
+
+	def remove_many(self, content_ids: Iterable[int]) -> None:
+		"""Drop deleted contents from the search results."""
+		content_ids = list(content_ids)
+		with self._lock:
+			if self._journal is not None:
+				self._journal.extend((content_id, None) for content_id in content_ids)
+			if not self._opened and not os.path.exists(self._file("meta.json")):
+				# Nothing indexed yet
+				return
+			self._ensure_open()
+			for content_id in content_ids:
+				row = self.row_of.pop(content_id, None)
+				if row is not None:
+					self.ids[row] = -1
+
+	@property
+	def needs_training(self) -> bool:
+		"""True once the index holds VECTOR_INDEX_TRAIN_AFTER vectors and twice as many as at the last training."""
+		self._ensure_open()
+		return self.count >= max(VECTOR_INDEX_TRAIN_AFTER, 2 * self.trained_count)
+
+	def train(self, nlist: Optional[int] = None) -> int:
+		"""(Re)compute the centroids from a sample of the live vectors and reassign every row.
+
+		Clustering and reassigning the rows present at the start run without the lock, so
+		searches and appends continue meanwhile; only rows appended during training and the
+		swap to the new lists hold it.
+		"""
+		with self._lock:
+			self._ensure_open()
+			if self._training:
+				return 0
+			count = self.count
+			live = np.flatnonzero(np.asarray(self.ids[:count]) >= 0)
+			if nlist is None:
+				nlist = min(VECTOR_INDEX_LISTS, len(live) // VECTOR_INDEX_LIST_SIZE)
+			if nlist < 2:
+				return 0
+			self._training = True
+		try:
+			return self._train(count, live, nlist)
+		finally:
+			self._training = False
+
+	def _train(self, count: int, live: np.ndarray, nlist: int) -> int:
+		rng = np.random.default_rng(len(live))
+		sample = np.sort(rng.choice(live, min(len(live), nlist * KMEANS_SAMPLE_PER_LIST), replace=False))
+		vectors = self.vectors[sample].astype(np.float32)
+		vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-6)
+		centroids = kmeans(vectors, nlist)
+		lists = np.empty(count, dtype=np.int32)
+		for start in range(0, count, SCORE_CHUNK_ROWS):
+			chunk = self.vectors[start:min(start + SCORE_CHUNK_ROWS, count)].astype(np.float32)
+			lists[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+		with self._lock:
+			appended = self.vectors[count:self.count].astype(np.float32)
+			self.lists[:count] = lists
+			if len(appended):
+				self.lists[count:self.count] = np.argmax(appended @ centroids.T, axis=1)
+			centroids.tofile(self._file("centroids.f32"))
+			self.centroids = centroids
+			self.trained_count = self.count
+			self.lists.flush()
+			self._write_meta()
+			self._load_lists()
+		return nlist
+
+	# -- queries
+
+	def _candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+		if not len(self.centroids):
+			return np.arange(self.count, dtype=np.int64)
+		nprobe = min(nprobe, len(self.centroids))
+		probes = np.argpartition(self.centroids @ query, -nprobe)[-nprobe:]
+		parts = [np.frombuffer(self.members[n], dtype=np.int32) for n in probes if len(self.members[n])]
+		if len(self.unassigned):
+			parts.append(np.frombuffer(self.unassigned, dtype=np.int32))
+		return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+	def search(self, query: np.ndarray, k: int = 100, nprobe: int = VECTOR_INDEX_PROBES) -> List[Tuple[int, float]]:
+		"""(content id, cosine similarity) of the approximately `k` nearest contents to a unit query."""
+		with self._lock:
+			self._ensure_open()
+			rows = self._candidates(query.astype(np.float32), nprobe)
+			best_rows, best_scores = [], []
+			for start in range(0, len(rows), SCORE_CHUNK_ROWS):
+				chunk = rows[start:start + SCORE_CHUNK_ROWS]
+				scores = self.vectors[chunk].astype(np.float32) @ query
+				scores[self.ids[chunk] < 0] = -np.inf
+				if len(chunk) > k:
+					top = np.argpartition(scores, -k)[-k:]
+					chunk, scores = chunk[top], scores[top]
+				best_rows.append(chunk)
+				best_scores.append(scores)
+			if not best_rows:
+				return []
+			rows, scores = np.concatenate(best_rows), np.concatenate(best_scores)
+			order = np.argsort(-scores)[:k]
+			ids = self.ids[rows[order]]
+			return [(int(content_id), float(score) / EMBEDDING_SCALE)
+			        for content_id, score in zip(ids, scores[order]) if content_id >= 0]
+
+	# -- maintenance
+
+	def rebuild(self, items: Iterable[Tuple[int, np.ndarray]]) -> int:
+		"""Replace the index with a compacted, trained one of `items` (content id, int8 vector).
+
+		Updates made while `items` is consumed are journalled and replayed onto the new index,
+		so contents analysed or deleted during a rebuild are not lost or resurrected.
+		"""
+		with self._rebuild_lock:
+			with self._lock:
+				self._journal = []
+			try:
+				return self._rebuild(items)
+			finally:
+				self._journal = None
+
+	def _rebuild(self, items: Iterable[Tuple[int, np.ndarray]]) -> int:
+		staging = IvfIndex(self.path.rstrip("/") + ".new", self.dim)
+		shutil.rmtree(staging.path, ignore_errors=True)
+		staging.open()
+		batch = []
+		for item in items:
+			batch.append(item)
+			if len(batch) >= SCORE_CHUNK_ROWS:
+				staging.add_many(batch)
+				batch = []
+		staging.add_many(batch)
+		staging.train()
+		staging.close()
+		with self._lock:
+			journal, self._journal = self._journal, None
+			self.close()
+			retired = self.path.rstrip("/") + ".old"
+			shutil.rmtree(retired, ignore_errors=True)
+			if os.path.exists(self.path):
+				os.replace(self.path, retired)
+			os.replace(staging.path, self.path)
+			shutil.rmtree(retired, ignore_errors=True)
+			self.open()
+			for content_id, vector in journal:
+				if vector is None:
+					self.remove(content_id)
+				else:
+					self.add(content_id, vector)
+			return len(self.row_of)
+
+	def stats(self) -> dict:
+		with self._lock:
+			self._ensure_open()
+			sizes = [len(members) for members in self.members] or [0]
+			return {"rows": self.count, "live": len(self.row_of), "lists": len(self.centroids),
+			        "unassigned": len(self.unassigned), "largest_list": max(sizes),
+			        "bytes": sum(os.path.getsize(self._file(name)) for name in os.listdir(self.path))}
+
+
+vector_index = IvfIndex()
+
+
+def train_if_needed() -> None:
+	"""Retrain the lists once enough vectors were added since the last training (runs in a thread)."""
+	if not vector_index.needs_training:
+		return
+	started = time.perf_counter()
+	nlist = vector_index.train()
+	if nlist:
+		logger.info("Vector index trained %d lists over %d vectors in %.1fs",
+		            nlist, len(vector_index), time.perf_counter() - started)
@@ -0,0 +1,125 @@
+
+import json
+import time
+from collections import defaultdict
+from typing import Iterator
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import select, update
+
+from api.db.database import SessionLocal
+from api.db.embeddings import embed_content, from_bytes, to_bytes
+from api.db.models import Content, ContentTag, Tag
+from api.db.vector_index import vector_index
+from api.routes.routes import require_api_key
+
+router = APIRouter()
+
+EXPORT_BATCH_SIZE = 1000
+EMBED_BATCH_SIZE = 1000
+
+
+def _content_line(content_id, url, title, description, tags) -> bytes:
+	return (json.dumps({
+		"id": content_id,
+		"url": url,
+		"title": title,
+		"description": description,
+		"tags": tags,
+	}) + "\n").encode("utf-8")
+
+
+def _iter_contents_ndjson(batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+	"""Contents joined with their tag names in one ordered pass over a server-side cursor.
+
+	Rows of the same content arrive consecutively (ordered by content id), so each
+	content is emitted as soon as the next one starts and nothing else is buffered.
+	"""
+	with SessionLocal() as db:
+		rows = db.execute(
+			select(Content.id, Content.url, Content.title, Content.description, Tag.name)
+			.outerjoin(ContentTag, ContentTag.content_id == Content.id)
+			.outerjoin(Tag, Tag.id == ContentTag.tag_id)
+			.order_by(Content.id, ContentTag.priority.desc())
+			.execution_options(stream_results=True, yield_per=batch_size)
+		)
+		current = None
+		tags = []
+		for content_id, url, title, description, tag_name in rows:
+			if current is not None and current[0] != content_id:
+				yield _content_line(*current, tags)
+				tags = []
+			current = (content_id, url, title, description)
+			if tag_name is not None:
+				tags.append(tag_name)
+		if current is not None:
+			yield _content_line(*current, tags)
+
+
+@router.get("/export")
+def export_contents():
+	"""Stream all analysed contents with their tags as NDJSON."""
+	return StreamingResponse(_iter_contents_ndjson(), media_type="application/x-ndjson")
+
+
+class VectorReindexOut(BaseModel):
+	embedded: int
+	indexed: int
+	lists: int
+	seconds: float
+
+
+def _embed_missing(batch_size: int = EMBED_BATCH_SIZE) -> int:
+	"""Compute the embeddings of contents stored without one (analysed before embeddings existed)."""
+	embedded = 0
+	last_id = 0
+	with SessionLocal() as db:
+		while True:
+			rows = db.execute(
+				select(Content.id, Content.title, Content.description)
+				.where(Content.id > last_id, Content.embedding == None)  # noqa: E711
+				.order_by(Content.id).limit(batch_size)
+			).all()
+			if not rows:
+				return embedded
+			last_id = rows[-1].id
+			tags = defaultdict(list)
+			for content_id, name in db.execute(
+				select(ContentTag.content_id, Tag.name).join(Tag, Tag.id == ContentTag.tag_id)
+				.where(ContentTag.content_id.in_([row.id for row in rows]))
+			):
+				tags[content_id].append(name)
+			db.execute(update(Content), [
+				{"id": row.id, "embedding": to_bytes(embed_content(row.title, row.description, tags[row.id]))}
+				for row in rows
+			])
+			db.commit()
+			embedded += len(rows)
+
+
+def _stored_embeddings(batch_size: int = EXPORT_BATCH_SIZE):
+	with SessionLocal() as db:
+		rows = db.execute(
+			select(Content.id, Content.embedding).where(Content.embedding != None)  # noqa: E711
+			.order_by(Content.id).execution_options(stream_results=True, yield_per=batch_size)
+		)
+		for content_id, embedding in rows:
+			yield content_id, from_bytes(embedding)
+
+
+@router.post("/reindex-vectors", response_model=VectorReindexOut, dependencies=[Depends(require_api_key)])
+def reindex_vectors():
+	"""Embed contents that have no embedding yet and rebuild the semantic search index from scratch.
+
+	Embeds and rebuilds the whole table, so it requires the API key.
+
+	The rebuilt index drops deleted and replaced contents and retrains its lists; searches keep
+	using the old index until the new one is swapped in.
+	"""
+	started = time.perf_counter()
+	embedded = _embed_missing()
+	indexed = vector_index.rebuild(_stored_embeddings())
+	return VectorReindexOut(embedded=embedded, indexed=indexed, lists=vector_index.stats()["lists"],
+	                        seconds=round(time.perf_counter() - started, 3))
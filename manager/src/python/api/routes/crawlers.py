@@ -0,0 +1,64 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel, Field
+
+from api.routes.routes import require_api_key
+from continous_loop import loop
+
+# Registered crawlers get crawl jobs (and in direct mode the analyzer URL), so only
+# holders of the manager API key may register or remove them
+router = APIRouter(dependencies=[Depends(require_api_key)])
+
+
+class CrawlerHeartbeat(BaseModel):
+	id: Optional[str] = None
+	url: str = Field(..., min_length=1, description="Base URL the manager reaches the crawler at")
+	capacity: Optional[int] = Field(None, ge=1, description="Jobs the crawler takes at once")
+	running: int = 0
+	queued: int = 0
+
+
+class CrawlerOut(BaseModel):
+	name: str
+	url: str
+	alive: bool
+	static: bool
+	capacity: int
+	in_flight: int
+	queued: int
+	failures: int
+	seen_seconds_ago: Optional[float] = None
+
+
+class CrawlersOut(BaseModel):
+	alive: int
+	deaths: int
+	released_jobs: int
+	crawlers: List[CrawlerOut]
+
+
+@router.post("/heartbeat")
+def heartbeat(req: CrawlerHeartbeat) -> bool:
+	"""Register a crawler or keep it alive; it gets links by the hash of their host (see crawlers.py)."""
+	loop.crawlers.heartbeat(req.url, name=req.id, capacity=req.capacity, queued=req.queued)
+	return True
+
+
+@router.get("", response_model=CrawlersOut)
+def list_crawlers():
+	return loop.crawlers.snapshot()
+
+
+@router.delete("/{name}")
+def remove_crawler(name: str):
+	"""Forget a crawler that was scaled down; its hosts and unfinished jobs move to the others.
+
+	A crawler that keeps sending heartbeats registers again with the next one.
+	"""
+	for crawler in loop.crawlers.instances():
+		if name in (crawler.name, crawler.url):
+			released = loop.crawlers.remove(crawler.url) or []
+			loop.release_crawl_jobs(released)
+			return {"removed": crawler.name, "released_jobs": len(released)}
+	raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown crawler")
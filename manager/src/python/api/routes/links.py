@@ -1,16 +1,31 @@
 
-from typing import List, Optional
+import csv
+import json
+import time
+from typing import AsyncIterator, Iterator, List, Optional
 from datetime import date
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from api.db.database import get_db
-from api.db.models import Links, Content, Tag
+from api.db.bulk import INSERT_BATCH_SIZE, check_delete_pattern, delete_links, insert_links_async, link_filter
+from api.db.database import SessionLocal, get_db, get_async_db
+from api.db.models import Links, Content, ContentTag, Tag
+from api.db.urls import normalize_url
+from api.routes.routes import require_api_key
+from continous_loop import loop
 
 router = APIRouter()
 
+EXPORT_BATCH_SIZE = 1000
+STATUS_BATCH_LIMIT = 1000
+# Longest import line kept; longer ones are dropped unbuffered and counted as invalid
+MAX_IMPORT_LINE_BYTES = 64 * 1024
+
 
 class LinkCreate(BaseModel):
 	url: str
@@ -25,28 +40,193 @@ class LinkOut(BaseModel):
 	id: int
 	url: str
 	analysed_on: Optional[date] = None
+	content_hash: Optional[str] = None
 
 	class Config:
 		orm_mode = True
 
 
+def _normalized_or_422(raw: str) -> str:
+	url = normalize_url(raw)
+	if url is None:
+		raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Not a usable link URL")
+	return url
+
+
 @router.post("/", response_model=LinkOut, status_code=status.HTTP_201_CREATED)
 def create_link(payload: LinkCreate, db: Session = Depends(get_db)):
-	existing = db.query(Links).filter(Links.url == payload.url).first()
+	url = _normalized_or_422(payload.url)
+	existing = db.query(Links).filter(Links.url == url).first()
 	if existing:
 		raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Link already exists")
 
-	link = Links(url=payload.url)
+	link = Links(url=url)
 	db.add(link)
 	db.commit()
 	db.refresh(link)
 	return link
 
 
+class LinkImportOut(BaseModel):
+	received: int
+	inserted: int
+	duplicates: int
+	invalid: int
+	seconds: float
+	rows_per_second: float
+
+
+async def _iter_lines(request: Request, max_line: int = MAX_IMPORT_LINE_BYTES) -> AsyncIterator[Optional[str]]:
+	"""Decode the streamed request body line by line without buffering it whole.
+
+	Lines longer than `max_line` bytes are not buffered; each yields None instead.
+	"""
+	pending = b""
+	overlong = False
+	async for chunk in request.stream():
+		pending += chunk
+		*lines, pending = pending.split(b"\n")
+		for line in lines:
+			if overlong or len(line) > max_line:
+				overlong = False
+				yield None
+			else:
+				yield line.decode("utf-8", errors="replace").rstrip("\r")
+		if len(pending) > max_line:
+			# Drop the line's bytes until its newline arrives
+			overlong = True
+			pending = b""
+	if overlong or len(pending) > max_line:
+		yield None
+	elif pending:
+		yield pending.decode("utf-8", errors="replace").rstrip("\r")
+
+
+def _detect_format(request: Request, fmt: str) -> str:
+	if fmt != "auto":
+		return fmt
+	content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+	if content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+		return "ndjson"
+	if content_type in ("text/csv", "application/csv"):
+		return "csv"
+	return "text"
+
+
+@router.post("/import", response_model=LinkImportOut)
+async def import_links(
+	request: Request,
+	fmt: str = Query("auto", alias="format", pattern="^(auto|ndjson|csv|text)$"),
+	db: AsyncSession = Depends(get_async_db),
+):
+	"""Bulk-import links from a streamed NDJSON, CSV or plain-text (one URL per line) upload.
+
+	URLs are normalized, deduplicated per chunk and written with batched INSERT IGNORE
+	statements; URLs already in the table are counted as duplicates.
+	"""
+	fmt = _detect_format(request, fmt)
+	started = time.perf_counter()
+	received = inserted = invalid = 0
+	url_column = 0
+	chunk: set = set()
+
+	async def flush() -> int:
+		count = await insert_links_async(db, list(chunk))
+		await db.commit()
+		chunk.clear()
+		return count
+
+	async for line in _iter_lines(request):
+		if line is None:
+			received += 1
+			invalid += 1
+			continue
+		if not line.strip() or (fmt == "text" and line.lstrip().startswith("#")):
+			continue
+		received += 1
+		raw = None
+		try:
+			if fmt == "ndjson":
+				item = json.loads(line)
+				raw = item.get("url") if isinstance(item, dict) else item
+			elif fmt == "csv":
+				row = next(csv.reader([line]))
+				if received == 1 and "url" in [c.strip().lower() for c in row]:
+					url_column = [c.strip().lower() for c in row].index("url")
+					received -= 1
+					continue
+				raw = row[url_column] if len(row) > url_column else None
+			else:
+				raw = line
+		except (ValueError, StopIteration):
+			pass
+
+		url = normalize_url(raw) if isinstance(raw, str) else None
+		if url is None:
+			invalid += 1
+			continue
+		chunk.add(url)
+		if len(chunk) >= INSERT_BATCH_SIZE:
+			inserted += await flush()
+
+	if chunk:
+		inserted += await flush()
+
+	seconds = time.perf_counter() - started
+	valid = received - invalid
+	return LinkImportOut(
+		received=received,
+		inserted=inserted,
+		duplicates=valid - inserted,
+		invalid=invalid,
+		seconds=round(seconds, 3),
+		rows_per_second=round(valid / seconds, 1) if seconds > 0 else 0.0,
+	)
+
+
 @router.get("/", response_model=List[LinkOut])
-def list_links(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-	q = db.query(Links).offset(skip).limit(limit).all()
-	return q
+def list_links(
+	response: Response,
+	skip: int = 0,
+	limit: int = Query(100, ge=1, le=1000),
+	after_id: Optional[int] = Query(None, description="Keyset cursor: only links with a greater id"),
+	db: Session = Depends(get_db),
+):
+	"""List links ordered by id.
+
+	Pass the id of the last link of the previous page as `after_id` (also returned in the
+	X-Next-After-Id header); unlike `skip`, this stays fast at any depth.
+	"""
+	q = db.query(Links).order_by(Links.id)
+	if after_id is not None:
+		q = q.filter(Links.id > after_id)
+	elif skip:
+		q = q.offset(skip)
+	links = q.limit(limit).all()
+	if len(links) == limit:
+		response.headers["X-Next-After-Id"] = str(links[-1].id)
+	return links
+
+
+def _iter_links_ndjson(batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+	with SessionLocal() as db:
+		rows = db.execute(
+			select(Links.id, Links.url, Links.analysed_on)
+			.order_by(Links.id)
+			.execution_options(stream_results=True, yield_per=batch_size)
+		)
+		for link_id, url, analysed_on in rows:
+			yield (json.dumps({
+				"id": link_id,
+				"url": url,
+				"analysed_on": analysed_on.isoformat() if analysed_on else None,
+			}) + "\n").encode("utf-8")
+
+
+@router.get("/export")
+def export_links():
+	"""Stream all links as NDJSON from a server-side cursor; memory stays flat for any table size."""
+	return StreamingResponse(_iter_links_ndjson(), media_type="application/x-ndjson")
 
 
 @router.get("/{link_id}", response_model=LinkOut)
@@ -64,7 +244,7 @@ def update_link(link_id: int, payload: LinkUpdate, db: Session = Depends(get_db)
 		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Link not found")
 
 	if payload.url is not None:
-		link.url = payload.url
+		link.url = _normalized_or_422(payload.url)
 	if payload.analysed_on is not None:
 		link.analysed_on = payload.analysed_on
 
@@ -76,31 +256,85 @@ def update_link(link_id: int, payload: LinkUpdate, db: Session = Depends(get_db)
 
 @router.delete("/{link_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_link(link_id: int, db: Session = Depends(get_db)):
-	link = db.query(Links).filter(Links.id == link_id).first()
-	if not link:
+	# Contents and their tag associations go with the link; orphaned tags are
+	# collected later by the periodic tag GC (api.db.maintenance)
+	counts = delete_links(db, link_filter(ids=[link_id]))
+	if not counts["links"]:
 		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Link not found")
+	return None
 
-	# Capture the URL so we can remove any Content rows that reference the same URL
-	url = link.url
 
-	# Delete Content rows that reference this URL. Use ORM delete to ensure relationship
-	# cascade rules are applied (Content -> ContentTag will delete association rows).
-	contents = db.query(Content).filter(Content.url == url).all()
-	for c in contents:
-		db.delete(c)
+class LinkBulkDelete(BaseModel):
+	ids: Optional[List[int]] = Field(None, max_length=10000)
+	url_pattern: Optional[str] = Field(None, description="SQL LIKE pattern, e.g. '%.onion/forum%'")
+	dead_for_days: Optional[int] = Field(None, ge=0, description="Crawled at least this many days ago without any content")
+	dry_run: bool = False
 
-	# After removing contents, remove any Tag rows that no longer have associated content_links
-	orphan_tags = db.query(Tag).filter(~Tag.content_links.any()).all()
-	for t in orphan_tags:
-		db.delete(t)
 
-	# Finally remove the link itself
-	db.delete(link)
+class LinkBulkDeleteOut(BaseModel):
+	links: int
+	contents: int
+	content_tags: int
+	dry_run: bool
+	seconds: float
+
+
+@router.post("/bulk-delete", response_model=LinkBulkDeleteOut, dependencies=[Depends(require_api_key)])
+def bulk_delete_links(payload: LinkBulkDelete, db: Session = Depends(get_db)):
+	"""Delete all links matching every given criterion, with their contents and tag associations.
+
+	Runs set-based DELETEs in batches; use `dry_run` to only count what would be removed.
+	Requires the API key, and a URL pattern specific enough not to match every link.
+	"""
+	try:
+		check_delete_pattern(payload.url_pattern)
+		clauses = link_filter(ids=payload.ids, url_pattern=payload.url_pattern, dead_for_days=payload.dead_for_days)
+	except ValueError as e:
+		raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+	started = time.perf_counter()
+	counts = delete_links(db, clauses, dry_run=payload.dry_run)
+	return LinkBulkDeleteOut(**counts, dry_run=payload.dry_run, seconds=round(time.perf_counter() - started, 3))
 
-	db.commit()
-	return None
 
 
+class LinkReanalyze(BaseModel):
+	ids: Optional[List[int]] = Field(None, max_length=STATUS_BATCH_LIMIT)
+	url_pattern: Optional[str] = Field(None, description="SQL LIKE pattern, e.g. '%.onion/forum%'")
+	limit: int = Field(100, ge=1, le=STATUS_BATCH_LIMIT)
+
+
+class LinkReanalyzeOut(BaseModel):
+	archived: int
+	submitted: int
+
+
+@router.post("/reanalyze", response_model=LinkReanalyzeOut)
+def reanalyze_links(payload: LinkReanalyze, db: Session = Depends(get_db)):
+	"""Re-run analysis of matching links from the crawler's page archive instead of crawling them again.
+
+	Only links whose last crawl was archived (content_hash set) are considered; the results
+	replace the stored contents when the analyzer calls back.
+	"""
+	try:
+		clauses = link_filter(ids=payload.ids, url_pattern=payload.url_pattern)
+	except ValueError as e:
+		raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+	items = db.execute(
+		select(Links.url, Links.content_hash)
+		.where(Links.content_hash.is_not(None), *clauses)
+		.order_by(Links.id)
+		.limit(payload.limit)
+	).all()
+	if not items:
+		return LinkReanalyzeOut(archived=0, submitted=0)
+	try:
+		submitted = loop.start_reanalysis(items)
+	except Exception as e:
+		raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Crawler archive unavailable: {e}")
+	return LinkReanalyzeOut(archived=len(items), submitted=submitted)
+
 
 class LinkStatusOut(BaseModel):
 	id: int
@@ -109,18 +343,66 @@ class LinkStatusOut(BaseModel):
 	tags: List[str] = []
 
 
+class LinkStatusQuery(BaseModel):
+	ids: List[int] = Field(default_factory=list, max_length=STATUS_BATCH_LIMIT)
+	urls: List[str] = Field(default_factory=list, max_length=STATUS_BATCH_LIMIT)
+
+
+class LinkStatusBatchOut(BaseModel):
+	links: List[LinkStatusOut]
+	missing_ids: List[int] = []
+	missing_urls: List[str] = []
+
+
+async def _resolve_status(db: AsyncSession, links) -> List[LinkStatusOut]:
+	"""Content flag and tag names for already loaded links with one extra query.
+
+	Tags are read straight from the join (best priority first) instead of going through
+	`Content.tags`, whose association proxy lazy-loads every ContentTag and Tag.
+	"""
+	if not links:
+		return []
+	tags_by_url = {}
+	rows = await db.execute(
+		select(Content.url, Tag.name)
+		.outerjoin(ContentTag, ContentTag.content_id == Content.id)
+		.outerjoin(Tag, Tag.id == ContentTag.tag_id)
+		.where(Content.url.in_({link.url for link in links}))
+		.order_by(Content.id, ContentTag.priority.desc())
+	)
+	for url, tag_name in rows:
+		tags = tags_by_url.setdefault(url, [])
+		if tag_name is not None:
+			tags.append(tag_name)
+	return [
+		LinkStatusOut(id=link.id, url=link.url, has_content=link.url in tags_by_url, tags=tags_by_url.get(link.url, []))
+		for link in links
+	]
+
+
+@router.post("/status", response_model=LinkStatusBatchOut)
+async def link_status_batch(payload: LinkStatusQuery, db: AsyncSession = Depends(get_async_db)):
+	"""Status of many links, selected by id and/or URL, in two queries regardless of the batch size."""
+	if not payload.ids and not payload.urls:
+		return LinkStatusBatchOut(links=[])
+	links = (await db.execute(
+		select(Links.id, Links.url)
+		.where(or_(Links.id.in_(payload.ids), Links.url.in_(payload.urls)))
+		.order_by(Links.id)
+	)).all()
+	found_ids = {link.id for link in links}
+	found_urls = {link.url for link in links}
+	return LinkStatusBatchOut(
+		links=await _resolve_status(db, links),
+		missing_ids=[i for i in dict.fromkeys(payload.ids) if i not in found_ids],
+		missing_urls=[u for u in dict.fromkeys(payload.urls) if u not in found_urls],
+	)
+
+
 @router.get("/{link_id}/status", response_model=LinkStatusOut)
-def link_status(link_id: int, db: Session = Depends(get_db)):
+async def link_status(link_id: int, db: AsyncSession = Depends(get_async_db)):
 	"""Return whether the given link has an analysed Content entry and its tags."""
-	link = db.query(Links).filter(Links.id == link_id).first()
+	link = (await db.execute(select(Links.id, Links.url).where(Links.id == link_id))).first()
 	if not link:
 		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Link not found")
-
-	content = db.query(Content).filter(Content.url == link.url).first()
-	if not content:
-		return LinkStatusOut(id=link.id, url=link.url, has_content=False, tags=[])
-
-	tag_names = [t.name for t in content.tags]
-	return LinkStatusOut(id=link.id, url=link.url, has_content=True, tags=tag_names)
-
-
+	return (await _resolve_status(db, [link]))[0]
@@ -1,25 +1,73 @@
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 
+import hashlib
+import hmac
 import os
-from fastapi import APIRouter, Depends, Header, HTTPException, status, BackgroundTasks
-from pydantic import BaseModel
-from api.db.models import ContentTag, Tag, Content, Links
-from api.db.database import get_db
-from sqlalchemy.orm import Session, joinedload
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status, BackgroundTasks
+from pydantic import BaseModel, Field
+from api.db.models import ContentTag, Content, Links
+from api.db.database import get_async_db
+from api.db.embeddings import embed_content, embed_text, quantize
+from api.db.facets import FACET_SCAN_LIMIT, apply_facet_counts_async, count_content, count_facets, top_facets, total_key
+from api.db.maintenance import reconcile_facet_counts
+from api.db.suggest import tag_suggester
+from api.db.tags import canonical_keys, tag_resolver
+from api.db.vector_index import train_if_needed, vector_index
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import asyncio
 import datetime
+import time
 from rapidfuzz import process, utils
 
 from continous_loop import loop
+from tracing import tracer
 
 router = APIRouter()
 
 
 API_KEY = os.getenv("MANAGER_API_KEY", "changeme")
+# HMAC-SHA256 secret the analyzer signs result callbacks with (its SHARED_SECRET, X-Signature header)
+SHARED_SECRET = os.getenv("SHARED_SECRET")
+SEARCH_MODE = os.getenv("SEARCH_MODE", "tags")
+SEARCH_LIMIT = 100
+# Cosine similarity below which nearest contents are noise (hash collisions) rather than related
+SEMANTIC_MIN_SCORE = float(os.getenv("SEMANTIC_MIN_SCORE", "0.15"))
+# Reciprocal rank fusion constant: score of a result is the sum of 1 / (RRF_K + rank) over both lists
+RRF_K = 60
 security = HTTPBearer()
 
 class SearchRequest(BaseModel):
     query: str
+    # tags: fuzzy match on tag names; semantic: nearest contents by text embedding;
+    # hybrid: both lists merged by reciprocal rank fusion
+    mode: Literal["tags", "semantic", "hybrid"] = SEARCH_MODE
+
+
+class FacetRequest(BaseModel):
+    # Empty: facets of all contents
+    query: str = ""
+    mode: Literal["tags", "semantic", "hybrid"] = SEARCH_MODE
+    limit: int = Field(20, ge=1, le=100, description="Most tags to return")
+
+
+class FacetCountOut(BaseModel):
+    contents: int
+    legal: int
+    illegal: int
+
+
+class TagFacetOut(FacetCountOut):
+    tag: str
+
+
+class FacetsOut(BaseModel):
+    total: FacetCountOut
+    tags: List[TagFacetOut]
+    # The result set had more than FACET_SCAN_LIMIT contents and only that many were counted
+    truncated: bool = False
 
 
 class SearchResult(BaseModel):
@@ -30,7 +78,21 @@ class SearchResult(BaseModel):
 class CrawlResult(BaseModel):
     url: str
     job_id: str
-    content: str
+    # Page body (relay mode), or the analyzer job the crawler submitted it to (direct mode)
+    content: Optional[str] = None
+    analysis_job_id: Optional[str] = None
+    content_length: Optional[int] = None
+    content_hash: Optional[str] = None
+    error: Optional[str] = None
+    # Conditional recrawl: HTTP 304, or a 200 with the same body as last time
+    not_modified: bool = False
+    unchanged: bool = False
+    bytes_saved: Optional[int] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # Pipeline trace of the link and the crawler's timestamps for it (see tracing.py)
+    trace_id: Optional[str] = None
+    timings: Optional[Dict[str, float]] = None
 
 class AnalyseResult(BaseModel):
     jobId: Optional[str]
@@ -38,12 +100,10 @@ class AnalyseResult(BaseModel):
     legality: Optional[bool] = None
     description: Optional[str]
     url: Optional[str]
+    sourceUrl: Optional[str] = None
     tags: Optional[List[str]] = None
-
-class SearchRequest(BaseModel):
-    query: str
-
-
+    traceId: Optional[str] = None
+    timings: Optional[Dict[str, float]] = None
 
 def _require_jwt(authorization: Optional[str] = Header(None)) -> str:
     """Placeholder JWT auth dependency.
@@ -67,38 +127,76 @@ def require_api_key(credentials: HTTPAuthorizationCredentials = Depends(security
     return token
 
 
-@router.post("/search")
-async def search(req: SearchRequest, session: Session = Depends(get_db)):
-    
-    # 1. Fetch all unique tag names/IDs once (cache this if possible)
-    tags_from_db = session.query(Tag.id, Tag.name).all() 
-    choices = {t.name: t.id for t in tags_from_db}
+async def _matched_tag_ids(query: str) -> List[int]:
+    # 1. Names/IDs of the tags in use, cached by the typeahead index (api/db/suggest.py)
+    # instead of fetching the whole tags table per query
+    await tag_suggester.ensure_loaded()
+    choices = tag_suggester.tag_names()
 
     # 2. Find the top 5 closest matches to the user's query
     # This handles "pythn" -> "python"
     matches = process.extract(
-        req.query, 
+        query, 
         choices.keys(), 
         processor=utils.default_process, 
         limit=5, 
         score_cutoff=60
     )
 
-    matched_tag_ids = [choices[name] for name, score, idx in matches]
+    return [choices[name] for name, score, idx in matches]
+
 
-    # 3. Filter your query using the IDs
+async def _tag_matches(session: AsyncSession, query: str) -> List[Content]:
+    matched_tag_ids = await _matched_tag_ids(query)
+    if not matched_tag_ids:
+        return []
+
+    # 3. Filter your query using the IDs; grouping removes duplicate contents
+    # if multiple tags match, ordered by their best matching tag priority
     q = (
-        session.query(Content)
-        .join(ContentTag)
-        .filter(ContentTag.tag_id.in_(matched_tag_ids))
-        .order_by(ContentTag.priority.desc())
-        .distinct(Content.id)      # remove duplicate contents if multiple matching rows
-        .options(joinedload(Content.tag_links).joinedload(ContentTag.tag))  # avoid N+1 when accessing tags
-        .limit(100)
+        select(Content)
+        .join(ContentTag, ContentTag.content_id == Content.id)
+        .where(ContentTag.tag_id.in_(matched_tag_ids))
+        .group_by(Content.id)
+        .order_by(func.max(ContentTag.priority).desc())
+        .limit(SEARCH_LIMIT)
     )
+    return list((await session.execute(q)).scalars().all())
+
+
+def _fuse(*rankings: List[int]) -> List[int]:
+    """Reciprocal rank fusion of content id rankings."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, content_id in enumerate(ranking):
+            scores[content_id] = scores.get(content_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+async def _nearest_ids(query: str) -> List[int]:
+    # The ANN scan is numpy work on the memory-mapped index, keep it off the event loop
+    nearest = await asyncio.to_thread(vector_index.search, embed_text(query), SEARCH_LIMIT)
+    return [content_id for content_id, score in nearest if score >= SEMANTIC_MIN_SCORE]
+
+
+@router.post("/search")
+async def search(req: SearchRequest, session: AsyncSession = Depends(get_async_db)):
+    by_tag = await _tag_matches(session, req.query) if req.mode != "semantic" else []
+    if req.mode == "tags":
+        contents = by_tag
+    else:
+        ranking = _fuse([content.id for content in by_tag], await _nearest_ids(req.query))
+        ranking = ranking[:SEARCH_LIMIT]
+        loaded = {content.id: content for content in by_tag}
+        missing = [content_id for content_id in ranking if content_id not in loaded]
+        if missing:
+            # Contents deleted since they were indexed are simply not found here
+            for content in (await session.execute(select(Content).where(Content.id.in_(missing)))).scalars():
+                loaded[content.id] = content
+        contents = [loaded[content_id] for content_id in ranking if content_id in loaded]
 
     results = []
-    for content in q.all():
+    for content in contents:
         results.append(SearchResult(
             title=getattr(content, "title", None) or content.url,
             url=content.url,
@@ -107,65 +205,186 @@ async def search(req: SearchRequest, session: Session = Depends(get_db)):
     return results
 
 
-@router.post("/crawl-results")
-async def crawl_results(req: CrawlResult, db: Session = Depends(get_db)) -> bool:
-    if req.job_id and req.content:
-        url = loop.crawler_running_jobs[req.job_id]
-
-        link = db.query(Links).filter(Links.url == url).first()
-        link.analysed_on = datetime.date.today()
-        db.commit()
+def _facets_out(total, tags, truncated=False) -> FacetsOut:
+    return FacetsOut(
+        total=FacetCountOut(contents=total[0], legal=total[1], illegal=total[2]),
+        tags=[TagFacetOut(tag=name, contents=row[0], legal=row[1], illegal=row[2]) for name, row in tags],
+        truncated=truncated,
+    )
 
-        loop.crawler_running_jobs.pop(req.job_id)
 
-        status = loop.start_analysejob(req.content, url)
-
-    if status:
-        return True
-    else:
-        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="crawl-results not implemented yet")
+@router.post("/search/facets", response_model=FacetsOut)
+async def search_facets(req: FacetRequest, session: AsyncSession = Depends(get_async_db)):
+    """Legality counts and the most frequent tags of the contents a /search query matches.
 
+    Without a query the counts cover all contents and come from the maintained facet_counts
+    table. A query's result set is counted over at most FACET_SCAN_LIMIT of its contents
+    (the tag match is not truncated to the /search page size), so requests take bounded time.
+    """
+    if not req.query.strip():
+        return _facets_out(*await top_facets(session, req.limit))
+
+    content_ids = await _nearest_ids(req.query) if req.mode != "tags" else []
+    if req.mode != "semantic":
+        tag_ids = await _matched_tag_ids(req.query)
+        if tag_ids:
+            content_ids += (await session.execute(
+                select(ContentTag.content_id).where(ContentTag.tag_id.in_(tag_ids))
+                .distinct().limit(FACET_SCAN_LIMIT + 1)
+            )).scalars().all()
+        content_ids = list(dict.fromkeys(content_ids))
+    truncated = len(content_ids) > FACET_SCAN_LIMIT
+    total, tags = await count_facets(session, content_ids[:FACET_SCAN_LIMIT], req.limit)
+    return _facets_out(total, tags, truncated)
+
+
+@router.post("/search/facets/reconcile", dependencies=[Depends(require_api_key)])
+async def reconcile_search_facets(session: AsyncSession = Depends(get_async_db)):
+    """Recount the maintained facet counts now instead of waiting for the periodic job (needs the API key)."""
+    started = time.perf_counter()
+    fixed = await reconcile_facet_counts(session)
+    return {"fixed": fixed, "seconds": round(time.perf_counter() - started, 3)}
 
 
-@router.post("/analyze-results")
-async def analyse_results(req: AnalyseResult, db: Session = Depends(get_db)) -> bool:
+@router.post("/crawl-results")
+async def crawl_results(req: CrawlResult, request: Request, db: AsyncSession = Depends(get_async_db)) -> bool:
+    tracer.merge(req.trace_id, {**(req.timings or {}), "crawl_reported": time.time()})
+    # Jobs that already timed out in the loop are unknown; the URL the crawler echoes is only
+    # trusted from an authenticated crawler, anyone else could replace any link's content
+    url = loop.crawler_running_jobs.pop(req.job_id, None)
+    if url is None and callback_authenticated(request.headers, await request.body()):
+        url = req.url
+    if url is None:
+        tracer.finish(req.trace_id)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown crawl job")
+    loop.crawlers.finished(req.job_id)
+    # A report shows the crawler keeps up, even when the site could not be fetched: dead onion
+    # hosts are normal and must not shrink the crawl limit. Crawler failures count as limiter
+    # errors where they show, in dispatch errors and job timeouts (see continous_loop.py).
+    loop.crawl_limiter.finish(req.job_id, ok=True)
+
+    link = (await db.execute(select(Links).where(Links.url == url).limit(1))).scalar_one_or_none()
+    if link is None:
+        tracer.finish(req.trace_id)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown crawl job")
+    link.analysed_on = datetime.date.today()
+    if req.etag or req.last_modified or not (req.error or req.not_modified):
+        link.etag = req.etag
+        link.last_modified = req.last_modified
+    if req.content_hash:
+        link.content_hash = req.content_hash
+    await db.commit()
+
+    if req.not_modified or req.unchanged:
+        # Stored analysis is still valid
+        loop.record_unchanged(req.not_modified, req.bytes_saved)
+        tracer.finish(req.trace_id)
+        return True
 
-    if not req.tags:
-        required_tags = []
+    if req.analysis_job_id:
+        loop.register_analysis(req.analysis_job_id, url)
+    elif req.content:
+        # Dispatched by the loop as soon as the analysis limiter has a free slot
+        loop.enqueue_analysis(req.content, url, req.trace_id)
     else:
+        tracer.finish(req.trace_id)
+    return True
 
-        tag_names = set(req.tags)
-        existing_tags = db.query(Tag).filter(Tag.name.in_(tag_names)).all()
 
-        existing_names = {tag.name for tag in existing_tags}
-        missing_names = tag_names - existing_names
 
-        new_tags = [Tag(name=name) for name in missing_names]
+async def _index_content(content_id: int, embedding) -> None:
+    """Add a stored analysis to the vector index; a failure only costs semantic recall until a reindex.
 
-        if new_tags:
-            db.add_all(new_tags)
+    Runs in a thread: appending waits for the index lock, which a search holds for its whole scan.
+    """
+    try:
+        await asyncio.to_thread(vector_index.add, content_id, embedding)
+        if vector_index.needs_training:
+            asyncio.get_running_loop().run_in_executor(None, train_if_needed)
+    except Exception as e:
+        print(f"Error indexing content {content_id}: {e}")
 
-        required_tags = existing_tags + new_tags
 
+def callback_authenticated(headers, body: bytes) -> bool:
+    """Whether a result callback comes from the analyzer: signed with SHARED_SECRET, or carrying the API key."""
+    if SHARED_SECRET:
+        expected = hmac.new(SHARED_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        if hmac.compare_digest(headers.get("X-Signature", ""), expected):
+            return True
+    scheme, _, token = headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.strip(), API_KEY)
 
-    real_url = loop.analyse_running_jobs[req.jobId]
-    loop.analyse_running_jobs.pop(req.jobId)
-    new_content = Content(
-        url = real_url,
-        title = req.title,
-        description = req.description,
-        tag_links = [ContentTag(tag=tag) for tag in required_tags]
-    )
 
-    db.add(new_content)
+@router.post("/analyze-results")
+async def analyse_results(req: AnalyseResult, request: Request, db: AsyncSession = Depends(get_async_db)) -> bool:
+    tracer.merge(req.traceId, {**(req.timings or {}), "analysis_reported": time.time()})
+
+    # Spelling variants ("Drugs", "drug") resolve to one canonical tag, see api/db/tags.py
+    keys = canonical_keys(req.tags)
+    tag_ids = await tag_resolver.resolve(db, req.tags or [])
+
+
+    # The analyzer echoes the crawled URL, so results arriving before the crawler's report still
+    # resolve; as that URL is the caller's word, it is only trusted from an authenticated callback.
+    # Others are refused until the job is known, and the analyzer's outbox retries them.
+    trusted = bool(req.sourceUrl) and callback_authenticated(request.headers, await request.body())
+    tracked_url = loop.finish_analysis(req.jobId, accepted_early=trusted)
+    real_url = tracked_url or (req.sourceUrl if trusted else None)
+    if real_url is None:
+        tracer.finish(req.traceId)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown analysis job")
+    existing = (await db.execute(
+        select(Content).where(Content.url == real_url).options(selectinload(Content.tag_links))
+    )).scalar_one_or_none()
+    embedding = quantize(embed_content(req.title, req.description, keys))
+    # Facet count changes, committed with the content (see api/db/facets.py)
+    facet_counts = {}
+    total = total_key()
+    if existing is None:
+        existing = Content(
+            url = real_url,
+            title = req.title,
+            description = req.description,
+            legality = req.legality,
+            embedding = embedding.tobytes(),
+            tag_links = [ContentTag(tag_id=tag_id) for tag_id in tag_ids]
+        )
+        db.add(existing)
+        uses = [(tag_id, key, 1) for tag_id, key in zip(tag_ids, keys)]
+    else:
+        # Re-analysis of an archived page: replace the previous result, keeping unchanged tag links
+        current = {link.tag_id: link for link in existing.tag_links}
+        uses = [(tag_id, key, 1) for tag_id, key in zip(tag_ids, keys) if tag_id not in current]
+        uses += [(tag_id, "", -1) for tag_id in current.keys() - set(tag_ids)]
+        count_content(facet_counts, current.keys(), existing.legality, -1, total)
+        existing.title = req.title
+        existing.description = req.description
+        existing.legality = req.legality
+        existing.embedding = embedding.tobytes()
+        existing.tag_links = [
+            current[tag_id] if tag_id in current else ContentTag(tag_id=tag_id) for tag_id in tag_ids
+        ]
+
+    count_content(facet_counts, tag_ids, req.legality, 1, total)
 
     try:
-        db.commit()
-        return True
+        await apply_facet_counts_async(db, facet_counts)
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error saving content: {e}")
-        return False
+        # Track the job again and fail the callback, so the analyzer's outbox delivers it again
+        loop.restore_analysis(req.jobId, tracked_url)
+        tracer.finish(req.traceId)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Could not store the analysis")
+
+    tracer.mark(req.traceId, "committed")
+    try:
+        tag_suggester.record_uses(uses)
+        await _index_content(existing.id, embedding)
+    finally:
+        tracer.finish(req.traceId)
+    return True
 
 
 
@@ -183,8 +402,11 @@ async def stop_loop():
 
 @router.get("/loop-status")
 async def loop_status():
-    return loop.active
-
-
+    """Whether the loop runs, plus the adaptive in-flight limits and throughput per stage."""
+    return loop.status()
 
 
+@router.get("/pipeline-latency")
+async def pipeline_latency(window: Optional[float] = Query(None, gt=0, description="Seconds to look back (default TRACE_WINDOW_SECONDS)")):
+    """p50/p95/p99 in seconds per pipeline stage of links traced within the window."""
+    return tracer.percentiles(window)
@@ -0,0 +1,101 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status
+from pydantic import BaseModel, Field
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from api.db.database import get_db
+from api.db.maintenance import reconcile_facets
+from api.db.models import Tag, TagAlias
+from api.db.suggest import TAG_SUGGEST_LIMIT, tag_suggester
+from api.db.tags import MAX_TAG_LENGTH, display_name, merge_duplicate_tags, normalize_tag, tag_resolver
+
+router = APIRouter()
+
+
+class TagSuggestion(BaseModel):
+	tag: str
+	uses: int
+
+
+@router.get("/suggest", response_model=List[TagSuggestion])
+async def suggest(
+	q: str = Query(..., min_length=1, max_length=MAX_TAG_LENGTH, description="What the user typed so far"),
+	limit: int = Query(10, ge=1, le=TAG_SUGGEST_LIMIT),
+):
+	"""Typeahead: tags starting with `q` (ignoring case and separators), most used first."""
+	await tag_suggester.ensure_loaded()
+	return [TagSuggestion(tag=name, uses=uses) for name, uses in tag_suggester.suggest(q, limit)]
+
+
+class TagMerge(BaseModel):
+	dry_run: bool = False
+
+
+class TagMergeOut(BaseModel):
+	tags_before: int
+	tags_after: int
+	content_tags_before: int
+	content_tags_after: Optional[int] = None
+	keys_merged: int
+	tags_merged: int
+	aliases_written: int
+	tags_renamed: int
+	dry_run: bool
+	seconds: float
+
+
+@router.post("/merge-duplicates", response_model=TagMergeOut)
+def merge_duplicates(payload: TagMerge, background: BackgroundTasks, db: Session = Depends(get_db)):
+	"""Merge tags whose names only differ in case, separators or plural into one canonical tag each.
+
+	Reports tag and content_tags cardinality before and after; use `dry_run` to only see what
+	would be merged (content_tags_after is then not computed). Facet counts of the merged tags
+	are recounted in the background after the response.
+	"""
+	counts = merge_duplicate_tags(db, dry_run=payload.dry_run)
+	if not payload.dry_run:
+		tag_suggester.invalidate()
+		background.add_task(reconcile_facets)
+	return TagMergeOut(**counts, dry_run=payload.dry_run)
+
+
+class TagAliasIn(BaseModel):
+	alias: str = Field(..., max_length=MAX_TAG_LENGTH, description="Spelling to map, e.g. 'btc'")
+	tag: str = Field(..., max_length=MAX_TAG_LENGTH, description="Tag it stands for, e.g. 'bitcoin'")
+
+
+class TagAliasOut(BaseModel):
+	alias: str
+	tag_id: int
+	tag: str
+
+
+@router.put("/aliases", response_model=TagAliasOut)
+def set_alias(payload: TagAliasIn, db: Session = Depends(get_db)):
+	"""Map a spelling (and all its variants) to a tag, e.g. a synonym; the tag is created if needed.
+
+	Applies to analyses stored from now on; run POST /tags/merge-duplicates to fold tags already
+	stored under the alias into the tag.
+	"""
+	alias, target = normalize_tag(payload.alias), normalize_tag(payload.tag)
+	if alias is None or target is None:
+		raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Empty tag after normalization")
+
+	tag = db.execute(
+		select(Tag).join(TagAlias, TagAlias.tag_id == Tag.id).where(TagAlias.alias == target)
+	).scalar_one_or_none()
+	if tag is None:
+		tag = db.execute(
+			select(Tag).where(Tag.name.in_([target, display_name(payload.tag)]))
+		).scalars().first()
+	if tag is None:
+		tag = Tag(name=display_name(payload.tag))
+		db.add(tag)
+		db.flush()
+	db.merge(TagAlias(alias=target, tag_id=tag.id))
+	db.merge(TagAlias(alias=alias, tag_id=tag.id))
+	db.commit()
+	tag_resolver.clear()
+	return TagAliasOut(alias=alias, tag_id=tag.id, tag=tag.name)
@@ -0,0 +1,124 @@
+"""
+Timing benchmark for link deletion and orphan-tag garbage collection.
+
+Seeds a synthetic dataset (links, contents sharing their URLs, a Zipf-ish tag
+distribution) and compares
+
+- per-link: the previous DELETE /links/{id} behaviour (ORM delete of each
+  Content, then a full orphan-tag anti-join scan) on a sample of links, and
+- bulk:     POST /links/bulk-delete by URL pattern over a share of the table,
+
+followed by one run of the batched orphan-tag GC.
+
+Usage:
+  python3 bench_bulk_delete.py [--links 50000] [--tags 5000] [--per-link-sample 200]
+
+DATABASE_URL defaults to a temporary SQLite file; point it at MySQL for production-like numbers.
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{DB_FILE}")
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from sqlalchemy import func, insert, select  # noqa: E402
+
+from api.db import database  # noqa: E402  (creates the schema)
+from api.db.maintenance import collect_orphan_tags  # noqa: E402
+from api.db.models import Content, ContentTag, Links, Tag  # noqa: E402
+from api.routes.links import router as links_router  # noqa: E402
+from api.routes.routes import API_KEY  # noqa: E402
+
+
+def seed(links: int, tags: int) -> None:
+    rng = random.Random(5)
+    today = datetime.date.today()
+    with database.SessionLocal() as db:
+        db.execute(insert(Tag), [{"name": f"tag-{i}"} for i in range(tags)])
+        # Every fourth link is dead: crawled long ago, no content
+        db.execute(insert(Links), [
+            {"url": f"http://site{i}.onion/{'forum' if i % 2 else 'shop'}",
+             "analysed_on": today - datetime.timedelta(days=60 if i % 4 == 0 else 1)}
+            for i in range(links)
+        ])
+        urls = [f"http://site{i}.onion/{'forum' if i % 2 else 'shop'}" for i in range(links) if i % 4]
+        db.execute(insert(Content), [{"url": url, "title": url, "description": "synthetic"} for url in urls])
+        content_ids = db.execute(select(Content.id)).scalars().all()
+        weights = [1 / (rank + 1) for rank in range(tags)]
+        rows = set()
+        for content_id in content_ids:
+            for tag_id in rng.choices(range(1, tags + 1), weights=weights, k=3):
+                rows.add((content_id, tag_id))
+        db.execute(insert(ContentTag), [{"content_id": c, "tag_id": t, "priority": 1} for c, t in rows])
+        db.commit()
+
+
+def legacy_delete(link_id: int) -> None:
+    with database.SessionLocal() as db:
+        link = db.query(Links).filter(Links.id == link_id).first()
+        for content in db.query(Content).filter(Content.url == link.url).all():
+            db.delete(content)
+        for tag in db.query(Tag).filter(~Tag.content_links.any()).all():
+            db.delete(tag)
+        db.delete(link)
+        db.commit()
+
+
+def count(model) -> int:
+    with database.SessionLocal() as db:
+        return db.execute(select(func.count()).select_from(model)).scalar_one()
+
+
+async def main_async(args):
+    app = FastAPI()
+    app.include_router(links_router, prefix="/links")
+
+    sample = list(range(2, 2 + 4 * args.per_link_sample, 4))
+    start = time.perf_counter()
+    for link_id in sample:
+        legacy_delete(link_id)
+    elapsed = time.perf_counter() - start
+    print(f"per-link delete  {len(sample) / elapsed:10.1f} links/s  ({len(sample)} links)")
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                 headers={"Authorization": f"Bearer {API_KEY}"}, timeout=None) as client:
+        before = count(Links)
+        start = time.perf_counter()
+        resp = await client.post("/links/bulk-delete", json={"url_pattern": "%/forum"})
+        elapsed = time.perf_counter() - start
+        resp.raise_for_status()
+        deleted = before - count(Links)
+        print(f"bulk by pattern  {deleted / elapsed:10.1f} links/s  {resp.json()}")
+
+        resp = await client.post("/links/bulk-delete", json={"dead_for_days": 30})
+        resp.raise_for_status()
+        print(f"bulk dead links  {resp.json()}")
+
+    async with database.AsyncSessionLocal() as session:
+        start = time.perf_counter()
+        removed = await collect_orphan_tags(session)
+        print(f"orphan-tag GC    removed {removed} tags in {time.perf_counter() - start:.3f}s")
+    await database.async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=50_000)
+    parser.add_argument("--tags", type=int, default=5000)
+    parser.add_argument("--per-link-sample", type=int, default=200)
+    args = parser.parse_args()
+
+    seed(args.links, args.tags)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Concurrency load test for the manager's async DB routes.
+
+Seeds a SQLite database with synthetic contents and tags, then fires concurrent
+POST /search requests through an in-process ASGI client against
+
+- legacy: the previous handler style (async route running a sync Session query
+  directly on the event loop), and
+- async:  the current handler on the async engine (api.db.database.async_engine).
+
+While the search load runs, a cheap probe endpoint is polled to show how much
+the event loop is stalled by blocking queries.
+
+Set DATABASE_URL to the MySQL instance (mysql+pymysql://...) for representative
+numbers: on a local SQLite file queries never wait on the network, so the
+thread hop of the async driver dominates and the legacy handler looks faster.
+
+Usage:
+  python3 bench_db_concurrency.py [--requests 400] [--concurrency 50] [--contents 20000]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{DB_FILE}")
+
+import httpx  # noqa: E402
+from fastapi import Depends, FastAPI  # noqa: E402
+from rapidfuzz import process, utils  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import Session, sessionmaker  # noqa: E402
+
+from api.db import database  # noqa: E402  (creates the schema)
+from api.db.models import Content, ContentTag, Tag  # noqa: E402
+from api.routes.routes import router, SearchRequest  # noqa: E402
+
+WORDS = "market forum vendor escrow bitcoin monero wiki links mirror hosting email chat news blog".split()
+
+
+def seed(contents: int, tags: int) -> None:
+    rng = random.Random(7)
+    with database.SessionLocal() as db:
+        tag_rows = [Tag(name=f"{rng.choice(WORDS)}-{i}") for i in range(tags)]
+        db.add_all(tag_rows)
+        db.flush()
+        for i in range(contents):
+            chosen = rng.sample(tag_rows, 3)
+            db.add(Content(
+                url=f"http://{i}.onion", title=f"Page {i}", description="synthetic",
+                tag_links=[ContentTag(tag=t, priority=rng.randint(0, 5)) for t in chosen],
+            ))
+        db.commit()
+
+
+# The legacy handler gets the old oversized pool: with a right-sized pool, blocking
+# checkouts on the event loop deadlock as soon as concurrency exceeds the pool.
+legacy_engine = create_engine(database.DATABASE_URL, pool_size=200, max_overflow=250)
+LegacySession = sessionmaker(autocommit=False, autoflush=False, bind=legacy_engine)
+
+
+def get_legacy_db():
+    db = LegacySession()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(router)
+
+    @app.post("/legacy-search")
+    async def legacy_search(req: SearchRequest, session: Session = Depends(get_legacy_db)):
+        tags_from_db = session.query(Tag.id, Tag.name).all()
+        choices = {t.name: t.id for t in tags_from_db}
+        matches = process.extract(req.query, choices.keys(), processor=utils.default_process,
+                                  limit=5, score_cutoff=60)
+        ids = [choices[name] for name, score, idx in matches]
+        rows = (session.query(Content).join(ContentTag).filter(ContentTag.tag_id.in_(ids))
+                .order_by(ContentTag.priority.desc()).limit(100).all())
+        return [{"title": c.title, "url": c.url, "description": c.description} for c in rows]
+
+    @app.get("/probe")
+    async def probe():
+        return True
+
+    return app
+
+
+async def run(client: httpx.AsyncClient, path: str, total: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, probe_latencies = [], []
+    done = asyncio.Event()
+
+    async def one(i: int):
+        async with semaphore:
+            t0 = time.perf_counter()
+            resp = await client.post(path, json={"query": WORDS[i % len(WORDS)]})
+            resp.raise_for_status()
+            latencies.append(time.perf_counter() - t0)
+
+    async def prober():
+        while not done.is_set():
+            t0 = time.perf_counter()
+            await client.get("/probe")
+            probe_latencies.append(time.perf_counter() - t0)
+            await asyncio.sleep(0.01)
+
+    probe_task = asyncio.create_task(prober())
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await probe_task
+
+    latencies.sort()
+    probe_latencies.sort()
+    print(f"{path:<16} {total / elapsed:8.1f} req/s  p50 {statistics.median(latencies) * 1000:7.1f} ms"
+          f"  p95 {latencies[int(len(latencies) * 0.95)] * 1000:7.1f} ms"
+          f"  probe p95 {probe_latencies[int(len(probe_latencies) * 0.95)] * 1000:7.1f} ms")
+
+
+async def main_async(args):
+    transport = httpx.ASGITransport(app=build_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await run(client, "/legacy-search", args.requests, args.concurrency)
+        await run(client, "/search", args.requests, args.concurrency)
+    await database.async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--contents", type=int, default=20000)
+    parser.add_argument("--tags", type=int, default=2000)
+    args = parser.parse_args()
+
+    seed(args.contents, args.tags)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
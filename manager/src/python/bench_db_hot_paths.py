@@ -0,0 +1,217 @@
+"""
+Latency, query count and query plan benchmark of the manager's database hot paths.
+
+Fills the database with synthetic_data.py (Zipfian tag popularity) and runs
+each path --rounds times through the real handlers:
+
+- search (head tag)       POST /search for the most popular tag
+- search (tail tag)       POST /search for a rarely used tag
+- get_crawl_links         the loop's next batch of links, with a batch in flight
+- analyze_results (new)   POST /analyze-results storing a new content with tags
+- analyze_results (again) POST /analyze-results replacing an existing analysis
+- delete_link             DELETE /links/{id} of an analysed link
+
+For every path it prints p50/p95 latency, the SQL statements per call and the
+query plan (EXPLAIN QUERY PLAN on SQLite, EXPLAIN on MySQL) of each distinct
+statement, marking full table scans with '!'. --output writes all of it as
+JSON, so schema and index changes can be compared with numbers.
+
+--scale 1 is the production sizing (1M links, 500k contents, 50k tags);
+the default 0.1 keeps a local SQLite run at well under a minute of seeding.
+
+Usage:
+  python3 bench_db_hot_paths.py [--scale 0.1] [--rounds 20] [--output plans.json]
+
+DATABASE_URL defaults to a temporary SQLite file; point it at MySQL for production-like
+numbers (--no-seed reuses data generated by an earlier run).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{DB_FILE}")
+os.environ.setdefault("TAG_GC_INTERVAL", "0")
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from sqlalchemy import event, select  # noqa: E402
+
+import synthetic_data  # noqa: E402
+from api.db import database  # noqa: E402  (creates the schema)
+from api.db.models import Content, Links, Tag  # noqa: E402
+from api.routes.links import router as links_router  # noqa: E402
+from api.routes.routes import API_KEY, router  # noqa: E402
+from continous_loop import loop  # noqa: E402
+
+
+class StatementRecorder:
+    """Collects (statement, parameters) of both engines while `active`."""
+
+    def __init__(self):
+        self.active = False
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active:
+            # executemany: the first parameter set is enough for EXPLAIN (insertmanyvalues
+            # batches already pass a single flattened set)
+            if executemany and isinstance(parameters, list):
+                parameters = parameters[0] if parameters else ()
+            self.statements.append((statement, parameters))
+
+
+recorder = StatementRecorder()
+event.listen(database.engine, "before_cursor_execute", recorder)
+event.listen(database.async_engine.sync_engine, "before_cursor_execute", recorder)
+
+
+def explain(statement, parameters):
+    """Plan lines of a statement, full table scans prefixed with '!'."""
+    sqlite = database.engine.dialect.name == "sqlite"
+    with database.engine.connect() as conn:
+        rows = conn.exec_driver_sql(("EXPLAIN QUERY PLAN " if sqlite else "EXPLAIN ") + statement,
+                                    parameters or ()).mappings().all()
+    lines = []
+    for row in rows:
+        if sqlite:
+            detail = row["detail"]
+            scan = detail.startswith("SCAN ") and "INDEX" not in detail
+        else:
+            detail = (f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']} "
+                      f"{row.get('Extra') or ''}").strip()
+            scan = row["type"] == "ALL"
+        lines.append(("! " if scan else "  ") + detail)
+    return lines
+
+
+async def measure(name, rounds, call):
+    timings, counts, plans = [], [], {}
+    await call(-1)  # warm-up
+    for i in range(rounds):
+        recorder.statements = []
+        recorder.active = True
+        start = time.perf_counter()
+        await call(i)
+        timings.append(time.perf_counter() - start)
+        recorder.active = False
+        counts.append(len(recorder.statements))
+        for statement, parameters in recorder.statements:
+            if statement not in plans and not statement.lstrip().upper().startswith(("INSERT", "BEGIN", "COMMIT")):
+                plans[statement] = explain(statement, parameters)
+    timings.sort()
+    result = {
+        "p50_ms": round(statistics.median(timings) * 1000, 2),
+        "p95_ms": round(timings[max(0, int(len(timings) * 0.95) - 1)] * 1000, 2),
+        "queries": {"min": min(counts), "max": max(counts)},
+        "plans": [{"statement": " ".join(s.split()), "plan": p} for s, p in plans.items()],
+    }
+    queries = f"{min(counts)}" if min(counts) == max(counts) else f"{min(counts)}-{max(counts)}"
+    print(f"{name:<26}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{queries:>9}")
+    return result
+
+
+def pick(rows, count, rng):
+    return rng.sample(rows, min(count, len(rows)))
+
+
+async def main_async(args):
+    rng = random.Random(5)
+    app = FastAPI()
+    app.include_router(router)
+    app.include_router(links_router, prefix="/links")
+    needed = args.rounds + 1
+
+    with database.SessionLocal() as db:
+        tags = db.execute(select(Tag.name).order_by(Tag.id)).scalars().all()
+        fresh = db.execute(select(Links.url).where(Links.analysed_on == None).limit(needed * 50)).scalars().all()  # noqa: E711
+        analysed = db.execute(select(Content.url).limit(needed * 50)).scalars().all()
+        deletable = db.execute(
+            select(Links.id).join(Content, Content.url == Links.url).limit(needed * 50)
+        ).scalars().all()
+    sampler = synthetic_data.ZipfSampler(len(tags), args.zipf_s, rng)
+    new_urls = pick(fresh, needed, rng)
+    analysed_urls = pick(analysed, needed, rng)
+    delete_ids = pick(deletable, needed, rng)
+    head_tag, tail_tag = tags[0], tags[-1]
+
+    def analysis(url, i):
+        names = sorted({tags[sampler.sample()] for _ in range(4)} | {f"bench-new-{i}"})
+        return {"jobId": None, "title": f"Bench {i}", "description": "synthetic", "url": None,
+                "sourceUrl": url, "tags": names}
+
+    results = {}
+    print(f"{'path':<26}{'p50 ms':>10}{'p95 ms':>10}{'queries':>9}")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def search(query):
+            resp = await client.post("/search", json={"query": query})
+            resp.raise_for_status()
+
+        async def crawl_links(_):
+            loop.crawler_running_jobs = {f"job-{n}": url for n, url in enumerate(fresh[:args.batch])}
+            await loop.get_crawl_links(args.batch)
+
+        async def analyze(urls, i):
+            # No analysis job behind these; the API key lets the manager trust sourceUrl
+            resp = await client.post("/analyze-results", json=analysis(urls[i], i),
+                                     headers={"Authorization": f"Bearer {API_KEY}"})
+            resp.raise_for_status()
+
+        async def delete(i):
+            resp = await client.delete(f"/links/{delete_ids[i]}")
+            resp.raise_for_status()
+
+        results["search (head tag)"] = await measure("search (head tag)", args.rounds, lambda _: search(head_tag))
+        results["search (tail tag)"] = await measure("search (tail tag)", args.rounds, lambda _: search(tail_tag))
+        results["get_crawl_links"] = await measure("get_crawl_links", args.rounds, crawl_links)
+        results["analyze_results (new)"] = await measure("analyze_results (new)", args.rounds,
+                                                         lambda i: analyze(new_urls, i))
+        results["analyze_results (again)"] = await measure("analyze_results (again)", args.rounds,
+                                                           lambda i: analyze(analysed_urls, i))
+        results["delete_link"] = await measure("delete_link", args.rounds, delete)
+    loop.crawler_running_jobs = {}
+    await database.async_engine.dispose()
+
+    for name, result in results.items():
+        print(f"\n== {name}")
+        for entry in result["plans"]:
+            print(f"  {entry['statement'][:160]}")
+            for line in entry["plan"]:
+                print(f"    {line}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=0.1, help="fraction of 1M links / 500k contents / 50k tags")
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=32, help="links per get_crawl_links call and in flight")
+    parser.add_argument("--no-seed", action="store_true", help="use the data already in DATABASE_URL")
+    parser.add_argument("--output", help="write latencies, query counts and plans as JSON")
+    args = parser.parse_args()
+
+    sizes = {"links": int(1_000_000 * args.scale), "contents": int(500_000 * args.scale),
+             "tags": max(len(synthetic_data.WORDS), int(50_000 * args.scale))}
+    if not args.no_seed:
+        started = time.perf_counter()
+        written = synthetic_data.generate(database.engine, sizes["links"], sizes["contents"], sizes["tags"],
+                                          args.zipf_s)
+        print(f"Seeded {written} in {time.perf_counter() - started:.1f}s "
+              f"({database.engine.dialect.name})\n")
+
+    results = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"database": database.engine.dialect.name, "sizes": None if args.no_seed else sizes,
+                       "paths": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
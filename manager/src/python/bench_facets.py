@@ -0,0 +1,128 @@
+"""
+Latency of facet counts (POST /search/facets) against GROUP BY over content_tags.
+
+Fills the database with synthetic_data.py (Zipfian tag popularity, legality
+verdicts), computes facet_counts with a full reconcile and measures:
+
+- reconcile                  recounting facet_counts from scratch (the periodic job)
+- GROUP BY, all contents     top tags and legality counted per request (the naive way)
+- facets, all contents       the same answer read from facet_counts
+- facets, head tag query     result set of the most popular tags (truncated at FACET_SCAN_LIMIT)
+- facets, tail tag query     result set of rarely used tags
+- facet count update         the upsert /analyze-results adds to its transaction
+
+Usage:
+  python3 bench_facets.py [--contents 200000] [--tags 50000] [--rounds 50]
+
+DATABASE_URL defaults to a temporary SQLite file.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{DB_FILE}")
+os.environ.setdefault("TAG_GC_INTERVAL", "0")
+os.environ.setdefault("FACET_RECONCILE_INTERVAL", "0")
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from sqlalchemy import func, select  # noqa: E402
+
+import synthetic_data  # noqa: E402
+from api.db import database  # noqa: E402  (creates the schema)
+from api.db.facets import FACET_SCAN_LIMIT, apply_facet_counts_async, count_content  # noqa: E402
+from api.db.maintenance import reconcile_facet_counts  # noqa: E402
+from api.db.models import Content, ContentTag, Tag  # noqa: E402
+from api.routes.routes import router  # noqa: E402
+
+
+def summary(name, timings):
+    timings = sorted(timings)
+    p50 = statistics.median(timings) * 1000
+    p99 = timings[max(0, int(len(timings) * 0.99) - 1)] * 1000
+    print(f"{name:<30}{p50:>10.2f}{p99:>10.2f}{len(timings):>8}")
+
+
+async def group_by_facets(limit):
+    """Top tags and legality counts of all contents, computed from the rows."""
+    async with database.AsyncSessionLocal() as session:
+        tags = (await session.execute(
+            select(ContentTag.tag_id, func.count().label("uses"))
+            .group_by(ContentTag.tag_id).order_by(func.count().desc()).limit(limit)
+        )).all()
+        legality = (await session.execute(select(Content.legality, func.count()).group_by(Content.legality))).all()
+    return tags, legality
+
+
+async def main_async(args):
+    rng = random.Random(9)
+    start = time.perf_counter()
+    async with database.AsyncSessionLocal() as session:
+        fixed = await reconcile_facet_counts(session)
+        names = [name for _, name in sorted((await session.execute(select(Tag.id, Tag.name))).all())]
+        tag_ids = (await session.execute(select(Tag.id))).scalars().all()
+    print(f"Reconcile wrote {fixed} facet rows in {time.perf_counter() - start:.2f}s\n")
+
+    print(f"{'':<30}{'p50 ms':>10}{'p99 ms':>10}{'calls':>8}")
+    timings = []
+    for _ in range(args.baseline_rounds):
+        start = time.perf_counter()
+        await group_by_facets(20)
+        timings.append(time.perf_counter() - start)
+    summary("GROUP BY, all contents", timings)
+
+    app = FastAPI()
+    app.include_router(router)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for name, queries in (
+            ("facets, all contents", [""] * args.rounds),
+            ("facets, head tag query", [names[rng.randrange(5)] for _ in range(args.rounds)]),
+            ("facets, tail tag query", [names[rng.randrange(len(names) // 2, len(names))] for _ in range(args.rounds)]),
+        ):
+            timings, truncated = [], 0
+            for query in queries:
+                start = time.perf_counter()
+                resp = await client.post("/search/facets", json={"query": query, "mode": "tags"})
+                timings.append(time.perf_counter() - start)
+                resp.raise_for_status()
+                truncated += resp.json()["truncated"]
+            summary(name, timings)
+            if truncated:
+                print(f"  {truncated} of {len(queries)} result sets truncated at {FACET_SCAN_LIMIT} contents")
+
+    timings = []
+    for _ in range(args.rounds):
+        counts = {}
+        count_content(counts, rng.sample(tag_ids, 4), rng.choice([True, False]))
+        async with database.AsyncSessionLocal() as session:
+            start = time.perf_counter()
+            await apply_facet_counts_async(session, counts)
+            await session.commit()
+            timings.append(time.perf_counter() - start)
+    summary("facet count update", timings)
+    await database.async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contents", type=int, default=200_000)
+    parser.add_argument("--tags", type=int, default=50_000)
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--baseline-rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    written = synthetic_data.generate(database.engine, args.contents, args.contents, args.tags, args.zipf_s)
+    print(f"Seeded {written} in {time.perf_counter() - started:.1f}s ({database.engine.dialect.name})")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Rows/sec benchmark for the bulk link import.
+
+Streams a synthetic onion list (with a share of duplicate and malformed lines)
+to POST /links/import through an in-process ASGI client and compares it with
+the per-URL POST /links/ path on a smaller sample.
+
+Usage:
+  python3 bench_link_import.py [--urls 200000] [--per-row-sample 2000] [--format text|ndjson|csv]
+
+DATABASE_URL defaults to a temporary SQLite file; point it at MySQL for production-like numbers.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{DB_FILE}")
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+
+from api.db import database  # noqa: E402  (creates the schema)
+from api.routes.links import router as links_router  # noqa: E402
+
+
+def onion(rng: random.Random) -> str:
+    return "http://" + base64.b32encode(rng.randbytes(35)).decode("ascii").lower()[:56] + ".onion"
+
+
+def make_lines(count: int, fmt: str, seed: int = 3):
+    rng = random.Random(seed)
+    seen = []
+    if fmt == "csv":
+        yield "url,source"
+    for i in range(count):
+        roll = rng.random()
+        if roll < 0.1 and seen:
+            url = rng.choice(seen).upper() + "/"  # duplicate after normalization
+        elif roll < 0.12:
+            url = "not a url"
+        else:
+            url = onion(rng)
+            if len(seen) < 10000:
+                seen.append(url)
+        if fmt == "ndjson":
+            yield json.dumps({"url": url})
+        elif fmt == "csv":
+            yield f"{url},bench"
+        else:
+            yield url
+
+
+async def body(lines, chunk_lines: int = 5000):
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= chunk_lines:
+            yield ("\n".join(buffer) + "\n").encode("utf-8")
+            buffer = []
+    if buffer:
+        yield "\n".join(buffer).encode("utf-8")
+
+
+async def main_async(args):
+    app = FastAPI()
+    app.include_router(links_router, prefix="/links")
+    content_type = {"text": "text/plain", "ndjson": "application/x-ndjson", "csv": "text/csv"}[args.format]
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                 timeout=None) as client:
+        start = time.perf_counter()
+        resp = await client.post("/links/import", content=body(make_lines(args.urls, args.format)),
+                                 headers={"Content-Type": content_type})
+        elapsed = time.perf_counter() - start
+        resp.raise_for_status()
+        print(f"bulk import  {args.urls / elapsed:10.0f} lines/s  {resp.json()}")
+
+        rng = random.Random(99)
+        start = time.perf_counter()
+        for _ in range(args.per_row_sample):
+            await client.post("/links/", json={"url": onion(rng)})
+        elapsed = time.perf_counter() - start
+        print(f"per-row POST {args.per_row_sample / elapsed:10.0f} rows/s  ({args.per_row_sample} rows)")
+    await database.async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--urls", type=int, default=200_000)
+    parser.add_argument("--per-row-sample", type=int, default=2000)
+    parser.add_argument("--format", choices=["text", "ndjson", "csv"], default="text")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Query count and latency benchmark for link status lookups.
+
+Seeds links, contents for most of them and a few tags per content, then
+resolves the status of --ids links
+
+- per-link: one GET /links/{id}/status per id (what the GUI did so far), and
+- batch:    a single POST /links/status with all ids,
+
+counting the SQL statements each variant sends to the database.
+
+Usage:
+  python3 bench_link_status.py [--links 20000] [--ids 1000] [--rounds 5]
+
+DATABASE_URL defaults to a temporary SQLite file; point it at MySQL for production-like numbers.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{DB_FILE}")
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from sqlalchemy import event, insert, select  # noqa: E402
+
+from api.db import database  # noqa: E402  (creates the schema)
+from api.db.models import Content, ContentTag, Links, Tag  # noqa: E402
+from api.routes.links import router as links_router  # noqa: E402
+
+statements = 0
+
+
+def _count(*_):
+    global statements
+    statements += 1
+
+
+event.listen(database.async_engine.sync_engine, "before_cursor_execute", _count)
+
+
+def seed(links: int, tags: int) -> None:
+    rng = random.Random(11)
+    with database.SessionLocal() as db:
+        db.execute(insert(Tag), [{"name": f"tag-{i}"} for i in range(tags)])
+        db.execute(insert(Links), [{"url": f"http://site{i}.onion"} for i in range(links)])
+        db.execute(insert(Content), [
+            {"url": f"http://site{i}.onion", "title": f"Site {i}"} for i in range(links) if i % 5
+        ])
+        content_ids = db.execute(select(Content.id)).scalars().all()
+        db.execute(insert(ContentTag), [
+            {"content_id": c, "tag_id": t, "priority": rng.randint(0, 5)}
+            for c in content_ids for t in rng.sample(range(1, tags + 1), 4)
+        ])
+        db.commit()
+
+
+async def measure(name: str, rounds: int, call):
+    global statements
+    timings, counts = [], []
+    for _ in range(rounds):
+        statements = 0
+        start = time.perf_counter()
+        await call()
+        timings.append(time.perf_counter() - start)
+        counts.append(statements)
+    print(f"{name:<9} {statistics.median(timings) * 1000:9.1f} ms/request-set  {counts[0]:6d} queries")
+
+
+async def main_async(args):
+    app = FastAPI()
+    app.include_router(links_router, prefix="/links")
+    ids = random.Random(1).sample(range(1, args.links + 1), args.ids)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def per_link():
+            for link_id in ids:
+                (await client.get(f"/links/{link_id}/status")).raise_for_status()
+
+        async def batch():
+            resp = await client.post("/links/status", json={"ids": ids})
+            resp.raise_for_status()
+            assert len(resp.json()["links"]) == len(ids)
+
+        await measure("per-link", args.rounds, per_link)
+        await measure("batch", args.rounds, batch)
+    await database.async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=20_000)
+    parser.add_argument("--tags", type=int, default=500)
+    parser.add_argument("--ids", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    seed(args.links, args.tags)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
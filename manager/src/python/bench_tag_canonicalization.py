@@ -0,0 +1,149 @@
+"""
+Tag cardinality and search latency before and after tag canonicalization.
+
+Fills the database with synthetic_data.py, then simulates the tag explosion of
+uncanonicalized analyzer output: the --explode most popular tags get spelling
+variants ("Market", "MARKET", "markets", ...) and their contents are spread
+over the variants. It reports tag and content_tags cardinality and POST /search
+p50/p95 for the popular tags, runs merge_duplicate_tags, and reports the same
+numbers again.
+
+Usage:
+  python3 bench_tag_canonicalization.py [--scale 0.05] [--explode 200] [--rounds 20] [--output tags.json]
+
+DATABASE_URL defaults to a temporary SQLite file; point it at MySQL for production-like
+numbers.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{DB_FILE}")
+os.environ.setdefault("TAG_GC_INTERVAL", "0")
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from sqlalchemy import func, insert, select, update  # noqa: E402
+
+import synthetic_data  # noqa: E402
+from api.db import database  # noqa: E402  (creates the schema)
+from api.db.models import ContentTag, Tag  # noqa: E402
+from api.db.tags import merge_duplicate_tags  # noqa: E402
+from api.routes.routes import router  # noqa: E402
+
+
+def variants(name):
+    """Spellings the analyzer produces for one tag."""
+    spellings = [name.title(), name.upper(), name.replace("-", "_"), " " + name + " "]
+    if name[-1].isalpha() and not name.endswith("s"):
+        plural = name + ("es" if name.endswith(("x", "sh", "ch")) else "s")
+        spellings += [plural, plural.title()]
+    return spellings
+
+
+def explode(engine, top):
+    """Give the `top` most used tags spelling variants, moving a share of their contents to each."""
+    with engine.begin() as conn:
+        popular = conn.execute(
+            select(Tag.id, Tag.name).join(ContentTag, ContentTag.tag_id == Tag.id)
+            .group_by(Tag.id, Tag.name).order_by(func.count().desc()).limit(top)
+        ).all()
+        taken = set(conn.execute(select(Tag.name)).scalars())
+        next_id = (conn.execute(select(func.max(Tag.id))).scalar() or 0) + 1
+        for tag_id, name in popular:
+            spellings = [v for v in dict.fromkeys(variants(name)) if v not in taken and len(v) <= 50]
+            taken.update(spellings)
+            rows = [{"id": next_id + n, "name": v} for n, v in enumerate(spellings)]
+            next_id += len(rows)
+            if not rows:
+                continue
+            conn.execute(insert(Tag), rows)
+            # Contents are spread evenly over the original and its variants
+            for n, row in enumerate(rows, start=1):
+                conn.execute(
+                    update(ContentTag)
+                    .where(ContentTag.tag_id == tag_id, ContentTag.content_id % (len(rows) + 1) == n)
+                    .values(tag_id=row["id"])
+                )
+    return [name for _, name in popular]
+
+
+def cardinality():
+    with database.SessionLocal() as db:
+        return {
+            "tags": db.execute(select(func.count()).select_from(Tag)).scalar(),
+            "content_tags": db.execute(select(func.count()).select_from(ContentTag)).scalar(),
+        }
+
+
+async def search_latency(queries, rounds):
+    app = FastAPI()
+    app.include_router(router)
+    timings, results = [], []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for i in range(rounds + 1):
+            query = queries[i % len(queries)]
+            start = time.perf_counter()
+            resp = await client.post("/search", json={"query": query})
+            elapsed = time.perf_counter() - start
+            resp.raise_for_status()
+            if i:  # the first call warms up
+                timings.append(elapsed)
+                results.append(len(resp.json()))
+    await database.async_engine.dispose()
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings) * 1000, 2),
+        "p95_ms": round(timings[max(0, int(len(timings) * 0.95) - 1)] * 1000, 2),
+        "mean_results": round(statistics.mean(results), 1),
+    }
+
+
+def report(name, numbers):
+    print(f"{name:<8}{numbers['tags']:>10}{numbers['content_tags']:>14}"
+          f"{numbers['p50_ms']:>10.2f}{numbers['p95_ms']:>10.2f}{numbers['mean_results']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=0.05, help="fraction of 1M links / 500k contents / 50k tags")
+    parser.add_argument("--explode", type=int, default=200, help="popular tags that get spelling variants")
+    parser.add_argument("--queries", type=int, default=20, help="popular tags searched for")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--output", help="write the numbers as JSON")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    written = synthetic_data.generate(
+        database.engine, int(1_000_000 * args.scale), int(500_000 * args.scale),
+        max(len(synthetic_data.WORDS), int(50_000 * args.scale)),
+    )
+    popular = explode(database.engine, args.explode)
+    print(f"Seeded {written} and variants of {len(popular)} tags in {time.perf_counter() - started:.1f}s "
+          f"({database.engine.dialect.name})\n")
+
+    queries = popular[:args.queries]
+    before = {**cardinality(), **asyncio.run(search_latency(queries, args.rounds))}
+    with database.SessionLocal() as db:
+        merged = merge_duplicate_tags(db)
+    after = {**cardinality(), **asyncio.run(search_latency(queries, args.rounds))}
+
+    print(f"{'':<8}{'tags':>10}{'content_tags':>14}{'p50 ms':>10}{'p95 ms':>10}{'results':>10}")
+    report("before", before)
+    report("after", after)
+    print(f"\nmerge_duplicate_tags: {merged}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"database": database.engine.dialect.name, "before": before, "after": after,
+                       "merge": merged}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Latency of tag typeahead (GET /tags/suggest) at production tag counts.
+
+Fills the database with synthetic_data.py (--tags tags, Zipfian usage), loads
+the suggestion index and measures, for prefixes of 1 to 4 characters taken from
+tag names weighted by usage (what users type):
+
+- load                    building the index from the database (once per refresh)
+- suggest (index)         TagSuggester.suggest in process
+- record_uses             the per-analysis index update of /analyze-results
+- GET /tags/suggest       the endpoint through the ASGI stack
+- tag fetch + rapidfuzz   what /search does per query, for comparison
+
+Usage:
+  python3 bench_tag_suggest.py [--tags 100000] [--contents 200000] [--rounds 2000]
+
+DATABASE_URL defaults to a temporary SQLite file.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{DB_FILE}")
+os.environ.setdefault("TAG_GC_INTERVAL", "0")
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from rapidfuzz import process, utils  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+
+import synthetic_data  # noqa: E402
+from api.db import database  # noqa: E402  (creates the schema)
+from api.db.models import Tag  # noqa: E402
+from api.db.suggest import tag_suggester  # noqa: E402
+from api.routes.tags import router  # noqa: E402
+
+
+def summary(name, timings):
+    timings = sorted(timings)
+    p50 = statistics.median(timings) * 1e6
+    p99 = timings[max(0, int(len(timings) * 0.99) - 1)] * 1e6
+    print(f"{name:<26}{p50:>12.1f}{p99:>12.1f}{len(timings):>8}")
+
+
+def timed(call, args):
+    timings = []
+    for arg in args:
+        start = time.perf_counter()
+        call(arg)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def main_async(args):
+    rng = random.Random(3)
+    start = time.perf_counter()
+    await tag_suggester.ensure_loaded()
+    load = time.perf_counter() - start
+    async with database.AsyncSessionLocal() as session:
+        tags = (await session.execute(select(Tag.id, Tag.name))).all()
+    print(f"Index of {len(tag_suggester)} tags in use loaded in {load * 1000:.0f} ms\n")
+
+    names = [name for _, name in sorted(tags)]
+    sampler = synthetic_data.ZipfSampler(len(names), args.zipf_s, rng)
+    prefixes = []
+    for _ in range(args.rounds):
+        name = names[sampler.sample()]
+        prefixes.append(name[:rng.randint(1, 4)])
+
+    print(f"{'':<26}{'p50 us':>12}{'p99 us':>12}{'calls':>8}")
+    timed(tag_suggester.suggest, prefixes[:100])  # warm-up
+    summary("suggest (index)", timed(tag_suggester.suggest, prefixes))
+    updates = [[(tag_id, name, 1) for tag_id, name in rng.sample(tags, 4)] for _ in range(args.rounds)]
+    summary("record_uses", timed(tag_suggester.record_uses, updates))
+
+    app = FastAPI()
+    app.include_router(router, prefix="/tags")
+    timings = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for prefix in prefixes[:args.http_rounds]:
+            start = time.perf_counter()
+            resp = await client.get("/tags/suggest", params={"q": prefix})
+            timings.append(time.perf_counter() - start)
+            resp.raise_for_status()
+        summary("GET /tags/suggest", timings)
+
+        timings = []
+        for prefix in prefixes[:args.baseline_rounds]:
+            start = time.perf_counter()
+            async with database.AsyncSessionLocal() as session:
+                choices = {name: tag_id for tag_id, name in (await session.execute(select(Tag.id, Tag.name))).all()}
+            process.extract(prefix, choices.keys(), processor=utils.default_process, limit=5, score_cutoff=60)
+            timings.append(time.perf_counter() - start)
+        summary("tag fetch + rapidfuzz", timings)
+    await database.async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tags", type=int, default=100_000)
+    parser.add_argument("--contents", type=int, default=200_000)
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--http-rounds", type=int, default=500)
+    parser.add_argument("--baseline-rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    written = synthetic_data.generate(database.engine, args.contents, args.contents, args.tags, args.zipf_s)
+    print(f"Seeded {written} in {time.perf_counter() - started:.1f}s ({database.engine.dialect.name})")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
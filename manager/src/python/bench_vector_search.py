@@ -0,0 +1,168 @@
+"""
+Recall and latency of the semantic search index (api/db/vector_index.py) at 1M vectors.
+
+Embeds --vectors synthetic contents (titles, descriptions and Zipf-distributed
+tags built like synthetic_data.py) with api.db.embeddings, appends them to an
+IvfIndex in a temporary directory and trains it. Then, for --queries queries
+(tag names, title words and word pairs), it reports:
+
+- ingest                  vectors/s of batched appends, and the latency of one
+                          incremental add (what /analyze-results does)
+- train                   k-means and reassignment of all rows
+- flat                    exact scan of all rows: latency, and the ground truth
+- nprobe 1..64            recall@10 against the flat scan, p50/p99 latency
+
+No database is involved. Usage:
+  python3 bench_vector_search.py [--vectors 1000000] [--queries 200] [--output vectors.json]
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import numpy as np  # noqa: E402
+
+import synthetic_data  # noqa: E402
+from api.db.embeddings import EMBEDDING_SCALE, embed_content, embed_text, quantize  # noqa: E402
+from api.db.vector_index import IvfIndex  # noqa: E402
+
+WORDS = synthetic_data.WORDS
+
+
+def contents(count, tags, rng):
+    sampler = synthetic_data.ZipfSampler(len(tags), 1.1, rng)
+    for _ in range(count):
+        yield (" ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).title(),
+               " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 30))),
+               list({tags[sampler.sample()] for _ in range(rng.randint(1, 6))}))
+
+
+def percentile(timings, q):
+    timings = sorted(timings)
+    return timings[max(0, int(len(timings) * q) - 1)]
+
+
+def search_all(index, queries, k, nprobe):
+    timings, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = index.search(query, k=k, nprobe=nprobe)
+        timings.append(time.perf_counter() - start)
+        results.append([content_id for content_id, _ in hits])
+    return timings, results
+
+
+def exact(index, queries, k):
+    """Exact top-k content ids of every query over the live rows, in chunks."""
+    best = [np.empty(0, dtype=np.int64) for _ in queries]
+    best_scores = [np.empty(0, dtype=np.float32) for _ in queries]
+    matrix = np.stack(queries).T
+    for start in range(0, index.count, 65536):
+        chunk = index.vectors[start:start + 65536].astype(np.float32)
+        scores = chunk @ matrix
+        scores[np.asarray(index.ids[start:start + len(chunk)]) < 0] = -np.inf
+        for q in range(len(queries)):
+            rows = np.concatenate([best[q], np.arange(start, start + len(chunk))])
+            all_scores = np.concatenate([best_scores[q], scores[:, q]])
+            top = np.argpartition(all_scores, -k)[-k:] if len(rows) > k else np.arange(len(rows))
+            best[q], best_scores[q] = rows[top], all_scores[top]
+    return [[int(index.ids[row]) for row in rows[np.argsort(-scores)]] for rows, scores in zip(best, best_scores)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=1_000_000)
+    parser.add_argument("--tags", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, help="inverted lists (default: VECTOR_INDEX_LISTS)")
+    parser.add_argument("--output", help="write the numbers as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    tags = synthetic_data.tag_names(args.tags, random.Random(12))
+    workdir = tempfile.mkdtemp()
+    index = IvfIndex(os.path.join(workdir, "index")).open()
+    report = {"vectors": args.vectors}
+
+    started, embedding, batch = time.perf_counter(), 0.0, []
+    for content_id, (title, description, names) in enumerate(contents(args.vectors, tags, rng)):
+        t = time.perf_counter()
+        batch.append((content_id, quantize(embed_content(title, description, names))))
+        embedding += time.perf_counter() - t
+        if len(batch) == 10000:
+            index.add_many(batch)
+            batch = []
+            print(f"\r{content_id + 1} vectors", end="", flush=True)
+    index.add_many(batch)
+    elapsed = time.perf_counter() - started
+    report["embed_us"] = round(embedding / args.vectors * 1e6, 1)
+    report["ingest_per_s"] = round(args.vectors / (elapsed - embedding))
+    print(f"\rEmbedded {args.vectors} contents ({report['embed_us']} us each), "
+          f"appended at {report['ingest_per_s']}/s")
+
+    queries = []
+    for _ in range(args.queries):
+        kind = rng.random()
+        if kind < 0.4:
+            text = rng.choice(tags[:2000]).replace("-", " ")
+        elif kind < 0.7:
+            text = rng.choice(WORDS)
+        else:
+            text = f"{rng.choice(WORDS)} {rng.choice(WORDS)}"
+        queries.append(embed_text(text) * EMBEDDING_SCALE)
+
+    start = time.perf_counter()
+    truth = exact(index, queries, args.k)
+    print(f"Ground truth for {len(queries)} queries in {time.perf_counter() - start:.1f}s")
+    flat_timings, _ = search_all(index, queries[:20], args.k, 1)
+    report["flat"] = {"p50_ms": round(statistics.median(flat_timings) * 1000, 2)}
+
+    start = time.perf_counter()
+    nlist = index.train(args.nlist)
+    report["train"] = {"lists": nlist, "seconds": round(time.perf_counter() - start, 1)}
+    print(f"Trained {nlist} lists in {report['train']['seconds']}s; "
+          f"flat scan p50 {report['flat']['p50_ms']} ms\n")
+
+    single = []
+    for n in range(200):
+        vector = quantize(embed_content(*next(contents(1, tags, rng))))
+        start = time.perf_counter()
+        index.add(args.vectors + n, vector)
+        single.append(time.perf_counter() - start)
+    report["add_us"] = {"p50": round(statistics.median(single) * 1e6, 1),
+                        "p99": round(percentile(single, 0.99) * 1e6, 1)}
+
+    print(f"{'nprobe':<8}{'recall@' + str(args.k):>10}{'p50 ms':>10}{'p99 ms':>10}")
+    report["nprobe"] = {}
+    for nprobe in (1, 2, 4, 8, 16, 32, 64):
+        timings, results = search_all(index, queries, args.k, nprobe)
+        recall = statistics.mean(len(set(found) & set(expected)) / args.k
+                                 for found, expected in zip(results, truth))
+        p50, p99 = statistics.median(timings) * 1000, percentile(timings, 0.99) * 1000
+        report["nprobe"][nprobe] = {"recall": round(recall, 3), "p50_ms": round(p50, 2), "p99_ms": round(p99, 2)}
+        print(f"{nprobe:<8}{recall:>10.3f}{p50:>10.2f}{p99:>10.2f}")
+
+    stats = index.stats()
+    report["index_mb"] = round(stats["bytes"] / 2 ** 20, 1)
+    report["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+    print(f"\nincremental add p50 {report['add_us']['p50']} us, p99 {report['add_us']['p99']} us; "
+          f"index {report['index_mb']} MB on disk (largest list {stats['largest_list']} rows); "
+          f"peak RSS {report['max_rss_mb']} MB")
+    index.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
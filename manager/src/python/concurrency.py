@@ -0,0 +1,166 @@
+"""
+Adaptive in-flight limits for the manager's crawl and analysis dispatch.
+
+AIMDLimiter raises its limit by one per window of successful completions
+(additive increase) and multiplies it by `decrease_factor` when the downstream
+service shows saturation (multiplicative decrease):
+
+- a job failed to start or did not complete within its timeout,
+- the smoothed completion latency exceeds `latency_tolerance` times the best
+  smoothed latency seen so far (the latency gradient), or
+- the queue depth reported by the service is above `queue_target`.
+
+Decreases are applied at most once per smoothed latency (and at least
+`min_decrease_interval` apart), so a burst of slow completions caused by one
+overshoot only halves the limit once. The limit only grows while it is
+actually used, so an idle pipeline does not ratchet it up. The latency
+baseline relaxes towards the current latency over `baseline_window` seconds,
+so a service that became permanently slower is not throttled forever.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Hashable, List, Optional
+
+THROUGHPUT_WINDOW = 60.0
+
+
+class AIMDLimiter:
+    def __init__(self, name: str, initial: int = 1, min_limit: int = 1, max_limit: int = 32,
+                 decrease_factor: float = 0.5, latency_tolerance: float = 2.0,
+                 queue_target: Optional[int] = None, min_decrease_interval: float = 1.0,
+                 baseline_window: float = 600.0, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.queue_target = queue_target
+        self.min_decrease_interval = min_decrease_interval
+        self.baseline_window = baseline_window
+        self.clock = clock
+
+        self.latency: Optional[float] = None   # EWMA of completion latency
+        self.baseline: Optional[float] = None  # best EWMA seen, drifting up slowly
+        self.queue_depth = 0
+        self.completed = 0
+        self.errors = 0
+        self.decreases = 0
+        self.last_decrease_reason: Optional[str] = None
+
+        self._started: Dict[Hashable, float] = {}
+        self._completions: deque = deque()
+        self._last_decrease = -math.inf
+        self._last_observed: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._started)
+
+    def available(self) -> int:
+        """Number of jobs that may be started right now."""
+        with self._lock:
+            return max(0, int(self.limit) - len(self._started))
+
+    def start(self, key: Hashable) -> None:
+        with self._lock:
+            self._started[key] = self.clock()
+
+    def finish(self, key: Hashable, ok: bool = True) -> Optional[float]:
+        """Record the completion of a started job; returns its latency, or None if unknown."""
+        with self._lock:
+            in_flight = len(self._started)
+            started = self._started.pop(key, None)
+            if started is None:
+                return None
+            now = self.clock()
+            latency = now - started
+            self.completed += 1
+            self._completions.append(now)
+            if not ok:
+                self.errors += 1
+                self._decrease(now, "error")
+                return latency
+
+            self._observe_latency(latency, now)
+            if self.latency > self.baseline * self.latency_tolerance:
+                self._decrease(now, "latency")
+            elif self._queue_saturated():
+                self._decrease(now, "queue")
+            elif in_flight >= int(self.limit):
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            return latency
+
+    def failed(self) -> None:
+        """Record a job that could not even be started (e.g. the service rejected it)."""
+        with self._lock:
+            self.errors += 1
+            self._decrease(self.clock(), "error")
+
+    def cancel(self, key: Hashable) -> bool:
+        """Drop a started job without counting it as completed or failed (it is retried elsewhere)."""
+        with self._lock:
+            return self._started.pop(key, None) is not None
+
+    def expire(self, timeout: float) -> List[Hashable]:
+        """Fail all jobs started more than `timeout` seconds ago and return their keys."""
+        deadline = self.clock() - timeout
+        with self._lock:
+            expired = [key for key, started in self._started.items() if started <= deadline]
+        for key in expired:
+            self.finish(key, ok=False)
+        return expired
+
+    def observe_queue_depth(self, depth: int) -> None:
+        with self._lock:
+            self.queue_depth = depth
+            if self._queue_saturated():
+                self._decrease(self.clock(), "queue")
+
+    def _queue_saturated(self) -> bool:
+        return self.queue_target is not None and self.queue_depth > self.queue_target
+
+    def _observe_latency(self, latency: float, now: float) -> None:
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if self.baseline is None or self.latency < self.baseline:
+            self.baseline = self.latency
+        else:
+            elapsed = now - self._last_observed
+            self.baseline += (self.latency - self.baseline) * (1 - math.exp(-elapsed / self.baseline_window))
+        self._last_observed = now
+
+    def _decrease(self, now: float, reason: str) -> None:
+        if now - self._last_decrease < max(self.latency or 0.0, self.min_decrease_interval):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self.decreases += 1
+        self.last_decrease_reason = reason
+
+    def throughput(self) -> float:
+        """Completions per second over the last THROUGHPUT_WINDOW seconds."""
+        now = self.clock()
+        with self._lock:
+            while self._completions and self._completions[0] < now - THROUGHPUT_WINDOW:
+                self._completions.popleft()
+            return len(self._completions) / THROUGHPUT_WINDOW
+
+    def snapshot(self) -> Dict:
+        throughput = self.throughput()
+        with self._lock:
+            return {
+                "limit": int(self.limit),
+                "in_flight": len(self._started),
+                "queue_depth": self.queue_depth,
+                "latency_seconds": round(self.latency, 3) if self.latency is not None else None,
+                "baseline_seconds": round(self.baseline, 3) if self.baseline is not None else None,
+                "throughput_per_second": round(throughput, 3),
+                "completed": self.completed,
+                "errors": self.errors,
+                "decreases": self.decreases,
+                "last_decrease_reason": self.last_decrease_reason,
+            }
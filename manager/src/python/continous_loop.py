@@ -1,98 +1,372 @@
 import threading
 import time
 import asyncio
+import datetime
+from collections import OrderedDict, deque
 import secrets
 import string
 import requests
 from requests.sessions import Session
 from requests.models import HTTPError
 import os
+from sqlalchemy import select
 from api.db.models import Links, Content
-from api.db.database import SessionLocal, get_db
+from api.db.database import AsyncSessionLocal
+from concurrency import AIMDLimiter
+from crawlers import CrawlerRegistry, crawler_base_url
+import instrumentation
+import profiling
+from tracing import tracer
+
+# Seconds before a dispatched job without callback counts as failed (and frees its slot)
+CRAWL_JOB_TIMEOUT = float(os.getenv("CRAWL_JOB_TIMEOUT", "300"))
+ANALYSE_JOB_TIMEOUT = float(os.getenv("ANALYSE_JOB_TIMEOUT", "600"))
+# Seconds between queue depth polls of the crawler and analyzer
+QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "5"))
+# 'relay': the crawler posts page bodies here and the manager forwards them to the analyzer.
+# 'direct': the crawler submits pages to the analyzer itself and only reports the jobId here.
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "relay")
+# Remembered ids of analysis results that arrived before the crawler reported the job
+EARLY_RESULTS_LIMIT = 1000
+# Recrawl links last crawled at least this many days ago (conditionally); 0 disables recrawls
+RECRAWL_AFTER_DAYS = int(os.getenv("RECRAWL_AFTER_DAYS", "0"))
+# Links fetched per free crawl slot; links of hosts whose crawler is busy wait for the next iteration
+CRAWL_LINKS_PER_SLOT = 4
 
 
 class ContiniousLoop():
-    def __init__(self, crawl_thread, analyse_thread, analyse_url, crawler_url, analyse_APIKEY, crawler_APIKEY):
+    def __init__(self, crawl_thread, analyse_thread, analyse_url, crawler_url, analyse_APIKEY, crawler_APIKEY,
+                 crawl_max=32, analyse_max=16, crawl_queue_target=None, analyse_queue_target=None,
+                 pipeline_mode="relay", crawler_urls=None):
         self.active = False
+        self.pipeline_mode = pipeline_mode
 
         self.crawler_url = crawler_url
+        # Links are sharded by host over these crawlers and the ones sending heartbeats, see crawlers.py
+        self.crawlers = CrawlerRegistry(crawler_urls or [crawler_url])
         self.analyse_url = analyse_url
 
         self.crawler_APIKEY = crawler_APIKEY
         self.analyse_APIKEY = analyse_APIKEY
 
-        self.crawl_thread: int = crawl_thread
-        self.analyse_threads: int = analyse_thread
+        # crawl_thread / analyse_thread are the initial in-flight limits; the limiters
+        # adapt them between 1 and crawl_max / analyse_max (see concurrency.py)
+        self.crawl_limiter = AIMDLimiter("crawl", initial=crawl_thread, max_limit=crawl_max,
+                                         queue_target=crawl_queue_target)
+        self.analyse_limiter = AIMDLimiter("analyse", initial=analyse_thread, max_limit=analyse_max,
+                                           queue_target=analyse_queue_target)
 
         self.crawler_running_jobs = {}
         self.analyse_running_jobs = {}
+        # Crawled content waiting for a free analysis slot
+        self.analyse_pending = deque()
+        self._early_results = OrderedDict()
+        self._last_queue_poll = 0.0
+        # Savings of conditional recrawls, see record_unchanged()
+        self.recrawl_stats = {
+            "conditional_requests": 0,
+            "not_modified": 0,
+            "unchanged_bodies": 0,
+            "bytes_saved": 0,
+            "analyses_avoided": 0,
+        }
 
 
     async def continious_loop(self):
         while self.active:
-            print("Loop start")
-            print(self.crawler_running_jobs)
-            if len(self.crawler_running_jobs) < self.crawl_thread:
-                link = self.get_crawl_link()
-                if link:
-                    content = self.start_crawljob(link)
+            # Work is handed to threads, so a sampled iteration profiles all of them
+            with profiling.maybe_profile("continious_loop", all_threads=True):
+                await self.run_iteration()
             await asyncio.sleep(1)
 
 
-    def get_crawl_link(self):
-        with SessionLocal() as db:
-            not_analysed = db.query(Links.url).filter(Links.analysed_on == None).first()
-            if not_analysed:
-                print("URL to analyse: ", not_analysed[0])
-                return not_analysed[0]
-            else:
+    async def run_iteration(self):
+        self.expire_stalled_jobs()
+        self.release_crawl_jobs(self.crawlers.expire())
+        if time.monotonic() - self._last_queue_poll >= QUEUE_POLL_INTERVAL:
+            self._last_queue_poll = time.monotonic()
+            await asyncio.to_thread(self.poll_queue_depths)
+
+        await self.dispatch_analysis()
+
+        free = min(self.crawl_limiter.available(), self.crawlers.free())
+        if free:
+            links = await self.get_crawl_links(free * CRAWL_LINKS_PER_SLOT)
+            # Each link goes to the crawler owning its host, if that one has a free slot
+            plan = self.crawlers.assign([link.url for link in links], free)
+            picked = time.time()
+            # requests-based calls; keep them off the event loop
+            results = await asyncio.gather(
+                *(asyncio.to_thread(self.start_crawljob, link.url, self._validators(link), picked, plan[link.url])
+                  for link in links if link.url in plan),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    print(result)
+
+
+    async def get_crawl_links(self, limit):
+        """Up to `limit` links to crawl that are not being crawled right now.
+
+        Never crawled links come first; with RECRAWL_AFTER_DAYS set, the stalest links
+        crawled before that fill the remaining slots.
+        """
+        async with AsyncSessionLocal() as db:
+            q = select(Links.url, Links.etag, Links.last_modified, Links.content_hash)
+            in_flight = list(self.crawler_running_jobs.values())
+            if in_flight:
+                q = q.where(Links.url.not_in(in_flight))
+            links = list((await db.execute(q.where(Links.analysed_on == None).limit(limit))).all())
+            if len(links) < limit and RECRAWL_AFTER_DAYS > 0:
+                due = datetime.date.today() - datetime.timedelta(days=RECRAWL_AFTER_DAYS)
+                links += (await db.execute(
+                    q.where(Links.analysed_on <= due).order_by(Links.analysed_on).limit(limit - len(links))
+                )).all()
+            if not links:
                 print("All links already analysed")
-                return False
+            return links
 
 
-    def start_crawljob(self, link):
-        # Use provided link; fall back to default if None/empty
-        if not link:
-            link = self.get_crawl_link()
+    @staticmethod
+    def _validators(link):
+        validators = {"etag": link.etag, "last_modified": link.last_modified, "content_hash": link.content_hash}
+        return validators if any(validators.values()) else None
+
+
+    def record_unchanged(self, not_modified, bytes_saved):
+        """Count a recrawl whose page did not change (HTTP 304 or identical body); its analysis is skipped."""
+        self.recrawl_stats["not_modified" if not_modified else "unchanged_bodies"] += 1
+        self.recrawl_stats["bytes_saved"] += bytes_saved or 0
+        self.recrawl_stats["analyses_avoided"] += 1
+
+
+    def enqueue_analysis(self, content, url, trace_id=None):
+        self.analyse_pending.append((content, url, trace_id))
+
+
+    def register_analysis(self, job_id, url):
+        """Track an analysis job the crawler submitted directly (PIPELINE_MODE=direct)."""
+        if self._early_results.pop(job_id, None):
+            return
+        self.analyse_running_jobs[job_id] = url
+        self.analyse_limiter.start(job_id)
+
+
+    def finish_analysis(self, job_id, accepted_early=False):
+        """URL of a finished analysis job, or None if it is not (yet) known.
 
-        payload = {"addresses": link}
-        # header = { "Authorization": f"Bearer {self.crawler_APIKEY}" }
+        `accepted_early`: the caller stores the result of an unknown job anyway (an
+        authenticated callback with sourceUrl), so a late crawler report must not track it.
+        """
+        url = self.analyse_running_jobs.pop(job_id, None)
+        if url is None:
+            # In direct mode the analyzer may call back before the crawler reported the job
+            if accepted_early:
+                self._early_results[job_id] = True
+            while len(self._early_results) > EARLY_RESULTS_LIMIT:
+                self._early_results.popitem(last=False)
+            return None
+        self.analyse_limiter.finish(job_id)
+        return url
 
-        response = requests.post(self.crawler_url, json=payload)
+
+    def restore_analysis(self, job_id, url=None):
+        """Undo finish_analysis for a result that could not be stored; the analyzer delivers it again.
+
+        `url` is what finish_analysis returned. The job is not restarted in the analysis
+        limiter, which already counted it as finished.
+        """
+        self._early_results.pop(job_id, None)
+        if url is not None:
+            self.analyse_running_jobs[job_id] = url
+
+
+    def start_reanalysis(self, items):
+        """Have the crawlers resubmit archived pages to the analyzer.
+
+        `items` are (url, content_hash) pairs; returns the number of analyzer jobs started.
+        Pages are archived by the crawler that crawled them, so each item goes to the
+        crawler owning its host.
+        """
+        by_crawler = {}
+        for url, content_hash in items:
+            crawler = self.crawlers.owner(url)
+            base = crawler.url if crawler else crawler_base_url(self.crawler_url)
+            by_crawler.setdefault(base, []).append({"content_hash": content_hash, "source_url": url})
+        started = 0
+        for base, archived in by_crawler.items():
+            response = requests.post(base + "/archive/reanalyze", json={
+                "analyze_url": self.analyse_url,
+                "items": archived,
+            }, headers={"Authorization": f"Bearer {self.crawler_APIKEY}"}, timeout=300)
+            response.raise_for_status()
+            for item in response.json():
+                if item.get("analysis_job_id"):
+                    self.register_analysis(item["analysis_job_id"], item["source_url"])
+                    started += 1
+        return started
+
+
+    async def dispatch_analysis(self):
+        batch = []
+        while self.analyse_pending and len(batch) < self.analyse_limiter.available():
+            batch.append(self.analyse_pending.popleft())
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self.start_analysejob, *item) for item in batch),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                print(result)
+
+
+    def expire_stalled_jobs(self):
+        for job_id in self.crawl_limiter.expire(CRAWL_JOB_TIMEOUT):
+            print(f"Crawl job {job_id} timed out")
+            self.crawler_running_jobs.pop(job_id, None)
+            self.crawlers.finished(job_id, reported=False)
+        for job_id in self.analyse_limiter.expire(ANALYSE_JOB_TIMEOUT):
+            print(f"Analyse job {job_id} timed out")
+            self.analyse_running_jobs.pop(job_id, None)
+
+
+    def release_crawl_jobs(self, job_ids):
+        """Forget crawl jobs of a crawler that died; their links are picked again and go to another crawler."""
+        for job_id in job_ids:
+            self.crawler_running_jobs.pop(job_id, None)
+            self.crawl_limiter.cancel(job_id)
+
+
+    def poll_queue_depths(self):
+        """Feed the limiters with the backlog reported by the crawlers and the analyzer.
+
+        A crawler answering its /status counts as alive, like a heartbeat; one that
+        does not counts as a failure. Crawls are throttled by the crawlers' queued jobs plus the content still
+        waiting for analysis here, analyses by the analyzer's queued jobs. In direct
+        mode crawls feed the analyzer without passing the analysis limiter, so its
+        queue throttles crawling as well.
+        """
+        for crawler in self.crawlers.instances():
+            try:
+                response = requests.get(crawler.url + "/status", timeout=5)
+                response.raise_for_status()
+                queued = sum(1 for job in response.json() if job.get("status") == "queued")
+                self.crawlers.heartbeat(crawler.url, queued=queued)
+            except (requests.RequestException, ValueError, AttributeError) as e:
+                print(f"Crawler {crawler.name} queue depth unavailable: {e}")
+                self.release_crawl_jobs(self.crawlers.failed(crawler.url))
+        crawler_queued = self.crawlers.queued()
+
+        analyzer_queued = 0
+        try:
+            response = requests.get(
+                self.analyse_url.rsplit("/", 1)[0] + "/jobs",
+                params={"state": "queued", "limit": 1},
+                headers={"Authorization": f"Bearer {self.analyse_APIKEY}"},
+                timeout=5,
+            )
+            analyzer_queued = response.json()["counts"]["queued"]
+            self.analyse_limiter.observe_queue_depth(analyzer_queued)
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            print(f"Analyzer queue depth unavailable: {e}")
+
+        backlog = crawler_queued + len(self.analyse_pending)
+        if self.pipeline_mode == "direct":
+            backlog += analyzer_queued
+        self.crawl_limiter.observe_queue_depth(backlog)
+
+
+    def status(self):
+        return {
+            "active": self.active,
+            "pipeline_mode": self.pipeline_mode,
+            "recrawl": dict(self.recrawl_stats),
+            "crawl": self.crawl_limiter.snapshot(),
+            "crawlers": self.crawlers.snapshot(),
+            "analyse": {**self.analyse_limiter.snapshot(), "pending": len(self.analyse_pending)},
+        }
+
+
+    def start_crawljob(self, link, validators=None, picked=None, crawler=None):
+        # Nothing to crawl; the loop fetches the next links via get_crawl_links()
+        if not link:
+            return False
+        crawler = crawler or self.crawlers.owner(link)
+        if crawler is None:
+            raise Exception("Error: No crawler available")
+
+        # Follows the link through crawler, analyzer and both callbacks, see tracing.py
+        trace_id = tracer.start(link, picked)
+        payload = {"addresses": link, "trace_ids": {link: trace_id}}
+        if self.pipeline_mode == "direct":
+            payload["analyze_url"] = self.analyse_url
+        if validators:
+            # Lets the crawler send If-None-Match / If-Modified-Since and skip unchanged pages
+            payload["validators"] = {link: validators}
+            self.recrawl_stats["conditional_requests"] += 1
+        headers = {"Authorization": f"Bearer {self.crawler_APIKEY}"}
+
+        try:
+            response = requests.post(crawler.url + "/crawl", json=payload, headers=headers, timeout=30)
+        except requests.RequestException as e:
+            self.crawl_limiter.failed()
+            self.release_crawl_jobs(self.crawlers.failed(crawler.url))
+            tracer.finish(trace_id)
+            raise Exception(f"Error: Crawler {crawler.name} unreachable: {e}")
 
         try:
             data = response.json()
         except ValueError:
-            raise Exception(f"Error: Crawler returned non-JSON response (status {response.status_code}): {response.text}")
+            self.crawl_limiter.failed()
+            self.release_crawl_jobs(self.crawlers.failed(crawler.url))
+            tracer.finish(trace_id)
+            raise Exception(f"Error: Crawler {crawler.name} returned non-JSON response (status {response.status_code}): {response.text}")
 
         job_id = data.get("job_id")
         if response.status_code == 200 and job_id:
             self.crawler_running_jobs[job_id] = link
+            self.crawl_limiter.start(job_id)
+            self.crawlers.started(crawler.url, job_id, link)
             # return parsed JSON so downstream code gets a serializable object
             return data
         else:
-            raise Exception(f"Error: Crawler Job could not be started (status {response.status_code}): {response.text}")
+            self.crawl_limiter.failed()
+            self.release_crawl_jobs(self.crawlers.failed(crawler.url))
+            tracer.finish(trace_id)
+            raise Exception(f"Error: Crawler {crawler.name} could not start the job (status {response.status_code}): {response.text}")
 
 
-    def start_analysejob(self, content, url):
+    def start_analysejob(self, content, url, trace_id=None):
 
-        payload = {"content": content}
+        payload = {"content": content, "sourceUrl": url, "traceId": trace_id}
+        tracer.mark(trace_id, "analysis_submitted")
 
         headers = { "Authorization": f"Bearer {self.analyse_APIKEY}" }
 
-        response = requests.post(self.analyse_url, json=payload, headers=headers)
+        try:
+            response = requests.post(self.analyse_url, json=payload, headers=headers)
+        except requests.RequestException as e:
+            self.analyse_limiter.failed()
+            tracer.finish(trace_id)
+            raise Exception(f"Error: Analyse unreachable: {e}")
 
         try:
             data = response.json()
         except ValueError:
+            self.analyse_limiter.failed()
+            tracer.finish(trace_id)
             raise Exception(f"Error: Analyse returned non-JSON response (status {response.status_code}): {response.text}")
 
         job_id = data.get("jobId")
 
         if response.status_code == 202 and job_id:
             self.analyse_running_jobs[job_id] = url
+            self.analyse_limiter.start(job_id)
             return True
         else:
+            self.analyse_limiter.failed()
+            tracer.finish(trace_id)
             raise Exception(f"Error: Analyse Job could not be started (status {response.status_code}): {response.text}")
 
     @staticmethod
@@ -105,13 +379,22 @@ class ContiniousLoop():
         return job_id
 
 
-crawler_url = "http://crawler:8080/crawl"
-analyse_url = "http://analyzer:8000/analyze"
+# Service URLs default to the docker compose hostnames (overridden by tests/bench_e2e.py)
+crawler_url = os.getenv("CRAWLER_URL", "http://crawler:8080/crawl")
+# Crawlers to shard links over (comma separated base URLs); more can join by sending heartbeats
+crawler_urls = [url for url in os.getenv("CRAWLER_URLS", "").split(",") if url.strip()] or [crawler_url]
+analyse_url = os.getenv("ANALYZER_URL", "http://analyzer:8000/analyze")
 # Read API keys from environment so services use the same configured value when running in Docker
 crawler_APIKEY = os.getenv("CRAWLER_APIKEY", os.getenv("API_KEY", "changeme"))
 analyse_APIKEY = os.getenv("API_KEY", "changeme")
-crawl_thread = 1
-analyse_thread = 1
+# Initial and maximum in-flight jobs per stage
+crawl_thread = int(os.getenv("CRAWL_CONCURRENCY", "1"))
+analyse_thread = int(os.getenv("ANALYSE_CONCURRENCY", "1"))
+crawl_max = int(os.getenv("CRAWL_CONCURRENCY_MAX", "32"))
+analyse_max = int(os.getenv("ANALYSE_CONCURRENCY_MAX", "16"))
+# Backlog above which a stage backs off (crawl: crawler queue + pending analyses)
+crawl_queue_target = int(os.getenv("CRAWL_QUEUE_TARGET", "50"))
+analyse_queue_target = int(os.getenv("ANALYSE_QUEUE_TARGET", "8"))
 
 
 loop = ContiniousLoop(
@@ -120,7 +403,65 @@ loop = ContiniousLoop(
     crawler_APIKEY = crawler_APIKEY,
     analyse_APIKEY = analyse_APIKEY,
     crawl_thread = crawl_thread,
-    analyse_thread = analyse_thread
+    analyse_thread = analyse_thread,
+    crawl_max = crawl_max,
+    analyse_max = analyse_max,
+    crawl_queue_target = crawl_queue_target,
+    analyse_queue_target = analyse_queue_target,
+    pipeline_mode = PIPELINE_MODE,
+    crawler_urls = crawler_urls
     )
 
 
+def _stages():
+    return (("crawl", loop.crawl_limiter), ("analyse", loop.analyse_limiter))
+
+
+# Read from the loop's own bookkeeping at scrape time
+instrumentation.gauge(
+    "manager_pipeline_jobs", "Jobs per stage: dispatched and unfinished, waiting here, queued downstream",
+    ["stage", "state"],
+    collect=lambda: {
+        ("crawl", "in_flight"): loop.crawl_limiter.in_flight,
+        ("crawl", "downstream_queued"): loop.crawl_limiter.queue_depth,
+        ("analyse", "in_flight"): loop.analyse_limiter.in_flight,
+        ("analyse", "pending"): len(loop.analyse_pending),
+        ("analyse", "downstream_queued"): loop.analyse_limiter.queue_depth,
+    },
+)
+instrumentation.gauge(
+    "manager_concurrency_limit", "Current adaptive in-flight limit per stage", ["stage"],
+    collect=lambda: {name: int(limiter.limit) for name, limiter in _stages()},
+)
+instrumentation.gauge(
+    "manager_job_latency_seconds", "Smoothed dispatch-to-callback latency per stage", ["stage"],
+    collect=lambda: {name: limiter.latency for name, limiter in _stages() if limiter.latency is not None},
+)
+instrumentation.counter(
+    "manager_jobs_completed_total", "Jobs finished or expired per stage", ["stage"],
+    collect=lambda: {name: limiter.completed for name, limiter in _stages()},
+)
+instrumentation.counter(
+    "manager_job_errors_total", "Jobs that could not be started, failed or timed out per stage", ["stage"],
+    collect=lambda: {name: limiter.errors for name, limiter in _stages()},
+)
+instrumentation.gauge(
+    "manager_crawler_jobs", "In-flight crawl jobs per registered crawler", ["crawler"],
+    collect=lambda: {crawler.name: len(crawler.jobs) for crawler in loop.crawlers.instances()},
+)
+instrumentation.gauge(
+    "manager_crawlers_alive", "Registered crawlers that are alive and on the hash ring",
+    collect=lambda: {(): loop.crawlers.snapshot()["alive"]},
+)
+instrumentation.counter(
+    "manager_crawler_deaths_total", "Crawlers marked dead (missed heartbeats or failed dispatches)",
+    collect=lambda: {(): loop.crawlers.deaths},
+)
+instrumentation.counter(
+    "manager_recrawl_events_total", "Conditional recrawl requests and their outcomes", ["event"],
+    collect=lambda: {k: v for k, v in loop.recrawl_stats.items() if k != "bytes_saved"},
+)
+instrumentation.counter(
+    "manager_recrawl_bytes_saved_total", "Page bytes not downloaded thanks to 304 responses",
+    collect=lambda: {(): loop.recrawl_stats["bytes_saved"]},
+)
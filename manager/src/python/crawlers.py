@@ -0,0 +1,278 @@
+"""
+Registry of crawler instances and host-affinity dispatch across them.
+
+Every crawler runs its own Tor client. Links are assigned to crawlers by
+consistent hashing of their host, so all pages of an onion site go to the same
+crawler, which keeps its circuits to the site, its connection pool and its
+per-host state (charset cache, archive, metrics) warm. A crawler joining or
+leaving only moves the hosts it owns.
+
+Crawlers are known from CRAWLER_URLS (polled through their /status) and from
+the heartbeats they POST to /crawlers/heartbeat. An instance is alive while it
+was seen within CRAWLER_HEARTBEAT_TIMEOUT seconds and has not failed
+CRAWLER_MAX_FAILURES dispatches in a row. When one dies, its hosts move to the
+next crawlers on the ring and its unfinished jobs are released, so the loop
+picks their links up again and crawls them elsewhere. A host whose crawler is
+busy waits for it rather than spilling over to another crawler.
+"""
+
+import bisect
+import hashlib
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+CRAWLER_HEARTBEAT_TIMEOUT = float(os.getenv("CRAWLER_HEARTBEAT_TIMEOUT", "30"))
+CRAWLER_MAX_FAILURES = int(os.getenv("CRAWLER_MAX_FAILURES", "3"))
+# In-flight jobs per crawler when its heartbeat does not report a capacity
+CRAWLER_CAPACITY = int(os.getenv("CRAWLER_CAPACITY", "8"))
+# Points per crawler on the ring; more points spread hosts more evenly
+RING_POINTS = 128
+
+
+def crawler_base_url(url: str) -> str:
+    """http://crawler:8080 for http://crawler:8080/crawl or http://crawler:8080/."""
+    url = url.strip().rstrip("/")
+    return url[:-len("/crawl")] if url.endswith("/crawl") else url
+
+
+def host_of(url: str) -> str:
+    return (urlsplit(url).hostname or url).lower()
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring of node names with `points` virtual points each."""
+
+    def __init__(self, points: int = RING_POINTS):
+        self.points = points
+        self._hashes: List[int] = []
+        self._nodes: List[str] = []
+
+    def __len__(self) -> int:
+        return len(set(self._nodes))
+
+    def __contains__(self, node: str) -> bool:
+        return node in self._nodes
+
+    def add(self, node: str) -> None:
+        if node in self:
+            return
+        for i in range(self.points):
+            h = _hash(f"{node}#{i}")
+            at = bisect.bisect(self._hashes, h)
+            self._hashes.insert(at, h)
+            self._nodes.insert(at, node)
+
+    def remove(self, node: str) -> None:
+        kept = [(h, n) for h, n in zip(self._hashes, self._nodes) if n != node]
+        self._hashes = [h for h, _ in kept]
+        self._nodes = [n for _, n in kept]
+
+    def nodes_for(self, key: str) -> Iterator[str]:
+        """Distinct nodes in ring order from the position of `key`: its owner first, then the successors."""
+        if not self._hashes:
+            return
+        start = bisect.bisect(self._hashes, _hash(key))
+        seen = set()
+        total = len(self)
+        for i in range(len(self._hashes)):
+            node = self._nodes[(start + i) % len(self._nodes)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == total:
+                    return
+
+    def node_for(self, key: str) -> Optional[str]:
+        return next(self.nodes_for(key), None)
+
+
+class CrawlerInstance:
+    def __init__(self, url: str, name: Optional[str] = None, capacity: int = CRAWLER_CAPACITY,
+                 static: bool = False):
+        self.url = crawler_base_url(url)
+        self.name = name or urlsplit(self.url).netloc or self.url
+        self.capacity = capacity
+        # Configured in CRAWLER_URLS (polled) rather than announced by heartbeats
+        self.static = static
+        self.alive = False
+        self.last_seen: Optional[float] = None
+        self.failures = 0
+        self.queued = 0
+        # Dispatched jobs without a result yet: job id -> link
+        self.jobs: Dict[str, str] = {}
+
+    @property
+    def free(self) -> int:
+        return max(0, self.capacity - len(self.jobs)) if self.alive else 0
+
+    def snapshot(self, now: float) -> Dict:
+        return {
+            "name": self.name,
+            "url": self.url,
+            "alive": self.alive,
+            "static": self.static,
+            "capacity": self.capacity,
+            "in_flight": len(self.jobs),
+            "queued": self.queued,
+            "failures": self.failures,
+            "seen_seconds_ago": round(now - self.last_seen, 1) if self.last_seen is not None else None,
+        }
+
+
+class CrawlerRegistry:
+    """Crawler instances keyed by base URL, their health, and the ring of the alive ones; thread safe."""
+
+    def __init__(self, static_urls: Iterable[str] = (), heartbeat_timeout: float = CRAWLER_HEARTBEAT_TIMEOUT,
+                 max_failures: int = CRAWLER_MAX_FAILURES, points: int = RING_POINTS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_failures = max_failures
+        self.clock = clock
+        self.deaths = 0
+        # Jobs released from dead crawlers, to be crawled elsewhere
+        self.released = 0
+        self._instances: Dict[str, CrawlerInstance] = {}
+        self._ring = HashRing(points)
+        self._job_crawler: Dict[str, str] = {}
+        self._lock = threading.RLock()
+        for url in static_urls:
+            if url.strip():
+                # Assumed up until dispatches or polls fail
+                self.heartbeat(url, static=True)
+
+    def instances(self) -> List[CrawlerInstance]:
+        with self._lock:
+            return list(self._instances.values())
+
+    def heartbeat(self, url: str, name: Optional[str] = None, capacity: Optional[int] = None,
+                  queued: Optional[int] = None, static: bool = False) -> CrawlerInstance:
+        """Record that a crawler is up (a heartbeat, a successful poll); (re)adds it to the ring."""
+        url = crawler_base_url(url)
+        with self._lock:
+            instance = self._instances.get(url)
+            if instance is None:
+                instance = self._instances[url] = CrawlerInstance(url, name, static=static)
+            if name:
+                instance.name = name
+            if capacity:
+                instance.capacity = capacity
+            if queued is not None:
+                instance.queued = queued
+            instance.last_seen = self.clock()
+            instance.failures = 0
+            if not instance.alive:
+                instance.alive = True
+                self._ring.add(url)
+            return instance
+
+    def failed(self, url: str) -> List[str]:
+        """Record a failed dispatch or poll; returns the released jobs if the crawler is now considered dead."""
+        with self._lock:
+            instance = self._instances.get(crawler_base_url(url))
+            if instance is None:
+                return []
+            instance.failures += 1
+            if instance.alive and instance.failures >= self.max_failures:
+                return self._kill(instance)
+            return []
+
+    def expire(self) -> List[str]:
+        """Mark crawlers not seen for `heartbeat_timeout` seconds dead; returns the jobs released."""
+        deadline = self.clock() - self.heartbeat_timeout
+        released = []
+        with self._lock:
+            for instance in self._instances.values():
+                if instance.alive and (instance.last_seen is None or instance.last_seen < deadline):
+                    released += self._kill(instance)
+        return released
+
+    def remove(self, url: str) -> Optional[List[str]]:
+        """Forget a crawler (scaled down); returns its released jobs, or None if it is unknown."""
+        with self._lock:
+            instance = self._instances.pop(crawler_base_url(url), None)
+            if instance is None:
+                return None
+            return self._kill(instance, died=False)
+
+    def _kill(self, instance: CrawlerInstance, died: bool = True) -> List[str]:
+        instance.alive = False
+        self._ring.remove(instance.url)
+        released = list(instance.jobs)
+        for job_id in released:
+            self._job_crawler.pop(job_id, None)
+        instance.jobs.clear()
+        self.deaths += died
+        self.released += len(released)
+        if released or died:
+            print(f"Crawler {instance.name} {'is down' if died else 'removed'}; "
+                  f"{len(released)} jobs released, {len(self._ring)} crawlers left")
+        return released
+
+    def owner(self, link: str) -> Optional[CrawlerInstance]:
+        """Alive crawler owning the host of `link`."""
+        with self._lock:
+            url = self._ring.node_for(host_of(link))
+            return self._instances[url] if url is not None else None
+
+    def free(self) -> int:
+        with self._lock:
+            return sum(instance.free for instance in self._instances.values())
+
+    def queued(self) -> int:
+        with self._lock:
+            return sum(instance.queued for instance in self._instances.values() if instance.alive)
+
+    def assign(self, links: Iterable[str], limit: int) -> Dict[str, CrawlerInstance]:
+        """Up to `limit` of `links` mapped to the crawler owning their host, within each crawler's free slots."""
+        plan: Dict[str, CrawlerInstance] = {}
+        with self._lock:
+            free = {url: instance.free for url, instance in self._instances.items()}
+            for link in links:
+                if len(plan) >= limit:
+                    break
+                url = self._ring.node_for(host_of(link))
+                if url is not None and free[url] > 0:
+                    free[url] -= 1
+                    plan[link] = self._instances[url]
+        return plan
+
+    def started(self, url: str, job_id: str, link: str) -> None:
+        with self._lock:
+            instance = self._instances.get(crawler_base_url(url))
+            if instance is None or not instance.alive:
+                return
+            instance.jobs[job_id] = link
+            instance.failures = 0
+            self._job_crawler[job_id] = instance.url
+
+    def finished(self, job_id: str, reported: bool = True) -> Optional[CrawlerInstance]:
+        """Forget a finished or timed out job; returns its crawler, if known.
+
+        A job the crawler `reported` shows that the crawler works, like a heartbeat.
+        """
+        with self._lock:
+            url = self._job_crawler.pop(job_id, None)
+            instance = self._instances.get(url) if url is not None else None
+            if instance is not None:
+                instance.jobs.pop(job_id, None)
+                if reported and instance.alive:
+                    instance.last_seen = self.clock()
+                    instance.failures = 0
+            return instance
+
+    def snapshot(self) -> Dict:
+        now = self.clock()
+        with self._lock:
+            return {
+                "alive": len(self._ring),
+                "deaths": self.deaths,
+                "released_jobs": self.released,
+                "crawlers": [instance.snapshot(now) for instance in self._instances.values()],
+            }
@@ -1,7 +1,14 @@
 from fastapi import FastAPI
+import asyncio
 import logging
-from api.routes.routes import router
+from api.routes.routes import router, require_api_key
 from api.routes.links import router as links_router
+from api.routes.contents import router as contents_router
+from api.routes.tags import router as tags_router
+from api.routes.crawlers import router as crawlers_router
+from api.db.maintenance import FACET_RECONCILE_INTERVAL, TAG_GC_INTERVAL, run_facet_reconcile, run_tag_gc
+from instrumentation import setup_metrics
+from profiling import setup_profiling
 
 import uvicorn
 from continous_loop import loop
@@ -15,11 +22,20 @@ app = FastAPI(title="darkwebsearch-manager", version="0.1.0")
 
 app.include_router(router)
 app.include_router(links_router, prefix="/links", tags=["links"])
+app.include_router(contents_router, prefix="/contents", tags=["contents"])
+app.include_router(tags_router, prefix="/tags", tags=["tags"])
+app.include_router(crawlers_router, prefix="/crawlers", tags=["crawlers"])
+setup_metrics(app)
+setup_profiling(app, "manager", require_api_key)
 
 @app.on_event("startup")
 async def on_startup():
     logger.info("Application startup: initializing resources")
     loop.continious_loop()
+    app.state.tag_gc = asyncio.create_task(run_tag_gc()) if TAG_GC_INTERVAL > 0 else None
+    app.state.facet_reconcile = (
+        asyncio.create_task(run_facet_reconcile()) if FACET_RECONCILE_INTERVAL > 0 else None
+    )
     # Example: initialize DB/clients and store on app.state
     # app.state.db = await init_db()
     # app.state.http = httpx.AsyncClient()
@@ -28,6 +44,9 @@ async def on_startup():
 @app.on_event("shutdown")
 async def on_shutdown():
     logger.info("Application shutdown: cleaning up resources")
+    for task in (app.state.tag_gc, app.state.facet_reconcile):
+        if task is not None:
+            task.cancel()
     # Example: cleanup/close connections
     # await app.state.db.close()
     # await app.state.http.aclose()
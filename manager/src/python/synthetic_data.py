@@ -0,0 +1,189 @@
+"""
+Seeded synthetic data for the manager schema (links, contents, tags, content_tags).
+
+Meant for sizing the database hot paths at production scale (see
+bench_db_hot_paths.py): the same seed always yields the same rows.
+
+- links:    onion URLs of sites with a few pages each. `contents` of them were
+            analysed, another `dead_fraction` were crawled without result, the
+            rest were never crawled (what the loop picks up next).
+- contents: one per analysed link, with title, description and a legality
+            verdict (mostly legal, some illegal, a few unknown). facet_counts
+            are not written; a facet reconcile computes them.
+- tags:     tag popularity follows a Zipf distribution with exponent `zipf_s`,
+            so a few tags ("market", "bitcoin", ...) are on a large share of
+            contents and most tags on a handful, as in real analyzer output.
+
+Rows are written with batched multi-row INSERTs and explicit ids following the
+ids already in the tables, so the generator also fills a database that holds
+data already.
+
+Usage:
+  DATABASE_URL=mysql+pymysql://... python3 synthetic_data.py [--links 1000000] [--contents 500000] [--tags 50000]
+"""
+
+import argparse
+import base64
+import bisect
+import datetime
+import hashlib
+import itertools
+import random
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from sqlalchemy import func, insert, select
+
+from api.db.models import Content, ContentTag, Links, Tag
+
+WORDS = (
+    "market bitcoin forum vendor escrow monero wiki links mirror hosting email chat news blog drugs "
+    "counterfeit hacking carding fraud weapons privacy security tutorial guide directory search crypto "
+    "exchange wallet mixer leaks documents books library music video images gallery social dating "
+    "service software download tools vpn proxy onion index archive paste board community support shop"
+).split()
+PAGES_PER_SITE = 4
+MAX_TAGS_PER_CONTENT = 8
+
+
+class ZipfSampler:
+    """Draws ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** s."""
+
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1 / (k ** s) for k in range(1, n + 1)))
+
+    def sample(self) -> int:
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+    def share(self, top: int) -> float:
+        """Expected fraction of draws falling on the `top` most popular ranks."""
+        return self.cumulative[min(top, len(self.cumulative)) - 1] / self.cumulative[-1]
+
+
+def onion_url(index: int, seed: int) -> str:
+    """URL of link `index`: page index % PAGES_PER_SITE of site index // PAGES_PER_SITE."""
+    site, page = divmod(index, PAGES_PER_SITE)
+    digest = hashlib.sha256(f"{seed}:{site}".encode()).digest()
+    host = base64.b32encode(digest).decode("ascii").lower()[:56]
+    return f"http://{host}.onion" + (f"/page/{page}" if page else "")
+
+
+def tag_names(count: int, rng: random.Random) -> List[str]:
+    """`count` unique tag names, plain words first (the popular ranks), then compounds."""
+    names = list(WORDS[:count])
+    seen = set(names)
+    while len(names) < count:
+        name = f"{rng.choice(WORDS)}-{rng.choice(WORDS)}"
+        if rng.random() < 0.7:
+            name += f"-{rng.randrange(10 ** rng.randint(1, 4))}"
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _next_id(connection, column) -> int:
+    return (connection.execute(select(func.max(column))).scalar() or 0) + 1
+
+
+def _chunks(rows: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def generate(engine, links: int = 1_000_000, contents: int = 500_000, tags: int = 50_000,
+             zipf_s: float = 1.1, dead_fraction: float = 0.1, seed: int = 42, batch_size: int = 10_000,
+             progress: Optional[Callable[[str, int], None]] = None) -> Dict[str, int]:
+    """Insert the synthetic data set through `engine`; returns the rows written per table."""
+    if contents > links:
+        raise ValueError("contents must not exceed links")
+    rng = random.Random(seed)
+    today = datetime.date.today()
+
+    with engine.connect() as connection:
+        first_link = _next_id(connection, Links.id)
+        first_content = _next_id(connection, Content.id)
+        first_tag = _next_id(connection, Tag.id)
+
+    analysed = set(rng.sample(range(links), contents))
+    dead = min(links - contents, int(links * dead_fraction))
+    dead_links = set(rng.sample([i for i in range(links) if i not in analysed], dead)) if dead else set()
+
+    def link_rows():
+        for i in range(links):
+            row = {"id": first_link + i, "url": onion_url(i, seed), "analysed_on": None,
+                   "content_hash": None, "etag": None, "last_modified": None}
+            if i in analysed or i in dead_links:
+                row["analysed_on"] = today - datetime.timedelta(days=rng.randrange(365))
+            if i in analysed:
+                row["content_hash"] = hashlib.sha256(row["url"].encode()).hexdigest()
+                if rng.random() < 0.3:
+                    row["etag"] = '"' + row["content_hash"][:16] + '"'
+            yield row
+
+    def content_rows():
+        # Own generator, so adding verdicts left the other rows of a seed unchanged
+        verdicts = random.Random(seed + 2)
+        for n, i in enumerate(sorted(analysed)):
+            verdict = verdicts.random()
+            yield {"id": first_content + n, "url": onion_url(i, seed),
+                   "title": _text(rng, rng.randint(2, 6)).title()[:255],
+                   "description": _text(rng, rng.randint(8, 30))[:1024],
+                   "legality": None if verdict < 0.05 else verdict < 0.65}
+
+    def content_tag_rows():
+        sampler = ZipfSampler(tags, zipf_s, rng)
+        for n in range(contents):
+            count = min(MAX_TAGS_PER_CONTENT, max(1, round(rng.gauss(4, 1.5))))
+            for rank in {sampler.sample() for _ in range(count)}:
+                yield {"content_id": first_content + n, "tag_id": first_tag + rank, "priority": rng.randint(0, 5)}
+
+    def tag_rows():
+        for rank, name in enumerate(tag_names(tags, random.Random(seed + 1))):
+            yield {"id": first_tag + rank, "name": name}
+
+    written = {}
+    for table, rows in ((Tag, tag_rows()), (Links, link_rows()), (Content, content_rows()),
+                        (ContentTag, content_tag_rows())):
+        count = 0
+        for chunk in _chunks(rows, batch_size):
+            with engine.begin() as connection:
+                connection.execute(insert(table), chunk)
+            count += len(chunk)
+            if progress:
+                progress(table.__tablename__, count)
+        written[table.__tablename__] = count
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=1_000_000)
+    parser.add_argument("--contents", type=int, default=500_000)
+    parser.add_argument("--tags", type=int, default=50_000)
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="Zipf exponent of the tag popularity")
+    parser.add_argument("--dead-fraction", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    from api.db import database  # creates the schema
+
+    started = time.perf_counter()
+    written = generate(database.engine, args.links, args.contents, args.tags, args.zipf_s,
+                       args.dead_fraction, args.seed)
+    seconds = time.perf_counter() - started
+    rows = sum(written.values())
+    print(", ".join(f"{count} {table}" for table, count in written.items())
+          + f" in {seconds:.1f}s ({rows / seconds:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
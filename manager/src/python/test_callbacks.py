@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import pytest  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+from api.routes import routes  # noqa: E402
+from continous_loop import loop  # noqa: E402
+
+
+def test_result_callbacks_are_authenticated_by_signature_or_api_key(monkeypatch):
+    body = b'{"jobId": "a", "sourceUrl": "http://x.onion"}'
+    monkeypatch.setattr(routes, "SHARED_SECRET", "s3cret")
+    signature = hmac.new(b"s3cret", body, hashlib.sha256).hexdigest()
+    assert routes.callback_authenticated({"X-Signature": signature}, body)
+    assert not routes.callback_authenticated({"X-Signature": signature}, body + b" ")
+    assert not routes.callback_authenticated({}, body)
+    assert routes.callback_authenticated({"Authorization": f"Bearer {routes.API_KEY}"}, body)
+    assert not routes.callback_authenticated({"Authorization": "Bearer guess"}, body)
+
+    monkeypatch.setattr(routes, "SHARED_SECRET", None)
+    assert not routes.callback_authenticated({"X-Signature": signature}, body)
+
+
+def test_refused_early_results_stay_tracked_for_the_retry():
+    # Unauthenticated early callback: refused, and the crawler's late report still tracks the job
+    assert loop.finish_analysis("early-1") is None
+    loop.register_analysis("early-1", "http://x.onion")
+    assert loop.finish_analysis("early-1") == "http://x.onion"
+
+    # Accepted early callback: the late report must not start tracking a finished job
+    assert loop.finish_analysis("early-2", accepted_early=True) is None
+    loop.register_analysis("early-2", "http://y.onion")
+    assert "early-2" not in loop.analyse_running_jobs
+
+
+class _Request:
+    def __init__(self, body, headers):
+        self._body = body
+        self.headers = headers
+
+    async def body(self):
+        return self._body
+
+
+class _Session:
+    def __init__(self, link):
+        self.link = link
+
+    async def execute(self, statement):
+        return SimpleNamespace(scalar_one_or_none=lambda: self.link)
+
+    async def commit(self):
+        pass
+
+
+def test_crawl_results_of_unknown_jobs_need_an_authenticated_crawler():
+    report = {"url": "http://x.onion", "job_id": "gone", "content": "forged page"}
+    body = json.dumps(report).encode()
+    req = routes.CrawlResult(**report)
+    link = SimpleNamespace(url="http://x.onion", analysed_on=None, etag=None, last_modified=None, content_hash="h")
+    pending = len(loop.analyse_pending)
+
+    with pytest.raises(HTTPException) as refused:
+        asyncio.run(routes.crawl_results(req, _Request(body, {}), _Session(link)))
+    assert refused.value.status_code == 404
+    assert len(loop.analyse_pending) == pending and link.analysed_on is None
+
+    headers = {"Authorization": f"Bearer {routes.API_KEY}"}
+    assert asyncio.run(routes.crawl_results(req, _Request(body, headers), _Session(link)))
+    assert len(loop.analyse_pending) == pending + 1
+    loop.analyse_pending.pop()
+
+
+def test_unreachable_sites_do_not_cut_the_crawl_limit():
+    loop.crawler_running_jobs["dead-host"] = "http://dead.onion"
+    loop.crawl_limiter.start("dead-host")
+    errors, limit = loop.crawl_limiter.errors, loop.crawl_limiter.limit
+    req = routes.CrawlResult(url="http://dead.onion", job_id="dead-host", error="SOCKS: host unreachable")
+    link = SimpleNamespace(url="http://dead.onion", analysed_on=None, etag=None, last_modified=None, content_hash=None)
+    assert asyncio.run(routes.crawl_results(req, _Request(b"{}", {}), _Session(link)))
+    assert loop.crawl_limiter.errors == errors and loop.crawl_limiter.limit >= limit
+
+
+class _FailingSession(_Session):
+    def add(self, row):
+        pass
+
+    async def commit(self):
+        raise RuntimeError("database is gone")
+
+    async def rollback(self):
+        pass
+
+
+def test_results_that_fail_to_store_are_retried():
+    loop.register_analysis("store-fails", "http://x.onion")
+    req = routes.AnalyseResult(jobId="store-fails", title="t", description="d", tags=[], legality=True, url=None)
+    with pytest.raises(HTTPException) as failed:
+        asyncio.run(routes.analyse_results(req, _Request(b"{}", {}), _FailingSession(None)))
+    # A 5xx makes the analyzer's outbox retry, and the retry still finds the job
+    assert failed.value.status_code == 503
+    assert loop.finish_analysis("store-fails") == "http://x.onion"
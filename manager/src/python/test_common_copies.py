@@ -0,0 +1,14 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+SYNC = Path(__file__).resolve().parents[3] / "common" / "sync.py"
+
+
+@pytest.mark.skipif(not SYNC.exists(), reason="common/ is not part of this tree (e.g. in the Docker image)")
+def test_service_copies_match_common():
+    spec = importlib.util.spec_from_file_location("common_sync", SYNC)
+    sync = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sync)
+    assert [str(path) for path in sync.stale_copies()] == []
@@ -0,0 +1,116 @@
+import itertools
+import random
+from collections import deque
+
+from concurrency import AIMDLimiter
+
+
+class StandInService:
+    """Simulated downstream service: `capacity` parallel workers, FIFO queue in front of them."""
+
+    def __init__(self, capacity, service_time, rng):
+        self.capacity = capacity
+        self.service_time = service_time
+        self.rng = rng
+        self.queue = deque()
+        self.running = []  # (finishes_at, job_id)
+
+    def submit(self, job_id):
+        self.queue.append(job_id)
+
+    def step(self, now):
+        done = [job_id for finishes_at, job_id in self.running if finishes_at <= now]
+        self.running = [(f, j) for f, j in self.running if f > now]
+        while self.queue and len(self.running) < self.capacity:
+            jitter = self.rng.uniform(0.8, 1.2)
+            self.running.append((now + self.service_time * jitter, self.queue.popleft()))
+        return done
+
+
+def simulate(limiter, service, clock, seconds, capacity_at=None, dt=0.05, poll_every=1.0):
+    job_ids = itertools.count()
+    limits = []
+    next_poll = 0.0
+    while clock[0] < seconds:
+        clock[0] += dt
+        if capacity_at:
+            service.capacity = capacity_at(clock[0])
+        for job_id in service.step(clock[0]):
+            limiter.finish(job_id)
+        for _ in range(limiter.available()):
+            job_id = next(job_ids)
+            limiter.start(job_id)
+            service.submit(job_id)
+        if clock[0] >= next_poll:
+            limiter.observe_queue_depth(len(service.queue))
+            next_poll += poll_every
+        limits.append((clock[0], limiter.limit))
+    return limits
+
+
+def mean_limit(limits, start, end):
+    window = [limit for t, limit in limits if start <= t < end]
+    return sum(window) / len(window)
+
+
+def test_limit_converges_near_capacity_on_latency():
+    clock = [0.0]
+    limiter = AIMDLimiter("sim", initial=1, max_limit=200, clock=lambda: clock[0])
+    service = StandInService(capacity=20, service_time=1.0, rng=random.Random(1))
+
+    limits = simulate(limiter, service, clock, seconds=300)
+
+    settled = mean_limit(limits, 150, 300)
+    assert 10 <= settled <= 45
+    assert limiter.decreases > 0
+    assert limiter.last_decrease_reason == "latency"
+
+
+def test_queue_depth_keeps_backlog_bounded():
+    clock = [0.0]
+    limiter = AIMDLimiter("sim", initial=1, max_limit=200, queue_target=4, latency_tolerance=100,
+                          clock=lambda: clock[0])
+    service = StandInService(capacity=10, service_time=1.0, rng=random.Random(2))
+
+    limits = simulate(limiter, service, clock, seconds=300)
+
+    assert 5 <= mean_limit(limits, 150, 300) <= 20
+    assert limiter.last_decrease_reason == "queue"
+
+
+def test_follows_capacity_drop():
+    clock = [0.0]
+    limiter = AIMDLimiter("sim", initial=1, max_limit=200, clock=lambda: clock[0])
+    service = StandInService(capacity=30, service_time=1.0, rng=random.Random(3))
+
+    limits = simulate(limiter, service, clock, seconds=600,
+                      capacity_at=lambda now: 30 if now < 300 else 5)
+
+    assert mean_limit(limits, 200, 300) > 2 * mean_limit(limits, 500, 600)
+    assert mean_limit(limits, 500, 600) <= 15
+
+
+def test_errors_and_timeouts_cut_the_limit():
+    clock = [0.0]
+    limiter = AIMDLimiter("sim", initial=16, max_limit=32, clock=lambda: clock[0])
+    for job_id in range(16):
+        limiter.start(job_id)
+    clock[0] = 10.0
+    assert len(limiter.expire(timeout=5)) == 16
+    assert limiter.limit == 8
+    assert limiter.errors == 16
+
+    clock[0] = 20.0
+    limiter.failed()
+    assert limiter.limit == 4
+    assert limiter.snapshot()["last_decrease_reason"] == "error"
+
+
+def test_idle_limiter_does_not_grow():
+    clock = [0.0]
+    limiter = AIMDLimiter("sim", initial=4, clock=lambda: clock[0])
+    for job_id in range(100):
+        limiter.start(job_id)
+        clock[0] += 1
+        limiter.finish(job_id)
+    assert limiter.limit == 4
@@ -0,0 +1,73 @@
+from collections import Counter
+
+from crawlers import CrawlerRegistry, HashRing, host_of
+
+HOSTS = [f"http://{i:056x}.onion/" for i in range(5000)]
+
+
+def owners(ring):
+    return {host: ring.node_for(host_of(host)) for host in HOSTS}
+
+
+def test_ring_spreads_hosts_and_moves_only_those_of_changed_nodes():
+    ring = HashRing()
+    for n in range(4):
+        ring.add(f"http://crawler-{n}:8080")
+    before = owners(ring)
+    shares = Counter(before.values())
+    assert len(shares) == 4
+    assert max(shares.values()) < 1.35 * len(HOSTS) / 4
+
+    ring.add("http://crawler-4:8080")
+    added = owners(ring)
+    moved = [host for host in HOSTS if added[host] != before[host]]
+    # Only hosts taken over by the new node move, about a fifth of them
+    assert all(added[host] == "http://crawler-4:8080" for host in moved)
+    assert 0.12 < len(moved) / len(HOSTS) < 0.28
+
+    ring.remove("http://crawler-4:8080")
+    assert owners(ring) == before
+    ring.remove("http://crawler-1:8080")
+    removed = owners(ring)
+    assert all(removed[host] == before[host] for host in HOSTS if before[host] != "http://crawler-1:8080")
+    assert list(ring.nodes_for("x.onion"))[0] == ring.node_for("x.onion") and len(list(ring.nodes_for("x.onion"))) == 3
+
+
+def test_registry_keeps_host_affinity_and_rebalances_dead_crawlers():
+    clock = [0.0]
+    registry = CrawlerRegistry(["http://crawler-a:8080/crawl"], heartbeat_timeout=30, max_failures=2,
+                               clock=lambda: clock[0])
+    registry.heartbeat("http://crawler-b:8080", name="b", capacity=2)
+    pages = [f"http://{host}.onion/page{n}" for host in "abcdefgh" for n in range(3)]
+
+    plan = registry.assign(pages, limit=100)
+    # A host's pages all go to its owner, within the owner's free slots
+    for link, crawler in plan.items():
+        assert crawler is registry.owner(link)
+    assert Counter(crawler.name for crawler in plan.values())["b"] <= 2
+    for n, (link, crawler) in enumerate(plan.items()):
+        registry.started(crawler.url, f"job-{n}", link)
+    b_jobs = [f"job-{n}" for n, crawler in enumerate(plan.values()) if crawler.name == "b"]
+    assert registry.free() == registry.instances()[0].capacity - (len(plan) - len(b_jobs))
+
+    # b stops sending heartbeats while a keeps reporting results
+    clock[0] = 40.0
+    registry.finished("job-missing")
+    registry.heartbeat("http://crawler-a:8080")
+    released = registry.expire()
+    assert sorted(released) == sorted(b_jobs)
+    assert registry.deaths == 1 and registry.snapshot()["alive"] == 1
+    assert all(registry.owner(link).name == "crawler-a:8080" for link in pages)
+
+    # Failed dispatches kill a crawler too; a heartbeat brings it back with its hosts
+    assert registry.failed("http://crawler-a:8080") == []
+    assert len(registry.failed("http://crawler-a:8080/")) == len(plan) - len(b_jobs)
+    assert registry.owner(pages[0]) is None and registry.assign(pages, 10) == {}
+    registry.heartbeat("http://crawler-a:8080")
+    registry.heartbeat("http://crawler-b:8080")
+    assert {link: crawler.name for link, crawler in registry.assign(pages, 100).items()} == \
+        {link: crawler.name for link, crawler in plan.items()}
+
+    assert registry.remove("http://crawler-b:8080") == []
+    assert registry.remove("http://crawler-b:8080") is None
+    assert registry.deaths == 2
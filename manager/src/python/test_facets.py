@@ -0,0 +1,126 @@
+import asyncio
+import os
+import random
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import create_engine, func, select, update  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from api.db.bulk import delete_links, link_filter  # noqa: E402
+from api.db.facets import (  # noqa: E402
+    FACET_TAG, FACET_TOTAL, apply_facet_counts, count_content, count_facets, top_facets, total_key,
+)
+from api.db.maintenance import reconcile_facet_counts  # noqa: E402
+from api.db.models import Base, Content, ContentTag, FacetCount, Links, Tag  # noqa: E402
+
+
+def recount(session):
+    """Facet counts the slow way: GROUP BY over the real rows."""
+    tags = {}
+    for tag_id, legality in session.execute(
+        select(ContentTag.tag_id, Content.legality).join(Content, Content.id == ContentTag.content_id)
+    ):
+        row = tags.setdefault(tag_id, [0, 0, 0])
+        row[0] += 1
+        row[1] += legality is True
+        row[2] += legality is False
+    legalities = [legality for legality, in session.execute(select(Content.legality))]
+    total = [len(legalities), legalities.count(True), legalities.count(False)]
+    return total, tags
+
+
+def stored(session):
+    total = [0, 0, 0]
+    tags = {}
+    for facet, value, contents, legal, illegal in session.execute(
+        select(FacetCount.facet, FacetCount.value, FacetCount.contents, FacetCount.legal, FacetCount.illegal)
+    ):
+        if facet == FACET_TOTAL:
+            total = [total[0] + contents, total[1] + legal, total[2] + illegal]
+        elif contents:
+            tags[value] = [contents, legal, illegal]
+    return total, tags
+
+
+def analyse(session, url, tag_ids, legality):
+    """What /analyze-results does to a content and the facet counts."""
+    content = session.execute(select(Content).where(Content.url == url)).scalar_one_or_none()
+    counts, total = {}, total_key()
+    if content is None:
+        content = Content(url=url)
+        session.add(content)
+        session.flush()
+    else:
+        current = [tag_id for tag_id, in session.execute(
+            select(ContentTag.tag_id).where(ContentTag.content_id == content.id))]
+        count_content(counts, current, content.legality, -1, total)
+        session.execute(ContentTag.__table__.delete().where(ContentTag.content_id == content.id))
+    content.legality = legality
+    session.add_all([ContentTag(content_id=content.id, tag_id=tag_id) for tag_id in tag_ids])
+    count_content(counts, tag_ids, legality, 1, total)
+    apply_facet_counts(session, counts)
+    session.commit()
+
+
+def test_incremental_counts_follow_analyses_and_deletes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'facets.db'}")
+    Base.metadata.create_all(engine)
+    rng = random.Random(5)
+    with Session(engine) as session:
+        tags = [Tag(name=f"tag{i}") for i in range(12)]
+        session.add_all(tags + [Links(url=f"http://{i}.onion") for i in range(60)])
+        session.commit()
+        tag_ids = [tag.id for tag in tags]
+
+        for _ in range(150):
+            url = f"http://{rng.randrange(60)}.onion"
+            analyse(session, url, rng.sample(tag_ids, rng.randint(0, 4)), rng.choice([True, False, None]))
+            assert stored(session) == recount(session)
+
+        counts = delete_links(session, link_filter(url_pattern="http://1%"))
+        assert counts["contents"] > 0
+        assert stored(session) == recount(session)
+
+
+def test_reconcile_repairs_drift_and_facets_are_served(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'facets.db'}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        tags = {name: Tag(name=name) for name in ["market", "forum", "drug", "unused"]}
+        session.add_all(tags.values())
+        session.commit()
+        for i, (names, legality) in enumerate([
+            (["market", "drug"], False), (["market"], False), (["market", "forum"], True), (["forum"], None),
+        ]):
+            analyse(session, f"http://{i}.onion", [tags[name].id for name in names], legality)
+        expected = recount(session)
+        # Drift: a counted tag, a missing one, a row of a tag that is gone and a wrong total
+        session.execute(update(FacetCount).where(FacetCount.value == tags["market"].id).values(contents=10))
+        session.execute(FacetCount.__table__.delete().where(FacetCount.value == tags["forum"].id))
+        session.add_all([FacetCount(facet=FACET_TAG, value=999, contents=3, legal=0, illegal=0),
+                         FacetCount(facet=FACET_TOTAL, value=7, contents=2, legal=1, illegal=0)])
+        session.commit()
+        assert stored(session) != expected
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'facets.db'}")
+
+    async def scenario():
+        async with AsyncSession(async_engine) as session:
+            first = await reconcile_facet_counts(session, batch_size=2)
+            second = await reconcile_facet_counts(session)
+            top = await top_facets(session, 2)
+            ids = (await session.execute(select(Content.id).order_by(Content.id))).scalars().all()
+            subset = await count_facets(session, ids[:2] + [12345], 5)
+        await async_engine.dispose()
+        return first, second, top, subset
+
+    first, second, top, subset = asyncio.run(scenario())
+    assert first > 0 and second == 0
+    with Session(engine) as session:
+        assert stored(session) == expected
+        assert session.execute(select(func.count()).select_from(FacetCount)
+                               .where(FacetCount.facet == FACET_TOTAL)).scalar() == 1
+    assert top == ([4, 1, 2], [("market", [3, 1, 2]), ("forum", [2, 1, 0])])
+    assert subset == ([2, 0, 2], [("market", [2, 0, 2]), ("drug", [1, 0, 1])])
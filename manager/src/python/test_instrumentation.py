@@ -0,0 +1,59 @@
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, text
+
+import instrumentation
+
+
+def render(metric):
+    return "\n".join(metric.render())
+
+
+def test_counter_and_histogram_exposition():
+    requests = instrumentation.Counter("test_requests_total", "Requests", ["route"])
+    requests.labels("/a").inc()
+    requests.labels("/a").inc(2)
+    assert 'test_requests_total{route="/a"} 3' in render(requests)
+
+    latency = instrumentation.Histogram("test_latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+    lines = render(latency).splitlines()
+    assert 'test_latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{le="1"} 2' in lines
+    assert 'test_latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "test_latency_seconds_count 3" in lines
+    assert "test_latency_seconds_sum 5.55" in lines
+
+
+def test_label_sets_are_capped():
+    fetches = instrumentation.Counter("test_fetches_total", "Fetches", ["host"])
+    with patch.object(instrumentation, "MAX_LABEL_SETS", 2):
+        for host in ("a", "b", "c", "d"):
+            fetches.labels(host).inc()
+    output = render(fetches)
+    assert 'host="c"' not in output
+    assert 'test_fetches_total{host="other"} 2' in output
+
+
+def test_collect_callbacks_and_failing_metric():
+    registry = instrumentation.Registry()
+    registry.register(instrumentation.Gauge("test_queue", "Queue", ["state"], collect=lambda: {"queued": 4}))
+    registry.register(instrumentation.Gauge("test_broken", "Broken", collect=lambda: 1 / 0))
+    output = registry.render()
+    assert 'test_queue{state="queued"} 4' in output
+    assert "# test_broken unavailable" in output
+
+
+def test_engine_statements_are_timed():
+    engine = create_engine("sqlite://")
+    instrumentation.instrument_engine(engine, "test")
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        try:
+            conn.execute(text("SELECT * FROM missing"))
+        except Exception:
+            pass
+    assert instrumentation.DB_QUERY_SECONDS.labels("test", "SELECT").counts[-1] == 0
+    assert sum(instrumentation.DB_QUERY_SECONDS.labels("test", "SELECT").counts) == 1
+    assert instrumentation.DB_QUERY_ERRORS.labels("test", "SELECT").value == 1
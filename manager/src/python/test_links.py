@@ -0,0 +1,80 @@
+import asyncio
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import pytest  # noqa: E402
+from sqlalchemy import create_engine, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+import numpy as np  # noqa: E402
+
+from api.db import bulk  # noqa: E402
+from api.db.bulk import check_delete_pattern, delete_links, insert_links, link_filter  # noqa: E402
+from api.db.models import Base, Content, Links  # noqa: E402
+from api.db.vector_index import IvfIndex  # noqa: E402
+from api.routes.links import _iter_lines  # noqa: E402
+
+
+class _Upload:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def lines(chunks, max_line):
+    async def collect():
+        return [line async for line in _iter_lines(_Upload(chunks), max_line)]
+    return asyncio.run(collect())
+
+
+def test_every_insert_path_stores_normalized_urls():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(Links(url="HTTP://Example.ONION/#top"))
+        session.commit()
+        assert insert_links(session, ["http://example.onion", "other.onion/", "not a url"]) == 1
+        session.commit()
+        assert sorted(session.scalars(select(Links.url))) == ["http://example.onion", "http://other.onion"]
+
+        link = session.scalars(select(Links).where(Links.url == "http://other.onion")).one()
+        link.url = "https://Other.onion:8443/page"
+        assert link.url == "https://other.onion:8443/page"
+        with pytest.raises(ValueError):
+            link.url = "ftp://other.onion"
+
+
+def test_deleted_contents_leave_the_vector_index(tmp_path, monkeypatch):
+    index = IvfIndex(str(tmp_path / "index"), dim=8)
+    monkeypatch.setattr(bulk, "vector_index", index)
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        urls = [f"http://{name}.onion" for name in "abc"]
+        session.add_all([Links(url=url) for url in urls] + [Content(id=n, url=url) for n, url in enumerate(urls)])
+        session.commit()
+        index.add_many((n, np.full(8, n + 1, dtype=np.int8)) for n in range(3))
+        assert delete_links(session, link_filter(url_pattern="http://b%"))["contents"] == 1
+        assert sorted(index.row_of) == [0, 2]
+
+
+def test_import_lines_are_capped():
+    assert lines([b"a.onion\nb.on", b"ion\r\nc.onion"], 16) == ["a.onion", "b.onion", "c.onion"]
+    # A line without newline is dropped as it grows, not buffered until the upload ends
+    assert lines([b"x" * 10, b"x" * 10, b"x" * 10, b"\nd.onion\n", b"y" * 20], 16) == [None, "d.onion", None]
+    assert lines([b"e.onion\n" + b"z" * 17 + b"\nf.onion"], 16) == ["e.onion", None, "f.onion"]
+
+
+@pytest.mark.parametrize("pattern", ["%", "%%", "_%", " % ", "http://%", "http%.onion%", "https://www.%/%"])
+def test_bulk_delete_rejects_patterns_matching_every_link(pattern):
+    with pytest.raises(ValueError):
+        check_delete_pattern(pattern)
+
+
+def test_bulk_delete_accepts_specific_patterns():
+    for pattern in (None, "%.onion/forum%", "http://abc%", "%market%"):
+        check_delete_pattern(pattern)
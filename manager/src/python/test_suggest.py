@@ -0,0 +1,58 @@
+import os
+import random
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from api.db.suggest import TAG_SUGGEST_LIMIT, TagSuggester  # noqa: E402
+from api.db.tags import fold_tag  # noqa: E402
+
+
+def brute_force(tags, prefix, limit):
+    key = fold_tag(prefix)
+    matches = [(-uses, fold_tag(name), name) for name, uses in tags.values() if uses > 0 and fold_tag(name).startswith(key)]
+    return [(name, -uses) for uses, _, name in sorted(matches)[:limit]]
+
+
+def test_suggest_ranks_by_uses_and_ignores_case_and_separators():
+    suggester = TagSuggester(scan_limit=2)
+    suggester.load([
+        (1, "drug", 50), (2, "drug market", 80), (3, "Drugstore", 5), (4, "forum", 99), (5, "dread", 0),
+    ])
+    assert suggester.suggest("DR") == [("drug market", 80), ("drug", 50), ("Drugstore", 5)]
+    assert suggester.suggest("drug_m") == [("drug market", 80)]
+    assert suggester.suggest("drug ") == [("drug market", 80)]
+    assert suggester.suggest("dr", limit=1) == [("drug market", 80)]
+    assert suggester.suggest("x") == [] and suggester.suggest("--") == []
+    assert len(suggester) == 4
+    assert suggester.tag_names() == {"drug": 1, "drug market": 2, "Drugstore": 3, "forum": 4}
+
+
+def test_record_uses_keeps_cached_top_lists_current():
+    rng = random.Random(7)
+    words = ["market", "mirror", "monero", "mixer", "music", "forum", "fraud"]
+    suggester = TagSuggester(scan_limit=4)
+    tags = {}
+    for tag_id in range(1, 301):
+        tags[tag_id] = (f"{rng.choice(words)} {rng.choice(words)} {tag_id}", rng.randint(1, 30))
+    suggester.load((tag_id, name, uses) for tag_id, (name, uses) in tags.items())
+    prefixes = ["m", "mi", "mar", "market m", "f", "fraud", "music fo"]
+    for prefix in prefixes:
+        assert suggester.suggest(prefix, TAG_SUGGEST_LIMIT) == brute_force(tags, prefix, TAG_SUGGEST_LIMIT)
+
+    next_id = 301
+    for _ in range(2000):
+        if rng.random() < 0.1:
+            tag_id, name, next_id = next_id, f"{rng.choice(words)} new {next_id}", next_id + 1
+            tags[tag_id] = (name, 0)
+        else:
+            tag_id = rng.choice(list(tags))
+            name = tags[tag_id][0]
+        delta = rng.choice([1, 1, 2, -1, -3])
+        if tags[tag_id][1] <= 0 and delta < 0:
+            continue
+        suggester.record_uses([(tag_id, name, delta)])
+        tags[tag_id] = (name, max(0, tags[tag_id][1] + delta))
+        prefix = rng.choice(prefixes)
+        assert suggester.suggest(prefix, TAG_SUGGEST_LIMIT) == brute_force(tags, prefix, TAG_SUGGEST_LIMIT)
+    assert len(suggester) == sum(1 for _, uses in tags.values() if uses > 0)
+    assert suggester.tag_names() == {name: tag_id for tag_id, (name, uses) in tags.items() if uses > 0}
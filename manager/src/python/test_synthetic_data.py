@@ -0,0 +1,66 @@
+import os
+import random
+from collections import Counter
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import create_engine, func, select  # noqa: E402
+
+import synthetic_data  # noqa: E402
+from api.db.models import Base, Content, ContentTag, Links, Tag  # noqa: E402
+
+
+def make_engine():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def test_generate_writes_consistent_rows():
+    engine = make_engine()
+    written = synthetic_data.generate(engine, links=400, contents=200, tags=100, dead_fraction=0.1, batch_size=64)
+    assert written["links"] == 400 and written["contents"] == 200 and written["tags"] == 100
+
+    with engine.connect() as conn:
+        link_urls = set(conn.execute(select(Links.url)).scalars())
+        content_urls = set(conn.execute(select(Content.url)).scalars())
+        never_crawled = conn.execute(select(func.count()).where(Links.analysed_on == None)).scalar()  # noqa: E711
+        tag_ids = set(conn.execute(select(Tag.id)).scalars())
+        pairs = conn.execute(select(ContentTag.content_id, ContentTag.tag_id)).all()
+
+    assert len(link_urls) == 400
+    assert content_urls <= link_urls
+    assert never_crawled == 400 - 200 - 40
+    assert {tag_id for _, tag_id in pairs} <= tag_ids
+    per_content = Counter(content_id for content_id, _ in pairs)
+    assert len(per_content) == 200
+    assert max(per_content.values()) <= synthetic_data.MAX_TAGS_PER_CONTENT
+
+
+def test_generate_is_deterministic_and_appends_after_existing_ids():
+    first, second = make_engine(), make_engine()
+    with second.begin() as conn:
+        conn.execute(Links.__table__.insert(), [{"url": "http://seed.onion"}])
+    synthetic_data.generate(first, links=50, contents=20, tags=30, seed=3)
+    synthetic_data.generate(second, links=50, contents=20, tags=30, seed=3)
+
+    query = select(Links.url, Links.analysed_on).where(Links.url != "http://seed.onion").order_by(Links.url)
+    with first.connect() as a, second.connect() as b:
+        assert a.execute(query).all() == b.execute(query).all()
+        assert b.execute(select(func.min(Links.id)).where(Links.url != "http://seed.onion")).scalar() == 2
+
+
+def test_tag_popularity_is_zipfian():
+    engine = make_engine()
+    synthetic_data.generate(engine, links=3000, contents=3000, tags=1000, zipf_s=1.1)
+    with engine.connect() as conn:
+        usage = Counter(conn.execute(select(ContentTag.tag_id)).scalars())
+    ranked = [count for _, count in usage.most_common()]
+    # The most popular tag is on a large share of contents, most tags on a few
+    assert usage[1] == ranked[0]
+    assert ranked[0] > 0.15 * 3000
+    assert sorted(ranked)[len(ranked) // 2] <= 5
+
+    sampler = synthetic_data.ZipfSampler(1000, 1.1, random.Random(1))
+    draws = Counter(sampler.sample() for _ in range(20000))
+    assert abs(draws[0] / 20000 - sampler.share(1)) < 0.02
@@ -0,0 +1,127 @@
+import asyncio
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import create_engine, select  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from api.db.models import Base, Content, ContentTag, Tag, TagAlias  # noqa: E402
+from api.db.tags import TagResolver, merge_duplicate_tags, normalize_tag  # noqa: E402
+
+
+def make_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'tags.db'}")
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def test_normalize_tag_folds_case_separators_and_plurals():
+    assert normalize_tag("Drugs") == normalize_tag("drug") == "drug"
+    assert normalize_tag("drug-market") == normalize_tag("Drugs_Market") == normalize_tag(" drugs  market ") == "drug market"
+    assert normalize_tag("Communities") == "community"
+    assert normalize_tag("boxes") == "box"
+    assert normalize_tag("Videos") == "video"
+    assert normalize_tag("News") == "news"
+    assert normalize_tag("access") == "access"
+    # Acronyms, -os words and short words are no plurals
+    assert normalize_tag("DDoS") == normalize_tag("ddos") == "ddos"
+    assert normalize_tag("SOCKS") == normalize_tag("socks") == "socks"
+    assert normalize_tag("macOS") == "macos"
+    assert normalize_tag("https") == normalize_tag("HTTPS") == "https"
+    assert normalize_tag("VPNs") == "vpns"
+    assert normalize_tag("guns") == "guns"
+    assert normalize_tag("Chaos") == "chaos"
+    assert normalize_tag("--!!") is None
+    assert len(normalize_tag("word " * 30)) <= 50
+
+
+def test_resolver_reuses_canonical_tags_and_caches_aliases(tmp_path):
+    engine = make_engine(tmp_path)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'tags.db'}")
+    resolver = TagResolver()
+
+    async def resolve(tags):
+        async with AsyncSession(async_engine) as session:
+            ids = await resolver.resolve(session, tags)
+            await session.commit()
+            return ids
+
+    async def scenario():
+        first = await resolve(["drug", "Drugs", "Drugs", "Drug-Market"])
+        second = await resolve(["drugs market", "DRUG"])
+        third = await resolve(["drug", "DDoS"])
+        await async_engine.dispose()
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert len(first) == 2
+    assert second == [first[1], first[0]]
+    assert third[0] == first[0]
+    with Session(engine) as session:
+        # Tags keep the most common real spelling; the folded keys only live in the aliases
+        assert sorted(session.execute(select(Tag.name)).scalars()) == ["DDoS", "Drug-Market", "Drugs"]
+        assert sorted(session.execute(select(TagAlias.alias)).scalars()) == ["ddos", "drug", "drug market"]
+    assert resolver._get("drug") == first[0]
+
+
+def test_resolver_finds_unaliased_tags_by_spelling(tmp_path):
+    engine = make_engine(tmp_path)
+    with Session(engine) as session:
+        session.add(Tag(name="DDoS"))
+        session.commit()
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'tags.db'}")
+
+    async def scenario():
+        async with AsyncSession(async_engine) as session:
+            ids = await TagResolver().resolve(session, ["ddos", "DDoS"])
+            await session.commit()
+        await async_engine.dispose()
+        return ids
+
+    ids = asyncio.run(scenario())
+    with Session(engine) as session:
+        assert session.execute(select(Tag.id, Tag.name)).all() == [(ids[0], "DDoS")]
+
+
+def test_merge_duplicate_tags_moves_contents_to_one_tag(tmp_path):
+    engine = make_engine(tmp_path)
+    with Session(engine) as session:
+        tags = {name: Tag(name=name) for name in ["Drugs", "drug", "DRUG", "Markets", "forum", "btc", "bitcoin"]}
+        session.add_all(tags.values())
+        session.flush()
+        session.add(TagAlias(alias="btc", tag_id=tags["bitcoin"].id))
+        session.add(TagAlias(alias="drug", tag_id=tags["drug"].id))
+        contents = [Content(url=f"http://{i}.onion") for i in range(4)]
+        session.add_all(contents)
+        session.flush()
+        for content, names in zip(contents, [["Drugs", "drug"], ["DRUG", "Markets"], ["Markets", "btc"], ["forum", "Drugs"]]):
+            session.add_all([ContentTag(content_id=content.id, tag_id=tags[name].id) for name in names])
+        session.commit()
+
+        dry = merge_duplicate_tags(session, dry_run=True)
+        # drug/Drugs/DRUG -> one tag, btc -> its alias target bitcoin
+        assert dry["tags_before"] == 7 and dry["tags_after"] == 4
+        assert len(session.execute(select(Tag)).scalars().all()) == 7
+
+        counts = merge_duplicate_tags(session)
+        assert counts["tags_after"] == 4
+        # The alias target of "drug" survives, named like the most used spelling "Drugs"
+        assert counts["tags_merged"] == 3 and counts["tags_renamed"] == 1
+        assert counts["content_tags_before"] == 8 and counts["content_tags_after"] == 7
+
+        names = {tag.id: tag.name for tag in session.execute(select(Tag)).scalars()}
+        assert sorted(names.values()) == ["Drugs", "Markets", "bitcoin", "forum"]
+        tagged = {}
+        for content_id, tag_id in session.execute(select(ContentTag.content_id, ContentTag.tag_id)):
+            tagged.setdefault(content_id, set()).add(names[tag_id])
+        assert tagged == {
+            contents[0].id: {"Drugs"}, contents[1].id: {"Drugs", "Markets"},
+            contents[2].id: {"Markets", "bitcoin"}, contents[3].id: {"forum", "Drugs"},
+        }
+        aliases = dict(session.execute(select(TagAlias.alias, TagAlias.tag_id)).all())
+        assert aliases["drug"] == tags["drug"].id and names[aliases["drug"]] == "Drugs"
+        assert names[aliases["btc"]] == "bitcoin" and names[aliases["market"]] == "Markets"
+
+        assert merge_duplicate_tags(session)["tags_merged"] == 0
@@ -0,0 +1,53 @@
+from tracing import PipelineTracer
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_stage_durations_across_hops():
+    clock = Clock()
+    tracer = PipelineTracer(clock=clock)
+    trace_id = tracer.start("http://abc.onion", picked=999.0)
+    tracer.merge(trace_id, {"crawl_started": 1002.0, "fetched": 1010.0, "bogus": 1.0})
+    clock.now = 1011.0
+    tracer.mark(trace_id, "crawl_reported")
+    # Relay mode: the manager submits the page to the analyzer later
+    clock.now = 1015.0
+    tracer.mark(trace_id, "analysis_submitted")
+    tracer.merge(trace_id, {"analysis_started": 1020.0, "analysis_done": 1050.0})
+    clock.now = 1051.0
+    tracer.mark(trace_id, "analysis_reported")
+    clock.now = 1051.5
+    tracer.mark(trace_id, "committed")
+    tracer.finish(trace_id)
+
+    stages = tracer.percentiles()["stages"]
+    expected = {
+        "loop_pickup": 1.0, "crawl_queue": 2.0, "fetch": 8.0, "crawl_callback": 1.0, "analysis_pending": 4.0,
+        "analysis_queue": 5.0, "analysis": 30.0, "delivery": 1.0, "db_commit": 0.5, "total": 52.5,
+    }
+    assert {stage: values["p50"] for stage, values in stages.items()} == expected
+    assert tracer.percentiles()["open_traces"] == 0
+
+
+def test_direct_mode_ordering_and_window():
+    clock = Clock()
+    tracer = PipelineTracer(window=60, clock=clock)
+    for i in range(100):
+        trace_id = tracer.start("http://abc.onion")
+        # The crawler submitted to the analyzer before reporting to the manager
+        tracer.merge(trace_id, {"crawl_started": clock.now, "fetched": clock.now + i,
+                                "analysis_submitted": clock.now + i + 0.1})
+        tracer.mark(trace_id, "crawl_reported", clock.now + i + 0.2)
+    fetch = tracer.percentiles()["stages"]["fetch"]
+    assert (fetch["count"], fetch["p50"], fetch["p95"], fetch["p99"]) == (100, 49, 94, 98)
+    assert tracer.percentiles()["stages"]["analysis_pending"] == {"count": 0}
+
+    clock.now += 61
+    assert tracer.percentiles()["stages"]["fetch"] == {"count": 0}
+    assert tracer.percentiles(window=120)["stages"]["fetch"]["count"] == 100
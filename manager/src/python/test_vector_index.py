@@ -0,0 +1,89 @@
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import numpy as np  # noqa: E402
+
+from api.db.embeddings import embed_content, embed_text, from_bytes, quantize, to_bytes  # noqa: E402
+from api.db.vector_index import IvfIndex  # noqa: E402
+
+
+def clustered(count, dim, clusters, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(clusters, size=count)] + 0.5 * rng.normal(size=(count, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def test_embeddings_relate_spellings_and_round_trip():
+    query = embed_text("stolen credit cards")
+    carding = embed_content("Carding forum", "fresh dumps and cvv", ["carding", "fraud"])
+    drugs = embed_content("Drug market", "weed and pills", ["drugs", "market"])
+    assert query @ carding > query @ drugs
+    assert abs(np.linalg.norm(carding) - 1) < 1e-5
+    stored = from_bytes(to_bytes(carding))
+    assert stored.dtype == np.int8 and len(stored) == len(carding)
+    assert np.array_equal(stored, quantize(carding))
+
+
+def test_flat_index_search_replace_remove_and_reopen(tmp_path):
+    vectors = clustered(500, 64, 5)
+    index = IvfIndex(str(tmp_path / "index"), dim=64)
+    index.add_many((content_id, quantize(vector)) for content_id, vector in enumerate(vectors))
+    assert len(index) == 500
+    assert index.search(vectors[42], k=1)[0][0] == 42
+
+    index.add(42, quantize(vectors[7]))
+    index.remove(7)
+    hits = [content_id for content_id, _ in index.search(vectors[7], k=3)]
+    assert hits[0] == 42 and 7 not in hits
+    assert len(index) == 499
+    index.close()
+
+    reopened = IvfIndex(str(tmp_path / "index"), dim=64).open()
+    assert len(reopened) == 499 and reopened.count == 501
+    assert reopened.search(vectors[7], k=1)[0][0] == 42
+
+
+def test_trained_index_recall_and_rebuild(tmp_path):
+    vectors = clustered(4000, 64, 40, seed=1)
+    index = IvfIndex(str(tmp_path / "index"), dim=64)
+    index.add_many((content_id, quantize(vector)) for content_id, vector in enumerate(vectors[:3000]))
+    assert index.train(nlist=32) == 32
+    # Vectors added after training go straight to their nearest list
+    index.add_many((content_id, quantize(vector)) for content_id, vector in enumerate(vectors[3000:], start=3000))
+    assert index.stats()["unassigned"] == 0
+
+    queries = clustered(4050, 64, 40, seed=1)[4000:]
+    # Recall against an exact search over the same int8 vectors
+    stored = np.stack([quantize(vector) for vector in vectors]).astype(np.float32)
+    exact = np.argsort(-(queries @ stored.T), axis=1)[:, :10]
+    found = [{content_id for content_id, _ in index.search(query, k=10, nprobe=8)} for query in queries]
+    recall = np.mean([len(hits & set(truth)) / 10 for hits, truth in zip(found, exact.tolist())])
+    assert recall > 0.9
+
+    assert index.rebuild((content_id, quantize(vectors[content_id])) for content_id in range(0, 4000, 2)) == 2000
+    assert index.count == 2000 and index.stats()["lists"] > 1
+    assert all(content_id % 2 == 0 for content_id, _ in index.search(queries[0], k=20))
+
+
+def test_rebuild_replays_updates_made_while_reading(tmp_path):
+    vectors = clustered(300, 64, 3, seed=2)
+    index = IvfIndex(str(tmp_path / "index"), dim=64)
+    index.add_many((content_id, quantize(vector)) for content_id, vector in enumerate(vectors[:200]))
+
+    def stored():
+        for content_id in range(200):
+            if content_id == 100:
+                # Analysed and deleted after the database read started
+                index.add(250, quantize(vectors[250]))
+                index.remove(5)
+            yield content_id, quantize(vectors[content_id])
+
+    assert index.rebuild(stored()) == 200
+    assert index.search(vectors[250], k=1)[0][0] == 250
+    assert 5 not in index.row_of
+    # Nothing is journalled once the rebuild is done
+    index.add(251, quantize(vectors[251]))
+    assert index._journal is None and len(index) == 201
@@ -0,0 +1,143 @@
+"""
+End-to-end latency tracing of links through the pipeline.
+
+The loop opens a trace when it dispatches a link to the crawler. The trace id
+travels with the crawl job, the /crawl-results report, the analyzer job and
+the /analyze-results callback; every hop adds wall-clock timestamps of the
+events it sees:
+
+    picked              loop selected the link            (manager)
+    dispatched          crawl job POSTed                   (manager)
+    crawl_started       crawler thread picked the URL up   (crawler)
+    fetched             response received through Tor      (crawler)
+    crawl_reported      /crawl-results received            (manager)
+    analysis_submitted  page POSTed to the analyzer        (manager in relay, crawler in direct mode)
+    analysis_started    analyzer job started               (analyzer)
+    analysis_done       analysis (LLM) finished            (analyzer)
+    analysis_reported   /analyze-results received          (manager)
+    committed           Content row committed              (manager)
+
+A stage is the time between two of these events. Its duration is recorded as
+soon as both ends are known, so crawls that end early (errors, unchanged
+pages) still contribute their crawl stages. Negative durations (e.g. the
+direct-mode analysis submission preceding the crawl report, or clock skew
+between containers) are ignored.
+
+Environment variables:
+- TRACE_WINDOW_SECONDS : Optional. Sliding window of the reported percentiles. Defaults to 3600.
+- TRACE_MAX_SAMPLES    : Optional. Samples kept per stage. Defaults to 10000.
+- TRACE_OPEN_LIMIT     : Optional. Unfinished traces kept before the oldest are dropped. Defaults to 10000.
+"""
+
+import math
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+import instrumentation
+
+TRACE_WINDOW_SECONDS = float(os.getenv("TRACE_WINDOW_SECONDS", "3600"))
+TRACE_MAX_SAMPLES = int(os.getenv("TRACE_MAX_SAMPLES", "10000"))
+TRACE_OPEN_LIMIT = int(os.getenv("TRACE_OPEN_LIMIT", "10000"))
+
+# stage: (start event, end event)
+STAGES = OrderedDict([
+    ("loop_pickup", ("picked", "dispatched")),
+    ("crawl_queue", ("dispatched", "crawl_started")),
+    ("fetch", ("crawl_started", "fetched")),
+    ("crawl_callback", ("fetched", "crawl_reported")),
+    ("analysis_pending", ("crawl_reported", "analysis_submitted")),
+    ("analysis_queue", ("analysis_submitted", "analysis_started")),
+    ("analysis", ("analysis_started", "analysis_done")),
+    ("delivery", ("analysis_done", "analysis_reported")),
+    ("db_commit", ("analysis_reported", "committed")),
+    ("total", ("picked", "committed")),
+])
+EVENTS = {event for pair in STAGES.values() for event in pair}
+
+STAGE_SECONDS = instrumentation.histogram(
+    "manager_pipeline_stage_seconds", "Duration of pipeline stages of traced links", ["stage"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200),
+)
+
+
+def _percentile(ordered, q: float) -> float:
+    """Nearest-rank percentile of a sorted, non-empty list."""
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+class PipelineTracer:
+    def __init__(self, window: float = TRACE_WINDOW_SECONDS, max_samples: int = TRACE_MAX_SAMPLES,
+                 open_limit: int = TRACE_OPEN_LIMIT, clock=time.time):
+        self.window = window
+        self.open_limit = open_limit
+        self.clock = clock
+        self._open: "OrderedDict[str, Dict]" = OrderedDict()
+        self._samples = {stage: deque(maxlen=max_samples) for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def start(self, url: str, picked: Optional[float] = None) -> str:
+        """Open a trace for a link about to be dispatched; returns its id."""
+        trace_id = uuid.uuid4().hex
+        now = self.clock()
+        with self._lock:
+            self._open[trace_id] = {"url": url, "events": {"picked": picked or now, "dispatched": now}, "done": set()}
+            while len(self._open) > self.open_limit:
+                self._open.popitem(last=False)
+            self._record(self._open[trace_id])
+        return trace_id
+
+    def mark(self, trace_id: Optional[str], event: str, at: Optional[float] = None) -> None:
+        self.merge(trace_id, {event: at or self.clock()})
+
+    def merge(self, trace_id: Optional[str], events: Optional[Dict[str, float]]) -> None:
+        """Add timestamps reported by a hop; unknown traces and events are ignored."""
+        if not trace_id or not events:
+            return
+        with self._lock:
+            trace = self._open.get(trace_id)
+            if trace is None:
+                return
+            for event, at in events.items():
+                if event in EVENTS and isinstance(at, (int, float)):
+                    trace["events"].setdefault(event, float(at))
+            self._record(trace)
+
+    def finish(self, trace_id: Optional[str]) -> None:
+        """Close a trace once the link will not make further progress."""
+        if trace_id:
+            with self._lock:
+                self._open.pop(trace_id, None)
+
+    def _record(self, trace: Dict) -> None:
+        events, now = trace["events"], self.clock()
+        for stage, (start, end) in STAGES.items():
+            if stage in trace["done"] or start not in events or end not in events:
+                continue
+            trace["done"].add(stage)
+            duration = events[end] - events[start]
+            if duration >= 0:
+                self._samples[stage].append((now, duration))
+                STAGE_SECONDS.labels(stage).observe(duration)
+
+    def percentiles(self, window: Optional[float] = None) -> Dict:
+        """Sample count and p50/p95/p99 in seconds per stage over the last `window` seconds."""
+        since = self.clock() - (window or self.window)
+        with self._lock:
+            samples = {stage: [d for at, d in values if at >= since] for stage, values in self._samples.items()}
+            open_traces = len(self._open)
+        stages = {}
+        for stage, durations in samples.items():
+            durations.sort()
+            stages[stage] = {"count": len(durations)}
+            if durations:
+                stages[stage].update({
+                    f"p{q}": round(_percentile(durations, q), 3) for q in (50, 95, 99)
+                })
+        return {"window_seconds": window or self.window, "open_traces": open_traces, "stages": stages}
+
+
+tracer = PipelineTracer()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+End-to-end throughput benchmark of the manager, crawler and analyzer.
+
+Runs the three services as uvicorn subprocesses on free local ports, the
+manager on a temporary SQLite database, against the stand-ins of standins.py:
+a Tor replacement serving synthetic onion pages with configurable latency and
+failure rate, and a mock OpenAI endpoint for the analyzer.
+
+The synthetic URLs are imported through POST /links/import, the loop is
+started and the run ends once every crawled page has been analysed and
+committed (or after --timeout, or --stall seconds without progress). Reported:
+
+- pages/min     : analysed pages committed per minute of loop runtime
+- crawls/min    : crawl reports (including failed fetches) per minute
+- stage latency : p50/p95/p99 per pipeline stage from the manager's /pipeline-latency
+- peak RSS      : high-water mark of each service process (Linux, /proc)
+
+Every run appends a JSON line (commit, workload, results) to --output and is
+compared with the previous run of the same workload, so regressions show up
+run over run; with --fail-on-regression a drop in pages/min or a rise in total
+p95 or peak RSS beyond --tolerance exits with status 1.
+
+Usage:
+  python3 tests/bench_e2e.py [--sites 1000] [--pages-per-site 2] [--latency 0.5] [--failure-rate 0.05]
+                             [--llm-latency 1.0] [--mode relay|direct] [--output bench_e2e.jsonl]
+
+The crawler reaches the stand-in through socks5h, as it reaches Tor, which
+needs PySocks from the crawler requirements; --proxy http avoids it.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Optional, Tuple
+
+import requests
+
+from standins import MockLLM, OnionSites, TorStandIn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_KEY = "changeme"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Service:
+    """One service as a uvicorn subprocess, logging to <workdir>/<name>.log."""
+
+    def __init__(self, name: str, directory: str, app: str, env: Dict[str, str], workdir: str):
+        self.name = name
+        self.directory = os.path.join(ROOT, directory)
+        self.app = app
+        self.port = free_port()
+        self.env = env
+        self.log_path = os.path.join(workdir, f"{name}.log")
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> None:
+        with open(self.log_path, "w") as log:
+            self.process = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", self.app, "--host", "127.0.0.1", "--port", str(self.port),
+                 "--log-level", "warning"],
+                cwd=self.directory, env={**os.environ, **self.env}, stdout=log, stderr=subprocess.STDOUT,
+            )
+
+    def wait_ready(self, timeout: float = 60) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if requests.get(self.url + "/metrics", timeout=1).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        with open(self.log_path) as log:
+            tail = log.read()[-2000:]
+        raise SystemExit(f"{self.name} did not start (see {self.log_path}):\n{tail}")
+
+    def peak_rss_mib(self) -> Optional[float]:
+        """VmHWM of the running process, or None where /proc is unavailable."""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+        return None
+
+    def stop(self) -> None:
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+def progress(db_path: str) -> Dict[str, int]:
+    """Links in the database (imported plus the manager's seed links), links reported by the crawler
+    and analysed contents committed so far."""
+    with sqlite3.connect(db_path, timeout=10) as db:
+        links, crawled = db.execute("SELECT COUNT(*), COUNT(analysed_on) FROM links").fetchone()
+        analysed = db.execute("SELECT COUNT(*) FROM contents").fetchone()[0]
+    return {"links": links, "crawled": crawled, "analysed": analysed}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, workdir: str) -> Dict:
+    sites = OnionSites(args.sites, args.pages_per_site, args.page_kb * 1024)
+    urls = sites.urls()
+    tor = TorStandIn(sites, args.latency, args.jitter, args.failure_rate).start()
+    llm = MockLLM(args.llm_latency, args.llm_jitter, args.llm_failure_rate).start()
+
+    common = {"PYTHONUNBUFFERED": "1", "API_KEY": API_KEY, "SHARED_SECRET": API_KEY, "PROFILE_DIR": os.path.join(workdir, "profiles")}
+    db_path = os.path.join(workdir, "manager.db")
+    manager = Service("manager", "manager/src/python", "main:app", {
+        **common,
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "VECTOR_INDEX_DIR": os.path.join(workdir, "vector_index"),
+        "PIPELINE_MODE": args.mode,
+        "CRAWL_CONCURRENCY": str(args.crawl_concurrency),
+        "CRAWL_CONCURRENCY_MAX": str(args.crawl_concurrency_max),
+        "ANALYSE_CONCURRENCY": str(args.analyse_concurrency),
+        "ANALYSE_CONCURRENCY_MAX": str(args.analyse_concurrency_max),
+        "QUEUE_POLL_INTERVAL": "1",
+    }, workdir)
+    crawler = Service("crawler", "crawler/src/fastapi", "main:app", {
+        **common,
+        "TOR_HOST": "127.0.0.1",
+        "TOR_CONTROL_PORT": str(tor.control_port),
+        "TOR_PROXY": f"{'socks5h' if args.proxy == 'socks5h' else 'http'}://127.0.0.1:{tor.proxy_port}",
+        "MANAGER_URL": f"{manager.url}/crawl-results",
+        "ANALYZER_API_KEY": API_KEY,
+        "ARCHIVE_DIR": os.path.join(workdir, "archive"),
+    }, workdir)
+    analyzer = Service("analyzer", "data-analysis/src", "app:app", {
+        **common,
+        "OPENAI_API_KEY": "" if args.no_llm else "bench",
+        "OPENAI_BASE_URL": llm.base_url,
+        "CALLBACK_URL": f"{manager.url}/analyze-results",
+        "OUTBOX_PATH": os.path.join(workdir, "outbox.sqlite3"),
+        "JOB_STORE_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "LOCAL_CLASSIFIER_PATH": "",
+    }, workdir)
+    manager.env["CRAWLER_URL"] = f"{crawler.url}/crawl"
+    manager.env["ANALYZER_URL"] = f"{analyzer.url}/analyze"
+    crawler.env["ANALYZER_URLS"] = f"{analyzer.url}/analyze"
+    services = [manager, crawler, analyzer]
+
+    try:
+        for service in services:
+            service.start()
+        for service in services:
+            service.wait_ready()
+
+        response = requests.post(f"{manager.url}/links/import", params={"format": "text"},
+                                 data="\n".join(urls).encode("utf-8"), timeout=300)
+        response.raise_for_status()
+        print(f"Imported {response.json()['inserted']} links; logs and data in {workdir}")
+
+        requests.post(f"{manager.url}/start-loop", timeout=10).raise_for_status()
+        started = last_change = time.monotonic()
+        last = progress(db_path)
+        last_print = 0.0
+        complete = False
+        while True:
+            time.sleep(args.poll)
+            now = time.monotonic()
+            current = progress(db_path)
+            if current != last:
+                last, last_change = current, now
+            if now - last_print >= 10:
+                last_print = now
+                print(f"  [{now - started:6.0f}s] crawled {current['crawled']}/{current['links']}  "
+                      f"analysed {current['analysed']}/{len(tor.served_urls)}")
+            if current["crawled"] >= current["links"] and current["analysed"] >= len(tor.served_urls):
+                complete = True
+                break
+            if now - started > args.timeout or now - last_change > args.stall:
+                break
+        runtime = last_change - started
+
+        requests.post(f"{manager.url}/stop-loop", timeout=10)
+        latency = requests.get(f"{manager.url}/pipeline-latency", params={"window": 86400}, timeout=10).json()
+        loop_status = requests.get(f"{manager.url}/loop-status", timeout=10).json()
+        peak_rss = {service.name: service.peak_rss_mib() for service in services}
+    finally:
+        for service in services:
+            service.stop()
+        tor.stop()
+        llm.stop()
+
+    minutes = runtime / 60 if runtime > 0 else float("nan")
+    return {
+        "complete": complete,
+        "runtime_seconds": round(runtime, 1),
+        "pages": len(urls),
+        "crawled": last["crawled"],
+        "analysed": last["analysed"],
+        "pages_per_minute": round(last["analysed"] / minutes, 1),
+        "crawls_per_minute": round(last["crawled"] / minutes, 1),
+        "stages": latency["stages"],
+        "peak_rss_mib": peak_rss,
+        "limits": {stage: loop_status[stage].get("limit") for stage in ("crawl", "analyse")},
+        "tor": dict(tor.stats),
+        "llm": dict(llm.stats),
+    }
+
+
+def report(result: Dict) -> None:
+    state = "complete" if result["complete"] else "INCOMPLETE (timeout or stall)"
+    print(f"\nRun {state}: {result['analysed']} of {result['pages']} pages analysed, "
+          f"{result['crawled']} crawled in {result['runtime_seconds']}s")
+    print(f"  pages/min {result['pages_per_minute']:>10}   crawls/min {result['crawls_per_minute']:>10}")
+    print(f"\n  {'stage':<18}{'count':>8}{'p50 s':>10}{'p95 s':>10}{'p99 s':>10}")
+    for stage, values in result["stages"].items():
+        print(f"  {stage:<18}{values['count']:>8}"
+              + "".join(f"{values.get(q, '-'):>10}" for q in ("p50", "p95", "p99")))
+    print("\n  peak RSS (MiB)  " + "  ".join(f"{k} {v}" for k, v in result["peak_rss_mib"].items()))
+    print(f"  final limits    {result['limits']}")
+    print(f"  tor stand-in    {result['tor']}")
+    print(f"  mock LLM        {result['llm']}")
+
+
+def key_metrics(result: Dict) -> Dict[str, Tuple[Optional[float], bool]]:
+    """Metrics compared run over run as (value, whether higher is better)."""
+    total = result["stages"].get("total", {})
+    rss = [v for v in result["peak_rss_mib"].values() if v is not None]
+    return {
+        "pages_per_minute": (result["pages_per_minute"], True),
+        "total_p95": (total.get("p95"), False),
+        "peak_rss_mib": (sum(rss) if rss else None, False),
+    }
+
+
+def compare(previous: Dict, record: Dict, tolerance: float) -> bool:
+    """Print the change against `previous`; True if a metric regressed beyond `tolerance`."""
+    print(f"\nCompared with {previous.get('commit')} at {previous.get('timestamp')}:")
+    regressed = False
+    before, after = key_metrics(previous["result"]), key_metrics(record["result"])
+    for name, (value, higher_is_better) in after.items():
+        old = before[name][0]
+        if value is None or not old:
+            continue
+        change = (value - old) / old
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        regressed |= bool(flag)
+        print(f"  {name:<18}{old:>10} -> {value:<10} ({change:+.1%}){flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sites", type=int, default=1000, help="synthetic onion sites")
+    parser.add_argument("--pages-per-site", type=int, default=2)
+    parser.add_argument("--page-kb", type=int, default=8, help="approximate page size")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per fetch through the stand-in")
+    parser.add_argument("--jitter", type=float, default=0.25)
+    parser.add_argument("--failure-rate", type=float, default=0.05, help="fraction of unreachable fetches")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="seconds per completion")
+    parser.add_argument("--llm-jitter", type=float, default=0.5)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--no-llm", action="store_true", help="no OPENAI_API_KEY: heuristic analysis only")
+    parser.add_argument("--mode", choices=("relay", "direct"), default="relay", help="PIPELINE_MODE")
+    parser.add_argument("--crawl-concurrency", type=int, default=1)
+    parser.add_argument("--crawl-concurrency-max", type=int, default=32)
+    parser.add_argument("--analyse-concurrency", type=int, default=1)
+    parser.add_argument("--analyse-concurrency-max", type=int, default=16)
+    parser.add_argument("--proxy", choices=("socks5h", "http"), default="socks5h")
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds before the run is cut off")
+    parser.add_argument("--stall", type=float, default=120, help="seconds without progress before giving up")
+    parser.add_argument("--poll", type=float, default=1.0)
+    parser.add_argument("--output", default="bench_e2e.jsonl", help="JSON lines file of past runs")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change counted as regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="keep logs, database and archive")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-e2e-")
+    try:
+        result = run(args, workdir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report(result)
+
+    workload = {k: v for k, v in vars(args).items()
+                if k not in ("output", "tolerance", "fail_on_regression", "keep", "poll", "timeout", "stall")}
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "workload": workload,
+        "result": result,
+    }
+    previous = None
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("workload") == workload and entry["result"].get("complete"):
+                    previous = entry
+    with open(args.output, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+    regressed = previous is not None and compare(previous, record, args.tolerance)
+    if regressed and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
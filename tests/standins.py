@@ -0,0 +1,347 @@
+"""
+Local stand-ins for the external dependencies of the pipeline, used by bench_e2e.py:
+
+- OnionSites   : a deterministic catalogue of synthetic onion sites and pages.
+- TorStandIn   : a Tor replacement. Its proxy port speaks SOCKS5 (socks5h, as the
+                 crawler uses it) as well as plain HTTP proxying and serves the
+                 synthetic pages itself, with configurable latency and failure rate;
+                 its control port answers the few commands stem sends.
+- MockLLM      : an OpenAI-compatible /v1/chat/completions endpoint returning
+                 analysis JSON with configurable latency and failure rate.
+
+All stand-ins listen on 127.0.0.1, run in background threads and keep counters
+in `stats`. Pages carry an ETag and Last-Modified header and answer conditional
+requests with 304, so recrawls can be benchmarked as well.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+TOPICS = {
+    "market": "vendor escrow listing shipping stealth bitcoin monero feedback order product price wallet",
+    "forum": "thread reply moderator member board discussion topic post signature rules welcome",
+    "wiki": "article index directory links mirror category hidden service guide portal update",
+    "crypto": "mixer tumbler exchange blockchain transaction address fees anonymous coins swap",
+    "blog": "journal opinion privacy surveillance freedom censorship essay author comments archive",
+    "hosting": "server uptime storage upload files bandwidth domain account plan support email",
+}
+FILLER = "the and with for from this that your our all new more about only here their other will".split()
+
+
+def onion_host(rng: random.Random) -> str:
+    return base64.b32encode(rng.randbytes(35)).decode("ascii").lower()[:56] + ".onion"
+
+
+class OnionSites:
+    """`sites` hosts with `pages_per_site` pages of roughly `page_bytes` bytes each."""
+
+    def __init__(self, sites: int, pages_per_site: int = 1, page_bytes: int = 8192, seed: int = 7):
+        rng = random.Random(seed)
+        self.hosts = [onion_host(rng) for _ in range(sites)]
+        self._known = set(self.hosts)
+        self.pages_per_site = pages_per_site
+        self.page_bytes = page_bytes
+        self.seed = seed
+        self.last_modified = formatdate(time.time() - 86400, usegmt=True)
+
+    def urls(self) -> List[str]:
+        paths = ["/"] + [f"/page/{i}" for i in range(1, self.pages_per_site)]
+        return [f"http://{host}{path}" for host in self.hosts for path in paths]
+
+    def knows(self, host: str) -> bool:
+        return host in self._known
+
+    def page(self, host: str, path: str) -> Optional[bytes]:
+        """HTML of a page, or None if the path does not exist."""
+        if path == "/":
+            index = 0
+        else:
+            match = re.fullmatch(r"/page/(\d+)", path)
+            index = int(match.group(1)) if match else -1
+        if not 0 <= index < self.pages_per_site:
+            return None
+        rng = random.Random(f"{self.seed}:{host}:{index}")
+        topic = rng.choice(sorted(TOPICS))
+        words = TOPICS[topic].split()
+        title = f"{topic.title()} {host[:8]} {index}"
+        links = "".join(
+            f'<li><a href="http://{rng.choice(self.hosts)}/">{rng.choice(words)}</a></li>' for _ in range(5)
+        )
+        parts = [f"<!DOCTYPE html><html><head><title>{title}</title></head><body><h1>{title}</h1><ul>{links}</ul>"]
+        size = len(parts[0])
+        while size < self.page_bytes:
+            sentence = " ".join(rng.choice(words if rng.random() < 0.4 else FILLER) for _ in range(12))
+            paragraph = f"<p>{sentence.capitalize()}.</p>\n"
+            parts.append(paragraph)
+            size += len(paragraph)
+        parts.append("</body></html>")
+        return "".join(parts).encode("utf-8")
+
+
+def _response(status: int, reason: str, headers: Dict[str, str], body: bytes = b"") -> bytes:
+    head = [f"HTTP/1.1 {status} {reason}"] + [f"{k}: {v}" for k, v in headers.items()]
+    head += [f"Content-Length: {len(body)}", "Connection: close", "", ""]
+    return "\r\n".join(head).encode("latin-1") + body
+
+
+class TorStandIn:
+    """SOCKS5 / HTTP proxy and control port serving `sites` in place of Tor and the hidden services.
+
+    Every request waits `latency` +- `jitter` seconds; a `failure_rate` fraction of
+    them fails like an unreachable hidden service (SOCKS reply 'host unreachable',
+    or a dropped connection when used as HTTP proxy).
+    """
+
+    def __init__(self, sites: OnionSites, latency: float = 0.5, jitter: float = 0.25,
+                 failure_rate: float = 0.0, seed: int = 11):
+        self.sites = sites
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.stats: Counter = Counter()
+        # URLs answered with a page at least once, i.e. the ones that should end up analysed
+        self.served_urls = set()
+        self.proxy_port = self.control_port = 0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="tor-standin", daemon=True)
+
+    def start(self) -> "TorStandIn":
+        async def listen():
+            proxy = await asyncio.start_server(self._handle_proxy, "127.0.0.1", 0, backlog=1024)
+            control = await asyncio.start_server(self._handle_control, "127.0.0.1", 0, backlog=1024)
+            return proxy, control
+
+        self._thread.start()
+        self._servers = asyncio.run_coroutine_threadsafe(listen(), self._loop).result()
+        self.proxy_port = self._servers[0].sockets[0].getsockname()[1]
+        self.control_port = self._servers[1].sockets[0].getsockname()[1]
+        return self
+
+    def stop(self) -> None:
+        async def close():
+            for server in self._servers:
+                server.close()
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+    async def _handle_proxy(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.stats["connections"] += 1
+        try:
+            first = await reader.readexactly(1)
+            if first == b"\x05":
+                host, port = await self._socks_handshake(reader, writer)
+                if host is None:
+                    return
+                head = await reader.readuntil(b"\r\n\r\n")
+                method, target, headers = self._parse_head(head)
+                url = f"http://{host}{target}" if port == 80 else f"http://{host}:{port}{target}"
+            else:
+                head = first + await reader.readuntil(b"\r\n\r\n")
+                method, url, headers = self._parse_head(head)
+                parts = urlsplit(url)
+                host = parts.hostname or ""
+                await asyncio.sleep(self._delay())
+                if not self.sites.knows(host) or self.rng.random() < self.failure_rate:
+                    self.stats["failed"] += 1
+                    return
+            writer.write(self._serve(method, url, headers))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            self.stats["broken_connections"] += 1
+        finally:
+            writer.close()
+
+    async def _socks_handshake(self, reader, writer) -> Tuple[Optional[str], int]:
+        methods = await reader.readexactly((await reader.readexactly(1))[0])
+        if 0 not in methods:
+            writer.write(b"\x05\xff")
+            return None, 0
+        writer.write(b"\x05\x00")
+        version, command, _, address_type = await reader.readexactly(4)
+        if address_type == 3:
+            host = (await reader.readexactly((await reader.readexactly(1))[0])).decode("ascii", "replace")
+        elif address_type == 1:
+            host = ".".join(str(b) for b in await reader.readexactly(4))
+        else:
+            host = (await reader.readexactly(16)).hex()
+        port = int.from_bytes(await reader.readexactly(2), "big")
+        if command != 1:
+            writer.write(b"\x05\x07\x00\x01" + bytes(6))  # command not supported
+            return None, 0
+        # Circuit and rendezvous setup is where Tor spends its time
+        await asyncio.sleep(self._delay())
+        if not self.sites.knows(host) or self.rng.random() < self.failure_rate:
+            self.stats["failed"] += 1
+            writer.write(b"\x05\x04\x00\x01" + bytes(6))  # host unreachable
+            return None, 0
+        writer.write(b"\x05\x00\x00\x01" + bytes(6))
+        return host, port
+
+    @staticmethod
+    def _parse_head(head: bytes) -> Tuple[str, str, Dict[str, str]]:
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        return method, target, headers
+
+    def _serve(self, method: str, url: str, headers: Dict[str, str]) -> bytes:
+        parts = urlsplit(url)
+        body = self.sites.page(parts.hostname or "", parts.path or "/") if method in ("GET", "HEAD") else None
+        if body is None:
+            self.stats["not_found"] += 1
+            return _response(404, "Not Found", {"Content-Type": "text/html; charset=utf-8"}, b"<h1>Not found</h1>")
+        etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        validators = {"ETag": etag, "Last-Modified": self.sites.last_modified}
+        if headers.get("if-none-match") == etag:
+            self.stats["not_modified"] += 1
+            return _response(304, "Not Modified", validators)
+        self.stats["served"] += 1
+        self.stats["bytes"] += len(body)
+        self.served_urls.add(url)
+        return _response(200, "OK", {"Content-Type": "text/html; charset=utf-8", **validators},
+                         body if method == "GET" else b"")
+
+    async def _handle_control(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Just enough of the Tor control protocol for stem's from_port / authenticate / signal."""
+        self.stats["control_connections"] += 1
+        try:
+            while True:
+                line = (await reader.readline()).decode("ascii", "replace").strip()
+                if not line:
+                    return
+                command = line.split(" ", 1)[0].upper()
+                if command == "PROTOCOLINFO":
+                    writer.write(b'250-PROTOCOLINFO 1\r\n250-AUTH METHODS=NULL\r\n'
+                                 b'250-VERSION Tor="0.4.8.0"\r\n250 OK\r\n')
+                elif command == "GETINFO":
+                    writer.write(b"552 Unrecognized key\r\n")
+                elif command == "QUIT":
+                    writer.write(b"250 closing connection\r\n")
+                    await writer.drain()
+                    return
+                else:
+                    if command == "SIGNAL":
+                        self.stats["signals"] += 1
+                    writer.write(b"250 OK\r\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class MockLLM:
+    """OpenAI-compatible chat completions answering with analysis JSON after `latency` +- `jitter` seconds."""
+
+    def __init__(self, latency: float = 1.0, jitter: float = 0.5, failure_rate: float = 0.0, seed: int = 13):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-llm", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def start(self) -> "MockLLM":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    @staticmethod
+    def analysis(text: str) -> Dict:
+        words = Counter(w for w in re.findall(r"[a-z]{5,}", text[:8000].lower()) if w not in ("content", "return"))
+        first_line = next((line.strip() for line in text.splitlines() if line.strip()), "")
+        return {
+            "tags": [word for word, _ in words.most_common(3)],
+            "title": first_line[:80] or None,
+            "legality": "escrow" not in words,
+            "description": " ".join(word for word, _ in words.most_common(8)),
+            "url": None,
+        }
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, payload: Dict):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._reply(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+                    return
+                with mock._lock:
+                    delay = max(0.0, mock.latency + mock.rng.uniform(-mock.jitter, mock.jitter))
+                    failed = mock.rng.random() < mock.failure_rate
+                time.sleep(delay)
+                if failed:
+                    mock.stats["failed"] += 1
+                    self._reply(500, {"error": {"message": "injected failure", "type": "server_error"}})
+                    return
+                prompt = "\n".join(str(m.get("content", "")) for m in request.get("messages", []))
+                content = json.dumps(mock.analysis(prompt.split("Content:", 1)[-1]))
+                mock.stats["completions"] += 1
+                self._reply(200, {
+                    "id": f"chatcmpl-{mock.stats['completions']}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {
+                        "prompt_tokens": len(prompt) // 4,
+                        "completion_tokens": len(content) // 4,
+                        "total_tokens": len(prompt) // 4 + len(content) // 4,
+                    },
+                })
+
+        return Handler